@@ -1,14 +1,16 @@
  # --------------------------------------------------------------
 #  menu.py
 #  Version: 1.0.1
-#  Last Updated: Feb 14th, 2026
+#  Last Updated: Oct 17th, 2026
 # --------------------------------------------------------------
 
 
 #### IMPORT MODULES ####
 
 import nuke
-import AOV_rebuild_karma
+
+## AOV_rebuild_karma itself is imported by the first command run, not at startup
+import AOV_rebuild_karma_menu
 
 #### ASSIGNING NUKE PATH ####
 
@@ -22,7 +24,19 @@ nukeCommonPath = '/path/to/your/.nuke'
 
 python_menu = nuke.menu('Nodes').addMenu("Python", icon="python_icon.png")
 
-python_menu.addCommand('AOV_rebuild_karma', 'AOV_rebuild_karma.custom_breakout_lightgroups_and_materials(nuke.selectedNode())','')
+python_menu.addCommand('AOV_rebuild_karma', AOV_rebuild_karma_menu.lazy_command('custom_breakout_lightgroups_and_materials(nuke.selectedNode())'),'')
+python_menu.addCommand('AOV_rebuild_karma batch', AOV_rebuild_karma_menu.lazy_command('custom_batch_breakout_lightgroups_and_materials()'),'')
+python_menu.addCommand('AOV_rebuild_karma update', AOV_rebuild_karma_menu.lazy_command('custom_update_rebuild()'),'')
+python_menu.addCommand('AOV_rebuild_karma as Group', AOV_rebuild_karma_menu.lazy_command('custom_group_breakout(nuke.selectedNode())'),'')
+python_menu.addCommand('AOV_rebuild_karma scoped to Cryptomatte', AOV_rebuild_karma_menu.lazy_command('custom_scoped_breakout()'),'')
+python_menu.addCommand('AOV_rebuild_karma precomp', AOV_rebuild_karma_menu.lazy_command('custom_precomp_rebuild()'),'')
+python_menu.addCommand('AOV_rebuild_karma channel budget', AOV_rebuild_karma_menu.lazy_command('custom_channel_budget()'),'')
+
+## one command per saved preset, see AOV_rebuild_karma_presets
+AOV_rebuild_karma_menu.build_presets_menu()
+
+## rebuilds reading a stale precomp go back to the render when a script is opened, see AOV_rebuild_karma_precomp
+nuke.addOnScriptLoad(AOV_rebuild_karma_menu.check_precomps)
 
 #### PYTHON MENU END ####
 
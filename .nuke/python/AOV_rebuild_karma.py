@@ -1,40 +1,35 @@
 import nuke
+import contextlib
+import os
 import re
+import sys
+import tempfile
+
+import AOV_rebuild_karma_build
+import AOV_rebuild_karma_channels
+import AOV_rebuild_karma_menu
+import AOV_rebuild_karma_presets
+import AOV_rebuild_karma_profile
+from AOV_rebuild_karma_profile import phase, count
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, get_centre_xypos, set_centred_xypos
+from AOV_rebuild_karma_graph import (ExternalNode, ANCHOR_KNOB, GRAPH_KEY_KNOB, NOTES_KNOB, REBUILD_ID_KNOB, REBUILD_ROLE_KNOB,
+                                     TAG_KNOB_PREFIX)
+from AOV_rebuild_karma_layout import SHUFFLE_Y_OFFSET, UNPREMULT_Y_OFFSET, BOTTOM_DOT_Y_PAD, graph_bbox, translate_graph
+from AOV_rebuild_karma_exr import ExrHeaderError, nuke_box
+from AOV_rebuild_karma_cryptomatte import parse_matte_list
+from AOV_rebuild_karma_schema import schema_for_metadata
+from AOV_rebuild_karma_layers import (LIGHTGROUP_REGEX, ADDITIONAL_LIGHTING_AOVS, MATERIAL_AOVS, UTILITY_AOVS,
+                                      classify_channels, classify_channels_from_settings)
 
 ## global Variables
-LIGHTGROUP_REGEX = re.compile(r'^(?:[a-z0-9]+_)?(li?g?h?t?s?)(?:_[a-z0-9]+)*$', re.IGNORECASE)
+## breakout pulldown of the panel > (breakout_materials, breakout_lightgroups)
+BREAKOUT_MODES = (('Materials_&_Lightgroups', True, True),
+                  ('Materials', True, False),
+                  ('Lightgroups', False, True),
+                  ('Utilities', False, False))
 
-ADDITIONAL_LIGHTING_AOVS = []
-
-X_SPACE = 300
-
-Y_SPACE = 100
-
-MERGE_FROM_COLOUR = 2569876223
-
-MERGE_PLUS_COLOUR = 2197786623
-
-MATERIAL_AOVS = [
-    'albedo', 'albedodiffuse', 'combineddiffuse', 'directdiffuse', 'indirectdiffuse', 'sss',
-    'combinedglossyreflection', 'directglossyreflection', 'indirectglossyreflection', 'coat',
-    'glossytransmission', 'caustics', 'refract',
-    'combinedemission', 'directemission', 'indirectemission',
-    'combinedvolume', 'directvolume', 'indirectvolume',
-    #'shadow', 'combineddiffuseshadow', 'directdiffuseshadow', 'indirectdiffuseshadow',
-    #'beautyunshadowed', 'combineddiffuseunshadowed', 'directdiffuseunshadowed', 'indirectdiffuseunshadowed',
-    'ao',]
-
-UTILITY_AOVS = ['alpha', 'depth_extra', 'P', 'P_camera', 'pRef', 'N', 'Ng', 'motionvectors', 'velocity', 'uv_extra', 'Facingratio_N', 'Facingratio_Ng', 'indirectraycount', 'primarysamples', 'cputime', 'oraclevariance',]
-
-DEFAULT_SETTINGS = {'breakout_materials' : True,
-                    'breakout_lightgroups' : True,
-                    'breakout_utilities' : True,
-                    'lg_regex' : LIGHTGROUP_REGEX,
-                    'expected_materials' : MATERIAL_AOVS,
-                    'expected_utilities' : UTILITY_AOVS,
-                    'additional_lighting' : ADDITIONAL_LIGHTING_AOVS,
-                    'x_space' : X_SPACE,
-                    'y_space' : Y_SPACE}
+## deep nodes whose output is a flat image
+DEEP_TO_FLAT_CLASSES = ('DeepToImage', 'DeepToImage2')
 
 ## helper functions
 def comma_seperated_to_list(comma_seperated_string):
@@ -52,29 +47,238 @@ def flatten_out_nested(nested_data):
             inner_items = flatten_out_nested(i)
             for y in inner_items:
                 list_of_items.append(y)
-    print (list_of_items)
     return (list_of_items)
 
 ## nodegraph helper functions
-def get_centre_xypos(node):
-    '''Returns a tuple with the xpos and ypos of `node` factoring the node width to obtain the node's center point.'''
-    xpos = int ( node.xpos() + node.screenWidth()/2 )
-    ypos = int (node.ypos()  + node.screenHeight()/2 )
-    return xpos, ypos
-
-def set_centred_xypos(node, xpos, ypos):
-    '''Positions `node` at the `xpos and `ypos` position in the nodegraph,
-    factoring the node width to obtain the node's center point.'''
-    x_centred = int (xpos - node.screenWidth()/2)
-    y_centred = int (ypos - node.screenHeight()/2)
-    node.setXYpos(x_centred, y_centred)
+def graph_source(node):
+    '''Returns the graph stand-in for the live `node` a rebuild is built from, carrying its position and size'''
+    return ExternalNode(None, node.xpos(), node.ypos(), node.screenWidth(), node.screenHeight(), node.Class())
+
+def is_deep(node):
+    '''Returns True when `node` outputs a deep stream (eg. a DeepRead), which gets a deep rebuild'''
+    return node.Class().startswith('Deep') and node.Class() not in DEEP_TO_FLAT_CLASSES
+
+def rebuild_graph(node, layer_index, settings = DEFAULT_SETTINGS, progress = None):
+    '''Returns the in-memory rebuild of `node` (see AOV_rebuild_karma_build), deep or flat as its stream is'''
+    if is_deep(node):
+        return AOV_rebuild_karma_build.build_deep_rebuild_graph(layer_index, settings, graph_source(node), progress)
+    return AOV_rebuild_karma_build.build_rebuild_graph(layer_index, settings, graph_source(node), progress)
+
+def paste_graph(graph, node):
+    '''Pastes `graph` below `node` in a single nodePaste and returns the pasted nodes.
+
+    Knobs that cannot be written as script text (see AOV_rebuild_karma_graph.DEFERRED_KNOBS) are set afterwards,
+    as are inputs from live nodes other than `node` (see AOV_rebuild_karma_graph.ExternalNode).'''
+    with phase('select'):
+        for selected in nuke.selectedNodes():
+            selected.setSelected(False)
+        node.setSelected(True)
+
+    with phase('serialize'):
+        script_text = graph.to_nk()
+    fd, path = tempfile.mkstemp(suffix = '.nk')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(script_text)
+        with phase('nodePaste'):
+            nuke.nodePaste(path)
+    finally:
+        os.remove(path)
+
+    with phase('select'):
+        pasted = nuke.selectedNodes()
+    count('nodes_created', len(pasted))
+    link_notes(pasted)
+    count('knob_writes', sum(len(n.knobs) for n in graph.node_list))
+    deferred = graph.deferred_nodes()
+    external_inputs = graph.external_inputs()
+    if deferred or external_inputs:
+        with phase('deferred'):
+            live_nodes = pasted_by_graph_node(graph, pasted)
+            for graph_node in deferred:
+                for name, value in graph_node.deferred_knobs.items():
+                    live_nodes[id(graph_node)][name].setValue(value)
+                count('knob_writes', len(graph_node.deferred_knobs))
+            for graph_node, i, live in external_inputs:
+                live_nodes[id(graph_node)].setInput(i, live)
+    return pasted
+
+def pasted_by_graph_node(graph, pasted):
+    '''Returns a dictionary of id(graph node) > live node for the `pasted` nodes of `graph`'''
+    by_key = {}
+    for live in pasted:
+        key = live.knob(GRAPH_KEY_KNOB)
+        if key is not None:
+            by_key[key.value()] = live
+    return {id(n) : by_key[str(i)] for i, n in enumerate(graph.node_list) if str(i) in by_key}
+
+def sibling_node(node, name):
+    '''Returns the node called `name` in the same group as `node`, or None'''
+    group = node.fullName().rpartition('.')[0]
+    return nuke.toNode('root.%s.%s' % (group, name) if group else 'root.%s' % name)
+
+def link_notes(pasted):
+    '''Ties the sticky notes among the `pasted` nodes of a rebuild to the first connected node pasted with them
+    (see AOV_rebuild_karma_graph.NOTES_KNOB), so find_rebuild_nodes gets to the notes without scanning the script'''
+    notes = [n for n in pasted if n.Class() == 'StickyNote' and get_rebuild_id(n) is not None]
+    anchor = next((n for n in pasted if n.Class() != 'StickyNote' and get_rebuild_id(n) is not None), None)
+    if not notes or anchor is None:
+        return
+    add_hidden_knob(anchor, NOTES_KNOB, ' '.join(note.name() for note in notes))
+    for note in notes:
+        add_hidden_knob(note, ANCHOR_KNOB, anchor.name())
+    count('knob_writes', len(notes) + 1)
+
+def add_hidden_knob(node, name, value):
+    '''Adds an invisible string knob holding `value` to the live `node`'''
+    knob = nuke.String_Knob(name, name)
+    knob.setFlag(nuke.INVISIBLE)
+    node.addKnob(knob)
+    knob.setValue(value)
+
+## progress and undo
+class RebuildCancelled(Exception):
+    '''Raised when the artist cancels a rebuild, by then everything it changed has been rolled back'''
+
+class RebuildProgress(object):
+    '''Reports the progress of a rebuild through a nuke.ProgressTask (nothing in terminal mode) and raises
+    RebuildCancelled at the next update once the artist has cancelled.
+
+    The bar is split into stages (see stage()), each counting its own steps: aov branches (branch()) or frames
+    scanned (frame()).'''
+    def __init__(self, title):
+        self.title = title
+        self.task = nuke.ProgressTask(title) if nuke.GUI else None
+        self.start = self.end = 0
+        self.done = 0
+        self.total = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        ## the task closes once nothing holds it
+        self.task = None
+        return False
+
+    def stage(self, message, start, end, total = 1):
+        '''Moves on to the part of the bar from `start` to `end` percent, `total` steps long'''
+        self.start, self.end = start, end
+        self.done = 0
+        self.total = max(1, total)
+        self.update(message)
+
+    def update(self, message):
+        if self.task is None:
+            return
+        if self.task.isCancelled():
+            raise RebuildCancelled('%s cancelled' % self.title)
+        self.task.setMessage(message)
+        self.task.setProgress(int(self.start + (self.end - self.start) * min(self.done, self.total) / float(self.total)))
+
+    def branch(self, aov):
+        '''Graph progress callback, see AOV_rebuild_karma_build.build_rebuild_graph'''
+        self.update('building %s' % aov)
+        self.done += 1
+
+    def frame(self, path, done, total):
+        '''Scan progress callback, see AOV_rebuild_karma_qc.sequence_layer_bounds'''
+        self.done = done
+        self.total = max(1, total)
+        self.update('scanning %s' % os.path.basename(path))
+
+    def rendered(self, done, total):
+        '''Render progress callback, see AOV_rebuild_karma_precomp.render_precomp'''
+        self.done = done
+        self.total = max(1, total)
+        self.update('rendered %d of %d frames' % (done, total))
+
+@contextlib.contextmanager
+def undo_group(name):
+    '''Makes everything done inside a single undo step, undone straight away if it raises (eg. RebuildCancelled)'''
+    nuke.Undo.begin(name)
+    try:
+        yield
+    except BaseException:
+        nuke.Undo.cancel()
+        raise
+    nuke.Undo.end()
+
+def branch_total(layer_index, settings = DEFAULT_SETTINGS):
+    '''Returns the number of aov branches a rebuild of `layer_index` adds'''
+    total = 0
+    if settings['breakout_materials']:
+        total += len(AOV_rebuild_karma_build.kept_aovs(layer_index['materials'], settings))
+    if settings['breakout_lightgroups']:
+        total += len(AOV_rebuild_karma_build.kept_aovs(layer_index['lightgroups'], settings))
+    return total
+
+## rebuild lookup functions
+def get_rebuild_id(node):
+    '''Returns the id of the rebuild `node` was created by, or None for nodes that are not part of a tagged rebuild'''
+    knob = node.knob(REBUILD_ID_KNOB)
+    return knob.value() if knob is not None else None
+
+def find_rebuild_nodes(node):
+    '''Returns every node of the rebuild `node` belongs to, found by walking the rebuild's own inputs and outputs
+    (and the other branches hanging off the node it was built from) so the cost scales with the rebuild rather than the script.
+    Sticky notes are reached through the connected node they were pasted with (see link_notes).'''
+    rebuild_id = get_rebuild_id(node)
+    if rebuild_id is None:
+        return []
+    found = {node.fullName() : node}
+    if node.Class() == 'StickyNote':
+        ## start the walk from the connected node the note was pasted with
+        anchor = node.knob(ANCHOR_KNOB)
+        node = sibling_node(node, anchor.value()) if anchor is not None else None
+        if node is None or get_rebuild_id(node) != rebuild_id:
+            return list(found.values())
+        found[node.fullName()] = node
+    to_visit = [node]
+    while to_visit:
+        current = to_visit.pop()
+        notes = current.knob(NOTES_KNOB)
+        if notes is not None:
+            for name in notes.value().split():
+                note = sibling_node(current, name)
+                if note is not None and get_rebuild_id(note) == rebuild_id:
+                    found[note.fullName()] = note
+        neighbours = current.dependent(nuke.INPUTS, False)
+        for n in current.dependencies(nuke.INPUTS):
+            neighbours.append(n)
+            ## the utility and rebuild branches only meet at the source they were built from
+            if get_rebuild_id(n) is None:
+                neighbours.extend(n.dependent(nuke.INPUTS, False))
+        for n in neighbours:
+            if n.fullName() not in found and get_rebuild_id(n) == rebuild_id:
+                found[n.fullName()] = n
+                to_visit.append(n)
+    return list(found.values())
+
+def _layout_role(node):
+    '''Returns the layout role of a rebuild node, from its role knob or for untagged rebuilds from its name'''
+    knob = node.knob(REBUILD_ROLE_KNOB)
+    if knob is not None:
+        return knob.value()
+    return re.sub(r'\d+$', '', node.name())
+
+def get_rebuild_tag(node, tag):
+    '''Returns the value of a graph tag (eg. 'pipe', 'aov') `node` was created under, or None'''
+    knob = node.knob(TAG_KNOB_PREFIX + tag)
+    return knob.value() if knob is not None else None
 
 ## layer utility functions
+def node_schema(node, settings = DEFAULT_SETTINGS):
+    '''Returns the AOV schema named in `settings`, or else the one of the Houdini version in the metadata of `node`'''
+    return settings.get('schema') or schema_for_metadata(node.metadata())
+
+def get_layer_index(node, settings = DEFAULT_SETTINGS):
+    '''Returns the cached layer index (see AOV_rebuild_karma_layers) for the channels in `node`'''
+    return classify_channels_from_settings(node.channels(), settings, node_schema(node, settings))
+
 def get_all_layers(node):
     '''returns a list of all the layers in a node '''
-    channels = node.channels()
-    layers = list(set([c.split('.')[0] for c in channels ]))
-    layers.sort()
+    layers = list(classify_channels(node.channels())['layers'])
     #print (layers) ## for debugging
     return layers
 
@@ -88,96 +292,225 @@ def get_all_layers(node):
 
 def get_lightgroup_layers(node, lightgroup_regex = LIGHTGROUP_REGEX, additional_lighting = ADDITIONAL_LIGHTING_AOVS):
     '''Return a list of all aovs in node which are lightgroups_or_materials.'''
-    lightgroups_or_materials = []
-    for layer in get_all_layers(node):
-        result = lightgroup_regex.search(layer)
-        if result:
-            lightgroups_or_materials.append(layer)
-        elif layer in additional_lighting:
-            lightgroups_or_materials.append(layer)
-    return lightgroups_or_materials
+    return list(classify_channels(node.channels(), lightgroup_regex, additional_lighting)['lightgroups'])
 
 def get_materials(node, expected_materials = MATERIAL_AOVS):
     '''Returns a list of all aovs which are in the expected_materials list'''
-    materials = []
-    for material in expected_materials:
-        for layer in get_all_layers(node):
-            if layer.lower() == material.lower(): ## using this setting according to the default karma naming convention (eg. 'C_emission')
-            #if layer == material:
-                materials.append(layer)
-    return materials
+    ## matched case-insensitively according to the default karma naming convention (eg. 'C_emission')
+    return list(classify_channels(node.channels(), expected_materials = expected_materials)['materials'])
 
 def get_utilities(node, expected_utilities = UTILITY_AOVS):
     '''Returns a list of all aovs which are in the expected_utilities list'''
-    utilities = []
-    for utility in expected_utilities:
-        for layer in get_all_layers(node):
-            if layer == utility:
-                utilities.append(layer)
-    return utilities
+    return list(classify_channels(node.channels(), expected_utilities = expected_utilities)['utilities'])
+
+def get_upstream_read(node):
+    '''Returns the Read at the top of the input 0 chain of `node` (`node` itself if it is one), or None'''
+    while node is not None and node.Class() != 'Read':
+        node = node.input(0)
+    return node
+
+def scan_settings(node, settings = DEFAULT_SETTINGS, progress = None):
+    '''Returns `settings` with the results of scanning the pixels of the Read above `node` over its frame range
+    (see AOV_rebuild_karma_qc). With 'crop_to_data' every frame is scanned and 'aov_bboxes' gets the box each
+    material and lightgroup aov covers. With 'prune_empty' the aovs black on every frame are added to 'pruned_aovs',
+    from the same scan when cropping or when not from 'prune_sample_frames' frames first, then every frame for the aovs
+    black on all of those. A rebuild scoped to a Cryptomatte
+    selection ('scope_mattes') gets the box the selection covers over every frame as 'scope_bbox'.
+    `progress` is called with (path, frames done, frames to scan) before each frame is read.'''
+    crop = settings.get('crop_to_data', False)
+    prune = settings.get('prune_empty', False)
+    scope = bool(settings.get('scope_mattes')) and settings.get('scope_bbox') is None
+    if not crop and not prune and not scope:
+        return settings
+    ## the pixel reader (and numpy) is only imported once a Read is scanned
+    import AOV_rebuild_karma_qc
+    read = get_upstream_read(node)
+    if read is None:
+        nuke.message('AOVs not scanned, there is no Read above %s.' % node.name())
+        return settings
+
+    layer_index = get_layer_index(node, settings)
+    layers = list(layer_index['materials']) + list(layer_index['lightgroups'])
+    frames = list(range(int(read['first'].value()), int(read['last'].value()) + 1))
+    scanned = dict(settings)
+    empty = None
+    if scope:
+        try:
+            box, display_window = AOV_rebuild_karma_qc.sequence_matte_bounds(nuke.filename(read), frames, settings['scope_layer'],
+                                                                             settings['scope_mattes'], progress)
+        except (ImportError, EnvironmentError, ExrHeaderError, AOV_rebuild_karma_qc.ExrPixelError) as e:
+            nuke.message('Rebuild not cropped to the matte, %s' % e)
+        else:
+            if box is None:
+                nuke.message('Rebuild not cropped, the Cryptomatte selection is on no frame of %s.' % read.name())
+            elif not AOV_rebuild_karma_qc.bounds_cover(box, display_window):
+                scanned['scope_bbox'] = nuke_box(box, display_window)
+    if crop:
+        try:
+            bounds, display_window = AOV_rebuild_karma_qc.sequence_layer_bounds(nuke.filename(read), frames, layers, progress)
+        except (EnvironmentError, ExrHeaderError, AOV_rebuild_karma_qc.ExrPixelError) as e:
+            nuke.message('AOV branches not cropped, %s' % e)
+        else:
+            ## aovs covering the whole format are not worth a Crop
+            scanned['aov_bboxes'] = {layer : nuke_box(box, display_window) for layer, box in bounds.items()
+                                     if box is not None and not AOV_rebuild_karma_qc.bounds_cover(box, display_window)}
+            ## data windows read from the headers say nothing about black pixels
+            if AOV_rebuild_karma_qc.np is not None:
+                empty = [layer for layer, box in bounds.items() if box is None]
+    if prune and empty is None:
+        try:
+            empty = AOV_rebuild_karma_qc.sequence_empty_layers(nuke.filename(read), frames, layers,
+                                                               settings['prune_sample_frames'], progress)
+        except (ImportError, EnvironmentError, ExrHeaderError, AOV_rebuild_karma_qc.ExrPixelError) as e:
+            nuke.message('Empty AOVs not pruned, %s' % e)
+    if prune and empty:
+        scanned['pruned_aovs'] = sorted(set(settings.get('pruned_aovs', ())) | set(empty))
+    return scanned
+
+def channel_settings(node, settings = DEFAULT_SETTINGS, registered = None):
+    '''Returns `settings` with the layer the rebuild of `node` keeps the original beauty in: with 'reuse_channels' one
+    the script (or the `registered` channels) already has, see AOV_rebuild_karma_channels.scratch_layer'''
+    if not settings.get('reuse_channels', False):
+        return settings
+    registered = nuke.channels() if registered is None else registered
+    return dict(settings, original_layer = AOV_rebuild_karma_channels.scratch_layer(node.channels(), registered))
+
+## channel budget functions
+def channel_budget(nodes, settings = DEFAULT_SETTINGS):
+    '''Returns {node name : channel budget} (see AOV_rebuild_karma_channels) of rebuilding each of `nodes` in turn in
+    this script. The rebuilds are only built in memory, no node is created.'''
+    registered = set(nuke.channels())
+    budgets = {}
+    for node in nodes:
+        layer_index = get_layer_index(node, settings)
+        graph = rebuild_graph(node, layer_index, channel_settings(node, settings, registered))
+        budget = AOV_rebuild_karma_channels.channel_budget(layer_index['channels'],
+                                                           AOV_rebuild_karma_channels.graph_channels(graph), registered)
+        budgets[node.name()] = budget
+        registered.update(budget['stream_new'])
+        registered.update(budget['rebuild_new'])
+    return budgets
+
+def confirm_channel_budget(node, layer_index, graph):
+    '''Returns False when pasting the rebuild `graph` of `node` would take the script past its channel limit and the
+    artist chooses not to, in terminal mode the rebuild is built with a warning'''
+    with phase('budget'):
+        budget = AOV_rebuild_karma_channels.channel_budget(layer_index['channels'],
+                                                           AOV_rebuild_karma_channels.graph_channels(graph), nuke.channels())
+    count('channels_added', len(budget['stream_new']) + len(budget['rebuild_new']))
+    if budget['headroom'] >= 0:
+        return True
+    report = AOV_rebuild_karma_channels.format_budget(budget, node.name())
+    if not nuke.GUI:
+        sys.stderr.write('%s\n' % report)
+        return True
+    return nuke.ask('%s\n\nBuild the rebuild anyway?' % report)
 
 ## user config functions
-def setup_breakout_panel(node=None):
-    '''Allows the user to customize the breakout config in the gui, and returns a dictionary, settings{} with the user defined settings'''
+def setup_breakout_panel(node=None, defaults=None):
+    '''Allows the user to customize the breakout config in the gui, starting from `defaults` (DEFAULT_SETTINGS or a preset),
+    and returns a new dictionary, settings{} with the user defined settings. Naming a preset saves the settings as it.'''
+    defaults = defaults or DEFAULT_SETTINGS
+    ## the pulldown opens on its first mode
+    modes = sorted(BREAKOUT_MODES, key = lambda mode: mode[1:] != (defaults['breakout_materials'], defaults['breakout_lightgroups']))
+
     p = nuke.Panel('Breakout Lightgroups_or_Materials and Materials')
-    p.addSingleLineInput('Lightgroup Regex', LIGHTGROUP_REGEX.pattern)
-    p.addBooleanCheckBox('Ignore case for regex?', True)
-    p.addEnumerationPulldown('Breakout:', 'Materials_&_Lightgroups Materials Lightgroups Utilities')
-    p.addSingleLineInput('Additional Lighting AOVS', ', '.join(ADDITIONAL_LIGHTING_AOVS))
-    p.addSingleLineInput('Material AOVs', ', '.join(MATERIAL_AOVS))
-    p.addSingleLineInput('Utility AOVs', ', '.join(UTILITY_AOVS))
-    p.addBooleanCheckBox('breakout_utilities', True)
+    p.addSingleLineInput('Lightgroup Regex', defaults['lg_regex'].pattern)
+    p.addBooleanCheckBox('Ignore case for regex?', bool(defaults['lg_regex'].flags & re.IGNORECASE))
+    p.addEnumerationPulldown('Breakout:', ' '.join(mode[0] for mode in modes))
+    p.addSingleLineInput('Additional Lighting AOVS', ', '.join(defaults['additional_lighting']))
+    p.addSingleLineInput('Material AOVs', ', '.join(defaults['expected_materials']))
+    p.addSingleLineInput('Utility AOVs', ', '.join(defaults['expected_utilities']))
+    p.addBooleanCheckBox('breakout_utilities', defaults['breakout_utilities'])
+    p.addBooleanCheckBox('compact (one upstream unpremult)', defaults['compact'])
+    p.addBooleanCheckBox('unassigned pipe as one Expression', defaults['unassigned_expression'])
+    p.addBooleanCheckBox('guard unassigned pipe against negatives', defaults['unassigned_guard'])
+    p.addBooleanCheckBox('prune empty AOVs (scans the Read)', defaults['prune_empty'])
+    p.addBooleanCheckBox('crop AOVs to their data (scans the Read)', defaults['crop_to_data'])
+    p.addBooleanCheckBox('reuse a layer of the script for the original (no new channels)', defaults['reuse_channels'])
     # if node is not None:
     #     layers = get_all_layers(node)
     #     text = "<h3>Layers in selected node</h3>\n"
     #     text += "\n".join(layers) if layers else "No layers found."
     #     p.addNotepad("Layers", text)
-    p.addSingleLineInput('x space between nodes', X_SPACE)
-    p.addSingleLineInput('y space between nodes', Y_SPACE)
+    p.addSingleLineInput('x space between nodes', defaults['x_space'])
+    p.addSingleLineInput('y space between nodes', defaults['y_space'])
+    p.addSingleLineInput('save as preset (optional)', '')
     p.setWidth(960)
     config_panel = p.show()
 
     if not config_panel:
         return None
 
-    ## load in information from panel
-    settings = DEFAULT_SETTINGS
-    if p.value('Ignore case for regex?') == True:
-        settings['lg_regex'] = re.compile(p.value('Lightgroup Regex'), re.IGNORECASE)
-    else:
-        settings['lg_regex'] = re.compile(p.value('Lightgroup Regex'))
+    ## load in information from panel, into a copy so nothing leaks into the next run
+    settings = dict(defaults)
+    settings['lg_regex'] = AOV_rebuild_karma_presets.compiled_regex(p.value('Lightgroup Regex'), p.value('Ignore case for regex?') == True)
     settings['additional_lighting'] = comma_seperated_to_list(p.value('Additional Lighting AOVS'))
     settings['expected_materials'] = comma_seperated_to_list(p.value('Material AOVs'))
     settings['expected_utilities'] = comma_seperated_to_list(p.value('Utility AOVs'))
 
-    if p.value('Breakout:') == 'Materials_&_Lightgroups':
-        settings['breakout_materials'] = True
-        settings['breakout_lightgroups'] = True
-        settings['breakout_utilities'] = True
-    elif p.value('Breakout:') == 'Materials':
-        settings['breakout_materials'] = True
-        settings['breakout_lightgroups'] = False
-        settings['breakout_utilities'] = True
-    elif p.value('Breakout:') == 'Lightgroups':
-        settings['breakout_materials'] = False
-        settings['breakout_lightgroups'] = True
-        settings['breakout_utilities'] = True
-    elif p.value('Breakout:') == 'Utilities':
-        settings['breakout_materials'] = False
-        settings['breakout_lightgroups'] = False
-        settings['breakout_utilities'] = True
+    for mode, breakout_materials, breakout_lightgroups in BREAKOUT_MODES:
+        if p.value('Breakout:') == mode:
+            settings['breakout_materials'] = breakout_materials
+            settings['breakout_lightgroups'] = breakout_lightgroups
     settings['breakout_utilities'] = p.value('breakout_utilities')
+    settings['compact'] = p.value('compact (one upstream unpremult)')
+    settings['unassigned_expression'] = p.value('unassigned pipe as one Expression')
+    settings['unassigned_guard'] = p.value('guard unassigned pipe against negatives')
+    settings['prune_empty'] = p.value('prune empty AOVs (scans the Read)')
+    settings['crop_to_data'] = p.value('crop AOVs to their data (scans the Read)')
+    settings['reuse_channels'] = p.value('reuse a layer of the script for the original (no new channels)')
     settings['x_space'] = int(p.value('x space between nodes'))
     settings['y_space'] = int(p.value('y space between nodes'))
+
+    preset = p.value('save as preset (optional)').strip()
+    if preset:
+        try:
+            AOV_rebuild_karma_presets.save_preset(preset, settings)
+        except (AOV_rebuild_karma_presets.PresetError, EnvironmentError) as e:
+            nuke.message('Preset not saved, %s' % e)
+        else:
+            AOV_rebuild_karma_menu.build_presets_menu()
     return settings
 
+## preset functions
+def _preset_and_node(name, node):
+    '''Returns (settings of the preset `name`, `node` or the selected node), telling the user and returning None when either is missing'''
+    if node is None:
+        try:
+            node = nuke.selectedNode()
+        except ValueError:
+            nuke.message('Please select a node to rebuild.')
+            return None
+    try:
+        return AOV_rebuild_karma_presets.preset_settings(name), node
+    except AOV_rebuild_karma_presets.PresetError as e:
+        nuke.message(str(e))
+        return None
+
+def run_preset(name, node=None):
+    '''Rebuilds the selected node with the preset `name` and no panel, the fast path for a show's config'''
+    found = _preset_and_node(name, node)
+    if found is not None:
+        custom_breakout_lightgroups_and_materials(found[1], found[0])
+
+def custom_edit_preset(name, node=None):
+    '''Opens the panel on the preset `name` and rebuilds the selected node with the settings chosen,
+    saving them over the preset when its name is given again'''
+    found = _preset_and_node(name, node)
+    if found is None:
+        return
+    settings = setup_breakout_panel(found[1], found[0])
+    if settings is not None:
+        custom_breakout_lightgroups_and_materials(found[1], settings)
+
 def custom_shuffle_out_lightgroups(node):
     '''Obtain custom user settings from a panel and the run the breakout script'''
     settings = setup_breakout_panel()
     breakout_lightgroups(node, settings['lg_regex'],  settings['additional_lighting'], settings['x_space'], settings['y_space'])
 
-def custom_breakout_lightgroups_and_materials(node):
-    '''Obtain custom user settings from a panel and the run the breakout script'''
+def custom_breakout_lightgroups_and_materials(node, settings=None):
+    '''Obtain custom user settings from a panel (unless given `settings`, eg. a preset) and the run the breakout script'''
     ## hard stop if Unpremult or Premult
     if node.Class() in ('Unpremult', 'Premult'):
         nuke.message(
@@ -190,8 +523,14 @@ def custom_breakout_lightgroups_and_materials(node):
         return
 
     ## Run the script
-    settings = setup_breakout_panel()
-    breakout_lightgroups_and_materials(node, settings)
+    if settings is None:
+        settings = setup_breakout_panel()
+    if settings is None:
+        return
+    try:
+        breakout_lightgroups_and_materials(node, settings)
+    except RebuildCancelled:
+        return
 
     ## warning node list - Each entry is a function that returns True if the node should warn
     warning_node_rules = {
@@ -213,630 +552,552 @@ def custom_breakout_lightgroups_and_materials(node):
             % warn_class
         )
 
-    # IMPORTANT: run the post pass after building
-    post_layout_adjustments()
-
-def breakout_utilities(node, settings = DEFAULT_SETTINGS):
-    '''Cycles through all the aovs classed as utilities and creates an aov shuffle of them'''
-    expected_utilities = settings['expected_utilities']
-    x_space = settings['x_space']
-    y_space = settings['y_space']
-
-    utilities = get_utilities(node, expected_utilities)
-    if not utilities:
-        return None
-
-    bpipe_nodes = []
-    x_pos, y_pos = get_centre_xypos(node)
-    x_pos += x_space
-
-    utility_dot = nuke.nodes.Dot(inputs = [node])
-    #utility_dot.setName('Utility_Pipe')
-    utility_dot['label'].setValue('UTILITY >')  ## for debugging layout
-    utility_dot["note_font_color"].setValue(int(0xFFFFFFFF))
-    utility_dot["note_font"].setValue("bold")
-    utility_dot["note_font_size"].setValue(40)
-    set_centred_xypos(utility_dot, x_pos, y_pos)
-    bpipe_nodes.append(utility_dot)
-
-    x_utl_dot_pos, y_utl_dot_pos = get_centre_xypos(utility_dot)
-
-    src_channels = set(node.channels())
-
-    available_layers = get_all_layers(node)
-    available_layers_lower = {l.lower() for l in available_layers}
-
-    # If user expects "alpha" but there's no alpha layer, synthesize from rgba.alpha
-    if "alpha" in {u.lower() for u in expected_utilities} and "alpha" not in available_layers_lower:
-        if "rgba.alpha" in src_channels:
-            # put alpha at the front so it appears first in the utility row
-            utilities = ["alpha"] + utilities
-
-    for i, utl in enumerate(utilities):
-        x_pos = x_utl_dot_pos + (x_space * (i + 1))
-        utility_pipe = [bpipe_nodes[-1]]
-
-        utl_dot = nuke.nodes.Dot(inputs=[utility_pipe[-1]])
-        set_centred_xypos(utl_dot, x_pos, y_pos)
-
-        utility_pipe.append(utl_dot)
-        bpipe_nodes.append(utl_dot)
-
-        shuffle_utl = nuke.nodes.Shuffle2(inputs=[utility_pipe[-1]], in1=utl, in2='alpha', label=utl)
-
-        # --- alpha special-case (do NOT let generic mapping overwrite it)
-        if utl.lower() == "alpha" and "alpha" not in available_layers_lower:
-            shuffle_utl["in1"].setValue("rgba")
-            shuffle_utl["in2"].setValue("alpha")
-            shuffle_utl["label"].setValue("alpha")
-            shuffle_utl["mappings"].setValue([
-                ("rgba.alpha", "rgba.red"),
-                ("rgba.alpha", "rgba.green"),
-                ("rgba.alpha", "rgba.blue"),
-                ("rgba.alpha", "rgba.alpha"),
-            ])
-        else:
-            ## gather channels that belong to this layer
-            layer_chans = [c for c in src_channels if c.startswith(utl + ".")]
-
-            has_xyz = all(f"{utl}.{c}" in src_channels for c in ("x", "y", "z"))
-            has_rgb = all(f"{utl}.{c}" in src_channels for c in ("red", "green", "blue"))
-            has_alpha = f"{utl}.alpha" in src_channels
-
-            alpha_src = f"{utl}.alpha" if has_alpha else "rgba.alpha"
-
-            if has_xyz:
-                shuffle_utl['mappings'].setValue([
-                    (f"{utl}.x", "rgba.red"),
-                    (f"{utl}.y", "rgba.green"),
-                    (f"{utl}.z", "rgba.blue"),
-                    (alpha_src, "rgba.alpha"),
-                ])
-
-            elif has_rgb:
-                shuffle_utl['mappings'].setValue([
-                    (f"{utl}.red", "rgba.red"),
-                    (f"{utl}.green", "rgba.green"),
-                    (f"{utl}.blue", "rgba.blue"),
-                    (alpha_src, "rgba.alpha"),
-                ])
-
-            else:
-                non_alpha = [c for c in layer_chans if not c.endswith(".alpha")]
-                single_src = (non_alpha[0] if non_alpha else (layer_chans[0] if layer_chans else None))
-
-                if single_src:
-                    shuffle_utl['mappings'].setValue([
-                        (single_src, "rgba.red"),
-                        (single_src, "rgba.green"),
-                        (single_src, "rgba.blue"),
-                        (alpha_src, "rgba.alpha"),
-                    ])
-                else:
-                    shuffle_utl['mappings'].setValue([
-                        (alpha_src, "rgba.alpha"),
-                    ])
-
-        shuffle_utl["note_font_color"].setValue(int(0xFFFFFFFF))
-        shuffle_utl["note_font"].setValue("bold")
-        set_centred_xypos(shuffle_utl, x_pos, y_pos + 28)
-        utility_pipe.append(shuffle_utl)
-
-    return utility_dot
-
-def plus_lightgroups_or_materials(node, mode = 0, settings = DEFAULT_SETTINGS, start_input=None):
-    '''Cycles through all the aovs classed as either materials (mode 0) or lightgroups (mode 1) and creates and aov minibuild of them'''
-    ## breakout settings
-    expected_materials = settings['expected_materials']
-    lightgroup_regex = settings['lg_regex']
-    additional_lighting = settings['additional_lighting']
-    x_space = settings['x_space']
-    y_space = settings['y_space']
-
-    if start_input is None:
-        start_input = node
-
-    bpipe_nodes = []
-    x_pos, y_pos = get_centre_xypos(node)
-    y_pos += y_space * 1.5
-
-    no_op = nuke.nodes.NoOp(inputs = [start_input])
-    no_op.setName('spacer_no_op', True)
-    set_centred_xypos(no_op, x_pos, y_pos)
-    bpipe_nodes.append(no_op)
-
-    y_pos+=y_space
-    start_dot = nuke.nodes.Dot(inputs = [bpipe_nodes[-1]])
-    #start_dot['label'].setValue('start_dot')  ## For debugging layout
-    start_dot.setName('start_dot', True)
-    set_centred_xypos(start_dot, x_pos, y_pos)
-    bpipe_nodes.append(start_dot)
-    top_nodes =[bpipe_nodes[-1]]
-    ## ensure bpipe_xpos/ypos always exist even if no AOVs are found
-    bpipe_xpos, bpipe_ypos = get_centre_xypos(bpipe_nodes[-1])
-
-    ## main breakout
-    if mode == 0:
-        lightgroups_or_materials =  get_materials(node, expected_materials)
-        missing_materials = list(set([mat.lower() for mat in expected_materials]) - set([mat.lower() for mat in lightgroups_or_materials]))
-        print([mat.lower() for mat in expected_materials])
-        print([mat.lower() for mat in lightgroups_or_materials])
-    elif mode == 1:
-        lightgroups_or_materials = get_lightgroup_layers(node, lightgroup_regex, additional_lighting)
-
-    ## guard + feedback to artist on missing material AOVs
-    if not lightgroups_or_materials:
-        sticky_label = '<h3>Missing Materials</h3>There are no materials in this stream.'
-        sticky_note = nuke.nodes.StickyNote(
-            label=sticky_label,
-            tile_color=0x272727ff,
-            note_font_color=0xa8a8a8ff,
-            note_font_size=40
-        )
-        sticky_note.setXYpos(int(x_pos + x_space), int(y_pos))
-        return bpipe_nodes
-
-    count = 0 ## track Lightgroup numbers
-
-    for lg in lightgroups_or_materials:
-        x_pos, y_pos = get_centre_xypos(top_nodes[-1])
-        x_pos += x_space
-
-        ## aov_pipe
-        aov_pipe = []
-        aov_dot = nuke.nodes.Dot(inputs = [top_nodes[-1]])
-        #aov_dot['label'].setValue('aov_dot')  ## for debugging layout
-        aov_dot.setName('aov_dot', True)
-        set_centred_xypos(aov_dot, x_pos, y_pos)
-        top_nodes.append(aov_dot)
-        aov_pipe.append(aov_dot)
-
-        y_pos+=y_space
-        shuffle_lg = nuke.nodes.Shuffle2(inputs = [aov_pipe[-1]], in1 = lg, in2 = 'alpha', label = lg)
-        shuffle_lg['mappings'].setValue([('rgba.alpha','rgba.alpha')])
-        shuffle_lg["note_font_color"].setValue(int(0xFFFFFFFF))
-        shuffle_lg["note_font"].setValue("bold")
-        set_centred_xypos(shuffle_lg, x_pos, y_pos)
-        aov_pipe.append(shuffle_lg)
-
-        y_pos+=y_space
-        unpremult_lg = nuke.nodes.Unpremult(inputs = [aov_pipe[-1]])
-        set_centred_xypos(unpremult_lg, x_pos, y_pos)
-        aov_pipe.append(unpremult_lg)
-
-        y_pos+=y_space
-        bottom_aov_dot = nuke.nodes.Dot(inputs = [aov_pipe[-1]])
-        #bottom_aov_dot['label'].setValue('bottom_aov_dot')  ## for debugging layout
-        bottom_aov_dot.setName('bottom_aov_dot', True)
-        set_centred_xypos(bottom_aov_dot, x_pos, y_pos)
-        aov_pipe.append(bottom_aov_dot)
-
-        ## bpipe
-        if mode == 0:
-
-            lg_lower = lg.lower()
-            ## build a lowercase lookup once per iteration (cheap + simple)
-            all_mats_lower = [m.lower() for m in lightgroups_or_materials]
-
-            if lg_lower.startswith('combined'):
-
-                suffix = lg_lower[len('combined'):]  ## eg. 'diffuse', 'volume', etc
-
-                direct_name   = 'direct'   + suffix
-                indirect_name = 'indirect' + suffix
-
-                if direct_name in all_mats_lower and indirect_name in all_mats_lower:
-
-                    sticky_label = (
-                        "combined %s not added to B pipe,\n\n"
-                        "direct %s and indirect %s used."
-                        % (suffix, suffix, suffix)
-                    )
-
-                    sticky_note = nuke.nodes.StickyNote(
-                        label=sticky_label,
-                        tile_color=0x272727ff,
-                        note_font_color=0xa8a8a8ff,
-                        note_font_size=11
-                    )
-
-                    ## place under the combined shuffle
-                    sx, sy = get_centre_xypos(shuffle_lg)
-                    sticky_note.setXYpos(int(sx), int(sy + y_space * 1))
-                    ## skip adding this combined AOV to the B pipe
-                    continue
-
-            # skip ao AOV in B pipe (materials rebuild only) - NO continue
-            if lg_lower == "ao":
-                sticky_label = (
-                    "ao AOV not added to B pipe,\n\n"
-                    "Please use as needed"
-                )
-
-                sticky_note = nuke.nodes.StickyNote(
-                    label=sticky_label,
-                    tile_color=0x272727ff,
-                    note_font_color=0xa8a8a8ff,
-                    note_font_size=11
-                )
-
-                sx, sy = get_centre_xypos(shuffle_lg)
-                sticky_note.setXYpos(int(sx), int(sy + y_space * 1))
-
-                # mark this iteration as "skip merge"
-                skip_bpipe = True
-            else:
-                skip_bpipe = False
-
-        ## skip albedo AOVs in B pipe (materials rebuild only)
-        if mode == 0 and 'albedo' in lg.lower():
-
-            ## ensure the RGB remove happens once at the start of the bpipe (same as normal flow)
-            bpipe_xpos, bpipe_ypos = get_centre_xypos(bpipe_nodes[-1])
-
-            if count == 0:
-                remove_rgb = nuke.nodes.Remove(
-                    operation='remove',
-                    channels='rgb',
-                    inputs=[bpipe_nodes[-1]],
-                    label='RGB',
-                    note_font_color=0xFFFFFFFF,
-                    note_font='bold'
-                )
-                set_centred_xypos(remove_rgb, bpipe_xpos, bpipe_ypos + y_space)
-                bpipe_nodes.append(remove_rgb)
-
-                ## mark "first" as handled so we don't create remove_rgb again next iteration
-                count = 1
-
-                ## update bpipe position now that we've appended remove_rgb
-                bpipe_xpos, bpipe_ypos = get_centre_xypos(bpipe_nodes[-1])
-
-            ## reserve the same vertical space a merge_plus would take (keeps layout unchanged)
-            merge_ypos = bpipe_ypos + (y_space * 3)
-
-            albedo_spacer_dot = nuke.nodes.Dot(inputs=[bpipe_nodes[-1]])
-            #albedo_spacer_dot['label'].setValue('albedo_skipped')  ## for debugging layout
-            albedo_spacer_dot.setName('albedo_spacer_dot', True)
-            set_centred_xypos(albedo_spacer_dot, bpipe_xpos, merge_ypos)
-            bpipe_nodes.append(albedo_spacer_dot)
-
-            ## keep the aov branch bottom aligned to the bpipe row (same as normal flow)
-            y_pos = merge_ypos
-            set_centred_xypos(aov_pipe[-1], x_pos, y_pos)
-
-            ## sticky note under the albedo shuffle
-            sticky_label = (
-                "albedo AOV not added to B pipe,\n\n"
-                "this AOV will break the basic rebuild.\n\n"
-                "Please only use for cheats\n\n" 
-                "or refer to the advanced rebuild for albedo rebuild."
-            )
-            sticky_note = nuke.nodes.StickyNote(
-                label=sticky_label,
-                tile_color=0x272727ff,
-                note_font_color=0xa8a8a8ff,
-                note_font_size=11
-            )
-            ## place underneath the albedo shuffle
-            sx, sy = get_centre_xypos(shuffle_lg)
-            sticky_note.setXYpos(int(sx - x_space * 0.5), int(sy + y_space * 1))
-            ...
-        elif mode == 0 and skip_bpipe:
-            # AO (or any future skip case): do nothing further to bpipe
-            # (no spacer dots, no remove node, no merge)
-            pass
-        else:
-            bpipe_xpos, bpipe_ypos = get_centre_xypos(bpipe_nodes[-1])
-
-            if count==0:
-                remove_rgb = nuke.nodes.Remove(
-                    operation='remove',
-                    channels='rgb',
-                    inputs=[bpipe_nodes[-1]],
-                    label='RGB',
-                    note_font_color=0xFFFFFFFF,
-                    note_font='bold'
-                )
-                set_centred_xypos(remove_rgb, bpipe_xpos, bpipe_ypos+y_space)
-                bpipe_nodes.append(remove_rgb)
-
-            bpipe_ypos += y_space * 2
-
-            bpipe_ypos += y_space
-            merge_plus = nuke.nodes.Merge2(
-                inputs=[bpipe_nodes[-1], aov_pipe[-1]],
-                operation='plus',
-                output='rgb',
-                tile_color=MERGE_PLUS_COLOUR,
-                label=lg
-            )
-            set_centred_xypos(merge_plus, bpipe_xpos, bpipe_ypos)
-            bpipe_nodes.append(merge_plus)
-
-            y_pos = bpipe_ypos
-            set_centred_xypos(aov_pipe[-1], x_pos, y_pos)
-
-            count += 1
-
-    ## unassigned Pipe
-    unassigned_pipe = []
-    x_pos += x_space
-    unassigned_aov_dot = nuke.nodes.Dot(inputs = [top_nodes[-1]])
-    #unassigned_aov_dot['label'].setValue('unassigned_aov_dot')  ## for debugging layout
-    unassigned_ypos = get_centre_xypos(top_nodes[-1], )[1]
-    set_centred_xypos(unassigned_aov_dot, x_pos, unassigned_ypos)
-    top_nodes.append(unassigned_aov_dot)
-    unassigned_pipe.append(unassigned_aov_dot)
-
-    ## feedback to artist on missing material aovs
-    if mode == 0 and missing_materials != []:
-        sticky_label = '<h3>Missing Materials</h3>'
-        for material in missing_materials:
-            sticky_label += '<i>' + material + r'</i>\n'
-        sticky_note = nuke.nodes.StickyNote(label=sticky_label, tile_color=0x272727ff, note_font_color=0xa8a8a8ff, note_font_size=40)
-        sticky_note.setXYpos(x_pos + x_space, unassigned_ypos)
-
-    unassigned_ypos += y_space
-    shuffle_original = nuke.nodes.Shuffle2(inputs = [unassigned_pipe[-1]], in1 = 'original', label = 'original rbg', note_font_color = 0xFFFFFFFF, note_font = 'bold')
-    set_centred_xypos(shuffle_original, x_pos, unassigned_ypos)
-
-    unassigned_pipe.append(shuffle_original)
-
-    for lg in lightgroups_or_materials:
-        unassigned_ypos += y_space
-        unpremult_unassigned_pipe = nuke.nodes.Unpremult(inputs = [unassigned_pipe[-1] ], channels = lg)
-        set_centred_xypos(unpremult_unassigned_pipe, x_pos, unassigned_ypos)
-        unassigned_pipe.append(unpremult_unassigned_pipe)
-        
-        unassigned_ypos += y_space
-        bpipe_ypos +=y_space * 0.5
-        merge_from = nuke.nodes.Merge2(inputs = [unassigned_pipe[-1], unassigned_pipe[-1]], Achannels = lg, operation ='from', output = 'rgb', tile_color = MERGE_FROM_COLOUR, label = lg)
-        set_centred_xypos(merge_from, x_pos, unassigned_ypos)
-        unassigned_pipe.append(merge_from)
-
-        y_pos += y_space * 0.5
-
-    unassigned_bottom_dot = nuke.nodes.Dot(inputs = [unassigned_pipe[-1]])
-    #unassigned_bottom_dot['label'].setValue('unassigned_bottom_dot')  ## for debugging layout
-    unassigned_bottom_dot.setName('unassigned_bottom_dot', True)
-    set_centred_xypos(unassigned_bottom_dot, x_pos, y_pos)
-    unassigned_pipe.append(unassigned_bottom_dot)
-
-    merge_plus = nuke.nodes.Merge2(inputs = [ bpipe_nodes[-1], unassigned_pipe[-1]], operation ='plus', output = 'rgb', tile_color = MERGE_PLUS_COLOUR, label = '<i> unassigned aov', disable = True)
-    merge_plus.setName('merge_plus', True)
-    set_centred_xypos(merge_plus, bpipe_xpos, bpipe_ypos)
-    bpipe_nodes.append(merge_plus)
-
-    bpipe_ypos += y_space
-    end_result = nuke.nodes.Dot(inputs =[bpipe_nodes[-1]])
-    #end_result['label'].setValue('end_result')  ## for debugging layout
-    set_centred_xypos(end_result, bpipe_xpos, bpipe_ypos)
-    bpipe_nodes.append(end_result)
-
-    return bpipe_nodes
-
-def breakout_lightgroups_and_materials(node, settings=DEFAULT_SETTINGS):
-    '''Runs a breakout of materials and lightgroups using divide/multiply to combine both operations in a mathematically correct fashion.'''
-    breakout_utilities_enabled = settings.get('breakout_utilities', False)
-    utility_dot = None
-    if breakout_utilities_enabled == True:
-        utility_dot = breakout_utilities(node, settings)
-    ## breakout settings
-    print(settings)
-    breakout_materials = settings['breakout_materials']
-    breakout_lightgroups = settings['breakout_lightgroups']
-    expected_materials = settings['expected_materials']
-    expected_utilities = settings['expected_utilities']
-    lightgroup_regex = settings['lg_regex']
-    additional_lighting = settings['additional_lighting']
-    x_space = settings['x_space']
-    y_space = settings['y_space']
-
-    ## guard : Utilities only mode
-    if (not settings.get('breakout_materials', False) and
-        not settings.get('breakout_lightgroups', False) and
-        settings.get('breakout_utilities', False)):
-
-        breakout_utilities(node, settings)
+    ## no post pass needed, the rebuild is pasted with its final layout (see AOV_rebuild_karma_layout)
+
+def cryptomatte_scope(crypto):
+    '''Returns (layer, names) of the selection of the Cryptomatte node `crypto`'''
+    layer = crypto['cryptoLayer'].value() if crypto.knob('cryptoLayer') is not None else ''
+    if not layer and crypto.knob('lastSelectedCryptoLayerName') is not None:
+        layer = crypto['lastSelectedCryptoLayerName'].value()
+    return layer, parse_matte_list(crypto['matteList'].value())
+
+def custom_scoped_breakout(node=None, crypto=None):
+    '''Obtain custom user settings from a panel and rebuild the selected node inside the matte of the selected
+    Cryptomatte only, leaving the rest of the frame as the original (see AOV_rebuild_karma_build.scope_matte).
+    With only a Cryptomatte selected, the node above it is rebuilt.'''
+    if crypto is None:
+        cryptos = nuke.selectedNodes('Cryptomatte')
+        crypto = cryptos[0] if cryptos else None
+    if node is None:
+        others = [n for n in nuke.selectedNodes() if n is not crypto]
+        node = others[0] if others else (crypto.input(0) if crypto is not None else None)
+    if crypto is None or node is None:
+        nuke.message('Please select a Cryptomatte with the hero asset picked (and the node to rebuild).')
         return
-
-    ## if there are no materials/lightgroups, run utilities only (if any)
-    materials = get_materials(node, expected_materials)
-    lightgroups = get_lightgroup_layers(node, lightgroup_regex, additional_lighting)
-    utilities = get_utilities(node, expected_utilities)
-
-    if not materials and not lightgroups and utilities:
-        if settings.get('breakout_utilities', False):
-            breakout_utilities(node, settings)
+    if is_deep(node):
+        nuke.message('Deep rebuilds cannot be scoped to a Cryptomatte, flatten the stream first.')
+        return
+    layer, names = cryptomatte_scope(crypto)
+    if not layer or not names:
+        nuke.message('Nothing is picked in %s, pick the asset to rebuild first.' % crypto.name())
         return
 
-    ## begin main bpipe
-    bpipe_nodes = []
-    x_pos, y_pos = get_centre_xypos(node)
-    y_pos += y_space
-
-    shuffle_original = nuke.nodes.Shuffle2(inputs=[node], label = '[value in1] > [value out1]', note_font_color = 0xFFFFFFFF, note_font = 'bold')
-    nuke.Layer('original', ['original.red', 'original.green', 'original.blue', 'original.alpha'])
-    shuffle_original['out1'].setValue('original')
-    set_centred_xypos(shuffle_original, x_pos, y_pos)
-    bpipe_nodes.append(shuffle_original)
-    y_pos += y_space
-
-    unpremult_original = nuke.nodes.Unpremult(inputs=[bpipe_nodes[-1]], )
-    #unpremult_original['channels'].setValue('original')
-    unpremult_original['channels'].setValue('original.red original.green original.blue')
-    set_centred_xypos(unpremult_original, x_pos, y_pos)
-    bpipe_nodes.append(unpremult_original)
-    y_pos += y_space
-
-    ## materials breakout
-    if breakout_materials == True:
-        mat_branch_dot = nuke.nodes.Dot(inputs=[bpipe_nodes[-1]], )
-        #mat_branch_dot['label'].setValue('mat_branch_dot')  ## for debugging layout
-        set_centred_xypos(mat_branch_dot, x_pos, y_pos)
-        bpipe_nodes.append(mat_branch_dot)
-        x_pos += x_space
-        mat_branch_dot2 = nuke.nodes.Dot(inputs=[bpipe_nodes[-1]], )
-        #mat_branch_dot2['label'].setValue('mat_branch_dot2')  ## for debugging layout
-        set_centred_xypos(mat_branch_dot2, x_pos, y_pos)
-
-        mat_pipe = plus_lightgroups_or_materials(mat_branch_dot2, 0, settings)
-        x_pos = get_centre_xypos(bpipe_nodes[-1])[0]
-        y_pos = get_centre_xypos(mat_pipe[-1])[1]
-
-        mat_dot_bottom = nuke.nodes.Dot(inputs=[bpipe_nodes[-1]])
-        #mat_dot_bottom['label'].setValue('mat_dot_bottom') ## for debugging layout
-        set_centred_xypos(mat_dot_bottom, x_pos, y_pos)
-        bpipe_nodes.append(mat_dot_bottom)
-
-        shuffle_back_original = nuke.nodes.Shuffle2(inputs=[bpipe_nodes[-1]], in1='original', label='original rbg', note_font_color = 0xFFFFFFFF, note_font = 'bold')
-        midpoint = int((get_centre_xypos(bpipe_nodes[-1])[0] + get_centre_xypos(mat_pipe[-1])[0]) / 2)
-        set_centred_xypos(shuffle_back_original, midpoint, y_pos)
-
-        y_pos += y_space
-        merge_divide = nuke.nodes.Merge2(inputs=[shuffle_back_original, mat_pipe[-1]], operation='divide', output='rgb')
-        set_centred_xypos(merge_divide, get_centre_xypos(mat_pipe[-1])[0], y_pos)
-        mat_pipe.append(merge_divide)
-
-        y_pos += y_space
-
-        merge_materials = nuke.nodes.Merge2(inputs=[bpipe_nodes[-1], mat_pipe[-1]], operation='multiply', output='rgb')
-        set_centred_xypos(merge_materials, x_pos, y_pos)
-        bpipe_nodes.append(merge_materials)
-
-        y_pos += y_space
-        spacer_dot = nuke.nodes.Dot(inputs=[bpipe_nodes[-1]], label='spacer dot!')
-        set_centred_xypos(spacer_dot, x_pos, y_pos)
-        bpipe_nodes.append(spacer_dot)
-
-    ## lightgroups breakout
-    if breakout_lightgroups == True and get_lightgroup_layers(node, lightgroup_regex, additional_lighting):
-        lg_branch_dot = nuke.nodes.Dot(inputs=[bpipe_nodes[-1]], )
-        #lg_branch_dot['label'].setValue('lg_branch_dot')  ## for debugging layout
-        set_centred_xypos(lg_branch_dot, x_pos, y_pos)
-        bpipe_nodes.append(lg_branch_dot)
-        x_pos += x_space
-        lg_branch_dot2 = nuke.nodes.Dot(inputs=[bpipe_nodes[-1]], )
-        #lg_branch_dot2['label'].setValue('lg_branch_dot2')  ## for debugging layout
-        set_centred_xypos(lg_branch_dot2, x_pos, y_pos)
-
-        lg_pipe = plus_lightgroups_or_materials(lg_branch_dot2, 1, settings)
-        x_pos = get_centre_xypos(bpipe_nodes[-1])[0]
-        y_pos = get_centre_xypos(lg_pipe[-1])[1]
-
-        lg_dot_bottom = nuke.nodes.Dot(inputs=[bpipe_nodes[-1]])
-        #lg_dot_bottom['label'].setValue('lg_dot_bottom')  ## for debugging layout
-        set_centred_xypos(lg_dot_bottom, x_pos, y_pos)
-        bpipe_nodes.append(lg_dot_bottom)
-
-        shuffle_back_original = nuke.nodes.Shuffle2(inputs=[bpipe_nodes[-1]], in1='original', label='original rbg', note_font_color = 0xFFFFFFFF, note_font = 'bold')
-        midpoint = int((get_centre_xypos(bpipe_nodes[-1])[0] + get_centre_xypos(lg_pipe[-1])[0]) / 2)
-        set_centred_xypos(shuffle_back_original, midpoint, y_pos)
-
-        y_pos += y_space
-        merge_divide = nuke.nodes.Merge2(inputs=[shuffle_back_original, lg_pipe[-1]], operation='divide', output='rgb')
-        set_centred_xypos(merge_divide, get_centre_xypos(lg_pipe[-1])[0], y_pos)
-        lg_pipe.append(merge_divide)
-
-        y_pos += y_space
-
-        merge_materials = nuke.nodes.Merge2(inputs=[bpipe_nodes[-1], lg_pipe[-1]], operation='multiply', output='rgb')
-        set_centred_xypos(merge_materials, x_pos, y_pos)
-        bpipe_nodes.append(merge_materials)
-
-    ## guard + feedback to artist on missing lightgroup AOVs
-    elif breakout_lightgroups == True:
-        sticky_label = '<h3>Missing Lightgroups</h3>There are no lightgroups in this stream (as per the regex code).'
-        sticky_note = nuke.nodes.StickyNote(
-            label=sticky_label,
-            tile_color=0x272727ff,
-            note_font_color=0xa8a8a8ff,
-            note_font_size=40
-        )
-        sticky_note.setXYpos(int(x_pos + x_space), int(y_pos))
+    settings = setup_breakout_panel()
+    if settings is None:
+        return
+    settings = dict(settings, scope_layer = layer, scope_mattes = names, scope_bbox = None)
+    custom_breakout_lightgroups_and_materials(node, settings)
+
+def custom_group_breakout(node):
+    '''Obtain custom user settings from a panel and package the rebuild of `node` in a single Group graded from its panel
+    (see AOV_rebuild_karma_group)'''
+    if is_deep(node):
+        nuke.message('Deep rebuilds are not packaged in a Group, run AOV_rebuild_karma on the deep stream instead.')
+        return
+    settings = setup_breakout_panel()
+    if settings is None:
+        return
+    ## the Group module is only imported once a Group is made or opened
+    import AOV_rebuild_karma_group
+    AOV_rebuild_karma_group.create_group(node, settings)
+
+def custom_precomp_rebuild(node=None):
+    '''Obtain the precomp settings from a panel, render the breakout of the selected rebuild to one multichannel EXR
+    and switch the rebuild over to reading it (see AOV_rebuild_karma_precomp)'''
+    if node is None:
+        node = nuke.selectedNode()
+    if get_rebuild_id(node) is None:
+        nuke.message('Please select a node of the AOV rebuild to precomp.')
+        return
+    import AOV_rebuild_karma_precomp
+
+    p = nuke.Panel('AOV rebuild precomp')
+    p.addEnumerationPulldown('compression', ' '.join(sorted(AOV_rebuild_karma_precomp.COMPRESSIONS,
+                                                            key = lambda name: name != AOV_rebuild_karma_precomp.COMPRESSION)))
+    p.addSingleLineInput('render processes', AOV_rebuild_karma_precomp.default_processes())
+    p.addSingleLineInput('precomp directory (optional)', os.environ.get(AOV_rebuild_karma_precomp.PRECOMP_DIR_ENV, ''))
+    if not p.show():
+        return
 
-    y_pos += y_space
+    try:
+        switch, reason = precomp_rebuild(node, p.value('compression'), int(p.value('render processes')),
+                                         p.value('precomp directory (optional)').strip() or None)
+    except RebuildCancelled:
+        return
+    except (ValueError, EnvironmentError) as e:
+        nuke.message('Rebuild not precomped, %s' % e)
+        return
+    if reason is not None:
+        nuke.message('The precomp was rendered but is not read, %s.' % reason)
+
+def custom_channel_budget(nodes=None):
+    '''Obtain custom user settings from a panel and report the channels rebuilding the selected nodes would take,
+    without creating any node'''
+    if nodes is None:
+        nodes = nuke.selectedNodes()
+    if not nodes:
+        nuke.message('Please select the nodes to rebuild.')
+        return
+    settings = setup_breakout_panel()
+    if settings is None:
+        return
+    budgets = channel_budget(sorted(nodes, key = lambda n: n.xpos()), settings)
+    nuke.message('\n\n'.join(AOV_rebuild_karma_channels.format_budget(budget, name) for name, budget in budgets.items()))
+
+def custom_update_rebuild(node=None):
+    '''Obtain custom user settings from a panel and patch the rebuild of the selected node to the current aovs upstream'''
+    if node is None:
+        node = nuke.selectedNode()
+    if get_rebuild_id(node) is None:
+        nuke.message('Please select a node of the AOV rebuild to update.')
+        return
 
-    final_premult = nuke.nodes.Premult(inputs=[bpipe_nodes[-1]])
-    set_centred_xypos(final_premult, x_pos, y_pos)
-    bpipe_nodes.append(final_premult)
+    settings = setup_breakout_panel()
+    if settings is None:
+        return
+    try:
+        report = update_rebuild(node, settings)
+    except RebuildCancelled:
+        return
+    except ValueError as e:
+        nuke.message(str(e))
+        return
 
-def post_layout_adjustments(y_offset_shuffle=28, y_offset_unpremult=32, y_pad_bottom_dot=50):
+    lines = []
+    for pipe in AOV_rebuild_karma_build.REBUILD_PIPES:
+        if pipe in report:
+            lines.append('%s: %d added, %d removed' % (pipe, len(report[pipe]['added']), len(report[pipe]['removed'])))
+    for pipe in report['rebuild_needed']:
+        lines.append('%s: not part of this rebuild, run a new rebuild to break them out' % pipe)
+    nuke.message('\n'.join(lines) or 'Rebuild is up to date.')
+
+def custom_batch_breakout_lightgroups_and_materials(nodes=None):
+    '''Obtain custom user settings from a panel once and rebuild every selected Read and DeepRead with them'''
+    if nodes is None:
+        nodes = nuke.selectedNodes('Read') + nuke.selectedNodes('DeepRead')
+    if not nodes:
+        nuke.message('Please select the Read nodes to rebuild.')
+        return
 
-    deleted_NoOps = 0
+    settings = setup_breakout_panel()
+    if settings is None:
+        return
+    try:
+        batch_breakout_lightgroups_and_materials(nodes, settings)
+    except RebuildCancelled:
+        return
 
-    ## move Shuffle2 nodes UP to the minimum Y of their upstream aov_dot + offset
-    for sh in nuke.allNodes():
-        if (
-            sh.Class() == 'Shuffle2'
-            or (sh.Class() == 'Remove' and sh['label'].value() == 'RGB')
-        ):
-            inp = sh.input(0)
-            if not inp:
+def breakout_utilities(node, settings = DEFAULT_SETTINGS, layer_index = None, emit_only = False):
+    '''Cycles through all the aovs classed as utilities and creates an aov shuffle of them.
+    With `emit_only` the .nk script text is returned instead of being pasted.'''
+    with AOV_rebuild_karma_profile.run('utilities', node = node.name(), settings = settings):
+        if layer_index is None:
+            with phase('classify'):
+                layer_index = get_layer_index(node, settings)
+        with phase('build'):
+            graph = AOV_rebuild_karma_build.build_utilities_graph(layer_index, settings, graph_source(node))
+        if emit_only:
+            return graph.to_nk()
+        if graph.node_list:
+            with phase('paste'):
+                return paste_graph(graph, node)
+        return []
+
+def breakout_lightgroups_and_materials(node, settings=DEFAULT_SETTINGS, emit_only = False):
+    '''Runs a breakout of materials and lightgroups using divide/multiply to combine both operations in a mathematically correct fashion.
+
+    The whole rebuild is described in memory (see AOV_rebuild_karma_build) and pasted in one operation,
+    every pasted node is tagged with the rebuild's id and the pasted nodes are returned.
+    With `emit_only` the .nk script text is returned instead. Deep streams (eg. a DeepRead) get a deep rebuild,
+    summed per sample and flattened once (see AOV_rebuild_karma_build.deep_breakout).
+
+    Progress is shown per aov branch and per frame scanned, the rebuild is one undo step. Cancelling raises
+    RebuildCancelled, nothing is pasted until the graph is complete and a paste cancelled is undone.'''
+    with AOV_rebuild_karma_profile.run('rebuild', node = node.name(), settings = settings), \
+            RebuildProgress('AOV rebuild of %s' % node.name()) as progress:
+        ## classify the stream once, every breakout reads from this index
+        progress.stage('classifying %s' % node.name(), 0, 5)
+        with phase('classify'):
+            layer_index = get_layer_index(node, settings)
+            settings = channel_settings(node, settings)
+        progress.stage('scanning %s' % node.name(), 5, 30)
+        with phase('scan'):
+            settings = scan_settings(node, settings, progress.frame)
+        progress.stage('building', 30, 80, branch_total(layer_index, settings))
+        with phase('build'):
+            graph = rebuild_graph(node, layer_index, settings, progress.branch)
+        profile_layer_index(layer_index, graph)
+        if emit_only:
+            with phase('serialize'):
+                return graph.to_nk()
+        if not graph.node_list or not confirm_channel_budget(node, layer_index, graph):
+            return []
+        progress.stage('pasting %d nodes' % len(graph.node_list), 80, 100)
+        with phase('paste'), undo_group('AOV rebuild'):
+            pasted = paste_graph(graph, node)
+            progress.stage('pasted %d nodes' % len(pasted), 100, 100)
+        profile_render(pasted)
+        return pasted
+
+def profile_layer_index(layer_index, graph):
+    '''Adds the size of a stream and of the graph built for it to the current profile run'''
+    count('channels', len(layer_index['channels']))
+    for bucket in ('materials', 'lightgroups', 'utilities'):
+        count(bucket, len(layer_index[bucket]))
+    count('graph_nodes', len(graph.node_list))
+
+def rebuild_end(pasted):
+    '''Returns the node at the end of the `pasted` rebuild (its final Premult, DeepToImage or scope Keymix), or None'''
+    ends = [n for n in pasted if n.Class() in ('Premult', 'DeepToImage', 'Keymix')]
+    return ends[-1] if ends else None
+
+def profile_render(pasted):
+    '''Renders the end of a pasted rebuild with nuke's performance timers on when the current profile run asks for it'''
+    frames = AOV_rebuild_karma_profile.render_frames()
+    end = rebuild_end(pasted)
+    if frames is None or end is None:
+        return
+    with phase('render'):
+        AOV_rebuild_karma_profile.set_render(AOV_rebuild_karma_profile.capture_render(pasted, end, *frames))
+
+def batch_breakout_lightgroups_and_materials(nodes, settings=DEFAULT_SETTINGS):
+    '''Rebuilds every node in `nodes` (eg. the Reads of a shot) with the same settings, side by side from left to right.
+
+    Nodes are moved right only as far as needed for their rebuild to clear the one on their left, and nodes with the
+    same channels share one classification. Returns a dictionary of node name > pasted nodes.
+    The whole batch is one undo step, cancelling it (RebuildCancelled) undoes the rebuilds already pasted.'''
+    layer_indexes = {}
+    pasted = {}
+    cursor = None
+    nodes = sorted(nodes, key = lambda n: n.xpos())
+    with AOV_rebuild_karma_profile.run('batch', nodes = [n.name() for n in nodes], settings = settings), \
+            RebuildProgress('AOV rebuild of %d nodes' % len(nodes)) as progress, undo_group('AOV batch rebuild'):
+        for i, node in enumerate(nodes):
+            ## each node gets an even share of the bar: scan, build then paste
+            share = 100.0 / len(nodes)
+            start = share * i
+            channels = tuple(node.channels())
+            schema = node_schema(node, settings)
+            layer_index = layer_indexes.get((channels, schema))
+            if layer_index is None:
+                with phase('classify'):
+                    layer_index = layer_indexes[(channels, schema)] = classify_channels_from_settings(channels, settings, schema)
+
+            progress.stage('scanning %s' % node.name(), start, start + share * 0.3)
+            with phase('scan'):
+                node_settings = scan_settings(node, channel_settings(node, settings), progress.frame)
+            progress.stage('building %s' % node.name(), start + share * 0.3, start + share * 0.8,
+                           branch_total(layer_index, node_settings))
+            with phase('build'):
+                graph = rebuild_graph(node, layer_index, node_settings, progress.branch)
+            profile_layer_index(layer_index, graph)
+            left, _, right, _ = graph_bbox(graph)
+            if cursor is not None and left < cursor:
+                translate_graph(graph, cursor - left, 0)
+                node.setXYpos(graph.source.xpos(), node.ypos())
+                right += cursor - left
+            cursor = right + settings['x_space']
+
+            if graph.node_list and not confirm_channel_budget(node, layer_index, graph):
+                raise RebuildCancelled('AOV rebuild of %s cancelled, over the channel limit' % node.name())
+            progress.stage('pasting %s' % node.name(), start + share * 0.8, start + share)
+            with phase('paste'):
+                pasted[node.name()] = paste_graph(graph, node) if graph.node_list else []
+    return pasted
+
+def _reconnect_around(doomed, chain_roles):
+    '''Reconnects whatever hangs off the `doomed` nodes with a role in `chain_roles` to the first surviving
+    node up their input 0 chain, so deleting them leaves the pipes they were part of intact'''
+    doomed_names = {n.fullName() for n in doomed}
+
+    def survivor(n):
+        while n is not None and n.fullName() in doomed_names:
+            n = n.input(0)
+        return n
+
+    for d in doomed:
+        if _layout_role(d) not in chain_roles:
+            continue
+        for dependent in d.dependent(nuke.INPUTS, False):
+            if dependent.fullName() in doomed_names:
+                continue
+            for i in range(dependent.inputs()):
+                if dependent.input(i) is not None and dependent.input(i).fullName() == d.fullName():
+                    dependent.setInput(i, survivor(d))
+
+def update_rebuild(node, settings=DEFAULT_SETTINGS):
+    '''Patches the rebuild `node` belongs to after the aovs of its upstream have changed.
+
+    The layers of the upstream are compared with the aovs each pipe was built for: branches of aovs that are gone are
+    deleted with their merges and unassigned pipe subtractions, new aovs get a branch added to the right of the pipe.
+    Nodes the rebuild did not create (eg. grades) are never deleted, so the work scales with the number of changed aovs.
+    With 'prune_empty' on, aovs that are now black over the frame range are removed like missing ones, with
+    'crop_to_data' on the Crops of the kept branches are reset to the data the aovs cover now.
+    Returns a dictionary of pipe > {'added' : [...], 'removed' : [...]}, plus 'rebuild_needed' listing the pipes
+    that cannot be patched (not built, or built without any aovs) and need a full rebuild.
+    The update is one undo step, cancelling it (RebuildCancelled) undoes what was patched so far.'''
+    with AOV_rebuild_karma_profile.run('update', node = node.name(), settings = settings), \
+            RebuildProgress('AOV rebuild update') as progress, undo_group('AOV rebuild update'):
+        progress.stage('finding the rebuild of %s' % node.name(), 0, 10)
+        with phase('find'):
+            members = find_rebuild_nodes(node)
+        if not members:
+            raise ValueError('%s is not part of an AOV rebuild' % node.name())
+        rebuild_id = get_rebuild_id(node)
+
+        by_role = {}
+        for n in members:
+            by_role.setdefault(_layout_role(n), []).append(n)
+        if 'deep_sum' in by_role or 'deep_aov_grade' in by_role:
+            raise ValueError('deep rebuilds cannot be patched, run a new rebuild of the deep stream')
+        if 'original_shuffle' not in by_role:
+            ## a utilities breakout has no pipes
+            raise ValueError('the AOV rebuild of %s has nothing to update' % node.name())
+        source = by_role['original_shuffle'][0].input(0)
+        with phase('classify'):
+            layer_index = get_layer_index(source, settings)
+        progress.stage('scanning %s' % source.name(), 10, 40)
+        with phase('scan'):
+            settings = scan_settings(source, settings, progress.frame)
+
+        ## the aovs each pipe was built for, in build order, with the nodes of every aov branch
+        pipes = {}
+        for n in members:
+            pipe = get_rebuild_tag(n, 'pipe')
+            if pipe is None:
+                continue
+            built = pipes.setdefault(pipe, {'aovs' : {}, 'roles' : {}})
+            aov = get_rebuild_tag(n, 'aov')
+            if aov is not None:
+                built['aovs'].setdefault(aov, []).append(n)
+            else:
+                built['roles'].setdefault(_layout_role(n), []).append(n)
+
+        compact = any(n['label'].value() == 'compact' for n in by_role.get('unpremult_original', []))
+        original_layer = by_role['original_shuffle'][0]['out1'].value()
+        patch_settings = dict(settings, compact = compact)
+        buckets = dict(zip(AOV_rebuild_karma_build.REBUILD_PIPES, ('materials', 'lightgroups')))
+
+        report = {'rebuild_needed' : []}
+        final_aovs = {}
+        for i, (pipe, bucket) in enumerate(buckets.items()):
+            current = AOV_rebuild_karma_build.kept_aovs(layer_index[bucket], settings)
+            built = pipes.get(pipe)
+            if built is None or 'unassigned_aov_dot' not in built['roles']:
+                final_aovs[pipe] = [] if built is None else list(built['aovs'])
+                if current and (built is None or not built['aovs']):
+                    report['rebuild_needed'].append(pipe)
                 continue
 
-            if inp.Class() == 'Dot' and ('aov_dot' in inp.name() or 'start_dot' in inp.name()):
-                sh_x, _ = get_centre_xypos(sh)
-                _, dot_y = get_centre_xypos(inp)
-
-                target_y = int(dot_y + y_offset_shuffle)
-                set_centred_xypos(sh, sh_x, target_y)
-
-    ## move Unpremult nodes up to the minimum Y of their upstream Shuffle2 + offset
-    for up in nuke.allNodes('Unpremult'):
-        inp = up.input(0)
-        if not inp:
-            continue
+            roles = built['roles']
+            ## left to right along the aov row, the order the pipe was built in
+            aov_dots = {aov : [n for n in branch if _layout_role(n) == 'aov_dot'] for aov, branch in built['aovs'].items()}
+            built_aovs = sorted(built['aovs'], key = lambda aov: aov_dots[aov][0].xpos() if aov_dots[aov] else 0)
+            removed = [aov for aov in built_aovs if aov not in current]
+            added = [aov for aov in current if aov not in built['aovs']]
+            if pipe == AOV_rebuild_karma_build.REBUILD_PIPES[0]:
+                ## a changed material set can flip whether a kept aov is plussed (eg. combined vs direct + indirect),
+                ## those branches are replaced
+                for aov in built_aovs:
+                    if aov in removed:
+                        continue
+                    merged = any(_layout_role(n) == 'aov_merge_plus' for n in built['aovs'][aov])
+                    if merged != (aov not in layer_index['bpipe_skip']):
+                        removed.append(aov)
+                        added.append(aov)
+            report[pipe] = {'added' : added, 'removed' : removed}
+            progress.stage('patching %s' % pipe, 40 + 30 * i, 70 + 30 * i, len(added))
+            final_aovs[pipe] = [aov for aov in built_aovs if aov not in removed] + added
+
+            ## remove the branches of aovs that are gone
+            doomed = [n for aov in removed for n in built['aovs'][aov]]
+            with phase('delete'):
+                _reconnect_around(doomed, ('aov_dot', 'aov_merge_plus', 'unassigned_unpremult', 'unassigned_merge_from'))
+                for n in doomed:
+                    nuke.delete(n)
+            count('nodes_deleted', len(doomed))
+
+            ## add branches for new aovs, right of the pipe's aov row
+            if added:
+                aov_row = [n for aov in built_aovs if aov not in removed for n in aov_dots[aov]]
+                top = max(aov_row + roles['unassigned_aov_dot'], key = lambda n: n.xpos())
+                unassigned_plus = roles['merge_plus'][0]
+                unassigned_bottom_dot = roles['unassigned_bottom_dot'][0]
+                unassigned = None if 'unassigned_expression' in roles else unassigned_bottom_dot.input(0)
+
+                with phase('build'):
+                    graph, bpipe_tail, unassigned_tail = AOV_rebuild_karma_build.build_patch_graph(
+                        layer_index, pipe, added, patch_settings, top, unassigned_plus.input(0), unassigned,
+                        rebuild_id, remove_rgb = 'remove_rgb' not in roles, progress = progress.branch)
+                with phase('paste'):
+                    live_nodes = pasted_by_graph_node(graph, paste_graph(graph, top))
+                if bpipe_tail is not None:
+                    unassigned_plus.setInput(0, live_nodes[id(bpipe_tail)])
+                if unassigned_tail is not None:
+                    unassigned_bottom_dot.setInput(0, live_nodes[id(unassigned_tail)])
+
+            ## kept branches follow the data window of their aov, the whole format when it is not known any more
+            if settings.get('crop_to_data', False):
+                aov_bboxes = settings.get('aov_bboxes') or {}
+                for aov in built_aovs:
+                    if aov in removed:
+                        continue
+                    for crop in (n for n in built['aovs'][aov] if _layout_role(n) == 'aov_crop'):
+                        if aov in aov_bboxes:
+                            crop['box'].setValue(list(aov_bboxes[aov]))
+                            crop['disable'].setValue(False)
+                        else:
+                            crop['disable'].setValue(True)
+
+            ## the pruned note lists what is pruned now, gone once nothing is
+            pruned = [aov for aov in layer_index[bucket] if aov not in current]
+            for note in roles.get('pruned_note', []):
+                if pruned:
+                    note['label'].setValue(AOV_rebuild_karma_build.pruned_aovs_label(pruned))
+                else:
+                    nuke.delete(note)
+
+            for expression in roles.get('unassigned_expression', []):
+                guard = bool(expression['expr3'].value())
+                knobs = AOV_rebuild_karma_build.unassigned_expression_knobs(layer_index, final_aovs[pipe], compact, guard, original_layer)
+                for name, value in knobs.items():
+                    expression[name].setValue(value)
+
+        if compact:
+            channels = AOV_rebuild_karma_build.layer_rgba(original_layer)[:3]
+            for pipe in AOV_rebuild_karma_build.REBUILD_PIPES:
+                channels += AOV_rebuild_karma_build.aov_colour_channels(layer_index, final_aovs.get(pipe, []))
+            for unpremult in by_role['unpremult_original']:
+                unpremult['channels'].setValue(' '.join(channels))
+        AOV_rebuild_karma_profile.annotate(report = report)
+        return report
+
+def precomp_rebuild(node, compression = None, processes = None, directory = None, nuke_exe = None):
+    '''Precomps the breakout of the compact rebuild `node` belongs to and switches the rebuild over to reading the precomp
+    (see AOV_rebuild_karma_precomp), replacing any precomp it had. `processes` terminal nukes render the frames.
+    Returns the Switch and why the precomp is stale, None once it is read.
+    Placing the precomp is one undo step, cancelling the render (RebuildCancelled) leaves the rebuild on the live stream.'''
+    import AOV_rebuild_karma_precomp
+    by_role = {}
+    for n in find_rebuild_nodes(node):
+        by_role.setdefault(_layout_role(n), []).append(n)
+    if 'unpremult_original' not in by_role:
+        raise AOV_rebuild_karma_precomp.PrecompError('%s is not part of a flat AOV rebuild' % node.name())
+    top = by_role['unpremult_original'][0]
+    ## only a compact rebuild has every aov unpremultiplied above its pipes
+    if top['label'].value() != 'compact':
+        raise AOV_rebuild_karma_precomp.PrecompError('%s is not a compact rebuild, build it compact to precomp it' % top.name())
+    read = get_upstream_read(top)
+    if read is None:
+        raise AOV_rebuild_karma_precomp.PrecompError('there is no Read above %s to precomp' % top.name())
+    first, last = int(read['first'].value()), int(read['last'].value())
+    path = AOV_rebuild_karma_precomp.precomp_path(read, directory)
+
+    with RebuildProgress('AOV rebuild precomp of %s' % read.name()) as progress:
+        with undo_group('AOV rebuild precomp'):
+            old = [n for role in AOV_rebuild_karma_precomp.PRECOMP_ROLES for n in by_role.get(role, [])]
+            _reconnect_around(old, ('precomp_switch',))
+            for n in old:
+                nuke.delete(n)
+            dependents = top.dependent(nuke.INPUTS, False)
+            graph, write, switch = AOV_rebuild_karma_precomp.precomp_graph(
+                top, path, first, last, compression or AOV_rebuild_karma_precomp.COMPRESSION, get_rebuild_id(top),
+                DEFAULT_SETTINGS['x_space'], DEFAULT_SETTINGS['y_space'])
+            live_nodes = pasted_by_graph_node(graph, paste_graph(graph, top))
+            write, switch = live_nodes[id(write)], live_nodes[id(switch)]
+            ## the pipes read through the Switch
+            for dependent in dependents:
+                for i in range(dependent.inputs()):
+                    if dependent.input(i) is not None and dependent.input(i).fullName() == top.fullName():
+                        dependent.setInput(i, switch)
+
+        progress.stage('rendering %s' % os.path.basename(path), 0, 100, last - first + 1)
+        AOV_rebuild_karma_precomp.render_precomp(write, first, last, processes, nuke_exe, progress.rendered)
+    return switch, AOV_rebuild_karma_precomp.check_precomp(switch)
+
+def post_layout_adjustments(nodes=None, y_offset_shuffle=SHUFFLE_Y_OFFSET, y_offset_unpremult=UNPREMULT_Y_OFFSET, y_pad_bottom_dot=BOTTOM_DOT_Y_PAD):
+    '''Re-applies the rebuild layout rules to the live `nodes` of one rebuild, using their real screen sizes.
+
+    Only `nodes` are looked at, so the cost scales with the rebuild and other rebuilds in the script are left alone.
+    Without `nodes` the rebuild the selected node belongs to is used, or the selection itself for rebuilds made
+    before nodes were tagged (these also get their temporary spacer nodes deleted).'''
+    with AOV_rebuild_karma_profile.run('layout'):
+        if nodes is None:
+            nodes = nuke.selectedNodes()
+            if len(nodes) == 1 and get_rebuild_id(nodes[0]) is not None:
+                nodes = find_rebuild_nodes(nodes[0])
+
+        members = {n.fullName() : n for n in nodes}
+        roles = {name : _layout_role(n) for name, n in members.items()}
+        by_role = {}
+        for name, role in roles.items():
+            by_role.setdefault(role, []).append(members[name])
+
+        def role_of(n):
+            return roles.get(n.fullName()) if n is not None else None
+
+        deleted_NoOps = 0
+
+        ## move Shuffle2 nodes UP to the minimum Y of their upstream aov_dot + offset
+        for sh in members.values():
+            if (
+                sh.Class() == 'Shuffle2'
+                or (sh.Class() == 'Remove' and sh['label'].value() == 'RGB')
+            ):
+                inp = sh.input(0)
+                if role_of(inp) in ('aov_dot', 'start_dot'):
+                    sh_x, _ = get_centre_xypos(sh)
+                    _, dot_y = get_centre_xypos(inp)
+
+                    target_y = int(dot_y + y_offset_shuffle)
+                    set_centred_xypos(sh, sh_x, target_y)
+
+        ## move Unpremult nodes up to the minimum Y of their upstream Shuffle2 + offset
+        for up in members.values():
+            if up.Class() != 'Unpremult':
+                continue
+            inp = up.input(0)
 
-        ## only unpremults with channels value 'rgb'
-        if up['channels'].value() == 'rgb' and inp.Class() == 'Shuffle2':
-            up_x, _ = get_centre_xypos(up)
-            _, sh_y = get_centre_xypos(inp)
+            ## only unpremults with channels value 'rgb'
+            if up['channels'].value() == 'rgb' and role_of(inp) is not None and inp.Class() == 'Shuffle2':
+                up_x, _ = get_centre_xypos(up)
+                _, sh_y = get_centre_xypos(inp)
 
-            target_y = int(sh_y + y_offset_unpremult)
-            set_centred_xypos(up, up_x, target_y)
+                target_y = int(sh_y + y_offset_unpremult)
+                set_centred_xypos(up, up_x, target_y)
 
-    ## bottom_aov_dot: align to upstream node, then place below using upstream size
-    for d in nuke.allNodes('Dot'):
-        if "bottom_aov_dot" in d.name().lower() and not d.dependent():
+        ## bottom_aov_dot: align to upstream node, then place below using upstream size
+        for d in by_role.get('bottom_aov_dot', []):
+            if not d.dependent(nuke.INPUTS, False):
 
-            up = d.input(0)
-            if not up:
-                continue
+                up = d.input(0)
+                if not up:
+                    continue
 
-            up_x, up_y = get_centre_xypos(up)
+                up_x, up_y = get_centre_xypos(up)
 
-            # half upstream height + half dot height + padding
-            offset = int((up.screenHeight() / 2) + (d.screenHeight() / 2) + y_pad_bottom_dot)
+                # half upstream height + half dot height + padding
+                offset = int((up.screenHeight() / 2) + (d.screenHeight() / 2) + y_pad_bottom_dot)
 
-            set_centred_xypos(d, up_x, int(up_y + offset))
+                set_centred_xypos(d, up_x, int(up_y + offset))
 
-    ## delete albedo_spacer_dot
-    for n in nuke.allNodes('Dot'):
-        if 'albedo_spacer_dot' in n.name():
+        ## delete albedo_spacer_dot (untagged rebuilds only)
+        for n in by_role.get('albedo_spacer_dot', []):
             nuke.delete(n)
 
-    merge_pluses = [
-        n for n in nuke.allNodes("Merge2")
-        if n.name().startswith("merge_plus")
-    ]
-
-    unassigned_bottom_dot = nuke.toNode("unassigned_bottom_dot")
-
-    if unassigned_bottom_dot:
-        for m in merge_pluses:
-            if unassigned_bottom_dot in m.dependencies():
-                ux, _ = get_centre_xypos(unassigned_bottom_dot)
-                _, my = get_centre_xypos(m)
-                set_centred_xypos(unassigned_bottom_dot, ux, my)
-                break
-
-    ## delete NoOps
-    for n in nuke.allNodes('NoOp'):
-        if 'spacer_no_op' in n.name():
+        ## level each unassigned_bottom_dot with the merge_plus it feeds
+        for unassigned_bottom_dot in by_role.get('unassigned_bottom_dot', []):
+            for m in unassigned_bottom_dot.dependent(nuke.INPUTS, False):
+                if role_of(m) == 'merge_plus':
+                    ux, _ = get_centre_xypos(unassigned_bottom_dot)
+                    _, my = get_centre_xypos(m)
+                    set_centred_xypos(unassigned_bottom_dot, ux, my)
+                    break
+
+        ## delete NoOps (untagged rebuilds only)
+        for n in by_role.get('spacer_no_op', []):
             nuke.delete(n)
             deleted_NoOps += 1
 
-    print("post_layout_adjustments() ran:",
-          "deleted_NoOps =", deleted_NoOps)
+        count('nodes', len(members))
+        count('noops_deleted', deleted_NoOps)
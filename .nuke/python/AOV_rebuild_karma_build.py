@@ -0,0 +1,961 @@
+import AOV_rebuild_karma_graph
+from AOV_rebuild_karma_graph import Expression
+from AOV_rebuild_karma_layout import SHUFFLE_Y_OFFSET, UNPREMULT_Y_OFFSET, BOTTOM_DOT_Y_PAD, centre_below
+from AOV_rebuild_karma_schema import get_schema
+from AOV_rebuild_karma_layers import (LIGHTGROUP_REGEX, ADDITIONAL_LIGHTING_AOVS, MATERIAL_AOVS, UTILITY_AOVS,
+                                      classify_channels_from_settings)
+
+## global Variables
+X_SPACE = 300
+
+Y_SPACE = 100
+
+MERGE_FROM_COLOUR = 2569876223
+
+MERGE_PLUS_COLOUR = 2197786623
+
+## layer the rebuild keeps the original beauty in, shared by every rebuild of a script
+ORIGINAL_LAYER = 'original'
+
+DEFAULT_SETTINGS = {'breakout_materials' : True,
+                    'breakout_lightgroups' : True,
+                    'breakout_utilities' : True,
+                    'lg_regex' : LIGHTGROUP_REGEX,
+                    'expected_materials' : MATERIAL_AOVS,
+                    'expected_utilities' : UTILITY_AOVS,
+                    'additional_lighting' : ADDITIONAL_LIGHTING_AOVS,
+                    'x_space' : X_SPACE,
+                    'y_space' : Y_SPACE,
+                    'compact' : False,
+                    'unassigned_expression' : False,
+                    'unassigned_guard' : False,
+                    'prune_empty' : False,
+                    'prune_sample_frames' : 10,
+                    'pruned_aovs' : (),
+                    'crop_to_data' : False,
+                    'aov_bboxes' : {},
+                    'schema' : None,
+                    'scope_layer' : None,
+                    'scope_mattes' : (),
+                    'scope_bbox' : None,
+                    'grade_knobs' : False,
+                    'reuse_channels' : False,
+                    'original_layer' : ORIGINAL_LAYER}
+
+## names of the aov pipes a rebuild is made of, by plus_lightgroups_or_materials mode
+REBUILD_PIPES = ('materials', 'lightgroups')
+
+## knobs of the Group holding a rebuild ('grade_knobs', see AOV_rebuild_karma_group) each aov branch is linked to
+GRADE_KNOB = '%s_grade'
+MUTE_KNOB = '%s_mute'
+
+## colour channels of an aov subtracted by the unassigned pipe, with the temporary variable each is summed into
+UNASSIGNED_COMPONENTS = (('red', 'dr'), ('green', 'dg'), ('blue', 'db'))
+
+## nodegraph helper functions
+def get_centre_xypos(node):
+    '''Returns a tuple with the xpos and ypos of `node` factoring the node width to obtain the node's center point.'''
+    xpos = int ( node.xpos() + node.screenWidth()/2 )
+    ypos = int (node.ypos()  + node.screenHeight()/2 )
+    return xpos, ypos
+
+def set_centred_xypos(node, xpos, ypos):
+    '''Positions `node` at the `xpos and `ypos` position in the nodegraph,
+    factoring the node width to obtain the node's center point.'''
+    x_centred = int (xpos - node.screenWidth()/2)
+    y_centred = int (ypos - node.screenHeight()/2)
+    node.setXYpos(x_centred, y_centred)
+
+def kept_aovs(aovs, settings = DEFAULT_SETTINGS):
+    '''Returns `aovs` without the ones pruned as empty (settings['pruned_aovs'], see AOV_rebuild_karma_qc.sequence_empty_layers)'''
+    pruned = settings.get('pruned_aovs', ())
+    return [aov for aov in aovs if aov not in pruned]
+
+def summed_aovs(layer_index, settings = DEFAULT_SETTINGS):
+    '''Returns [(pipe, aovs)] of the aovs a rebuild plusses into each of its pipes (summed per sample by a deep
+    rebuild, graded from the panel of a rebuild Group)'''
+    pipes = []
+    if settings['breakout_materials']:
+        materials = [aov for aov in kept_aovs(layer_index['materials'], settings) if aov not in layer_index['bpipe_skip']]
+        if materials:
+            pipes.append((REBUILD_PIPES[0], materials))
+    if settings['breakout_lightgroups']:
+        lightgroups = kept_aovs(layer_index['lightgroups'], settings)
+        if lightgroups:
+            pipes.append((REBUILD_PIPES[1], lightgroups))
+    return pipes
+
+def compact_unpremult_channels(layer_index, settings = DEFAULT_SETTINGS):
+    '''Returns the colour channels of every material / lightgroup aov the rebuild breaks out,
+    unpremultiplied once upstream in compact mode instead of once per aov branch'''
+    layers = []
+    if settings['breakout_materials']:
+        layers.extend(layer_index['materials'])
+    if settings['breakout_lightgroups']:
+        layers.extend(layer_index['lightgroups'])
+    return aov_colour_channels(layer_index, kept_aovs(layers, settings))
+
+def aov_colour_channels(layer_index, aovs):
+    '''Returns the channels of `aovs` other than alpha, in order'''
+    channels = []
+    for layer in dict.fromkeys(aovs):
+        channels.extend(c for c in layer_index['layer_channels'].get(layer, []) if not c.endswith('.alpha'))
+    return channels
+
+def layer_rgba(layer):
+    '''Returns the red, green, blue and alpha channels of `layer`'''
+    return ['%s.%s' % (layer, c) for c in ('red', 'green', 'blue', 'alpha')]
+
+def unassigned_expression_knobs(layer_index, aovs, compact = False, guard = False, original = ORIGINAL_LAYER):
+    '''Returns the knobs of a single Expression node computing original rgb (of the `original` layer) minus the sum
+    of `aovs`, the same result as the per aov Unpremult / Merge2 (from) chain of the unassigned pipe.
+
+    The aovs are unpremultiplied by original.alpha inside the expression unless they already are (`compact`).
+    With `guard` negative results are clamped to 0 and the alpha holds a mask of the pixels that went negative,
+    which happens when aovs overlap (eg. 'albedo' and 'albedo_diffuse', see the README known issues).'''
+    src_channels = layer_index['channel_set']
+    knobs = {}
+    for i, (component, temp_name) in enumerate(UNASSIGNED_COMPONENTS):
+        summed = ' + '.join(c for c in ('%s.%s' % (aov, component) for aov in aovs) if c in src_channels)
+        if not summed:
+            summed = '0'
+        elif compact:
+            summed = '(%s)' % summed
+        else:
+            summed = '(%s) / (%s.alpha != 0 ? %s.alpha : 1)' % (summed, original, original)
+        knobs['temp_name%d' % i] = temp_name
+        knobs['temp_expr%d' % i] = '%s.%s - %s' % (original, component, summed)
+        knobs['expr%d' % i] = 'max(%s, 0)' % temp_name if guard else temp_name
+    if guard:
+        knobs['expr3'] = ' || '.join('%s < 0' % temp_name for _, temp_name in UNASSIGNED_COMPONENTS)
+    return knobs
+
+def bpipe_skip_reason(aov, materials_lower, schema = None):
+    '''Returns why a material aov is broken out but not plussed into the B pipe ('combined', 'ao' or 'albedo'), or None.
+    Layer indexes hold the answer for each of their materials in 'bpipe_skip'.'''
+    return get_schema(schema).bpipe_skip_reason(aov, materials_lower)
+
+def bpipe_skip_label(reason, aov):
+    '''Returns the sticky note text explaining why `aov` is not in the B pipe'''
+    if reason == 'combined':
+        suffix = aov.lower()[len('combined'):]
+        return ("combined %s not added to B pipe,\n\n"
+                "direct %s and indirect %s used."
+                % (suffix, suffix, suffix))
+    if reason == 'ao':
+        return ("ao AOV not added to B pipe,\n\n"
+                "Please use as needed")
+    return ("albedo AOV not added to B pipe,\n\n"
+            "this AOV will break the basic rebuild.\n\n"
+            "Please only use for cheats\n\n"
+            "or refer to the advanced rebuild for albedo rebuild.")
+
+def pruned_aovs_label(aovs):
+    '''Returns the sticky note text listing the aovs of a pipe pruned as empty'''
+    label = '<h3>Pruned AOVs</h3>empty over the frame range, not broken out' + r'\n'
+    for aov in aovs:
+        label += '<i>' + aov + r'</i>\n'
+    return label
+
+def bpipe_skip_note(graph, reason, aov, x_pos, y_pos):
+    '''Adds a sticky note at `x_pos`, `y_pos` explaining why `aov` is not in the B pipe'''
+    sticky_note = graph.nodes.StickyNote(
+        label=bpipe_skip_label(reason, aov),
+        tile_color=0x272727ff,
+        note_font_color=0xa8a8a8ff,
+        note_font_size=11
+    )
+    sticky_note.setXYpos(int(x_pos), int(y_pos))
+    return sticky_note
+
+## rebuild builders
+def breakout_utilities(graph, node, layer_index, settings = DEFAULT_SETTINGS):
+    '''Cycles through all the aovs classed as utilities and adds an aov shuffle of them to `graph`'''
+    nodes = graph.nodes
+    expected_utilities = settings['expected_utilities']
+    x_space = settings['x_space']
+    y_space = settings['y_space']
+
+    utilities = list(layer_index['utilities'])
+    if not utilities:
+        return None
+
+    bpipe_nodes = []
+    x_pos, y_pos = get_centre_xypos(node)
+    x_pos += x_space
+
+    utility_dot = nodes.Dot(inputs = [node])
+    #utility_dot.setName('Utility_Pipe')
+    utility_dot['label'].setValue('UTILITY >')  ## for debugging layout
+    utility_dot["note_font_color"].setValue(int(0xFFFFFFFF))
+    utility_dot["note_font"].setValue("bold")
+    utility_dot["note_font_size"].setValue(40)
+    set_centred_xypos(utility_dot, x_pos, y_pos)
+    bpipe_nodes.append(utility_dot)
+
+    x_utl_dot_pos, y_utl_dot_pos = get_centre_xypos(utility_dot)
+
+    src_channels = layer_index['channel_set']
+    available_layers_lower = layer_index['layers_lower']
+
+    # If user expects "alpha" but there's no alpha layer, synthesize from rgba.alpha
+    if "alpha" in {u.lower() for u in expected_utilities} and "alpha" not in available_layers_lower:
+        if "rgba.alpha" in src_channels:
+            # put alpha at the front so it appears first in the utility row
+            utilities = ["alpha"] + utilities
+
+    for i, utl in enumerate(utilities):
+        x_pos = x_utl_dot_pos + (x_space * (i + 1))
+        utility_pipe = [bpipe_nodes[-1]]
+
+        utl_dot = nodes.Dot(inputs=[utility_pipe[-1]])
+        set_centred_xypos(utl_dot, x_pos, y_pos)
+
+        utility_pipe.append(utl_dot)
+        bpipe_nodes.append(utl_dot)
+
+        shuffle_utl = nodes.Shuffle2(inputs=[utility_pipe[-1]], in1=utl, in2='alpha', label=utl)
+
+        # --- alpha special-case (do NOT let generic mapping overwrite it)
+        if utl.lower() == "alpha" and "alpha" not in available_layers_lower:
+            shuffle_utl["in1"].setValue("rgba")
+            shuffle_utl["in2"].setValue("alpha")
+            shuffle_utl["label"].setValue("alpha")
+            shuffle_utl["mappings"].setValue([
+                ("rgba.alpha", "rgba.red"),
+                ("rgba.alpha", "rgba.green"),
+                ("rgba.alpha", "rgba.blue"),
+                ("rgba.alpha", "rgba.alpha"),
+            ])
+        else:
+            ## gather channels that belong to this layer
+            layer_chans = layer_index['layer_channels'].get(utl, [])
+
+            has_xyz = all(f"{utl}.{c}" in src_channels for c in ("x", "y", "z"))
+            has_rgb = all(f"{utl}.{c}" in src_channels for c in ("red", "green", "blue"))
+            has_alpha = f"{utl}.alpha" in src_channels
+
+            alpha_src = f"{utl}.alpha" if has_alpha else "rgba.alpha"
+
+            if has_xyz:
+                shuffle_utl['mappings'].setValue([
+                    (f"{utl}.x", "rgba.red"),
+                    (f"{utl}.y", "rgba.green"),
+                    (f"{utl}.z", "rgba.blue"),
+                    (alpha_src, "rgba.alpha"),
+                ])
+
+            elif has_rgb:
+                shuffle_utl['mappings'].setValue([
+                    (f"{utl}.red", "rgba.red"),
+                    (f"{utl}.green", "rgba.green"),
+                    (f"{utl}.blue", "rgba.blue"),
+                    (alpha_src, "rgba.alpha"),
+                ])
+
+            else:
+                non_alpha = [c for c in layer_chans if not c.endswith(".alpha")]
+                single_src = (non_alpha[0] if non_alpha else (layer_chans[0] if layer_chans else None))
+
+                if single_src:
+                    shuffle_utl['mappings'].setValue([
+                        (single_src, "rgba.red"),
+                        (single_src, "rgba.green"),
+                        (single_src, "rgba.blue"),
+                        (alpha_src, "rgba.alpha"),
+                    ])
+                else:
+                    shuffle_utl['mappings'].setValue([
+                        (alpha_src, "rgba.alpha"),
+                    ])
+
+        shuffle_utl["note_font_color"].setValue(int(0xFFFFFFFF))
+        shuffle_utl["note_font"].setValue("bold")
+        set_centred_xypos(shuffle_utl, x_pos, y_pos + SHUFFLE_Y_OFFSET)
+        utility_pipe.append(shuffle_utl)
+
+    return utility_dot
+
+def aov_grade_value(aov):
+    '''Returns the Multiply value of the branch of `aov` linked to its grade and mute knobs on the parent Group'''
+    grade_knob = GRADE_KNOB % aov
+    mute_knob = MUTE_KNOB % aov
+    return [Expression('parent.%s?0:parent.%s.%s' % (mute_knob, grade_knob, c)) for c in ('r', 'g', 'b')] + [1]
+
+def aov_branch(graph, top_input, aov, x_pos, y_pos, compact = False, bbox = None, grade = False):
+    '''Adds the branch of one aov hanging off `top_input` at `x_pos`, `y_pos`: aov dot, shuffle, unpremult
+    (unless the aov is already unpremultiplied in `compact` mode), with `grade` a Multiply linked to the knobs of the
+    Group holding the rebuild, a Crop to the (x, y, r, t) `bbox` of its data when given and bottom dot.
+    Returns the branch nodes, top to bottom.'''
+    nodes = graph.nodes
+    if graph.progress is not None:
+        graph.progress(aov)
+
+    aov_pipe = []
+    aov_dot = nodes.Dot(inputs = [top_input])
+    #aov_dot['label'].setValue('aov_dot')  ## for debugging layout
+    aov_dot.setName('aov_dot', True)
+    set_centred_xypos(aov_dot, x_pos, y_pos)
+    aov_pipe.append(aov_dot)
+
+    ## shuffle and unpremult sit tight under the aov dot
+    shuffle_lg = nodes.Shuffle2(inputs = [aov_pipe[-1]], in1 = aov, in2 = 'alpha', label = aov)
+    shuffle_lg.role = 'aov_shuffle'
+    shuffle_lg['mappings'].setValue([('rgba.alpha','rgba.alpha')])
+    shuffle_lg["note_font_color"].setValue(int(0xFFFFFFFF))
+    shuffle_lg["note_font"].setValue("bold")
+    set_centred_xypos(shuffle_lg, x_pos, y_pos + SHUFFLE_Y_OFFSET)
+    aov_pipe.append(shuffle_lg)
+
+    if not compact:
+        unpremult_lg = nodes.Unpremult(inputs = [aov_pipe[-1]])
+        unpremult_lg.role = 'aov_unpremult'
+        set_centred_xypos(unpremult_lg, x_pos, y_pos + SHUFFLE_Y_OFFSET + UNPREMULT_Y_OFFSET)
+        aov_pipe.append(unpremult_lg)
+
+    if grade:
+        grade_lg = nodes.Multiply(inputs = [aov_pipe[-1]], channels = 'rgb', value = aov_grade_value(aov), label = 'grade')
+        grade_lg.role = 'aov_grade'
+        _, grade_ypos = get_centre_xypos(aov_pipe[-1])
+        set_centred_xypos(grade_lg, x_pos, grade_ypos + UNPREMULT_Y_OFFSET)
+        aov_pipe.append(grade_lg)
+
+    ## nuke only pulls the box of a Crop from upstream, the shuffle, unpremult and merge stop working on black tiles
+    if bbox is not None:
+        crop_lg = nodes.Crop(inputs = [aov_pipe[-1]], box = list(bbox), label = 'data window')
+        crop_lg.role = 'aov_crop'
+        _, crop_ypos = get_centre_xypos(aov_pipe[-1])
+        set_centred_xypos(crop_lg, x_pos, crop_ypos + UNPREMULT_Y_OFFSET)
+        aov_pipe.append(crop_lg)
+
+    ## placed under the unpremult (or shuffle), moved down to the bpipe row when the aov is merged
+    bottom_aov_dot = nodes.Dot(inputs = [aov_pipe[-1]])
+    #bottom_aov_dot['label'].setValue('bottom_aov_dot')  ## for debugging layout
+    bottom_aov_dot.setName('bottom_aov_dot', True)
+    set_centred_xypos(bottom_aov_dot, x_pos, centre_below(aov_pipe[-1], bottom_aov_dot, BOTTOM_DOT_Y_PAD))
+    aov_pipe.append(bottom_aov_dot)
+    return aov_pipe
+
+def unassigned_subtract(graph, unassigned_input, aov, x_pos, y_pos, y_space, compact = False):
+    '''Adds the unpremult (unless `compact`) and Merge2 (from) taking one aov off the unassigned pipe below `y_pos`.
+    Returns the merge and the row it sits on.'''
+    nodes = graph.nodes
+    if not compact:
+        y_pos += y_space
+        unpremult_unassigned_pipe = nodes.Unpremult(inputs = [unassigned_input], channels = aov)
+        unpremult_unassigned_pipe.role = 'unassigned_unpremult'
+        set_centred_xypos(unpremult_unassigned_pipe, x_pos, y_pos)
+        unassigned_input = unpremult_unassigned_pipe
+
+    y_pos += y_space
+    merge_from = nodes.Merge2(inputs = [unassigned_input, unassigned_input], Achannels = aov, operation ='from', output = 'rgb', tile_color = MERGE_FROM_COLOUR, label = aov)
+    merge_from.role = 'unassigned_merge_from'
+    set_centred_xypos(merge_from, x_pos, y_pos)
+    return merge_from, y_pos
+
+def bpipe_remove_rgb(graph, bpipe_input, x_pos, y_pos):
+    '''Adds the Remove clearing rgb at the head of the bpipe, the aov merges plus onto it'''
+    remove_rgb = graph.nodes.Remove(
+        operation='remove',
+        channels='rgb',
+        inputs=[bpipe_input],
+        label='RGB',
+        note_font_color=0xFFFFFFFF,
+        note_font='bold'
+    )
+    remove_rgb.role = 'remove_rgb'
+    ## part of the pipe, not of the aov it was created for
+    remove_rgb.tags.pop('aov', None)
+    set_centred_xypos(remove_rgb, x_pos, y_pos)
+    return remove_rgb
+
+def aov_merge_plus(graph, bpipe_input, aov_input, aov, x_pos, y_pos):
+    '''Adds the Merge2 (plus) of one aov branch onto the bpipe'''
+    merge_plus = graph.nodes.Merge2(
+        inputs=[bpipe_input, aov_input],
+        operation='plus',
+        output='rgb',
+        tile_color=MERGE_PLUS_COLOUR,
+        label=aov
+    )
+    merge_plus.role = 'aov_merge_plus'
+    set_centred_xypos(merge_plus, x_pos, y_pos)
+    return merge_plus
+
+def plus_lightgroups_or_materials(graph, node, layer_index, mode = 0, settings = DEFAULT_SETTINGS, start_input=None):
+    '''Cycles through all the aovs classed as either materials (mode 0) or lightgroups (mode 1) and adds an aov minibuild of them to `graph`'''
+    nodes = graph.nodes
+    ## breakout settings
+    x_space = settings['x_space']
+    y_space = settings['y_space']
+    ## compact mode: the aovs arrive already unpremultiplied (see compact_unpremult_channels)
+    compact = settings.get('compact', False)
+    ## (x, y, r, t) data window of the aovs scanned with 'crop_to_data'
+    aov_bboxes = settings.get('aov_bboxes') or {}
+    ## plussed aovs graded from the panel of the Group holding the rebuild
+    grade_knobs = settings.get('grade_knobs', False)
+    ## layer holding the original beauty, see breakout_lightgroups_and_materials
+    original_layer = settings.get('original_layer', ORIGINAL_LAYER)
+
+    if start_input is None:
+        start_input = node
+
+    bpipe_nodes = []
+    x_pos, y_pos = get_centre_xypos(node)
+    ## leave a row free between the branch dot and the start of the pipe
+    y_pos += y_space * 2.5
+
+    start_dot = nodes.Dot(inputs = [start_input])
+    #start_dot['label'].setValue('start_dot')  ## For debugging layout
+    start_dot.setName('start_dot', True)
+    set_centred_xypos(start_dot, x_pos, y_pos)
+    bpipe_nodes.append(start_dot)
+    top_nodes =[bpipe_nodes[-1]]
+    ## ensure bpipe_xpos/ypos always exist even if no AOVs are found
+    bpipe_xpos, bpipe_ypos = get_centre_xypos(bpipe_nodes[-1])
+    ## centre of the bpipe row the next merge hangs off, skipped albedo AOVs still reserve a row
+    bpipe_cursor = (bpipe_xpos, bpipe_ypos)
+    start_dot_ypos = bpipe_ypos
+
+    ## main breakout
+    if mode == 0:
+        lightgroups_or_materials = layer_index['materials']
+        missing_materials = layer_index['missing_materials']
+    elif mode == 1:
+        lightgroups_or_materials = layer_index['lightgroups']
+
+    ## combined/direct/indirect, ao and albedo decisions made once per stream by the schema.
+    ## pruned aovs count, an empty direct aov still means its combined aov is not plussed
+    bpipe_skip = layer_index['bpipe_skip']
+
+    ## aovs found empty by the pixel statistics pre-pass get no branch
+    pruned_aovs = [aov for aov in lightgroups_or_materials if aov in settings.get('pruned_aovs', ())]
+    lightgroups_or_materials = kept_aovs(lightgroups_or_materials, settings)
+
+    ## guard + feedback to artist on missing material AOVs
+    if not lightgroups_or_materials and pruned_aovs:
+        sticky_note = nodes.StickyNote(label=pruned_aovs_label(pruned_aovs), tile_color=0x272727ff, note_font_color=0xa8a8a8ff, note_font_size=40)
+        sticky_note.role = 'pruned_note'
+        sticky_note.setXYpos(int(x_pos + x_space), int(y_pos))
+        return bpipe_nodes
+    if not lightgroups_or_materials:
+        sticky_label = '<h3>Missing Materials</h3>There are no materials in this stream.'
+        sticky_note = nodes.StickyNote(
+            label=sticky_label,
+            tile_color=0x272727ff,
+            note_font_color=0xa8a8a8ff,
+            note_font_size=40
+        )
+        sticky_note.setXYpos(int(x_pos + x_space), int(y_pos))
+        return bpipe_nodes
+
+    count = 0 ## track Lightgroup numbers
+
+    for lg in lightgroups_or_materials:
+        x_pos, y_pos = get_centre_xypos(top_nodes[-1])
+        x_pos += x_space
+
+        ## bpipe, some material aovs are broken out but not plussed (materials rebuild only)
+        skip_reason = bpipe_skip.get(lg) if mode == 0 else None
+
+        graph.tags['aov'] = lg
+        aov_pipe = aov_branch(graph, top_nodes[-1], lg, x_pos, y_pos, compact, aov_bboxes.get(lg),
+                              grade_knobs and skip_reason is None)
+        top_nodes.append(aov_pipe[0])
+        ## sticky notes use the nominal shuffle row
+        shuffle_ypos = y_pos + y_space
+
+        if skip_reason == 'combined' or skip_reason == 'ao':
+            ## place under the combined / ao shuffle, do nothing further to bpipe (no remove node, no merge)
+            bpipe_skip_note(graph, skip_reason, lg, x_pos, shuffle_ypos + y_space * 1)
+        elif skip_reason == 'albedo':
+
+            ## ensure the RGB remove happens once at the start of the bpipe (same as normal flow)
+            bpipe_xpos, bpipe_ypos = bpipe_cursor
+
+            if count == 0:
+                bpipe_nodes.append(bpipe_remove_rgb(graph, bpipe_nodes[-1], bpipe_xpos, start_dot_ypos + SHUFFLE_Y_OFFSET))
+
+                ## mark "first" as handled so we don't create remove_rgb again next iteration
+                count = 1
+
+                ## the bpipe continues a row below the start dot
+                bpipe_ypos += y_space
+
+            ## reserve the same vertical space a merge_plus would take (keeps layout unchanged)
+            merge_ypos = bpipe_ypos + (y_space * 3)
+            bpipe_cursor = (bpipe_xpos, merge_ypos)
+
+            ## place underneath the albedo shuffle
+            bpipe_skip_note(graph, skip_reason, lg, x_pos - x_space * 0.5, shuffle_ypos + y_space * 1)
+        else:
+            bpipe_xpos, bpipe_ypos = bpipe_cursor
+
+            if count==0:
+                bpipe_nodes.append(bpipe_remove_rgb(graph, bpipe_nodes[-1], bpipe_xpos, start_dot_ypos + SHUFFLE_Y_OFFSET))
+
+            bpipe_ypos += y_space * 2
+
+            bpipe_ypos += y_space
+            merge_plus = aov_merge_plus(graph, bpipe_nodes[-1], aov_pipe[-1], lg, bpipe_xpos, bpipe_ypos)
+            bpipe_nodes.append(merge_plus)
+            bpipe_cursor = (bpipe_xpos, bpipe_ypos)
+
+            ## bring the aov branch bottom down to the merge row
+            y_pos = bpipe_ypos
+            set_centred_xypos(aov_pipe[-1], x_pos, y_pos)
+
+            count += 1
+
+    graph.tags.pop('aov', None)
+
+    ## unassigned Pipe
+    unassigned_pipe = []
+    x_pos += x_space
+    unassigned_aov_dot = nodes.Dot(inputs = [top_nodes[-1]])
+    #unassigned_aov_dot['label'].setValue('unassigned_aov_dot')  ## for debugging layout
+    unassigned_aov_dot.role = 'unassigned_aov_dot'
+    unassigned_ypos = get_centre_xypos(top_nodes[-1], )[1]
+    set_centred_xypos(unassigned_aov_dot, x_pos, unassigned_ypos)
+    top_nodes.append(unassigned_aov_dot)
+    unassigned_pipe.append(unassigned_aov_dot)
+
+    ## feedback to artist on missing material aovs
+    if mode == 0 and missing_materials != []:
+        sticky_label = '<h3>Missing Materials</h3>'
+        for material in missing_materials:
+            sticky_label += '<i>' + material + r'</i>\n'
+        sticky_note = nodes.StickyNote(label=sticky_label, tile_color=0x272727ff, note_font_color=0xa8a8a8ff, note_font_size=40)
+        sticky_note.setXYpos(x_pos + x_space, unassigned_ypos)
+
+    ## feedback to artist on pruned aovs, right of the missing materials note
+    if pruned_aovs:
+        pruned_note = nodes.StickyNote(label=pruned_aovs_label(pruned_aovs), tile_color=0x272727ff, note_font_color=0xa8a8a8ff, note_font_size=40)
+        pruned_note.role = 'pruned_note'
+        pruned_note.setXYpos(x_pos + x_space * (3 if mode == 0 and missing_materials != [] else 1), unassigned_ypos)
+
+    unassigned_ypos += y_space
+    if settings.get('unassigned_expression', False):
+        ## the whole subtraction compiled into one node
+        guard = settings.get('unassigned_guard', False)
+        expression_unassigned = nodes.Expression(inputs = [unassigned_pipe[-1]],
+                                                 label = 'original rgb - aovs' + (' (guarded)' if guard else ''),
+                                                 tile_color = MERGE_FROM_COLOUR, note_font_color = 0xFFFFFFFF, note_font = 'bold',
+                                                 **unassigned_expression_knobs(layer_index, lightgroups_or_materials, compact, guard,
+                                                                               original_layer))
+        expression_unassigned.role = 'unassigned_expression'
+        set_centred_xypos(expression_unassigned, x_pos, unassigned_ypos)
+        unassigned_pipe.append(expression_unassigned)
+    else:
+        shuffle_original = nodes.Shuffle2(inputs = [unassigned_pipe[-1]], in1 = original_layer, label = 'original rbg', note_font_color = 0xFFFFFFFF, note_font = 'bold')
+        shuffle_original.role = 'unassigned_shuffle'
+        set_centred_xypos(shuffle_original, x_pos, unassigned_ypos)
+
+        unassigned_pipe.append(shuffle_original)
+
+        for lg in lightgroups_or_materials:
+            graph.tags['aov'] = lg
+            merge_from, unassigned_ypos = unassigned_subtract(graph, unassigned_pipe[-1], lg, x_pos, unassigned_ypos, y_space, compact)
+            bpipe_ypos +=y_space * 0.5
+            unassigned_pipe.append(merge_from)
+        graph.tags.pop('aov', None)
+
+    ## level with the unassigned merge_plus it feeds
+    unassigned_bottom_dot = nodes.Dot(inputs = [unassigned_pipe[-1]])
+    #unassigned_bottom_dot['label'].setValue('unassigned_bottom_dot')  ## for debugging layout
+    unassigned_bottom_dot.setName('unassigned_bottom_dot', True)
+    set_centred_xypos(unassigned_bottom_dot, x_pos, bpipe_ypos)
+    unassigned_pipe.append(unassigned_bottom_dot)
+
+    merge_plus = nodes.Merge2(inputs = [ bpipe_nodes[-1], unassigned_pipe[-1]], operation ='plus', output = 'rgb', tile_color = MERGE_PLUS_COLOUR, label = '<i> unassigned aov', disable = True)
+    merge_plus.setName('merge_plus', True)
+    set_centred_xypos(merge_plus, bpipe_xpos, bpipe_ypos)
+    bpipe_nodes.append(merge_plus)
+
+    bpipe_ypos += y_space
+    end_result = nodes.Dot(inputs =[bpipe_nodes[-1]])
+    #end_result['label'].setValue('end_result')  ## for debugging layout
+    end_result.role = 'end_result'
+    set_centred_xypos(end_result, bpipe_xpos, bpipe_ypos)
+    bpipe_nodes.append(end_result)
+
+    return bpipe_nodes
+
+def breakout_lightgroups_and_materials(graph, node, layer_index, settings=DEFAULT_SETTINGS):
+    '''Adds a breakout of materials and lightgroups to `graph`, using divide/multiply to combine both operations in a mathematically correct fashion.'''
+    nodes = graph.nodes
+
+    breakout_utilities_enabled = settings.get('breakout_utilities', False)
+    utility_dot = None
+    if breakout_utilities_enabled == True:
+        utility_dot = breakout_utilities(graph, node, layer_index, settings)
+    ## breakout settings
+    breakout_materials = settings['breakout_materials']
+    breakout_lightgroups = settings['breakout_lightgroups']
+    x_space = settings['x_space']
+    y_space = settings['y_space']
+
+    ## guard : Utilities only mode
+    if (not settings.get('breakout_materials', False) and
+        not settings.get('breakout_lightgroups', False) and
+        settings.get('breakout_utilities', False)):
+
+        ## the utilities have already been broken out above
+        return graph
+
+    ## if there are no materials/lightgroups, run utilities only (if any)
+    materials = layer_index['materials']
+    lightgroups = layer_index['lightgroups']
+    utilities = layer_index['utilities']
+
+    if not materials and not lightgroups and utilities:
+        return graph
+    ## a pipe whose every lightgroup was pruned as empty is left out like a stream without lightgroups
+    lightgroups = kept_aovs(lightgroups, settings)
+
+    ## begin main bpipe
+    bpipe_nodes = []
+    x_pos, y_pos = get_centre_xypos(node)
+    y_pos += y_space
+
+    ## scoped to a Cryptomatte selection: every pipe works inside the box of the matte
+    scoped = bool(settings.get('scope_mattes'))
+    top_input = node
+    if scoped and settings.get('scope_bbox') is not None:
+        top_input = scope_crop(graph, node, settings, x_pos, y_pos)
+        y_pos += y_space
+
+    shuffle_original = nodes.Shuffle2(inputs=[top_input], label = '[value in1] > [value out1]', note_font_color = 0xFFFFFFFF, note_font = 'bold')
+    shuffle_original.role = 'original_shuffle'
+    ## a layer the script already has is reused with 'reuse_channels' (see AOV_rebuild_karma_channels.scratch_layer)
+    original_layer = settings.get('original_layer', ORIGINAL_LAYER)
+    graph.add_layer(original_layer, layer_rgba(original_layer))
+    shuffle_original['out1'].setValue(original_layer)
+    set_centred_xypos(shuffle_original, x_pos, y_pos)
+    bpipe_nodes.append(shuffle_original)
+    y_pos += y_space
+
+    unpremult_original = nodes.Unpremult(inputs=[bpipe_nodes[-1]], )
+    unpremult_original.role = 'unpremult_original'
+    #unpremult_original['channels'].setValue('original')
+    unpremult_channels = layer_rgba(original_layer)[:3]
+    ## compact mode: unpremult every aov here once, the aov branches and unassigned pipe then skip their own unpremults.
+    ## the aov layers leave the rebuild unpremultiplied, only rgb is premultiplied again at the end
+    if settings.get('compact', False):
+        unpremult_channels += compact_unpremult_channels(layer_index, settings)
+        unpremult_original['label'].setValue('compact')
+    unpremult_original['channels'].setValue(' '.join(unpremult_channels))
+    set_centred_xypos(unpremult_original, x_pos, y_pos)
+    bpipe_nodes.append(unpremult_original)
+    y_pos += y_space
+
+    ## materials breakout
+    if breakout_materials == True:
+        mat_branch_dot = nodes.Dot(inputs=[bpipe_nodes[-1]], )
+        #mat_branch_dot['label'].setValue('mat_branch_dot')  ## for debugging layout
+        set_centred_xypos(mat_branch_dot, x_pos, y_pos)
+        bpipe_nodes.append(mat_branch_dot)
+        x_pos += x_space
+        mat_branch_dot2 = nodes.Dot(inputs=[bpipe_nodes[-1]], )
+        #mat_branch_dot2['label'].setValue('mat_branch_dot2')  ## for debugging layout
+        set_centred_xypos(mat_branch_dot2, x_pos, y_pos)
+
+        graph.tags['pipe'] = REBUILD_PIPES[0]
+        mat_pipe = plus_lightgroups_or_materials(graph, mat_branch_dot2, layer_index, 0, settings)
+        graph.tags.pop('pipe')
+        x_pos = get_centre_xypos(bpipe_nodes[-1])[0]
+        y_pos = get_centre_xypos(mat_pipe[-1])[1]
+
+        mat_dot_bottom = nodes.Dot(inputs=[bpipe_nodes[-1]])
+        #mat_dot_bottom['label'].setValue('mat_dot_bottom') ## for debugging layout
+        set_centred_xypos(mat_dot_bottom, x_pos, y_pos)
+        bpipe_nodes.append(mat_dot_bottom)
+
+        shuffle_back_original = nodes.Shuffle2(inputs=[bpipe_nodes[-1]], in1=original_layer, label='original rbg', note_font_color = 0xFFFFFFFF, note_font = 'bold')
+        midpoint = int((get_centre_xypos(bpipe_nodes[-1])[0] + get_centre_xypos(mat_pipe[-1])[0]) / 2)
+        set_centred_xypos(shuffle_back_original, midpoint, y_pos)
+
+        y_pos += y_space
+        merge_divide = nodes.Merge2(inputs=[shuffle_back_original, mat_pipe[-1]], operation='divide', output='rgb')
+        set_centred_xypos(merge_divide, get_centre_xypos(mat_pipe[-1])[0], y_pos)
+        mat_pipe.append(merge_divide)
+
+        y_pos += y_space
+
+        merge_materials = nodes.Merge2(inputs=[bpipe_nodes[-1], mat_pipe[-1]], operation='multiply', output='rgb')
+        set_centred_xypos(merge_materials, x_pos, y_pos)
+        bpipe_nodes.append(merge_materials)
+
+        y_pos += y_space
+        spacer_dot = nodes.Dot(inputs=[bpipe_nodes[-1]], label='spacer dot!')
+        set_centred_xypos(spacer_dot, x_pos, y_pos)
+        bpipe_nodes.append(spacer_dot)
+
+    ## lightgroups breakout
+    if breakout_lightgroups == True and lightgroups:
+        lg_branch_dot = nodes.Dot(inputs=[bpipe_nodes[-1]], )
+        #lg_branch_dot['label'].setValue('lg_branch_dot')  ## for debugging layout
+        set_centred_xypos(lg_branch_dot, x_pos, y_pos)
+        bpipe_nodes.append(lg_branch_dot)
+        x_pos += x_space
+        lg_branch_dot2 = nodes.Dot(inputs=[bpipe_nodes[-1]], )
+        #lg_branch_dot2['label'].setValue('lg_branch_dot2')  ## for debugging layout
+        set_centred_xypos(lg_branch_dot2, x_pos, y_pos)
+
+        graph.tags['pipe'] = REBUILD_PIPES[1]
+        lg_pipe = plus_lightgroups_or_materials(graph, lg_branch_dot2, layer_index, 1, settings)
+        graph.tags.pop('pipe')
+        x_pos = get_centre_xypos(bpipe_nodes[-1])[0]
+        y_pos = get_centre_xypos(lg_pipe[-1])[1]
+
+        lg_dot_bottom = nodes.Dot(inputs=[bpipe_nodes[-1]])
+        #lg_dot_bottom['label'].setValue('lg_dot_bottom')  ## for debugging layout
+        set_centred_xypos(lg_dot_bottom, x_pos, y_pos)
+        bpipe_nodes.append(lg_dot_bottom)
+
+        shuffle_back_original = nodes.Shuffle2(inputs=[bpipe_nodes[-1]], in1=original_layer, label='original rbg', note_font_color = 0xFFFFFFFF, note_font = 'bold')
+        midpoint = int((get_centre_xypos(bpipe_nodes[-1])[0] + get_centre_xypos(lg_pipe[-1])[0]) / 2)
+        set_centred_xypos(shuffle_back_original, midpoint, y_pos)
+
+        y_pos += y_space
+        merge_divide = nodes.Merge2(inputs=[shuffle_back_original, lg_pipe[-1]], operation='divide', output='rgb')
+        set_centred_xypos(merge_divide, get_centre_xypos(lg_pipe[-1])[0], y_pos)
+        lg_pipe.append(merge_divide)
+
+        y_pos += y_space
+
+        merge_materials = nodes.Merge2(inputs=[bpipe_nodes[-1], lg_pipe[-1]], operation='multiply', output='rgb')
+        set_centred_xypos(merge_materials, x_pos, y_pos)
+        bpipe_nodes.append(merge_materials)
+
+    ## guard + feedback to artist on missing lightgroup AOVs
+    elif breakout_lightgroups == True:
+        sticky_label = '<h3>Missing Lightgroups</h3>There are no lightgroups in this stream (as per the regex code).'
+        if layer_index['lightgroups']:
+            sticky_label = pruned_aovs_label(layer_index['lightgroups'])
+        sticky_note = nodes.StickyNote(
+            label=sticky_label,
+            tile_color=0x272727ff,
+            note_font_color=0xa8a8a8ff,
+            note_font_size=40
+        )
+        sticky_note.setXYpos(int(x_pos + x_space), int(y_pos))
+
+    y_pos += y_space
+
+    final_premult = nodes.Premult(inputs=[bpipe_nodes[-1]])
+    set_centred_xypos(final_premult, x_pos, y_pos)
+    bpipe_nodes.append(final_premult)
+
+    if scoped:
+        scope_matte(graph, node, final_premult, settings, y_pos)
+
+    return graph
+
+## scoped rebuild
+def scope_crop(graph, node, settings, x_pos, y_pos):
+    '''Adds the Crop every pipe of a rebuild scoped to a Cryptomatte selection hangs off, boxed to the data of the
+    matte over the shot (settings['scope_bbox']), so no branch pulls pixels from outside it. Returns the Crop.'''
+    crop = graph.nodes.Crop(inputs = [node], box = list(settings['scope_bbox']), label = 'scope')
+    crop.role = 'scope_crop'
+    set_centred_xypos(crop, x_pos, y_pos)
+    return crop
+
+def scope_matte(graph, node, rebuild_input, settings, y_pos):
+    '''Adds the shared matte of a rebuild scoped to a Cryptomatte selection: a Cryptomatte keying
+    settings['scope_mattes'] out of `node` and a Keymix putting the rebuild (`rebuild_input`) back over the untouched
+    `node` inside the matte. The matte and original sit in a column left of the rebuild. Returns the Keymix.'''
+    nodes = graph.nodes
+    x_space = settings['x_space']
+    y_space = settings['y_space']
+    x_pos, top_ypos = get_centre_xypos(node)
+    matte_xpos = x_pos - x_space * 2
+    original_xpos = x_pos - x_space
+
+    original_dot = nodes.Dot(inputs = [node])
+    original_dot.role = 'scope_original_dot'
+    set_centred_xypos(original_dot, original_xpos, top_ypos + y_space)
+
+    matte = nodes.Cryptomatte(inputs = [original_dot], cryptoLayer = settings['scope_layer'],
+                              matteList = ', '.join(name.replace(',', '\\,') for name in settings['scope_mattes']),
+                              previewEnabled = False, label = 'scope')
+    matte.role = 'scope_cryptomatte'
+    set_centred_xypos(matte, matte_xpos, top_ypos + y_space * 2)
+
+    original_bottom_dot = nodes.Dot(inputs = [original_dot])
+    set_centred_xypos(original_bottom_dot, original_xpos, y_pos)
+    matte_bottom_dot = nodes.Dot(inputs = [matte])
+    set_centred_xypos(matte_bottom_dot, matte_xpos, y_pos + y_space)
+
+    ## B is the original, A the rebuild, the cropped rebuild is black outside the box so B keeps its own
+    keymix = nodes.Keymix(inputs = [original_bottom_dot, rebuild_input, matte_bottom_dot], maskChannel = 'rgba.alpha',
+                          bbox = 'B', label = 'scope')
+    keymix.role = 'scope_keymix'
+    set_centred_xypos(keymix, get_centre_xypos(rebuild_input)[0], y_pos + y_space)
+    return keymix
+
+## deep rebuild
+def deep_sum_knobs(layer_index, pipes):
+    '''Returns the knobs of the DeepExpression rebuilding the rgb of every sample from the aovs of `pipes`.
+
+    One pipe is its sum. Both pipes are combined the way the flat rebuild does with divide / multiply,
+    rgb * (materials / rgb) * (lightgroups / rgb), per sample instead of per flattened pixel. Samples hold
+    premultiplied colour, so the sums need no unpremult.'''
+    src_channels = layer_index['channel_set']
+    knobs = {'chans0' : 'rgb'}
+    for component, _ in UNASSIGNED_COMPONENTS:
+        sums = []
+        for _, aovs in pipes:
+            summed = ' + '.join(c for c in ('%s.%s' % (aov, component) for aov in aovs) if c in src_channels)
+            sums.append('(%s)' % (summed or '0'))
+        if len(sums) == 1:
+            expression = sums[0]
+        else:
+            expression = 'rgba.%s != 0 ? %s * %s / rgba.%s : 0' % (component, sums[0], sums[1], component)
+        knobs['rgba.%s' % component] = expression
+    return knobs
+
+def deep_breakout(graph, node, layer_index, settings = DEFAULT_SETTINGS):
+    '''Adds a deep rebuild under the deep `node` to `graph` and returns its nodes.
+
+    A deep stream cannot be split into aov branches and plussed back together (DeepMerge combines samples, it does
+    not add them), so every aov gets a DeepColorCorrect limited to its layer on the stream itself, a single
+    DeepExpression sums the aovs of each sample into rgb and the stream is flattened once at the end.
+    Holdouts and anything else deep keep working per sample up to the DeepToImage.'''
+    nodes = graph.nodes
+    x_space = settings['x_space']
+    y_space = settings['y_space']
+    x_pos, y_pos = get_centre_xypos(node)
+    deep_nodes = []
+    previous = node
+
+    pipes = summed_aovs(layer_index, settings)
+    notes_ypos = y_pos + y_space
+    for pipe, aovs in pipes:
+        graph.tags['pipe'] = pipe
+        for aov in aovs:
+            if graph.progress is not None:
+                graph.progress(aov)
+            graph.tags['aov'] = aov
+            y_pos += y_space
+            grade = nodes.DeepColorCorrect(inputs = [previous], channels = aov, label = aov)
+            grade.role = 'deep_aov_grade'
+            set_centred_xypos(grade, x_pos, y_pos)
+            deep_nodes.append(grade)
+            previous = grade
+        graph.tags.clear()
+
+    ## feedback to artist on the aovs broken out by the flat rebuild but left out of the sum
+    skipped = []
+    if settings['breakout_materials']:
+        skipped = [aov for aov in kept_aovs(layer_index['materials'], settings) if aov in layer_index['bpipe_skip']]
+    pruned = [aov for aov in layer_index['materials'] + layer_index['lightgroups'] if aov in settings.get('pruned_aovs', ())]
+    if skipped or pruned or not pipes:
+        label = '<h3>Deep rebuild</h3>'
+        if not pipes:
+            label += 'There are no materials or lightgroups to sum in this stream.' + r'\n'
+        for aov in skipped:
+            label += '<i>%s</i> not summed (%s)' % (aov, layer_index['bpipe_skip'][aov]) + r'\n'
+        for aov in pruned:
+            label += '<i>%s</i> pruned, empty over the frame range' % aov + r'\n'
+        sticky_note = nodes.StickyNote(label = label, tile_color = 0x272727ff, note_font_color = 0xa8a8a8ff, note_font_size = 40)
+        sticky_note.role = 'deep_note'
+        sticky_note.setXYpos(int(x_pos + x_space), int(notes_ypos))
+    if not pipes:
+        return deep_nodes
+
+    y_pos += y_space
+    deep_sum = nodes.DeepExpression(inputs = [previous], label = 'sum of aovs', tile_color = MERGE_PLUS_COLOUR,
+                                    note_font_color = 0xFFFFFFFF, note_font = 'bold', **deep_sum_knobs(layer_index, pipes))
+    deep_sum.role = 'deep_sum'
+    set_centred_xypos(deep_sum, x_pos, y_pos)
+    deep_nodes.append(deep_sum)
+
+    y_pos += y_space
+    flatten = nodes.DeepToImage(inputs = [deep_sum])
+    flatten.role = 'deep_flatten'
+    set_centred_xypos(flatten, x_pos, y_pos)
+    deep_nodes.append(flatten)
+    return deep_nodes
+
+## graph builders
+def build_deep_rebuild_graph(layer_index, settings = DEFAULT_SETTINGS, source = None, progress = None):
+    '''Describes a deep rebuild of a deep stream classified as `layer_index` as an in-memory graph (see deep_breakout).
+    Utilities are not broken out, they are flat shuffles.'''
+    graph = AOV_rebuild_karma_graph.Graph(source)
+    graph.progress = progress
+    deep_breakout(graph, graph.source, layer_index, settings)
+    return graph
+
+def build_rebuild_graph(layer_index, settings = DEFAULT_SETTINGS, source = None, progress = None):
+    '''Describes a full rebuild of a stream classified as `layer_index` as an in-memory graph, without touching nuke.
+
+    `source` is the AOV_rebuild_karma_graph.ExternalNode standing in for the upstream node, placed at 0, 0 when omitted.
+    `progress` is called with the aov of every aov branch as it is added.'''
+    graph = AOV_rebuild_karma_graph.Graph(source)
+    graph.progress = progress
+    return breakout_lightgroups_and_materials(graph, graph.source, layer_index, settings)
+
+def build_utilities_graph(layer_index, settings = DEFAULT_SETTINGS, source = None):
+    '''Describes a utilities only breakout of a stream classified as `layer_index` as an in-memory graph'''
+    graph = AOV_rebuild_karma_graph.Graph(source)
+    breakout_utilities(graph, graph.source, layer_index, settings)
+    return graph
+
+def build_patch_graph(layer_index, pipe, aovs, settings, top, bpipe, unassigned = None, rebuild_id = None, remove_rgb = False,
+                      progress = None):
+    '''Describes the branches of `aovs` being added to the `pipe` of an existing rebuild as an in-memory graph.
+
+    `top`, `bpipe` and `unassigned` are the live nodes the new branches hang off: the rightmost dot of the pipe's aov row,
+    the bpipe node the new merges go after and the unassigned pipe node the new subtractions go after (None when the
+    unassigned pipe is a single Expression). With `remove_rgb` the bpipe gets its Remove before the first new merge.
+    `progress` is called with each aov as its branch is added.
+    Returns the graph and the new ends of the bpipe and unassigned pipe, None where nothing was added.'''
+    graph = AOV_rebuild_karma_graph.Graph(rebuild_id = rebuild_id)
+    graph.progress = progress
+    graph.source = graph.external(top, top.Class())
+    x_space = settings['x_space']
+    y_space = settings['y_space']
+    compact = settings.get('compact', False)
+    aov_bboxes = settings.get('aov_bboxes') or {}
+
+    top_input = graph.source
+    bpipe_input = graph.external(bpipe, bpipe.Class())
+    unassigned_input = graph.external(unassigned, unassigned.Class()) if unassigned is not None else None
+    bpipe_tail = None
+    unassigned_tail = None
+
+    x_pos, y_pos = get_centre_xypos(top_input)
+    bpipe_xpos, bpipe_ypos = get_centre_xypos(bpipe_input)
+    if unassigned_input is not None:
+        unassigned_xpos, unassigned_ypos = get_centre_xypos(unassigned_input)
+
+    graph.tags['pipe'] = pipe
+    for aov in aovs:
+        graph.tags['aov'] = aov
+        x_pos += x_space
+        skip_reason = layer_index['bpipe_skip'].get(aov) if pipe == REBUILD_PIPES[0] else None
+        aov_pipe = aov_branch(graph, top_input, aov, x_pos, y_pos, compact, aov_bboxes.get(aov),
+                              settings.get('grade_knobs', False) and skip_reason is None)
+        top_input = aov_pipe[0]
+
+        if skip_reason is None:
+            if remove_rgb:
+                bpipe_input = bpipe_remove_rgb(graph, bpipe_input, bpipe_xpos, bpipe_ypos + SHUFFLE_Y_OFFSET)
+                remove_rgb = False
+            bpipe_ypos += y_space
+            bpipe_input = bpipe_tail = aov_merge_plus(graph, bpipe_input, aov_pipe[-1], aov, bpipe_xpos, bpipe_ypos)
+            set_centred_xypos(aov_pipe[-1], x_pos, bpipe_ypos)
+        else:
+            bpipe_skip_note(graph, skip_reason, aov, x_pos, y_pos + y_space * 2)
+
+        if unassigned_input is not None:
+            unassigned_input, unassigned_ypos = unassigned_subtract(graph, unassigned_input, aov, unassigned_xpos, unassigned_ypos, y_space, compact)
+            unassigned_tail = unassigned_input
+    graph.tags.clear()
+    return graph, bpipe_tail, unassigned_tail
+
+def rebuild_script_text(channels, settings = DEFAULT_SETTINGS):
+    '''Returns the .nk script text of a full rebuild for a list of channel names, eg. for diffing a rebuild outside of nuke'''
+    layer_index = classify_channels_from_settings(channels, settings)
+    return build_rebuild_graph(layer_index, settings).to_nk()
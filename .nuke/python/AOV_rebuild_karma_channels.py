@@ -0,0 +1,132 @@
+'''Channel budget of a rebuild: how much of the channels a Nuke script can hold (CHANNEL_LIMIT) a rebuild takes,
+worked out from the channel names and the in-memory graph before any node is created.
+
+A script registers every channel name it meets once, for the whole script: the channels of every Read and the layers
+a rebuild adds. Past the limit new channels are dropped and the script breaks in ways that are hard to read.
+The aov branches shuffle into rgba, so what a rebuild adds does not grow with its aovs: it is the layer the original
+beauty is kept in (AOV_rebuild_karma_build.ORIGINAL_LAYER), registered once and shared by every rebuild of the script.
+The renders themselves are what fill a script up, eg. a few passes of 60 lightgroups each. With 'reuse_channels' the
+rebuild keeps the original in a layer the script already has (see scratch_layer) and adds no channel at all.
+
+From the command line, the budget of a script reading the given renders (the header of the first frame of each):
+
+    python AOV_rebuild_karma_channels.py /render/sh010/karma.####.exr /render/sh010/karma_fx.####.exr
+'''
+import argparse
+import json
+import sys
+
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, ORIGINAL_LAYER, build_rebuild_graph, layer_rgba
+from AOV_rebuild_karma_exr import ExrHeaderError, scan_exr_layers
+from AOV_rebuild_karma_graph import ExternalNode
+from AOV_rebuild_karma_validate import add_classification_arguments, classification_settings, expand_sequence
+
+## global Variables
+## channels a Nuke script can register
+CHANNEL_LIMIT = 1023
+
+## channels every script has before anything is read
+BUILTIN_CHANNELS = ('rgba.red', 'rgba.green', 'rgba.blue', 'rgba.alpha', 'depth.Z')
+
+## budget left under which a rebuild is warned about
+HEADROOM_WARNING = 64
+
+## channel use
+def graph_channels(graph):
+    '''Returns the channels the in-memory rebuild `graph` writes to: its layers and the outputs of its Shuffles'''
+    channels = [c for layer in graph.layers.values() for c in layer]
+    for node in graph.node_list:
+        mappings = node.deferred_knobs.get('mappings') or node.knobs.get('mappings') or ()
+        channels.extend(out for _, out in mappings)
+    return list(dict.fromkeys(channels))
+
+def scratch_layer(stream_channels, registered_channels, layer = ORIGINAL_LAYER):
+    '''Returns the layer a rebuild of a stream with `stream_channels` can keep the original beauty in without adding
+    channels to a script holding `registered_channels`: `layer` once the script has it, otherwise the first layer
+    with red, green, blue and alpha the script has and the stream does not carry, `layer` when there is none'''
+    registered = set(registered_channels)
+    if set(layer_rgba(layer)) <= registered:
+        return layer
+    stream_layers = {c.split('.', 1)[0] for c in stream_channels}
+    for name in sorted({c.split('.', 1)[0] for c in registered}):
+        if name != 'rgba' and name not in stream_layers and set(layer_rgba(name)) <= registered:
+            return name
+    return layer
+
+def channel_budget(stream_channels, rebuild_channels, registered_channels = BUILTIN_CHANNELS, limit = CHANNEL_LIMIT):
+    '''Returns the channel budget of rebuilding a stream of `stream_channels` writing to `rebuild_channels` in a script
+    holding `registered_channels`: the channels the script has, the ones the stream and the rebuild add to it,
+    the total and what is left under `limit`'''
+    registered = set(registered_channels)
+    stream_new = sorted(set(stream_channels) - registered)
+    rebuild_new = sorted(set(rebuild_channels) - registered - set(stream_channels))
+    total = len(registered) + len(stream_new) + len(rebuild_new)
+    return {'registered' : len(registered),
+            'stream_channels' : len(set(stream_channels)),
+            'stream_new' : stream_new,
+            'rebuild_new' : rebuild_new,
+            'total' : total,
+            'limit' : limit,
+            'headroom' : limit - total}
+
+def format_budget(budget, name = 'rebuild'):
+    lines = ['%s: %d channels in the stream, %d new to the script, %d added by the rebuild%s'
+             % (name, budget['stream_channels'], len(budget['stream_new']), len(budget['rebuild_new']),
+                ' (%s)' % ', '.join(budget['rebuild_new']) if budget['rebuild_new'] else ''),
+             '%d of %d channels used, %d left' % (budget['total'], budget['limit'], budget['headroom'])]
+    if budget['headroom'] < 0:
+        lines.append('OVER THE LIMIT by %d channels, the script will drop channels' % -budget['headroom'])
+    elif budget['headroom'] < HEADROOM_WARNING:
+        lines.append('close to the limit')
+    return '\n'.join(lines)
+
+## command line
+def render_budgets(patterns, settings = DEFAULT_SETTINGS, limit = CHANNEL_LIMIT):
+    '''Returns the budget of rebuilding each render of `patterns` in turn in one script, each read from the header of
+    its first frame on disk and counted against the channels of the renders and rebuilds before it'''
+    registered = set(BUILTIN_CHANNELS)
+    budgets = []
+    for pattern in patterns:
+        frames = expand_sequence(pattern)
+        if not frames:
+            raise EnvironmentError('no frames of %s on disk' % pattern)
+        header = scan_exr_layers(frames[0][1], settings)
+        layer_index = header['layer_index']
+        render_settings = dict(settings)
+        if settings.get('reuse_channels'):
+            render_settings['original_layer'] = scratch_layer(layer_index['channels'], registered)
+        graph = build_rebuild_graph(layer_index, render_settings, ExternalNode(None))
+        budget = channel_budget(layer_index['channels'], graph_channels(graph), registered, limit)
+        budget['render'] = pattern
+        budgets.append(budget)
+        registered.update(layer_index['channels'])
+        registered.update(budget['rebuild_new'])
+    return budgets
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Count the channels rebuilding Karma renders in one Nuke script takes.')
+    parser.add_argument('patterns', nargs = '+', help = "sequence paths using '####', '%%04d' or the path of any frame")
+    parser.add_argument('--limit', type = int, default = CHANNEL_LIMIT, help = 'channels a script can hold (default: %d)' % CHANNEL_LIMIT)
+    parser.add_argument('--reuse-channels', action = 'store_true',
+                        help = 'keep the original beauty in a layer the script already has where there is one')
+    add_classification_arguments(parser)
+    parser.add_argument('--json', action = 'store_true', help = 'print the budgets as json')
+    args = parser.parse_args(argv)
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(classification_settings(args))
+    settings['reuse_channels'] = args.reuse_channels
+    try:
+        budgets = render_budgets(args.patterns, settings, args.limit)
+    except (EnvironmentError, ExrHeaderError) as e:
+        print('error: %s' % e, file = sys.stderr)
+        return 2
+
+    if args.json:
+        print(json.dumps(budgets, indent = 2))
+    else:
+        print('\n\n'.join(format_budget(budget, budget['render']) for budget in budgets))
+    return 1 if budgets and budgets[-1]['headroom'] < 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
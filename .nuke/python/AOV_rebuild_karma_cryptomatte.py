@@ -0,0 +1,114 @@
+'''Cryptomatte selections of a render, for rebuilds scoped to a matte ('scope_mattes', see
+AOV_rebuild_karma_build.scope_matte).
+
+A Cryptomatte node keys names (its matteList) out of the ranked id / coverage layers of a render, eg.
+CryptoMaterial00, CryptoMaterial01... each holding two ids and their coverage as red, green / blue, alpha.
+The id of a name is read from the manifest in the EXR metadata, or hashed the way Cryptomatte does
+(MurmurHash3 of the name as a float32) when the render has no manifest. No pixels are read here,
+AOV_rebuild_karma_qc.sequence_matte_bounds finds the box a selection covers.
+'''
+import json
+import re
+import struct
+
+## global Variables
+## cryptomatte/<key>/name, cryptomatte/<key>/manifest... of the EXR metadata
+METADATA_REGEX = re.compile(r'^cryptomatte/([0-9a-f]+)/(\w+)$')
+
+## raw ids the Cryptomatte node writes into its matteList for names it cannot find, eg. <1.4378e-21>
+RAW_ID_REGEX = re.compile(r'^<(.+)>$')
+
+## matteList entries are separated by commas, names holding one escape it with a backslash
+MATTE_LIST_REGEX = re.compile(r'((?:\\.|[^,])+)')
+
+## ids
+def _murmur3_32(data, seed = 0):
+    '''MurmurHash3 x86 32 bit of the bytes `data`, the hash Cryptomatte ids are made with'''
+    c1, c2 = 0xcc9e2d51, 0x1b873593
+    length = len(data)
+    h = seed
+    rounded = length & ~3
+    for i in range(0, rounded, 4):
+        k = (data[i] | data[i + 1] << 8 | data[i + 2] << 16 | data[i + 3] << 24) * c1 & 0xffffffff
+        k = (k << 15 | k >> 17) * c2 & 0xffffffff
+        h ^= k
+        h = (h << 13 | h >> 19) & 0xffffffff
+        h = (h * 5 + 0xe6546b64) & 0xffffffff
+    k = 0
+    tail = length & 3
+    if tail == 3:
+        k ^= data[rounded + 2] << 16
+    if tail >= 2:
+        k ^= data[rounded + 1] << 8
+    if tail >= 1:
+        k ^= data[rounded]
+        k = k * c1 & 0xffffffff
+        k = (k << 15 | k >> 17) * c2 & 0xffffffff
+        h ^= k
+    h ^= length
+    h ^= h >> 16
+    h = h * 0x85ebca6b & 0xffffffff
+    h ^= h >> 13
+    h = h * 0xc2b2ae35 & 0xffffffff
+    h ^= h >> 16
+    return h
+
+def _uint32_to_float32(value):
+    return struct.unpack('<f', struct.pack('<I', value))[0]
+
+def name_to_id(name):
+    '''Returns the float id Cryptomatte gives `name`: its hash as a float32, nudged off inf / nan and denormals'''
+    value = _murmur3_32(name.encode('utf-8'))
+    exponent = value >> 23 & 255
+    if exponent == 0 or exponent == 255:
+        value ^= 1 << 23
+    return _uint32_to_float32(value)
+
+def parse_matte_list(matte_list):
+    '''Returns the names of the comma separated matteList of a Cryptomatte node, backslash escapes removed'''
+    names = []
+    for entry in MATTE_LIST_REGEX.findall(matte_list or ''):
+        name = re.sub(r'\\(.)', r'\1', entry.strip())
+        if name:
+            names.append(name)
+    return names
+
+## metadata
+def crypto_layers(metadata):
+    '''Returns {layer : {'manifest' : json text, 'hash' : ...}} of the Cryptomatte layers in the string `metadata`
+    of an EXR header'''
+    by_key = {}
+    for key, value in metadata.items():
+        match = METADATA_REGEX.match(key)
+        if match:
+            by_key.setdefault(match.group(1), {})[match.group(2)] = value
+    return {fields['name'] : fields for fields in by_key.values() if 'name' in fields}
+
+def matte_ids(metadata, layer, names):
+    '''Returns the float ids of `names` in the Cryptomatte `layer` of a render with string `metadata`,
+    from its manifest when it has one'''
+    manifest = {}
+    text = crypto_layers(metadata).get(layer, {}).get('manifest')
+    if text:
+        try:
+            manifest = json.loads(text)
+        except ValueError:
+            manifest = {}
+    ids = []
+    for name in names:
+        raw = RAW_ID_REGEX.match(name)
+        if raw:
+            try:
+                ids.append(float(raw.group(1)))
+            except ValueError:
+                pass
+        elif name in manifest:
+            ids.append(_uint32_to_float32(int(manifest[name], 16)))
+        else:
+            ids.append(name_to_id(name))
+    return ids
+
+def rank_layers(layers, layer):
+    '''Returns the ranked id / coverage layers of the Cryptomatte `layer` among `layers`, in rank order'''
+    rank_regex = re.compile(r'^%s\d{2}$' % re.escape(layer))
+    return sorted(name for name in layers if rank_regex.match(name))
@@ -0,0 +1,243 @@
+import struct
+
+from AOV_rebuild_karma_layers import classify_channels, classify_channels_from_settings
+from AOV_rebuild_karma_schema import schema_for_metadata
+
+## global Variables
+EXR_MAGIC = 20000630
+
+## version field flags
+EXR_TILED_FLAG = 0x200
+EXR_LONG_NAMES_FLAG = 0x400
+EXR_NON_IMAGE_FLAG = 0x800
+EXR_MULTIPART_FLAG = 0x1000
+
+EXR_COMPRESSION = ['none', 'rle', 'zips', 'zip', 'piz', 'pxr24', 'b44', 'b44a', 'dwaa', 'dwab']
+
+EXR_PIXEL_TYPES = ['uint', 'half', 'float']
+
+## first read covers the header of any sane render, larger headers are read on demand
+HEADER_READ_SIZE = 65536
+
+## how Nuke's exr reader names the channel suffixes of a layer
+NUKE_CHANNEL_SUFFIXES = {'R' : 'red', 'G' : 'green', 'B' : 'blue', 'A' : 'alpha'}
+
+class ExrHeaderError(Exception):
+    '''Raised when a file is not an EXR or its header cannot be parsed'''
+
+## header parsing
+def _read_string(data, pos):
+    '''Returns the null terminated string at `pos` and the position after its terminator'''
+    end = data.index(b'\0', pos)
+    return data[pos:end].decode('latin-1'), end + 1
+
+def _parse_chlist(value):
+    '''Returns a list of (name, pixel_type, x_sampling, y_sampling) tuples from a chlist attribute'''
+    channels = []
+    pos = 0
+    while value[pos:pos + 1] != b'\0':
+        name, pos = _read_string(value, pos)
+        pixel_type, _plinear, x_sampling, y_sampling = struct.unpack_from('<iB3xii', value, pos)
+        pos += 16
+        channels.append((name, EXR_PIXEL_TYPES[pixel_type], x_sampling, y_sampling))
+    return channels
+
+def _parse_attribute(attr_type, value):
+    '''Decodes the attribute types the scanner cares about, anything else is left as raw bytes'''
+    if attr_type == 'chlist':
+        return _parse_chlist(value)
+    if attr_type == 'box2i':
+        return struct.unpack('<4i', value)
+    if attr_type == 'compression':
+        return EXR_COMPRESSION[value[0]] if value[0] < len(EXR_COMPRESSION) else value[0]
+    if attr_type == 'string':
+        return value.decode('utf-8', 'replace')
+    if attr_type == 'int':
+        return struct.unpack('<i', value)[0]
+    if attr_type == 'float':
+        return struct.unpack('<f', value)[0]
+    if attr_type == 'v2f':
+        return struct.unpack('<2f', value)
+    return value
+
+def _parse_headers(data, multipart):
+    '''Parses one header (or every part header for multipart files) starting after the version field.
+    Returns the headers and the position of the chunk offset table that follows them.'''
+    headers = []
+    pos = 8
+    while True:
+        header = {}
+        while data[pos:pos + 1] != b'\0':
+            name, pos = _read_string(data, pos)
+            attr_type, pos = _read_string(data, pos)
+            size = struct.unpack_from('<i', data, pos)[0]
+            pos += 4
+            value = data[pos:pos + size]
+            if len(value) != size:
+                raise IndexError('header truncated')
+            pos += size
+            header[name] = (attr_type, _parse_attribute(attr_type, value))
+        pos += 1
+        headers.append(header)
+        ## an empty header ends the part list of a multipart file
+        if not multipart or data[pos:pos + 1] == b'\0':
+            break
+        if pos >= len(data):
+            raise IndexError('header truncated')
+    if multipart:
+        pos += 1
+    return headers, pos
+
+def read_exr_header(path):
+    '''Reads the header of the EXR at `path` without decoding any pixels.
+
+    Returns a dictionary holding the channel names, data and display windows, compression,
+    string metadata, the per part information for multipart files and the header size in bytes
+    (where the chunk offset table starts).'''
+    with open(path, 'rb') as f:
+        data = f.read(HEADER_READ_SIZE)
+        if len(data) < 8:
+            raise ExrHeaderError('%s is not an EXR file' % path)
+        magic, version = struct.unpack_from('<iI', data, 0)
+        if magic != EXR_MAGIC:
+            raise ExrHeaderError('%s is not an EXR file' % path)
+
+        multipart = bool(version & EXR_MULTIPART_FLAG)
+        while True:
+            try:
+                headers, header_size = _parse_headers(data, multipart)
+                break
+            except (IndexError, ValueError, struct.error):
+                more = f.read(len(data))
+                if not more:
+                    raise ExrHeaderError('%s has a truncated header' % path)
+                data += more
+
+    parts = []
+    for header in headers:
+        part = {'name' : header.get('name', (None, None))[1],
+                'type' : header.get('type', (None, 'scanlineimage' if not version & EXR_TILED_FLAG else 'tiledimage'))[1],
+                'channels' : [c[0] for c in header.get('channels', (None, []))[1]],
+                'channel_types' : {c[0] : c[1] for c in header.get('channels', (None, []))[1]},
+                'data_window' : header.get('dataWindow', (None, None))[1],
+                'display_window' : header.get('displayWindow', (None, None))[1],
+                'compression' : header.get('compression', (None, None))[1],
+                'metadata' : {k : v[1] for k, v in header.items() if v[0] == 'string'}}
+        parts.append(part)
+
+    first = parts[0]
+    channels = []
+    for part in parts:
+        channels.extend(part['channels'])
+
+    return {'path' : path,
+            'version' : version & 0xff,
+            'multipart' : multipart,
+            'deep' : bool(version & EXR_NON_IMAGE_FLAG) or any((p['type'] or '').startswith('deep') for p in parts),
+            'channels' : channels,
+            'data_window' : first['data_window'],
+            'display_window' : first['display_window'],
+            'compression' : first['compression'],
+            'metadata' : first['metadata'],
+            'parts' : parts,
+            'header_size' : header_size}
+
+## nuke naming
+def nuke_channel_name(exr_channel):
+    '''Returns the layer.channel name Nuke's exr reader gives `exr_channel` (eg. 'C_diffuse.R' > 'C_diffuse.red')'''
+    if '.' not in exr_channel:
+        if exr_channel in NUKE_CHANNEL_SUFFIXES:
+            return 'rgba.' + NUKE_CHANNEL_SUFFIXES[exr_channel]
+        if exr_channel == 'Z':
+            return 'depth.Z'
+        return 'other.' + exr_channel
+    layer, channel = exr_channel.rsplit('.', 1)
+    layer = layer.replace('.', '_')
+    return layer + '.' + NUKE_CHANNEL_SUFFIXES.get(channel, channel)
+
+def nuke_channels(header):
+    '''Returns the channels of an exr header as Nuke would list them from node.channels()'''
+    return [nuke_channel_name(c) for c in header['channels']]
+
+def layer_data_windows(header):
+    '''Returns {layer : data window} of the nuke layers of an exr header, each layer taking the data window
+    of the part it is stored in (only multipart files can give layers different windows)'''
+    windows = {}
+    for part in header['parts']:
+        for exr_channel in part['channels']:
+            windows.setdefault(nuke_channel_name(exr_channel).split('.')[0], part['data_window'])
+    return windows
+
+def nuke_box(bounds, display_window):
+    '''Returns the nuke (x, y, r, t) box of the inclusive exr pixel `bounds` (xmin, ymin, xmax, ymax), exr rows
+    counting down from the top of `display_window` and nuke's y counting up from its bottom'''
+    xmin, ymin, xmax, ymax = bounds
+    left, _top, _right, bottom = display_window
+    return (xmin - left, bottom - ymax, xmax - left + 1, bottom - ymin + 1)
+
+## classification
+def scan_exr_layers(path, settings = None):
+    '''Reads the header of `path` and returns it with a 'layer_index' entry, classified with the
+    same rules as AOV_rebuild_karma (or the rules in a breakout `settings` dictionary) and the schema of
+    the Houdini version in its metadata'''
+    header = read_exr_header(path)
+    channels = nuke_channels(header)
+    schema = schema_for_metadata(header['metadata'])
+    if settings is None:
+        header['layer_index'] = classify_channels(channels, schema = schema)
+    else:
+        header['layer_index'] = classify_channels_from_settings(channels, settings, schema)
+    return header
+
+## synthetic files
+def _attribute(name, attr_type, value):
+    '''Packs a single header attribute'''
+    return name.encode() + b'\0' + attr_type.encode() + b'\0' + struct.pack('<i', len(value)) + value
+
+def write_exr(path, channels, data_window = (0, 0, 15, 15), display_window = None, compression = 'none', metadata = None,
+              values = None):
+    '''Writes a small single part scanline EXR with half float `channels` (exr names, eg. 'C_diffuse.R'), black or
+    filled with the value `values` gives the channel.
+
+    Only meant for generating synthetic renders for the scanner, the data is always stored uncompressed
+    whatever `compression` the header advertises.'''
+    if display_window is None:
+        display_window = data_window
+    channels = sorted(channels)
+
+    chlist = b''
+    for channel in channels:
+        chlist += channel.encode() + b'\0' + struct.pack('<iB3xii', EXR_PIXEL_TYPES.index('half'), 0, 1, 1)
+    chlist += b'\0'
+
+    header = struct.pack('<iI', EXR_MAGIC, 2)
+    header += _attribute('channels', 'chlist', chlist)
+    header += _attribute('compression', 'compression', bytes([EXR_COMPRESSION.index(compression)]))
+    header += _attribute('dataWindow', 'box2i', struct.pack('<4i', *data_window))
+    header += _attribute('displayWindow', 'box2i', struct.pack('<4i', *display_window))
+    header += _attribute('lineOrder', 'lineOrder', b'\0')
+    header += _attribute('pixelAspectRatio', 'float', struct.pack('<f', 1.0))
+    header += _attribute('screenWindowCenter', 'v2f', struct.pack('<2f', 0.0, 0.0))
+    header += _attribute('screenWindowWidth', 'float', struct.pack('<f', 1.0))
+    for key, value in sorted((metadata or {}).items()):
+        header += _attribute(key, 'string', value.encode())
+    header += b'\0'
+
+    xmin, ymin, xmax, ymax = data_window
+    width = xmax - xmin + 1
+    height = ymax - ymin + 1
+    values = values or {}
+    line = b''.join(struct.pack('<e', values.get(channel, 0.0)) * width for channel in channels)
+
+    offset = len(header) + 8 * height
+    offsets = b''
+    for _ in range(height):
+        offsets += struct.pack('<Q', offset)
+        offset += 8 + len(line)
+
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(offsets)
+        for y in range(ymin, ymax + 1):
+            f.write(struct.pack('<ii', y, len(line)))
+            f.write(line)
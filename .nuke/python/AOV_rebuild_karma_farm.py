@@ -0,0 +1,189 @@
+'''Builds AOV rebuild comps for a list of shots with terminal mode Nuke, no panel or selection needed.
+
+The manifest is a json file listing the Read of every shot and where to save its comp, with optional
+settings shared by all shots and per shot overrides (same keys as AOV_rebuild_karma_build.DEFAULT_SETTINGS,
+'lg_regex' given as a string):
+
+    {"settings" : {"compact" : true, "expected_utilities" : ["alpha", "N", "P"]},
+     "shots" : [{"name" : "sh010", "read" : "/render/sh010/karma.####.exr", "first" : 1001, "last" : 1100,
+                 "output" : "/comp/sh010/sh010_rebuild.nk"},
+                {"name" : "sh020", "read" : "/render/sh020/karma.####.exr", "output" : "/comp/sh020/sh020_rebuild.nk",
+                 "settings" : {"breakout_lightgroups" : false}}]}
+
+"preset" : "show_karma" starts every shot from a preset saved from the panel (see AOV_rebuild_karma_presets)
+instead of the defaults.
+
+Shots are shared out evenly to --workers worker processes, each one a `nuke -t` session building its shots in a row
+(at most --shots-per-process each, bigger manifests queue more sessions):
+
+    python AOV_rebuild_karma_farm.py shots.json --workers 8 --nuke /opt/Nuke15.1v3/Nuke15.1
+'''
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+## global Variables
+## most shots built by each nuke session, nuke start up is paid once per chunk
+SHOTS_PER_PROCESS = 8
+
+## prefix of the lines a worker prints its shot results on, nuke -t prints plenty of its own
+RESULT_PREFIX = 'AOV_REBUILD_RESULT '
+
+NUKE_ENV = 'AOV_REBUILD_NUKE'
+
+## manifest functions
+def load_manifest(path):
+    '''Reads a shot manifest, filling in shot names and resolving relative paths against the manifest's directory.
+    Raises ValueError when two shots have the same name, results are reported by name.'''
+    with open(path) as f:
+        manifest = json.load(f)
+    root = os.path.dirname(os.path.abspath(path))
+    names = set()
+    for i, shot in enumerate(manifest['shots']):
+        shot.setdefault('name', 'shot%03d' % (i + 1))
+        if shot['name'] in names:
+            raise ValueError('shot name %s is used twice in %s' % (shot['name'], path))
+        names.add(shot['name'])
+        for key in ('read', 'output'):
+            if not os.path.isabs(shot[key]):
+                shot[key] = os.path.join(root, shot[key])
+    return manifest
+
+## worker, runs inside nuke -t
+def build_shot(shot, settings):
+    '''Builds the rebuild of one shot in an empty script and saves it to the shot's output path'''
+    import nuke
+    import AOV_rebuild_karma
+
+    nuke.scriptClear()
+    read = nuke.nodes.Read(file = shot['read'])
+    if 'first' in shot:
+        read['first'].setValue(shot['first'])
+        read['last'].setValue(shot.get('last', shot['first']))
+    if not read.channels():
+        raise ValueError('no channels in %s' % shot['read'])
+
+    pasted = AOV_rebuild_karma.breakout_lightgroups_and_materials(read, settings)
+
+    output_dir = os.path.dirname(shot['output'])
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    nuke.scriptSaveAs(shot['output'], 1)
+    return len(pasted)
+
+def run_worker(manifest_path, shot_indices):
+    '''Builds the shots of a manifest at `shot_indices` one after the other, printing a result line per shot'''
+    ## nuke -t does not put the script's directory on sys.path
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from AOV_rebuild_karma_build import DEFAULT_SETTINGS
+    from AOV_rebuild_karma_presets import settings_from_dict, preset_settings
+
+    manifest = load_manifest(manifest_path)
+    defaults = preset_settings(manifest['preset']) if manifest.get('preset') else DEFAULT_SETTINGS
+    shared = settings_from_dict(manifest.get('settings', {}), defaults)
+
+    for i in shot_indices:
+        shot = manifest['shots'][i]
+        start = time.time()
+        result = {'name' : shot['name'], 'output' : shot['output'], 'error' : None, 'nodes' : 0}
+        try:
+            settings = settings_from_dict(shot.get('settings', {}), shared)
+            result['nodes'] = build_shot(shot, settings)
+        except Exception as e:
+            result['error'] = '%s: %s' % (type(e).__name__, e)
+        result['seconds'] = round(time.time() - start, 3)
+        print(RESULT_PREFIX + json.dumps(result))
+        sys.stdout.flush()
+
+## dispatcher
+def worker_command(manifest_path, shot_indices, nuke_exe = None):
+    '''Returns the command line of a worker building the shots at `shot_indices` of the manifest, under nuke -t or
+    under this Python interpreter when `nuke_exe` is None (a stand-in nuke module must then be importable).
+    Shots are passed by index, names can hold any character.'''
+    args = [os.path.abspath(__file__), '--worker', '--shots', ','.join(str(i) for i in shot_indices), manifest_path]
+    if nuke_exe is None:
+        return [sys.executable] + args
+    return [nuke_exe, '-t'] + args
+
+def run_chunk(command):
+    '''Runs one worker and returns the shot results it printed'''
+    process = subprocess.run(command, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+    results = [json.loads(line[len(RESULT_PREFIX):]) for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    return results, process.returncode, process.stdout
+
+def shot_chunks(shot_count, workers, shots_per_process = SHOTS_PER_PROCESS):
+    '''Returns the shot indices each worker builds: the shots shared out evenly so every one of `workers` has some,
+    at most `shots_per_process` per worker'''
+    size = min(max(1, math.ceil(shot_count / workers)), shots_per_process)
+    return [list(range(i, min(i + size, shot_count))) for i in range(0, shot_count, size)]
+
+def build_manifest(manifest_path, workers = None, nuke_exe = None, shots_per_process = SHOTS_PER_PROCESS):
+    '''Builds every shot of a manifest across `workers` concurrent worker processes and returns the shot results'''
+    manifest_path = os.path.abspath(manifest_path)
+    names = [shot['name'] for shot in load_manifest(manifest_path)['shots']]
+    workers = workers or os.cpu_count()
+    chunks = shot_chunks(len(names), workers, shots_per_process)
+
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as pool:
+        futures = {pool.submit(run_chunk, worker_command(manifest_path, chunk, nuke_exe)) : chunk for chunk in chunks}
+        for future in concurrent.futures.as_completed(futures):
+            chunk_results, returncode, output = future.result()
+            results.extend(chunk_results)
+            ## a worker that died part way through a chunk is reported against the shots it did not get to
+            built = {result['name'] for result in chunk_results}
+            lines = output.strip().splitlines()
+            for name in (names[i] for i in futures[future]):
+                if name not in built:
+                    error = 'worker exited with %d: %s' % (returncode, lines[-1] if lines else '')
+                    results.append({'name' : name, 'output' : None, 'error' : error, 'nodes' : 0, 'seconds' : 0})
+
+    order = {name : i for i, name in enumerate(names)}
+    return sorted(results, key = lambda result: order[result['name']])
+
+## command line
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Build AOV rebuild comps for every shot of a manifest with terminal mode Nuke.')
+    parser.add_argument('manifest', help = 'json shot manifest')
+    parser.add_argument('--workers', type = int, default = None, help = 'concurrent nuke sessions (default: cpu count)')
+    parser.add_argument('--nuke', default = os.environ.get(NUKE_ENV, 'nuke'),
+                        help = 'nuke executable (default: $%s or nuke)' % NUKE_ENV)
+    parser.add_argument('--python', action = 'store_true',
+                        help = 'run the workers with this Python interpreter instead of nuke -t (for a stand-in nuke module)')
+    parser.add_argument('--shots-per-process', type = int, default = SHOTS_PER_PROCESS,
+                        help = 'most shots built by each nuke session (default: %d)' % SHOTS_PER_PROCESS)
+    parser.add_argument('--json', action = 'store_true', help = 'print the results as json')
+    parser.add_argument('--worker', action = 'store_true', help = argparse.SUPPRESS)
+    parser.add_argument('--shots', help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(args.manifest, [int(i) for i in args.shots.split(',')])
+        return 0
+
+    start = time.time()
+    try:
+        results = build_manifest(args.manifest, args.workers, None if args.python else args.nuke, args.shots_per_process)
+    except ValueError as e:
+        print('error: %s' % e, file = sys.stderr)
+        return 2
+    failed = [result for result in results if result['error']]
+
+    if args.json:
+        print(json.dumps(results, indent = 2))
+    else:
+        for result in results:
+            if result['error']:
+                print('%-12s FAILED %s' % (result['name'], result['error']))
+            else:
+                print('%-12s %5d nodes %7.2fs  %s' % (result['name'], result['nodes'], result['seconds'], result['output']))
+        print('%d shots built, %d failed in %.1fs' % (len(results) - len(failed), len(failed), time.time() - start))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
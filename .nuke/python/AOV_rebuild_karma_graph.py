@@ -0,0 +1,285 @@
+import re
+import uuid
+
+from AOV_rebuild_karma_layout import DEFAULT_NODE_SIZE, node_size
+
+## global Variables
+## knobs that are not written to the script text but set through the python knob api once pasted,
+## the Shuffle2 mappings script format is not stable between Nuke releases
+DEFERRED_KNOBS = ('mappings',)
+
+## node classes that have no inputs, the node written after one never takes it off the stack
+NO_INPUT_CLASSES = ('StickyNote', 'BackdropNode', 'Read', 'DeepRead', 'Constant', 'Input')
+
+## hidden knobs tagging every node a rebuild creates: the rebuild it belongs to, its position in the
+## graph (used to apply deferred knobs) and its layout role (the name it was given, eg. 'aov_dot')
+REBUILD_ID_KNOB = 'aov_rebuild_id'
+GRAPH_KEY_KNOB = 'aov_rebuild_key'
+REBUILD_ROLE_KNOB = 'aov_rebuild_role'
+
+## hidden knobs set once a graph is pasted, tying its sticky notes (connected to nothing) to a connected node pasted
+## with them: that node lists the names of the notes, each note names that node
+NOTES_KNOB = 'aov_rebuild_notes'
+ANCHOR_KNOB = 'aov_rebuild_anchor'
+
+## hidden knobs written for the graph tags a node was created under (see Graph.tags), eg. the aov a branch belongs to
+TAG_KNOB_PREFIX = 'aov_rebuild_'
+
+_BARE_STRING = re.compile(r'^[A-Za-z0-9_.+\-/:]+$')
+
+class Expression(str):
+    '''A knob value that is an expression rather than a string, eg. [Expression('parent.mix')] is written as
+    {{parent.mix}} and a list of one per channel as {{parent.white.r} {parent.white.g} ...}'''
+
+class GraphKnob(object):
+    '''Minimal stand-in for a nuke knob so graph nodes can be built with the same code as live nodes'''
+    def __init__(self, node, name):
+        self._node = node
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def value(self):
+        return self._node.get_knob(self._name)
+
+    getValue = value
+
+    def setValue(self, value):
+        self._node.set_knob(self._name, value)
+
+class GraphNode(object):
+    '''A node of an in-memory rebuild graph, answering the small part of the nuke node api the builders use'''
+    def __init__(self, graph, node_class, inputs = None, knobs = None):
+        self.graph = graph
+        self.node_class = node_class
+        self.inputs = list(inputs or [])
+        self.knobs = {}
+        self.deferred_knobs = {}
+        self.node_name = None
+        self.role = None
+        self.tags = dict(graph.tags) if graph is not None else {}
+        self.x = 0
+        self.y = 0
+        for name, value in (knobs or {}).items():
+            self.set_knob(name, value)
+
+    def __repr__(self):
+        return '<GraphNode %s %s>' % (self.node_class, self.node_name or id(self))
+
+    ## knobs
+    def set_knob(self, name, value):
+        if name in DEFERRED_KNOBS:
+            self.deferred_knobs[name] = value
+        else:
+            self.knobs[name] = value
+
+    def get_knob(self, name):
+        if name in self.deferred_knobs:
+            return self.deferred_knobs[name]
+        return self.knobs.get(name)
+
+    def __getitem__(self, name):
+        return GraphKnob(self, name)
+
+    def knob(self, name):
+        return GraphKnob(self, name)
+
+    ## nuke node api
+    def Class(self):
+        return self.node_class
+
+    def name(self):
+        return self.node_name
+
+    def setName(self, name, uncollide = False):
+        self.node_name = self.graph.unique_name(name) if uncollide else name
+        self.role = name
+
+    def input(self, i):
+        return self.inputs[i] if i < len(self.inputs) else None
+
+    def setInput(self, i, node):
+        while len(self.inputs) <= i:
+            self.inputs.append(None)
+        self.inputs[i] = node
+
+    def xpos(self):
+        return self.x
+
+    def ypos(self):
+        return self.y
+
+    def setXYpos(self, x, y):
+        self.x = int(x)
+        self.y = int(y)
+
+    def screenWidth(self):
+        return self.graph.node_size(self)[0]
+
+    def screenHeight(self):
+        return self.graph.node_size(self)[1]
+
+class ExternalNode(GraphNode):
+    '''A live node the graph connects to. The graph's source is written to script text as $cut_paste_input,
+    inputs from any other external node are left unconnected and set to `live` once the graph is pasted.'''
+    def __init__(self, graph, xpos = 0, ypos = 0, width = DEFAULT_NODE_SIZE[0], height = DEFAULT_NODE_SIZE[1], node_class = 'Input', live = None):
+        GraphNode.__init__(self, graph, node_class)
+        self.x = xpos
+        self.y = ypos
+        self.size = (width, height)
+        self.live = live
+
+class _NodeFactory(object):
+    '''Lets a graph be populated with `graph.nodes.Dot(inputs = [...], label = '...')`, mirroring nuke.nodes'''
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getattr__(self, node_class):
+        def create(inputs = None, **knobs):
+            return self._graph.add(node_class, inputs, **knobs)
+        return create
+
+class Graph(object):
+    '''An in-memory description of a rebuild that can be written out as .nk script text'''
+    def __init__(self, source = None, node_sizes = None, rebuild_id = None):
+        self.rebuild_id = rebuild_id or uuid.uuid4().hex[:12]
+        self.node_list = []
+        self.layers = {}
+        self.names = set()
+        self.node_sizes = node_sizes
+        self.nodes = _NodeFactory(self)
+        ## tags copied onto every node added while they are set, eg. {'pipe' : 'lightgroups', 'aov' : 'LG_key'}
+        self.tags = {}
+        ## called with the aov of every aov branch as it is added, eg. to report progress (see AOV_rebuild_karma.RebuildProgress)
+        self.progress = None
+        self.source = source if source is not None else ExternalNode(self)
+        self.source.graph = self
+
+    def add(self, node_class, inputs = None, **knobs):
+        '''Creates a node in the graph and returns it'''
+        node = GraphNode(self, node_class, inputs, knobs)
+        self.node_list.append(node)
+        return node
+
+    def add_layer(self, name, channels):
+        '''Registers a layer to be created when the script text is read (same as nuke.Layer)'''
+        self.layers[name] = list(channels)
+
+    def delete(self, node):
+        '''Removes `node` from the graph, anything downstream is reconnected to its first input'''
+        self.node_list.remove(node)
+        for other in self.node_list:
+            other.inputs = [node.input(0) if i is node else i for i in other.inputs]
+
+    def unique_name(self, name):
+        '''Returns `name`, numbered the same way nuke uncollides node names if it is already taken'''
+        unique = name
+        count = 0
+        while unique in self.names:
+            count += 1
+            unique = '%s%d' % (name, count)
+        self.names.add(unique)
+        return unique
+
+    def external(self, live, node_class = 'Input'):
+        '''Returns a stand-in for a live node other than the source, see ExternalNode'''
+        return ExternalNode(self, live.xpos(), live.ypos(), live.screenWidth(), live.screenHeight(), node_class, live)
+
+    def external_inputs(self):
+        '''Returns (node, input number, live node) for every input connected once the graph is pasted'''
+        return [(node, i, inp.live) for node in self.node_list for i, inp in enumerate(node.inputs)
+                if isinstance(inp, ExternalNode) and inp is not self.source]
+
+    def node_size(self, node):
+        if isinstance(node, ExternalNode):
+            return node.size
+        return node_size(node.node_class, self.node_sizes)
+
+    def deferred_nodes(self):
+        '''Returns the nodes which have knobs to set after the script text is pasted'''
+        return [node for node in self.node_list if node.deferred_knobs]
+
+    def to_nk(self):
+        '''Returns the graph as .nk script text, ready for nuke.nodePaste'''
+        return graph_to_nk(self)
+
+## script text serialization
+def nk_value(value):
+    '''Returns `value` formatted as a .nk knob value'''
+    if isinstance(value, Expression):
+        return '{%s}' % nk_value(str(value))
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        return repr(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, (list, tuple)):
+        return '{' + ' '.join(nk_value(v) for v in value) + '}'
+    value = str(value)
+    if _BARE_STRING.match(value):
+        return value
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('[', '\\[')
+               .replace('$', '\\$').replace('\n', '\\n'))
+    return '"%s"' % escaped
+
+def graph_to_nk(graph):
+    '''Serializes `graph` to .nk script text.
+
+    Inputs are pushed onto the stack before each node (input 0 last, on top of the stack) unless the
+    node only takes the one written just before it, and the source node is referenced as $cut_paste_input.'''
+    variables = {}
+    used_as_input = set()
+    for node in graph.node_list:
+        for i in node.inputs:
+            if i is not None:
+                used_as_input.add(id(i))
+
+    lines = ['set cut_paste_input [stack 0]']
+    for name, channels in sorted(graph.layers.items()):
+        lines.append('add_layer {%s %s}' % (name, ' '.join(channels)))
+
+    previous = None
+    for count, node in enumerate(graph.node_list):
+        ## a single input fed by the node just written is already on top of the stack
+        if len(node.inputs) == 1 and node.inputs[0] is previous and previous is not None:
+            pass
+        else:
+            for i in reversed(node.inputs):
+                if i is None or (isinstance(i, ExternalNode) and i is not graph.source):
+                    lines.append('push 0')
+                elif i is graph.source:
+                    lines.append('push $cut_paste_input')
+                else:
+                    lines.append('push $%s' % variables[id(i)])
+
+        lines.append('%s {' % node.node_class)
+        ## 'inputs 0' included, like nuke writes it for a Read
+        if len(node.inputs) != 1:
+            lines.append(' inputs %d' % len(node.inputs))
+        for name, value in node.knobs.items():
+            lines.append(' %s %s' % (name, nk_value(value)))
+        if node.node_name:
+            lines.append(' name %s' % nk_value(node.node_name))
+        lines.append(' addUserKnob {20 aov_rebuild_tab l "AOV Rebuild" +INVISIBLE}')
+        lines.append(' addUserKnob {1 %s +INVISIBLE}' % REBUILD_ID_KNOB)
+        lines.append(' %s %s' % (REBUILD_ID_KNOB, graph.rebuild_id))
+        lines.append(' addUserKnob {1 %s +INVISIBLE}' % GRAPH_KEY_KNOB)
+        lines.append(' %s %d' % (GRAPH_KEY_KNOB, count))
+        if node.role:
+            lines.append(' addUserKnob {1 %s +INVISIBLE}' % REBUILD_ROLE_KNOB)
+            lines.append(' %s %s' % (REBUILD_ROLE_KNOB, nk_value(node.role)))
+        for tag, value in sorted(node.tags.items()):
+            lines.append(' addUserKnob {1 %s%s +INVISIBLE}' % (TAG_KNOB_PREFIX, tag))
+            lines.append(' %s%s %s' % (TAG_KNOB_PREFIX, tag, nk_value(value)))
+        lines.append(' xpos %d' % node.x)
+        lines.append(' ypos %d' % node.y)
+        lines.append('}')
+
+        if id(node) in used_as_input:
+            variables[id(node)] = 'N%d' % count
+            lines.append('set N%d [stack 0]' % count)
+        previous = None if node.node_class in NO_INPUT_CLASSES else node
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,144 @@
+'''A rebuild packaged in a single Group node, graded from its panel.
+
+The root of the script holds one node per rebuild instead of hundreds. The Group panel has a grade and a mute knob
+for every plussed material and lightgroup, each linked to a Multiply in the branch of its aov inside, and the
+breakout settings the Group was made with are stored on it, so it can rebuild itself without the breakout panel.
+
+The inner graph is built lazily: the Group keeps a signature of its input (channels, AOV schema and settings) and
+only rebuilds when the input it is shown or connected to has a different one, or when 'rebuild' is pressed. Grades
+of the aovs still there are kept. Opening a script or the panel of an up to date Group only compares signatures,
+the rebuild modules are imported the first time a Group has to be rebuilt.
+'''
+import hashlib
+import json
+
+import nuke
+
+import AOV_rebuild_karma_presets
+from AOV_rebuild_karma_schema import schema_for_metadata
+
+## global Variables
+## hidden knobs of the Group: the settings it was made with (as a preset) and the signature of the input it was built for
+SETTINGS_KNOB = 'aov_rebuild_settings'
+SIGNATURE_KNOB = 'aov_rebuild_signature'
+
+## knobs of the Group panel that are not per aov
+TAB_KNOB = 'aov_rebuild_tab'
+REBUILD_KNOB = 'aov_rebuild_rebuild'
+
+## dividers between the grade knobs of each pipe, eg. 'aov_rebuild_pipe_materials'
+PIPE_KNOB = 'aov_rebuild_pipe_%s'
+
+## knobs of a Group whose change may mean the input changed
+CHECK_KNOBS = ('inputChange', 'showPanel')
+
+KNOB_CHANGED = 'import AOV_rebuild_karma_group; AOV_rebuild_karma_group.knob_changed()'
+
+REBUILD_COMMAND = 'import AOV_rebuild_karma_group; AOV_rebuild_karma_group.rebuild_group(nuke.thisNode(), force = True)'
+
+## signature
+def input_signature(node, settings_text):
+    '''Returns the signature of what a rebuild of `node` depends on: its channels, the AOV schema of its metadata and
+    the json `settings_text` it is built with'''
+    data = json.dumps([sorted(node.channels()), schema_for_metadata(node.metadata()), settings_text])
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+def group_settings(group):
+    '''Returns the breakout settings stored on `group`'''
+    return AOV_rebuild_karma_presets.settings_from_dict(json.loads(group[SETTINGS_KNOB].value()))
+
+## panel
+def aov_knob_names(group):
+    '''Returns the names of the per aov knobs and pipe dividers on the panel of `group`'''
+    import AOV_rebuild_karma_build
+    grade_suffix = AOV_rebuild_karma_build.GRADE_KNOB % ''
+    mute_suffix = AOV_rebuild_karma_build.MUTE_KNOB % ''
+    pipe_prefix = PIPE_KNOB % ''
+    return [name for name in group.knobs()
+            if name.endswith(grade_suffix) or name.endswith(mute_suffix) or name.startswith(pipe_prefix)]
+
+def set_aov_knobs(group, pipes):
+    '''Replaces the per aov knobs of `group` with a grade and a mute knob for every aov of `pipes` ([(pipe, aovs)]),
+    keeping the values of the knobs of aovs that are still there'''
+    import AOV_rebuild_karma_build
+    kept = {}
+    for name in aov_knob_names(group):
+        knob = group.knob(name)
+        kept[name] = knob.toScript()
+        group.removeKnob(knob)
+
+    for pipe, aovs in pipes:
+        group.addKnob(nuke.Text_Knob(PIPE_KNOB % pipe, pipe))
+        for aov in aovs:
+            grade = nuke.Color_Knob(AOV_rebuild_karma_build.GRADE_KNOB % aov, aov)
+            grade.setValue(1)
+            mute = nuke.Boolean_Knob(AOV_rebuild_karma_build.MUTE_KNOB % aov, 'mute')
+            mute.clearFlag(nuke.STARTLINE)
+            for knob in (grade, mute):
+                group.addKnob(knob)
+                if knob.name() in kept:
+                    knob.fromScript(kept[knob.name()])
+
+def setup_group(group, settings):
+    '''Adds the rebuild knobs to a new `group` and stores the breakout `settings` on it'''
+    group.addKnob(nuke.Tab_Knob(TAB_KNOB, 'AOV Rebuild'))
+    group.addKnob(nuke.PyScript_Knob(REBUILD_KNOB, 'rebuild', REBUILD_COMMAND))
+    for name in (SETTINGS_KNOB, SIGNATURE_KNOB):
+        knob = nuke.String_Knob(name, name)
+        knob.setFlag(nuke.INVISIBLE)
+        group.addKnob(knob)
+    group[SETTINGS_KNOB].setValue(json.dumps(AOV_rebuild_karma_presets.preset_from_settings(settings), sort_keys = True))
+    group['knobChanged'].setValue(KNOB_CHANGED)
+
+## inner graph
+def rebuild_group(group, force = False):
+    '''Rebuilds the inner graph of the rebuild `group` when its input has changed since it was built (or with `force`).
+    Returns True when it was rebuilt.'''
+    source = group.input(0)
+    if source is None:
+        return False
+    settings_text = group[SETTINGS_KNOB].value()
+    signature = input_signature(source, settings_text)
+    if not force and group[SIGNATURE_KNOB].value() == signature:
+        return False
+
+    ## the rebuild is imported once a Group has to be built, not when a script holding one is opened
+    import AOV_rebuild_karma
+    import AOV_rebuild_karma_build
+    if AOV_rebuild_karma.is_deep(source):
+        nuke.message('%s: deep rebuilds are not packaged in a Group, run the rebuild on the deep stream instead.' % group.name())
+        return False
+    settings = dict(group_settings(group), grade_knobs = True)
+
+    with AOV_rebuild_karma.undo_group('AOV rebuild group'), group:
+        for n in nuke.allNodes():
+            nuke.delete(n)
+        input_node = nuke.nodes.Input()
+        input_node.setXYpos(0, 0)
+        ## classified from the node the Group is connected to, the Input inside shows the same channels
+        layer_index = AOV_rebuild_karma.get_layer_index(source, settings)
+        settings = AOV_rebuild_karma.scan_settings(source, AOV_rebuild_karma.channel_settings(source, settings))
+        graph = AOV_rebuild_karma_build.build_rebuild_graph(layer_index, settings, AOV_rebuild_karma.graph_source(input_node))
+        pasted = AOV_rebuild_karma.paste_graph(graph, input_node) if graph.node_list else []
+
+        end = AOV_rebuild_karma.rebuild_end(pasted) or input_node
+        output = nuke.nodes.Output(inputs = [end])
+        output.setXYpos(end.xpos(), end.ypos() + settings['y_space'])
+
+    set_aov_knobs(group, AOV_rebuild_karma_build.summed_aovs(layer_index, settings))
+    group[SIGNATURE_KNOB].setValue(signature)
+    return True
+
+def create_group(node, settings):
+    '''Returns a new rebuild Group under `node`, built with breakout `settings`'''
+    group = nuke.nodes.Group(inputs = [node], label = 'AOV rebuild')
+    group.setXYpos(node.xpos(), node.ypos() + settings['y_space'] * 2)
+    setup_group(group, settings)
+    rebuild_group(group, force = True)
+    return group
+
+## callbacks
+def knob_changed():
+    '''knobChanged of a rebuild Group: checks its input when it is connected or its panel is opened'''
+    if nuke.thisKnob().name() in CHECK_KNOBS:
+        rebuild_group(nuke.thisNode())
@@ -0,0 +1,106 @@
+from AOV_rebuild_karma_schema import DEFAULT_SCHEMA, get_schema
+
+## global Variables
+## the rules of the default schema, see AOV_rebuild_karma_schema for the other Houdini versions
+LIGHTGROUP_REGEX = get_schema(DEFAULT_SCHEMA).lightgroup_regex
+
+ADDITIONAL_LIGHTING_AOVS = []
+
+MATERIAL_AOVS = list(get_schema(DEFAULT_SCHEMA).materials)
+
+UTILITY_AOVS = list(get_schema(DEFAULT_SCHEMA).utilities)
+
+## number of layer indexes kept around, one per channel list / rule set combination
+LAYER_INDEX_CACHE_SIZE = 64
+
+_layer_index_cache = {}
+
+## layer index functions
+def _classify(channels, lightgroup_regex, additional_lighting, expected_materials, expected_utilities, schema):
+    '''Does the single pass over `channels` that every layer lookup is answered from'''
+    layer_channels = {}
+    for channel in channels:
+        layer = channel.split('.')[0]
+        if layer in layer_channels:
+            layer_channels[layer].append(channel)
+        else:
+            layer_channels[layer] = [channel]
+
+    layers = sorted(layer_channels)
+
+    ## lowercase lookups, the karma naming convention is matched case-insensitively for materials (eg. 'C_emission')
+    layers_by_lower = {}
+    for layer in layers:
+        layers_by_lower.setdefault(layer.lower(), []).append(layer)
+
+    additional_lighting_set = set(additional_lighting)
+    lightgroups = [layer for layer in layers if lightgroup_regex.search(layer) or layer in additional_lighting_set]
+
+    materials = []
+    for material in expected_materials:
+        materials.extend(layers_by_lower.get(material.lower(), ()))
+
+    layer_set = set(layers)
+    utilities = [utility for utility in expected_utilities if utility in layer_set]
+
+    classified = set(lightgroups) | set(materials) | set(utilities)
+    unknown = [layer for layer in layers if layer not in classified]
+
+    materials_lower = {m.lower() for m in materials}
+    missing_materials = sorted({m.lower() for m in expected_materials} - materials_lower)
+
+    ## per aov decisions of the schema, made once per stream so the builders only look them up
+    bpipe_skip = {}
+    for material in materials:
+        reason = schema.bpipe_skip_reason(material, materials_lower)
+        if reason is not None:
+            bpipe_skip[material] = reason
+
+    return {'channels' : tuple(channels),
+            'channel_set' : frozenset(channels),
+            'layers' : layers,
+            'layer_set' : frozenset(layer_set),
+            'layers_lower' : frozenset(layers_by_lower),
+            'layer_channels' : layer_channels,
+            'materials' : materials,
+            'materials_lower' : frozenset(materials_lower),
+            'missing_materials' : missing_materials,
+            'schema' : schema.name,
+            'bpipe_skip' : bpipe_skip,
+            'overlaps' : schema.overlapping(materials_lower),
+            'lightgroups' : lightgroups,
+            'utilities' : utilities,
+            'unknown' : unknown}
+
+def classify_channels(channels, lightgroup_regex = LIGHTGROUP_REGEX, additional_lighting = ADDITIONAL_LIGHTING_AOVS,
+                      expected_materials = MATERIAL_AOVS, expected_utilities = UTILITY_AOVS, schema = None):
+    '''Returns a layer index for a list of channel names such as the output of node.channels().
+
+    The index is a dictionary holding the layer to channels mapping plus the material, lightgroup,
+    utility and unknown buckets, and the B pipe decisions and overlapping aovs of `schema` (DEFAULT_SCHEMA).
+    Indexes are cached per channel list, rule set and schema, so treat the result as read only.'''
+    channels = tuple(channels)
+    schema = get_schema(schema)
+    key = (channels, lightgroup_regex.pattern, lightgroup_regex.flags, tuple(additional_lighting),
+           tuple(expected_materials), tuple(expected_utilities), schema.name)
+    index = _layer_index_cache.get(key)
+    if index is None:
+        index = _classify(channels, lightgroup_regex, additional_lighting, expected_materials, expected_utilities, schema)
+        if len(_layer_index_cache) >= LAYER_INDEX_CACHE_SIZE:
+            _layer_index_cache.pop(next(iter(_layer_index_cache)))
+        _layer_index_cache[key] = index
+    return index
+
+def classify_channels_from_settings(channels, settings, schema = None):
+    '''Returns the layer index for `channels` using the rules held in a breakout settings dictionary, with the
+    schema the settings name or else `schema` (eg. the one picked from the render's metadata)'''
+    return classify_channels(channels,
+                             settings['lg_regex'],
+                             settings['additional_lighting'],
+                             settings['expected_materials'],
+                             settings['expected_utilities'],
+                             settings.get('schema') or schema)
+
+def clear_layer_index_cache():
+    '''Empties the layer index cache'''
+    _layer_index_cache.clear()
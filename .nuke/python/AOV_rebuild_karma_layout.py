@@ -0,0 +1,45 @@
+## global Variables
+## screen sizes of the nodes a rebuild creates (width, height), so every position can be worked out
+## before any node exists in the DAG
+NODE_SIZES = {'Dot' : (12, 12),
+              'StickyNote' : (80, 18)}
+
+DEFAULT_NODE_SIZE = (80, 18)
+
+## centre to centre distance from an aov dot (or the start dot) down to the Shuffle2 / Remove under it
+SHUFFLE_Y_OFFSET = 28
+
+## centre to centre distance from a Shuffle2 down to the Unpremult under it
+UNPREMULT_Y_OFFSET = 32
+
+## gap left between an Unpremult and the bottom dot of an aov branch that is not merged into the bpipe
+BOTTOM_DOT_Y_PAD = 50
+
+## layout functions
+def node_size(node_class, node_sizes = None):
+    '''Returns the (width, height) of a node of `node_class` from the size table'''
+    if node_sizes and node_class in node_sizes:
+        return node_sizes[node_class]
+    return NODE_SIZES.get(node_class, DEFAULT_NODE_SIZE)
+
+def centre_below(upstream, node, pad):
+    '''Returns the centre y that places `node` `pad` pixels under the bottom edge of `upstream`'''
+    up_ypos = upstream.ypos() + upstream.screenHeight()/2
+    return int(up_ypos + upstream.screenHeight()/2 + node.screenHeight()/2 + pad)
+
+def graph_positions(graph):
+    '''Returns the layout of a rebuild graph as plain data, one (class, name, xpos, ypos) tuple per node in creation order'''
+    return [(node.Class(), node.name(), node.xpos(), node.ypos()) for node in graph.node_list]
+
+def graph_bbox(graph):
+    '''Returns the (left, top, right, bottom) nodegraph area covered by a rebuild graph and the node it hangs off'''
+    nodes = [graph.source] + graph.node_list
+    return (min(n.xpos() for n in nodes),
+            min(n.ypos() for n in nodes),
+            max(n.xpos() + n.screenWidth() for n in nodes),
+            max(n.ypos() + n.screenHeight() for n in nodes))
+
+def translate_graph(graph, dx, dy):
+    '''Moves every node of a rebuild graph, and the node it hangs off, by `dx`, `dy`'''
+    for n in [graph.source] + graph.node_list:
+        n.setXYpos(n.xpos() + dx, n.ypos() + dy)
@@ -0,0 +1,46 @@
+'''Menu commands of the rebuild, registered at startup without importing it.
+
+menu.py only imports this module (and the presets file reader): every command is a string importing
+AOV_rebuild_karma the first time it is run, so the rebuild, its EXR reader, numpy QC and layout are loaded by the
+first artist to use them in a session and by nobody else. benchmarks/bench_startup.py checks what startup imports.
+'''
+import sys
+
+import nuke
+
+import AOV_rebuild_karma_presets
+
+## global Variables
+## menu of the Nodes toolbar holding a command per saved preset
+PRESETS_MENU = 'Python/AOV_rebuild_karma presets'
+
+## tag knob of the Switch a precomp adds to a rebuild (see AOV_rebuild_karma_precomp.PRECOMP_TAG)
+PRECOMP_KNOB = 'aov_rebuild_precomp'
+
+def lazy_command(call):
+    '''Returns the menu command running `call` of AOV_rebuild_karma, importing it first'''
+    return 'import AOV_rebuild_karma; AOV_rebuild_karma.%s' % call
+
+def build_presets_menu():
+    '''Fills the presets menu with a command per saved preset, each rebuilding the selected node with no panel,
+    and an edit command per preset opening the panel on it'''
+    menu = nuke.menu('Nodes').addMenu(PRESETS_MENU)
+    menu.clearMenu()
+    try:
+        names = AOV_rebuild_karma_presets.preset_names()
+    except AOV_rebuild_karma_presets.PresetError as e:
+        sys.stderr.write('AOV rebuild presets not loaded, %s\n' % e)
+        return
+    for name in names:
+        menu.addCommand(name, lazy_command('run_preset(%r)' % name))
+    edit_menu = menu.addMenu('edit')
+    for name in names:
+        edit_menu.addCommand(name, lazy_command('custom_edit_preset(%r)' % name))
+
+def check_precomps():
+    '''onScriptLoad callback: points the precomp Switches of the opened script back at the live stream where their
+    precomp is stale. The precomp module is only imported when the script holds a precomp.'''
+    switches = [n for n in nuke.allNodes('Switch') if n.knob(PRECOMP_KNOB) is not None]
+    if switches:
+        import AOV_rebuild_karma_precomp
+        AOV_rebuild_karma_precomp.check_precomps(switches)
@@ -0,0 +1,238 @@
+'''Precomps of a rebuild's breakout to one multichannel EXR, so the rebuild reads a single file instead of pulling every
+aov out of the render (and unpremultiplying it) again on every frame.
+
+The stream out of the Unpremult at the top of a compact rebuild, every aov already unpremultiplied, is written by a
+Write next to it. Rebuilds that unpremultiply each aov in its branch are not precomped, their precomp would hold the aovs
+as rendered and still be unpremultiplied on every frame. The Write is
+rendered in chunks of frames by terminal Nuke processes running side by side on the local cores, and read back by a
+Read feeding a Switch between the Unpremult and the pipes. The Switch reads the precomp while it is fresh and goes back
+to the live stream once the render is newer than the precomp, its frame range changed or it has channels the precomp
+is missing. Freshness is checked when the precomp is rendered and when a script holding one is opened
+(see AOV_rebuild_karma_menu.check_precomps).
+
+AOV_REBUILD_PRECOMP_DIR sets where precomps are written, a precomp directory next to the script otherwise.
+'''
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+import nuke
+
+from AOV_rebuild_karma_farm import NUKE_ENV
+from AOV_rebuild_karma_validate import expand_sequence
+
+## global Variables
+PRECOMP_DIR_ENV = 'AOV_REBUILD_PRECOMP_DIR'
+
+## compressions of the precomp EXR: ZIP is lossless, and with the aovs written as 32 bit float the unpremultiplied aovs are
+## not rounded again, so the rebuild still sums to the beauty. DWAA is a fraction of the size
+COMPRESSIONS = {'zip' : 'Zip (1 scanline)', 'dwaa' : 'DWAA'}
+COMPRESSION = 'zip'
+
+DATATYPE = '32 bit float'
+
+## threads each terminal nuke renders with, the cores are shared out between the processes
+THREADS_PER_PROCESS = 4
+
+## seconds between checks of the renders, for the progress bar and cancelling
+POLL_SECONDS = 0.5
+
+## graph tag of the Switch, its knob (see AOV_rebuild_karma_menu.PRECOMP_KNOB) holds the precomp path
+PRECOMP_TAG = 'precomp'
+
+## nodes a precomp adds to a rebuild
+PRECOMP_ROLES = ('precomp_write', 'precomp_read', 'precomp_switch')
+
+class PrecompError(ValueError):
+    '''A precomp that cannot be made or rendered'''
+
+## paths and frames
+def precomp_path(read, directory = None):
+    '''Returns the precomp sequence of the rebuild of `read`, '<directory>/<render name>_precomp.####.exr', written to
+    AOV_REBUILD_PRECOMP_DIR or a precomp directory next to the script by default'''
+    if directory is None:
+        directory = os.environ.get(PRECOMP_DIR_ENV)
+    if not directory:
+        script = nuke.root().name()
+        directory = os.path.join(os.path.dirname(script) if script != 'Root' else tempfile.gettempdir(), 'precomp')
+    ## the render's name without its frame number and extension
+    name = re.sub(r'([._](#+|%0?\d*d|\d+))?\.\w+$', '', os.path.basename(nuke.filename(read))) or read.name()
+    return os.path.join(directory, '%s_precomp.####.exr' % name).replace('\\', '/')
+
+def frame_chunks(first, last, chunks):
+    '''Returns `first` to `last` split into at most `chunks` runs of frames as (first, last), as even as they go'''
+    frames = last - first + 1
+    chunks = max(1, min(chunks, frames))
+    size, extra = divmod(frames, chunks)
+    ranges = []
+    start = first
+    for i in range(chunks):
+        end = start + size - (0 if i < extra else 1)
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+def sequence_mtimes(pattern, frames):
+    '''Returns the modification time of every frame of `pattern` in `frames`, None for the ones missing'''
+    mtimes = []
+    for _, path in expand_sequence(pattern, frames):
+        try:
+            mtimes.append(os.path.getmtime(path))
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+## rendering
+def default_processes():
+    '''Returns how many terminal nukes render at once, enough for each to get THREADS_PER_PROCESS of the cores'''
+    return max(1, (os.cpu_count() or 1) // THREADS_PER_PROCESS)
+
+def write_render_script(write, path):
+    '''Saves `write` and every node it pulls from to the script `path`, under the root settings of the open script
+    (colour management, formats...) so the renders match the session'''
+    upstream = {}
+    to_visit = [write]
+    while to_visit:
+        n = to_visit.pop()
+        if n.fullName() not in upstream:
+            upstream[n.fullName()] = n
+            to_visit.extend(n.dependencies(nuke.INPUTS | nuke.HIDDEN_INPUTS | nuke.EXPRESSIONS))
+
+    selected = nuke.selectedNodes()
+    for n in selected:
+        n.setSelected(False)
+    for n in upstream.values():
+        n.setSelected(True)
+    try:
+        nuke.nodeCopy(path)
+    finally:
+        for n in upstream.values():
+            n.setSelected(False)
+        for n in selected:
+            n.setSelected(True)
+
+    with open(path) as f:
+        copied = f.read()
+    with open(path, 'w') as f:
+        f.write('Root {\n%s\n}\n' % nuke.root().writeKnobs(nuke.WRITE_NON_DEFAULT_ONLY | nuke.TO_SCRIPT))
+        f.write(copied)
+
+def render_command(script, write_name, first, last, nuke_exe = None):
+    '''Returns the command line of a terminal nuke rendering the Write `write_name` of `script` over first-last'''
+    nuke_exe = nuke_exe or os.environ.get(NUKE_ENV) or nuke.EXE_PATH
+    return [nuke_exe, '-x', '-m', str(THREADS_PER_PROCESS), '-X', write_name, '-F', '%d-%d' % (first, last), script]
+
+def render_precomp(write, first, last, processes = None, nuke_exe = None, progress = None):
+    '''Renders `write` over `first` to `last` in chunks of frames, one terminal nuke per chunk, `processes`
+    (default_processes()) all running at once. `progress` is called with (frames written, frames) while they run.
+    Raises PrecompError naming the log of a process that failed, every process is killed when `progress` raises
+    (eg. RebuildCancelled).'''
+    processes = processes or default_processes()
+    frames = list(range(first, last + 1))
+    pattern = nuke.filename(write)
+    temp_dir = tempfile.mkdtemp(prefix = 'aov_rebuild_precomp_')
+    script = os.path.join(temp_dir, 'precomp.nk')
+    write_render_script(write, script)
+
+    start = time.time()
+    running = []
+    try:
+        for chunk_first, chunk_last in frame_chunks(first, last, processes):
+            log_path = os.path.join(temp_dir, '%d-%d.log' % (chunk_first, chunk_last))
+            with open(log_path, 'w') as log:
+                process = subprocess.Popen(render_command(script, write.name(), chunk_first, chunk_last, nuke_exe),
+                                           stdout = log, stderr = subprocess.STDOUT)
+            running.append((process, log_path))
+        while any(process.poll() is None for process, _ in running):
+            if progress is not None:
+                written = sum(1 for mtime in sequence_mtimes(pattern, frames) if mtime is not None and mtime >= start)
+                progress(written, len(frames))
+            time.sleep(POLL_SECONDS)
+    except BaseException:
+        for process, _ in running:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+        raise
+
+    failed = [(process.returncode, log_path) for process, log_path in running if process.returncode != 0]
+    if failed:
+        raise PrecompError('%d of %d renders failed, see %s' % (len(failed), len(running), failed[0][1]))
+    shutil.rmtree(temp_dir, ignore_errors = True)
+
+## rebuild nodes
+def precomp_graph(top, path, first, last, compression, rebuild_id, x_space, y_space):
+    '''Describes the precomp of the stream out of the live node `top`: a Write left of it, the Read of what it renders
+    below the Write and a Switch under `top` between the live stream (input 0) and the precomp (input 1).
+    The Switch is left on the live stream until the precomp is checked.'''
+    ## only making a precomp needs the graph modules, checking one does not
+    import AOV_rebuild_karma_graph
+    from AOV_rebuild_karma_build import get_centre_xypos, set_centred_xypos
+
+    graph = AOV_rebuild_karma_graph.Graph(rebuild_id = rebuild_id)
+    graph.source = graph.external(top, top.Class())
+    x_pos, y_pos = get_centre_xypos(graph.source)
+
+    write = graph.nodes.Write(inputs = [graph.source], file = path, file_type = 'exr', channels = 'all',
+                              datatype = DATATYPE, compression = COMPRESSIONS[compression], metadata = 'all metadata',
+                              create_directories = True, label = 'precomp')
+    write.role = 'precomp_write'
+    set_centred_xypos(write, x_pos - x_space, y_pos)
+
+    read = graph.nodes.Read(file = path, first = first, last = last, origfirst = first, origlast = last, label = 'precomp')
+    read.role = 'precomp_read'
+    set_centred_xypos(read, x_pos - x_space, y_pos + y_space)
+
+    graph.tags[PRECOMP_TAG] = path
+    switch = graph.nodes.Switch(inputs = [graph.source, read], which = 0, label = 'precomp')
+    switch.role = 'precomp_switch'
+    set_centred_xypos(switch, x_pos, y_pos + y_space // 2)
+    return graph, write, switch
+
+def precomp_staleness(switch):
+    '''Returns why the precomp read by the precomp `switch` cannot stand in for the live stream, None when it can'''
+    live, read = switch.input(0), switch.input(1)
+    if live is None or read is None:
+        return 'not connected'
+    first, last = int(read['first'].value()), int(read['last'].value())
+    precomp_mtimes = sequence_mtimes(nuke.filename(read), range(first, last + 1))
+    if None in precomp_mtimes:
+        return '%d frames not rendered' % precomp_mtimes.count(None)
+
+    ## the render is the Read at the top of the live stream
+    source = live
+    while source is not None and source.Class() != 'Read':
+        source = source.input(0)
+    if source is not None:
+        if (int(source['first'].value()), int(source['last'].value())) != (first, last):
+            return 'frame range of %s changed' % source.name()
+        source_mtimes = [mtime for mtime in sequence_mtimes(nuke.filename(source), range(first, last + 1)) if mtime is not None]
+        if source_mtimes and max(source_mtimes) > min(precomp_mtimes):
+            return '%s is newer' % source.name()
+
+    missing = set(live.channels()) - set(read.channels())
+    if missing:
+        return '%d channels not in the precomp' % len(missing)
+    return None
+
+def check_precomp(switch):
+    '''Points the precomp `switch` at the precomp when it is fresh and at the live stream when not.
+    Returns why it is stale, None when it is fresh.'''
+    reason = precomp_staleness(switch)
+    switch['which'].setValue(0 if reason else 1)
+    switch['label'].setValue('precomp' if reason is None else 'precomp stale, live\n%s' % reason)
+    return reason
+
+def check_precomps(switches):
+    '''Checks every precomp Switch of `switches` (see check_precomp), telling the artist about the stale ones'''
+    stale = []
+    for switch in switches:
+        reason = check_precomp(switch)
+        if reason is not None:
+            stale.append('%s: %s' % (switch.name(), reason))
+    if stale and nuke.GUI:
+        nuke.message('AOV rebuild precomps not used, reading the render instead:\n\n%s' % '\n'.join(stale))
+    return stale
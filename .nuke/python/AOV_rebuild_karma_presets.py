@@ -0,0 +1,194 @@
+'''Named breakout settings saved to a json file in the .nuke directory, so a show's config can be run again without
+filling in the panel.
+
+    {"presets" : {"show_karma" : {"lg_regex" : "^LG_", "lg_regex_ignore_case" : true, "breakout_materials" : false,
+                                  "expected_materials" : ["diffuse", "specular"], "x_space" : 200, "y_space" : 100}}}
+
+A preset holds any of the PRESET_TYPES keys of AOV_rebuild_karma_build.DEFAULT_SETTINGS, 'lg_regex' given as a
+string, anything it leaves out keeps its default. Presets are validated when the file is read, the file is only read
+again once it changes and each regex is compiled once. Listing presets does not import the rebuild modules, the
+presets menu is built at startup (see AOV_rebuild_karma_menu).
+
+AOV_REBUILD_PRESETS points at another file, eg. one shared by a show.
+'''
+import functools
+import json
+import os
+import re
+
+## global Variables
+PRESETS_ENV = 'AOV_REBUILD_PRESETS'
+
+## next to menu.py, this file lives in .nuke/python
+PRESETS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'AOV_rebuild_karma_presets.json')
+
+## settings a preset can hold (what the panel asks for) > type of their json value, 'names' being a list of strings
+## and 'schema' the name of an AOV schema or null to pick it from the render (see AOV_rebuild_karma_schema).
+## Scan results ('pruned_aovs', 'aov_bboxes'), the Cryptomatte scope ('scope_mattes') and the layer picked for the
+## original ('original_layer') belong to a Read
+PRESET_TYPES = {'lg_regex' : 'regex',
+                'lg_regex_ignore_case' : 'bool',
+                'additional_lighting' : 'names',
+                'expected_materials' : 'names',
+                'expected_utilities' : 'names',
+                'breakout_materials' : 'bool',
+                'breakout_lightgroups' : 'bool',
+                'breakout_utilities' : 'bool',
+                'compact' : 'bool',
+                'unassigned_expression' : 'bool',
+                'unassigned_guard' : 'bool',
+                'prune_empty' : 'bool',
+                'prune_sample_frames' : 'count',
+                'crop_to_data' : 'bool',
+                'reuse_channels' : 'bool',
+                'x_space' : 'count',
+                'y_space' : 'count',
+                'schema' : 'schema'}
+
+## preset names end up as menu items, '/' would make a sub menu
+PRESET_NAME_REGEX = re.compile(r'^[\w.\- ]+$')
+
+## path > ((mtime, size), {name : preset})
+_cache = {}
+
+class PresetError(ValueError):
+    '''A preset or presets file that cannot be used'''
+
+def presets_path(path = None):
+    return path or os.environ.get(PRESETS_ENV) or PRESETS_FILE
+
+## settings
+@functools.lru_cache(maxsize = None)
+def compiled_regex(pattern, ignore_case = True):
+    '''Returns `pattern` compiled, once per pattern and flag'''
+    return re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+
+def default_settings():
+    ## imported on first use, not when the presets menu is built
+    from AOV_rebuild_karma_build import DEFAULT_SETTINGS
+    return DEFAULT_SETTINGS
+
+def settings_from_dict(overrides, defaults = None):
+    '''Returns a copy of the breakout settings `defaults` (DEFAULT_SETTINGS) updated from json friendly `overrides`'''
+    settings = dict(default_settings() if defaults is None else defaults)
+    for key, value in overrides.items():
+        if key == 'lg_regex_ignore_case':
+            continue
+        if key == 'lg_regex':
+            value = compiled_regex(value, overrides.get('lg_regex_ignore_case', True))
+        elif key not in settings:
+            raise KeyError('unknown setting %r' % key)
+        settings[key] = value
+    return settings
+
+def preset_from_settings(settings):
+    '''Returns the json friendly preset of breakout `settings`'''
+    preset = {}
+    for key in PRESET_TYPES:
+        if key == 'lg_regex_ignore_case':
+            preset[key] = bool(settings['lg_regex'].flags & re.IGNORECASE)
+        elif key == 'lg_regex':
+            preset[key] = settings['lg_regex'].pattern
+        elif isinstance(settings[key], (list, tuple)):
+            preset[key] = list(settings[key])
+        else:
+            preset[key] = settings[key]
+    return preset
+
+## validation
+def validate_preset(name, preset):
+    '''Raises PresetError naming the first problem of `preset`, returns it otherwise'''
+    if not isinstance(name, str) or not PRESET_NAME_REGEX.match(name):
+        raise PresetError('%r is not a preset name, use letters, digits, spaces, dots and dashes' % (name,))
+    if not isinstance(preset, dict):
+        raise PresetError('preset %s is not a json object' % name)
+    for key, value in preset.items():
+        value_type = PRESET_TYPES.get(key)
+        if value_type is None:
+            raise PresetError('preset %s: unknown setting %r' % (name, key))
+        if value_type == 'regex':
+            if not isinstance(value, str):
+                raise PresetError('preset %s: lg_regex is not a string' % name)
+            try:
+                compiled_regex(value, preset.get('lg_regex_ignore_case', True) is True)
+            except re.error as e:
+                raise PresetError('preset %s: lg_regex %r does not compile, %s' % (name, value, e))
+        elif value_type == 'bool':
+            if not isinstance(value, bool):
+                raise PresetError('preset %s: %s is not true or false' % (name, key))
+        elif value_type == 'schema':
+            if value is not None and not isinstance(value, str):
+                raise PresetError('preset %s: schema is not a schema name or null' % name)
+        elif value_type == 'count':
+            ## bool is an int too
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                raise PresetError('preset %s: %s is not a whole number' % (name, key))
+        elif not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            raise PresetError('preset %s: %s is not a list of names' % (name, key))
+    if preset.get('prune_sample_frames') == 0:
+        raise PresetError('preset %s: prune_sample_frames must be 1 or more' % name)
+    return preset
+
+## presets file
+def _file_state(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+def load_presets(path = None):
+    '''Returns {name : preset} of the presets file, {} when there is none. The file is only read again once it changes.'''
+    path = presets_path(path)
+    try:
+        state = _file_state(path)
+    except OSError:
+        return {}
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except ValueError as e:
+        raise PresetError('%s is not valid json, %s' % (path, e))
+    presets = data.get('presets') if isinstance(data, dict) else None
+    if not isinstance(presets, dict):
+        raise PresetError('%s has no "presets" object' % path)
+    for name, preset in presets.items():
+        validate_preset(name, preset)
+    _cache[path] = (state, presets)
+    return presets
+
+def preset_names(path = None):
+    return sorted(load_presets(path), key = str.lower)
+
+def preset_settings(name, path = None, defaults = None):
+    '''Returns a fresh copy of `defaults` (DEFAULT_SETTINGS) with the preset `name` applied'''
+    presets = load_presets(path)
+    if name not in presets:
+        raise PresetError('there is no preset named %s in %s' % (name, presets_path(path)))
+    return settings_from_dict(presets[name], defaults)
+
+def write_presets(presets, path = None):
+    '''Replaces the presets file with `presets`, written to a temporary file first so a failed write loses nothing'''
+    path = presets_path(path)
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump({'presets' : presets}, f, indent = 1, sort_keys = True)
+        f.write('\n')
+    os.replace(temporary, path)
+    _cache[path] = (_file_state(path), presets)
+
+def save_preset(name, settings, path = None):
+    '''Saves breakout `settings` as the preset `name`, replacing any preset of that name'''
+    preset = validate_preset(name, preset_from_settings(settings))
+    presets = dict(load_presets(path))
+    presets[name] = preset
+    write_presets(presets, path)
+
+def delete_preset(name, path = None):
+    presets = dict(load_presets(path))
+    if presets.pop(name, None) is not None:
+        write_presets(presets, path)
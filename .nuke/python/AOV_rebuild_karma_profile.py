@@ -0,0 +1,219 @@
+'''Instrumentation of the rebuild: per phase timers, counts of the nodes and knobs written and an optional capture
+of what the built rebuild costs to render, appended to a json lines log one run at a time.
+
+Off by default, turned on by pointing the AOV_REBUILD_PROFILE environment variable at the log (or with enable()).
+AOV_REBUILD_PROFILE_RENDER set to a frame range ('1001-1003') also renders every rebuild through a temporary
+Write with nuke's performance timers on. While off phase() hands back a shared do-nothing context and count()
+returns straight away, the instrumented code pays a function call per phase.
+
+    AOV_REBUILD_PROFILE=/tmp/aov_rebuild_profile.jsonl nuke
+
+Each run is one line:
+
+    {"operation" : "rebuild", "seconds" : 2.31, "phases" : {"classify" : 0.004, "build" : 0.41, "paste" : 1.8, ...},
+     "counts" : {"nodes_created" : 412, "knob_writes" : 2980, ...}, "context" : {"node" : "Read1", ...}}
+
+Phases nested inside each other are named after both, eg. 'paste.nodePaste'.
+'''
+import collections
+import contextlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+## global Variables
+PROFILE_ENV = 'AOV_REBUILD_PROFILE'
+
+PROFILE_RENDER_ENV = 'AOV_REBUILD_PROFILE_RENDER'
+
+## slowest nodes listed in a render capture
+SLOWEST_NODES = 10
+
+## nuke's performance timers count in microseconds
+MICROSECONDS = 1e-6
+
+_log_path = None
+_render_frames = None
+_run = None
+
+class _NoPhase(object):
+    '''Context handed out by phase() while profiling is off'''
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_PHASE = _NoPhase()
+
+class Run(object):
+    '''Timers and counts of one profiled operation'''
+    def __init__(self, operation, context):
+        self.operation = operation
+        self.context = context
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.phases = collections.OrderedDict()
+        self.phase_stack = []
+        self.counts = collections.Counter()
+        self.render = None
+
+    def to_dict(self):
+        return {'operation' : self.operation,
+                'started' : time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                'seconds' : round(self.seconds, 6) if self.seconds is not None else None,
+                'phases' : {name : round(seconds, 6) for name, seconds in self.phases.items()},
+                'counts' : dict(self.counts),
+                'context' : {key : json_value(value) for key, value in self.context.items()},
+                'render' : self.render}
+
+## configuration
+def parse_frames(text):
+    '''Returns (first, last) of a '1001-1003' or '1001' frame range, None for an empty one'''
+    if not text:
+        return None
+    match = re.match(r'^\s*(-?\d+)(?:\s*-\s*(-?\d+))?\s*$', text)
+    if match is None:
+        raise ValueError('%s is not a frame range' % text)
+    first = int(match.group(1))
+    return first, int(match.group(2)) if match.group(2) else first
+
+def enable(path, render_frames = None):
+    '''Turns profiling on, appending runs to the json lines log at `path`. With `render_frames` (first, last)
+    every rebuild is also rendered over those frames with nuke's performance timers on.'''
+    global _log_path, _render_frames
+    _log_path = path
+    _render_frames = render_frames
+
+def disable():
+    global _log_path, _render_frames
+    _log_path = None
+    _render_frames = None
+
+def enabled():
+    return _log_path is not None
+
+## instrumentation
+@contextlib.contextmanager
+def run(operation, **context):
+    '''Profiles everything inside as one run of `operation`, written to the log at the end. Runs started inside
+    another run (eg. each rebuild of a batch) are part of the outer one. Yields the Run, None while profiling is off.'''
+    global _run
+    if _log_path is None or _run is not None:
+        yield _run
+        return
+    _run = Run(operation, context)
+    try:
+        yield _run
+    finally:
+        current, _run = _run, None
+        current.seconds = time.perf_counter() - current.start
+        write_run(current)
+
+@contextlib.contextmanager
+def _timed(name):
+    current = _run
+    current.phase_stack.append(name)
+    key = '.'.join(current.phase_stack)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.phases[key] = current.phases.get(key, 0.0) + time.perf_counter() - start
+        current.phase_stack.pop()
+
+def phase(name):
+    '''Returns a context timing what runs inside it as the phase `name` of the current run'''
+    if _run is None:
+        return _NO_PHASE
+    return _timed(name)
+
+def count(name, value = 1):
+    '''Adds `value` to the count `name` of the current run'''
+    if _run is None:
+        return
+    _run.counts[name] += value
+
+def annotate(**context):
+    '''Adds entries to the context of the current run'''
+    if _run is None:
+        return
+    _run.context.update(context)
+
+def render_frames():
+    '''Returns the (first, last) frames rebuilds are rendered over when the current run captures render cost, or None'''
+    return _render_frames if _run is not None else None
+
+def set_render(report):
+    if _run is not None:
+        _run.render = report
+
+## output
+def json_value(value):
+    '''Returns `value` in a form json can hold (compiled regexes as their pattern, anything else unknown as text)'''
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, dict):
+        return {str(k) : json_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [json_value(v) for v in value]
+    if hasattr(value, 'pattern'):
+        return value.pattern
+    return str(value)
+
+def write_run(current, path = None):
+    '''Appends `current` to the log as one json line, a log that cannot be written never stops a rebuild'''
+    path = path or _log_path
+    try:
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'a') as f:
+            f.write(json.dumps(current.to_dict(), sort_keys = True) + '\n')
+    except EnvironmentError as e:
+        sys.stderr.write('AOV rebuild profile not written to %s: %s\n' % (path, e))
+
+## render cost
+def capture_render(nodes, end, first, last):
+    '''Renders `end` over `first`-`last` through a temporary Write with nuke's performance timers on and returns
+    the wall time, the engine time of the rebuild `nodes` by class and the slowest of them'''
+    import nuke
+
+    fd, path = tempfile.mkstemp(suffix = '.exr')
+    os.close(fd)
+    write = nuke.nodes.Write(inputs = [end], file = path, file_type = 'exr', channels = 'rgba')
+    was_running = nuke.usingPerformanceTimers()
+    nuke.startPerformanceTimers()
+    nuke.resetPerformanceTimers()
+    try:
+        start = time.perf_counter()
+        nuke.execute(write, first, last)
+        seconds = time.perf_counter() - start
+        engine = {n.fullName() : (n.Class(), n.performanceInfo(nuke.PROFILE_ENGINE)['timeTakenWall'] * MICROSECONDS)
+                  for n in nodes}
+    finally:
+        if not was_running:
+            nuke.stopPerformanceTimers()
+        nuke.delete(write)
+        os.remove(path)
+
+    by_class = collections.Counter()
+    for node_class, node_seconds in engine.values():
+        by_class[node_class] += node_seconds
+    slowest = sorted(engine.items(), key = lambda item: -item[1][1])[:SLOWEST_NODES]
+    return {'frames' : [first, last],
+            'seconds' : round(seconds, 6),
+            'engine_by_class' : {node_class : round(s, 6) for node_class, s in by_class.items()},
+            'slowest' : [[name, round(node_seconds, 6)] for name, (_, node_seconds) in slowest]}
+
+## the environment turns profiling on for the whole session
+if os.environ.get(PROFILE_ENV):
+    try:
+        enable(os.environ[PROFILE_ENV], parse_frames(os.environ.get(PROFILE_RENDER_ENV)))
+    except ValueError as e:
+        sys.stderr.write('%s ignored, %s\n' % (PROFILE_RENDER_ENV, e))
+        enable(os.environ[PROFILE_ENV])
@@ -0,0 +1,629 @@
+'''Reference engine for the rebuild maths, checks a Karma EXR sequence rebuilds back to its beauty without Nuke.
+
+The plus / divide / multiply rebuild of AOV_rebuild_karma_build.breakout_lightgroups_and_materials is run with
+numpy on the raw channels of every frame (the same Unpremult and Merge2 maths as the nodes, in float32) and
+compared against the beauty. Each frame reports the residual of the rebuild, the pixels over the tolerance,
+the negative pixels of every aov and the pixels the unassigned pipe of each pipe takes below 0 (overlapping
+aovs such as 'albedo' and 'albedo_diffuse', see the README known issues).
+
+    python AOV_rebuild_karma_qc.py /render/h21_karma_all_aovs.####.exr --frames 1001-1100
+    python AOV_rebuild_karma_qc.py /render/h21_karma_all_aovs.1001.exr --tolerance 0.001 --json
+
+The same decoding gives the per layer min / max / non-zero statistics used to prune aovs that are black over a shot
+(sequence_empty_layers, see the 'prune_empty' breakout setting) and the pixel bounds the aov branches are cropped
+to (sequence_layer_bounds, see 'crop_to_data'), and the box a Cryptomatte selection covers (sequence_matte_bounds,
+see 'scope_mattes').
+
+Frames are processed a strip of scanlines at a time so memory stays flat whatever the resolution and aov count.
+Uncompressed, ZIPS and ZIP scanline files are decoded natively, any other compression needs the OpenEXR module.
+'''
+import argparse
+import concurrent.futures
+import functools
+import json
+import struct
+import sys
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import OpenEXR
+except ImportError:
+    OpenEXR = None
+
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, REBUILD_PIPES, kept_aovs
+from AOV_rebuild_karma_cryptomatte import matte_ids, rank_layers
+from AOV_rebuild_karma_exr import ExrHeaderError, layer_data_windows, nuke_channel_name, read_exr_header
+from AOV_rebuild_karma_layers import classify_channels_from_settings
+from AOV_rebuild_karma_schema import schema_for_metadata
+from AOV_rebuild_karma_validate import add_classification_arguments, classification_settings, expand_sequence, frame_range_argument
+
+## global Variables
+## largest residual (in any of rgb) a pixel of the rebuild can have and still match the beauty, relative to the
+## beauty above 1. Half float aovs are each rounded on their own so their sum drifts from the beauty as aovs are added.
+## Also how far below 0 (relative to the original) the unassigned pipe has to go for a pixel to count as negative.
+TOLERANCE = 5e-3
+
+## scanlines processed at a time. A strip of 40 aovs at 4K fits in the last level cache, larger strips measured
+## slower (benchmarks/bench_qc.py --strip-rows)
+STRIP_ROWS = 16
+
+BEAUTY_CHANNELS = ('rgba.red', 'rgba.green', 'rgba.blue')
+
+ALPHA_CHANNEL = 'rgba.alpha'
+
+## colour channels of an aov, in the order they are stacked
+AOV_COMPONENTS = ('red', 'green', 'blue')
+
+## scanlines stored in each chunk of a scanline EXR, by compression
+EXR_LINES_PER_CHUNK = {'none' : 1, 'rle' : 1, 'zips' : 1, 'zip' : 16, 'piz' : 32, 'pxr24' : 16,
+                       'b44' : 32, 'b44a' : 32, 'dwaa' : 32, 'dwab' : 256}
+
+## compressions decoded without the OpenEXR module
+NATIVE_COMPRESSIONS = ('none', 'zips', 'zip')
+
+EXR_PIXEL_DTYPES = {'uint' : '<u4', 'half' : '<f2', 'float' : '<f4'}
+
+class ExrPixelError(Exception):
+    '''Raised when the pixels of an EXR cannot be decoded'''
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('AOV_rebuild_karma_qc needs numpy (pip install numpy)')
+
+## pixel decoding
+def _unzip_chunk(data):
+    '''Decompresses a ZIP / ZIPS chunk: inflate, undo the delta predictor and put the two byte halves back together'''
+    deltas = np.frombuffer(zlib.decompress(data), np.uint8).copy()
+    ## each byte is stored as the difference to the one before, plus 128
+    deltas[1:] -= 128
+    predicted = np.cumsum(deltas, dtype = np.uint8)
+    ## the first half holds the even bytes, the second half the odd ones
+    raw = np.empty_like(predicted)
+    half = (len(raw) + 1) // 2
+    raw[0::2] = predicted[:half]
+    raw[1::2] = predicted[half:]
+    return raw
+
+def _iter_scanline_strips(path, header, channels, strip_rows):
+    '''Decodes a single part scanline EXR chunk by chunk, see iter_exr_strips'''
+    part = header['parts'][0]
+    xmin, ymin, xmax, ymax = header['data_window']
+    width = xmax - xmin + 1
+    height = ymax - ymin + 1
+    compression = header['compression']
+    lines_per_chunk = EXR_LINES_PER_CHUNK[compression]
+    chunk_count = (height + lines_per_chunk - 1) // lines_per_chunk
+
+    ## a scanline holds the channels one after the other, in the order of the channel list
+    wanted = set(channels)
+    layout = []
+    row_bytes = 0
+    for exr_channel in part['channels']:
+        dtype = np.dtype(EXR_PIXEL_DTYPES[part['channel_types'][exr_channel]])
+        name = nuke_channel_name(exr_channel)
+        if name in wanted:
+            layout.append((name, row_bytes, dtype))
+        row_bytes += width * dtype.itemsize
+
+    chunks_per_strip = max(1, strip_rows // lines_per_chunk)
+    with open(path, 'rb') as f:
+        ## the offset table lists the chunks top to bottom whatever the line order they were written in
+        f.seek(header['header_size'])
+        table = f.read(8 * chunk_count)
+        if len(table) != 8 * chunk_count:
+            raise ExrPixelError('%s is truncated' % path)
+        offsets = struct.unpack('<%dQ' % chunk_count, table)
+
+        for first_chunk in range(0, chunk_count, chunks_per_strip):
+            decoded = []
+            for chunk in range(first_chunk, min(first_chunk + chunks_per_strip, chunk_count)):
+                f.seek(offsets[chunk])
+                _y, size = struct.unpack('<ii', f.read(8))
+                data = f.read(size)
+                if len(data) != size:
+                    raise ExrPixelError('%s is truncated' % path)
+                rows = min(lines_per_chunk, height - chunk * lines_per_chunk)
+                ## chunks that do not get any smaller are stored uncompressed
+                if compression != 'none' and size < rows * row_bytes:
+                    try:
+                        decoded.append(_unzip_chunk(data))
+                    except zlib.error as e:
+                        raise ExrPixelError('%s: chunk %d is corrupt (%s)' % (path, chunk, e))
+                else:
+                    decoded.append(np.frombuffer(data, np.uint8))
+
+            strip = np.concatenate(decoded)
+            if len(strip) % row_bytes:
+                raise ExrPixelError('%s: chunk %d does not hold whole scanlines' % (path, first_chunk))
+            strip = strip.reshape(-1, row_bytes)
+            planes = {name : strip[:, start:start + width * dtype.itemsize].view(dtype).astype(np.float32)
+                      for name, start, dtype in layout}
+            yield first_chunk * lines_per_chunk, planes
+
+def _iter_openexr_strips(path, header, channels, strip_rows):
+    '''Decodes a whole EXR with the OpenEXR module and hands it out in strips, see iter_exr_strips'''
+    if OpenEXR is None:
+        raise ExrPixelError('%s: %s compressed, tiled or multipart files need the OpenEXR module (pip install OpenEXR)'
+                            % (path, header['compression']))
+    wanted = set(channels)
+    planes = {}
+    with OpenEXR.File(path, separate_channels = True) as exr:
+        for part in exr.parts:
+            for exr_channel, channel in part.channels.items():
+                name = nuke_channel_name(exr_channel)
+                if name in wanted:
+                    planes[name] = np.asarray(channel.pixels, np.float32)
+
+    xmin, ymin, xmax, ymax = header['data_window']
+    for first_row in range(0, ymax - ymin + 1, strip_rows):
+        yield first_row, {name : plane[first_row:first_row + strip_rows] for name, plane in planes.items()}
+
+def iter_exr_strips(path, channels, strip_rows = STRIP_ROWS, header = None):
+    '''Yields (first row, planes) for successive strips of scanlines of the EXR at `path`, planes mapping each
+    of the nuke `channels` (eg. 'C_diffuse.red') found in the file to a float32 array of the strip'''
+    _require_numpy()
+    if header is None:
+        header = read_exr_header(path)
+    if header['deep']:
+        raise ExrPixelError('%s is a deep EXR' % path)
+    if (header['multipart'] or header['parts'][0]['type'] != 'scanlineimage'
+            or header['compression'] not in NATIVE_COMPRESSIONS):
+        return _iter_openexr_strips(path, header, channels, strip_rows)
+    return _iter_scanline_strips(path, header, channels, strip_rows)
+
+## rebuild maths, on float32 planes or (3, rows, columns) stacks of rgb planes
+## the masks of the special cases are only built when a min says they can happen, a min is much cheaper than a mask.
+## `out` takes the result in place of a new array and may be one of the inputs.
+def scratch(buffers, name, shape):
+    '''Returns the float32 array `name` of `buffers` (a dict kept between strips) for `shape`, allocated on first use
+    or when the shape changes, a new array when `buffers` is None'''
+    if buffers is None:
+        return np.empty(shape, np.float32)
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape:
+        buffer = buffers[name] = np.empty(shape, np.float32)
+    return buffer
+
+def inverse_alpha(alpha, out = None):
+    '''Returns what Unpremult multiplies by: 1/alpha, 1 where alpha is 0 (those pixels are left as they are)'''
+    if out is None:
+        out = np.empty(alpha.shape, np.float32)
+    out.fill(1)
+    np.divide(1, alpha, out = out, where = alpha != 0)
+    return out
+
+def unpremult(rgb, inverse, out = None):
+    '''Unpremult: `rgb` multiplied by the inverse_alpha of the alpha'''
+    return np.multiply(rgb, inverse, out = out)
+
+def merge_divide(a, b, out = None):
+    '''Merge2 divide: A/B, 0 where both are negative or B is 0'''
+    b_min = b.min()
+    if b_min > 0:
+        return np.divide(a, b, out = out)
+    where = b > 0 if b_min == 0 else (b > 0) | ((b < 0) & (a >= 0))
+    if out is None:
+        out = np.zeros(a.shape, np.float32)
+        return np.divide(a, b, out = out, where = where)
+    np.divide(a, b, out = out, where = where)
+    np.copyto(out, 0, where = ~where)
+    return out
+
+def merge_multiply(a, b, out = None):
+    '''Merge2 multiply: A*B, A where both are negative'''
+    both_negative = (a < 0) & (b < 0) if a.min() < 0 and b.min() < 0 else None
+    out = np.multiply(a, b, out = out)
+    if both_negative is not None:
+        np.copyto(out, a, where = both_negative)
+    return out
+
+def rebuild_pipes(layer_index, settings = DEFAULT_SETTINGS):
+    '''Returns (pipe, plussed aovs, aovs) for the pipes a rebuild of `layer_index` divides and multiplies
+    into the bpipe, in order, or None when breakout_lightgroups_and_materials builds no rebuild'''
+    materials = layer_index['materials']
+    lightgroups = layer_index['lightgroups']
+    if not settings['breakout_materials'] and not settings['breakout_lightgroups'] and settings.get('breakout_utilities', False):
+        return None
+    if not materials and not lightgroups and layer_index['utilities']:
+        return None
+
+    pipes = []
+    materials = kept_aovs(materials, settings)
+    lightgroups = kept_aovs(lightgroups, settings)
+    if settings['breakout_materials']:
+        plussed = [aov for aov in materials if aov not in layer_index['bpipe_skip']]
+        pipes.append((REBUILD_PIPES[0], plussed, materials))
+    if settings['breakout_lightgroups'] and lightgroups:
+        pipes.append((REBUILD_PIPES[1], lightgroups, lightgroups))
+    return pipes
+
+def pipe_channels(pipes):
+    '''Returns the channels a rebuild of `pipes` reads: the beauty and the colour of every aov'''
+    channels = list(BEAUTY_CHANNELS) + [ALPHA_CHANNEL]
+    for _pipe, _plussed, aovs in pipes:
+        channels.extend('%s.%s' % (aov, component) for aov in aovs for component in AOV_COMPONENTS)
+    return channels
+
+def sum_aovs(planes, aovs, shape, negative_pixels = None, out = None):
+    '''Returns the rgb of `aovs` summed into a (3, rows, columns) stack (`out` when given), missing channels count
+    as black. The pixels of each aov with a negative component are counted into `negative_pixels`.'''
+    total = out if out is not None else np.empty((3,) + shape, np.float32)
+    total.fill(0)
+    for aov in aovs:
+        aov_planes = []
+        negative = False
+        for i, component in enumerate(AOV_COMPONENTS):
+            plane = planes.get('%s.%s' % (aov, component))
+            if plane is None:
+                continue
+            np.add(total[i], plane, out = total[i])
+            if negative_pixels is not None:
+                ## most aovs never go below 0, checked while the plane is still in cache
+                negative = negative or plane.min() < 0
+                aov_planes.append(plane)
+        if negative_pixels is None:
+            continue
+        count = int(np.count_nonzero(functools.reduce(np.minimum, aov_planes) < 0)) if negative else 0
+        negative_pixels[aov] = negative_pixels.get(aov, 0) + count
+    return total
+
+def rebuild_planes(planes, pipes, buffers = None):
+    '''Runs the rebuild of breakout_lightgroups_and_materials on channel `planes` (nuke channel name to 2d array).
+
+    `pipes` comes from rebuild_pipes. Returns the beauty, the original (unpremultiplied beauty), the rebuilt rgb
+    and its per pixel residual against the beauty as (3, rows, columns) stacks, the result of the unassigned pipe
+    of every pipe and the negative pixel count of every aov. Each aov is unpremultiplied on its own in the node graph,
+    here the aovs are summed first and unpremultiplied once. With `buffers` (see scratch) the arrays are reused from
+    one call to the next, the results only hold until the next call.'''
+    _require_numpy()
+    alpha = planes.get(ALPHA_CHANNEL)
+    if alpha is None:
+        alpha = np.zeros(planes[BEAUTY_CHANNELS[0]].shape, np.float32)
+    shape = alpha.shape
+    stack = (3,) + shape
+    inverse = inverse_alpha(alpha, scratch(buffers, 'inverse', shape))
+    beauty = scratch(buffers, 'beauty', stack)
+    for i, channel in enumerate(BEAUTY_CHANNELS):
+        plane = planes.get(channel)
+        beauty[i] = plane if plane is not None else 0
+    ## the 'original' layer, a copy of the beauty unpremultiplied by unpremult_original
+    original = unpremult(beauty, inverse, scratch(buffers, 'original', stack))
+
+    ## the main pipe carries the beauty rgb down to the final Premult
+    result = beauty
+    unassigned = {}
+    negative_pixels = {}
+    for pipe, plussed, aovs in pipes:
+        bpipe = scratch(buffers, 'bpipe', stack)
+        unpremult(sum_aovs(planes, plussed, shape, negative_pixels, bpipe), inverse, bpipe)
+        ## the unassigned pipe takes every aov off the original, plussed or not (its merge into the bpipe is disabled)
+        unassigned[pipe] = np.subtract(original, bpipe, out = scratch(buffers, 'unassigned_' + pipe, stack))
+        skipped = [aov for aov in aovs if aov not in plussed]
+        if skipped:
+            skipped_sum = scratch(buffers, 'skipped', stack)
+            unpremult(sum_aovs(planes, skipped, shape, negative_pixels, skipped_sum), inverse, skipped_sum)
+            np.subtract(unassigned[pipe], skipped_sum, out = unassigned[pipe])
+        ## with no aov plussed there is no Remove, the bpipe keeps the beauty rgb
+        ## the Merge2 divide takes the pipe as A over the original as B, bpipe / original multiplied onto the main pipe
+        divided = merge_divide(bpipe if plussed else beauty, original, bpipe)
+        result = merge_multiply(divided, result, scratch(buffers, 'rebuilt', stack))
+
+    rebuilt = np.multiply(result, alpha, out = scratch(buffers, 'rebuilt', stack))
+    return {'beauty' : beauty,
+            'original' : original,
+            'rebuilt' : rebuilt,
+            'residual' : np.subtract(rebuilt, beauty, out = scratch(buffers, 'residual', stack)),
+            'unassigned' : unassigned,
+            'negative_pixels' : negative_pixels}
+
+## layer statistics
+def layer_stats(path, layers = None, strip_rows = STRIP_ROWS):
+    '''Returns {layer : {'min' : value, 'max' : value, 'nonzero' : pixels, 'bounds' : box}} for the `layers` of the EXR
+    at `path` (every layer when None), 'nonzero' counting the pixels where any channel of the layer is not 0 and
+    'bounds' the inclusive (xmin, ymin, xmax, ymax) exr pixel box around them, None for a black layer'''
+    header = read_exr_header(path)
+    by_layer = {}
+    for channel in (nuke_channel_name(c) for c in header['channels']):
+        layer = channel.split('.')[0]
+        if layers is None or layer in layers:
+            by_layer.setdefault(layer, []).append(channel)
+
+    stats = {layer : {'min' : None, 'max' : None, 'nonzero' : 0, 'bounds' : None} for layer in by_layer}
+    wanted = [channel for channels in by_layer.values() for channel in channels]
+    xmin, ymin = header['data_window'][:2]
+    for first_row, planes in iter_exr_strips(path, wanted, strip_rows, header):
+        for layer, channels in by_layer.items():
+            layer_planes = [planes[c] for c in channels if c in planes]
+            if not layer_planes:
+                continue
+            layer_stat = stats[layer]
+            low = min(float(plane.min()) for plane in layer_planes)
+            high = max(float(plane.max()) for plane in layer_planes)
+            layer_stat['min'] = low if layer_stat['min'] is None else min(layer_stat['min'], low)
+            layer_stat['max'] = high if layer_stat['max'] is None else max(layer_stat['max'], high)
+            ## black strips, the common case for an empty aov, need no mask
+            if low != 0 or high != 0:
+                mask = functools.reduce(np.logical_or, [plane != 0 for plane in layer_planes])
+                layer_stat['nonzero'] += int(np.count_nonzero(mask))
+                rows = np.flatnonzero(mask.any(axis = 1))
+                columns = np.flatnonzero(mask.any(axis = 0))
+                layer_stat['bounds'] = union_bounds(layer_stat['bounds'],
+                                                    (xmin + int(columns[0]), ymin + first_row + int(rows[0]),
+                                                     xmin + int(columns[-1]), ymin + first_row + int(rows[-1])))
+    return stats
+
+def union_bounds(a, b):
+    '''Returns the box around the inclusive pixel boxes `a` and `b`, either of which can be None'''
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def bounds_cover(a, b):
+    '''Returns True when the inclusive pixel box `a` holds all of `b`'''
+    return a[0] <= b[0] and a[1] <= b[1] and a[2] >= b[2] and a[3] >= b[3]
+
+def sample_frames(items, count = None):
+    '''Returns `count` of `items` spread evenly from the first to the last, all of them when count is None or 0'''
+    items = list(items)
+    if not count or count >= len(items):
+        return items
+    if count == 1:
+        return items[:1]
+    return [items[int(round(i * (len(items) - 1) / float(count - 1)))] for i in range(count)]
+
+def sequence_empty_layers(pattern, frames = None, layers = None, samples = None, progress = None):
+    '''Returns the `layers` of `pattern` (every layer when None) that are black in every frame.
+    `samples` frames spread over the sequence are scanned first, so most layers are ruled out in a few frames, and the
+    layers black on all of them are then confirmed on every other frame. Each frame only reads the layers still empty.
+    `progress` is called with (path, frames done, frames to scan) before each frame is read.'''
+    _require_numpy()
+    paths = [path for _, path in expand_sequence(pattern, frames)]
+    sampled = sample_frames(paths, samples)
+    sampled_set = set(sampled)
+    paths = sampled + [path for path in paths if path not in sampled_set]
+    empty = None
+    for done, path in enumerate(paths):
+        if progress is not None:
+            progress(path, done, len(paths))
+        stats = layer_stats(path, layers if empty is None else empty)
+        black = {layer for layer, layer_stat in stats.items() if not layer_stat['nonzero']}
+        empty = black if empty is None else empty & black
+        if not empty:
+            break
+    return sorted(empty or ())
+
+def sequence_layer_bounds(pattern, frames = None, layers = None, progress = None):
+    '''Returns ({layer : bounds}, display window) for the `layers` of `pattern` (every layer when None) over every frame,
+    bounds being the inclusive exr pixel box holding every non-zero pixel of the layer on any frame, None when it is
+    black throughout. Without numpy the pixels are not read and each layer gets the data window of its part.
+    `progress` is called with (path, frames done, frames to scan) before each frame is read.'''
+    bounds = {}
+    display_window = None
+    paths = [path for _, path in expand_sequence(pattern, frames)]
+    for done, path in enumerate(paths):
+        if progress is not None:
+            progress(path, done, len(paths))
+        header = read_exr_header(path)
+        display_window = display_window or header['display_window']
+        if np is None:
+            found = {layer : window for layer, window in layer_data_windows(header).items() if layers is None or layer in layers}
+        else:
+            found = {layer : layer_stat['bounds'] for layer, layer_stat in layer_stats(path, layers).items()}
+        for layer, box in found.items():
+            bounds[layer] = union_bounds(bounds.get(layer), box)
+    return bounds, display_window
+
+def matte_bounds(path, layer, ids, strip_rows = STRIP_ROWS, header = None):
+    '''Returns the inclusive exr pixel box around the pixels of the EXR at `path` whose Cryptomatte `layer` holds any
+    of the float `ids` with some coverage, None when no pixel does'''
+    _require_numpy()
+    header = header or read_exr_header(path)
+    channels = {nuke_channel_name(c) for c in header['channels']}
+    ## two ids per rank, in red / blue, with their coverage in green / alpha
+    pairs = [('%s.%s' % (rank, id_component), '%s.%s' % (rank, coverage_component))
+             for rank in rank_layers({channel.split('.')[0] for channel in channels}, layer)
+             for id_component, coverage_component in (('red', 'green'), ('blue', 'alpha'))]
+    pairs = [pair for pair in pairs if pair[0] in channels and pair[1] in channels]
+    if not pairs:
+        raise ExrPixelError('%s has no %s Cryptomatte layers' % (path, layer))
+
+    ids = np.array(ids, np.float32)
+    bounds = None
+    xmin, ymin = header['data_window'][:2]
+    for first_row, planes in iter_exr_strips(path, [c for pair in pairs for c in pair], strip_rows, header):
+        mask = functools.reduce(np.logical_or, [np.isin(planes[id_channel], ids) & (planes[coverage_channel] > 0)
+                                                for id_channel, coverage_channel in pairs])
+        if not mask.any():
+            continue
+        rows = np.flatnonzero(mask.any(axis = 1))
+        columns = np.flatnonzero(mask.any(axis = 0))
+        bounds = union_bounds(bounds, (xmin + int(columns[0]), ymin + first_row + int(rows[0]),
+                                       xmin + int(columns[-1]), ymin + first_row + int(rows[-1])))
+    return bounds
+
+def sequence_matte_bounds(pattern, frames = None, layer = None, names = (), progress = None):
+    '''Returns (bounds, display window) of the Cryptomatte selection `names` of `layer` over every frame of `pattern`,
+    bounds being the inclusive exr pixel box holding the selection on any frame, None when it is on none.
+    `progress` is called with (path, frames done, frames to scan) before each frame is read.'''
+    _require_numpy()
+    bounds = None
+    display_window = None
+    paths = [path for _, path in expand_sequence(pattern, frames)]
+    for done, path in enumerate(paths):
+        if progress is not None:
+            progress(path, done, len(paths))
+        header = read_exr_header(path)
+        display_window = display_window or header['display_window']
+        ids = matte_ids(header['metadata'], layer, names)
+        bounds = union_bounds(bounds, matte_bounds(path, layer, ids, header = header))
+    return bounds, display_window
+
+## frame QC
+class FrameQC(object):
+    '''Accumulates the QC of a frame rebuilt one strip of scanlines at a time'''
+    def __init__(self, pipes, tolerance = TOLERANCE, origin = (0, 0)):
+        self.pipes = pipes
+        self.tolerance = tolerance
+        self.origin = origin
+        self.pixels = 0
+        self.residual_max = 0.0
+        self.residual_max_pixel = None
+        self.residual_sum = 0.0
+        self.residual_sum_squares = 0.0
+        self.pixels_over_tolerance = 0
+        self.negative_pixels = {}
+        self.unassigned_negative_pixels = {pipe : 0 for pipe, _, _ in pipes}
+        self.unassigned_min = {pipe : 0.0 for pipe, _, _ in pipes}
+        ## arrays reused from strip to strip, see scratch
+        self.buffers = {}
+
+    def add(self, planes, first_row):
+        '''Rebuilds one strip starting at scanline `first_row` of the data window and adds it to the totals'''
+        result = rebuild_planes(planes, self.pipes, self.buffers)
+        residual = result['residual']
+        self.residual_sum_squares += float(np.vdot(residual, residual))
+        ## the worst channel of each pixel
+        np.abs(residual, out = residual)
+        pixel_residual = np.maximum(residual[0], residual[1], out = scratch(self.buffers, 'pixel_residual', residual.shape[1:]))
+        np.maximum(pixel_residual, residual[2], out = pixel_residual)
+
+        strip_max = float(pixel_residual.max())
+        if strip_max > self.residual_max:
+            row, column = divmod(int(np.argmax(pixel_residual)), pixel_residual.shape[1])
+            self.residual_max = strip_max
+            self.residual_max_pixel = (self.origin[0] + column, self.origin[1] + first_row + row)
+        self.residual_sum += float(pixel_residual.sum())
+        self.pixels += pixel_residual.size
+        ## the tolerance only grows with the pixel value, a strip within it needs no per pixel test
+        if strip_max > self.tolerance:
+            allowed = self.tolerance * np.maximum(np.abs(result['beauty']), 1).max(axis = 0)
+            self.pixels_over_tolerance += int(np.count_nonzero(pixel_residual > allowed))
+
+        for aov, count in result['negative_pixels'].items():
+            self.negative_pixels[aov] = self.negative_pixels.get(aov, 0) + count
+        for pipe, unassigned in result['unassigned'].items():
+            strip_min = float(unassigned.min())
+            self.unassigned_min[pipe] = min(self.unassigned_min[pipe], strip_min)
+            if strip_min < -self.tolerance:
+                allowed = self.tolerance * np.maximum(np.abs(result['original']), 1).max(axis = 0)
+                self.unassigned_negative_pixels[pipe] += int(np.count_nonzero(unassigned.min(axis = 0) < -allowed))
+
+    def report(self):
+        '''Returns the QC of the frame as a json friendly dictionary'''
+        pixels = max(self.pixels, 1)
+        return {'pixels' : self.pixels,
+                'residual_max' : self.residual_max,
+                'residual_max_pixel' : self.residual_max_pixel,
+                'residual_mean' : self.residual_sum / pixels,
+                'residual_rms' : (self.residual_sum_squares / (3 * pixels)) ** 0.5,
+                'pixels_over_tolerance' : self.pixels_over_tolerance,
+                'match' : self.pixels_over_tolerance == 0,
+                'negative_pixels' : {aov : count for aov, count in self.negative_pixels.items() if count},
+                'unassigned_negative_pixels' : self.unassigned_negative_pixels,
+                'unassigned_min' : self.unassigned_min}
+
+def qc_frame(path, settings = DEFAULT_SETTINGS, tolerance = TOLERANCE, strip_rows = STRIP_ROWS):
+    '''Rebuilds one frame and returns its QC report, or an error string if the frame cannot be read or rebuilt'''
+    try:
+        header = read_exr_header(path)
+        layer_index = classify_channels_from_settings([nuke_channel_name(c) for c in header['channels']], settings,
+                                                      schema_for_metadata(header['metadata']))
+        pipes = rebuild_pipes(layer_index, settings)
+        if pipes is None:
+            return {'path' : path, 'error' : 'no materials or lightgroups to rebuild'}
+        qc = FrameQC(pipes, tolerance, header['data_window'][:2])
+        for first_row, planes in iter_exr_strips(path, pipe_channels(pipes), strip_rows, header):
+            qc.add(planes, first_row)
+    except (OSError, ExrHeaderError, ExrPixelError) as e:
+        return {'path' : path, 'error' : str(e)}
+    report = qc.report()
+    report['path'] = path
+    report['error'] = None
+    return report
+
+def qc_sequence(pattern, frames = None, settings = DEFAULT_SETTINGS, tolerance = TOLERANCE, workers = None):
+    '''Rebuilds every frame of `pattern` on a process pool and returns a report holding the QC of each frame,
+    the frames whose rebuild does not match the beauty and the frames that could not be read'''
+    _require_numpy()
+    sequence = expand_sequence(pattern, frames)
+    paths = [path for _, path in sequence]
+
+    check = functools.partial(qc_frame, settings = settings, tolerance = tolerance)
+    if workers == 1 or len(paths) < 2:
+        checked = list(map(check, paths))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+            checked = list(pool.map(check, paths))
+
+    results = []
+    for (frame, _), result in zip(sequence, checked):
+        result['frame'] = frame
+        results.append(result)
+
+    return {'pattern' : pattern,
+            'frame_count' : len(sequence),
+            'tolerance' : tolerance,
+            'frames' : [result for result in results if not result['error']],
+            'mismatched' : [result['frame'] for result in results if not result['error'] and not result['match']],
+            'unreadable' : [{'frame' : result['frame'], 'path' : result['path'], 'error' : result['error']}
+                            for result in results if result['error']]}
+
+def format_report(report):
+    '''Returns a human readable summary of a qc_sequence report'''
+    lines = ['%s: %d frames, %d match the beauty within %g'
+             % (report['pattern'], report['frame_count'], len(report['frames']) - len(report['mismatched']), report['tolerance'])]
+    for result in report['frames']:
+        lines.append('frame %s %s max %.6f at %s, rms %.6f, %d pixels over tolerance'
+                     % (result['frame'], 'ok ' if result['match'] else 'BAD', result['residual_max'],
+                        result['residual_max_pixel'], result['residual_rms'], result['pixels_over_tolerance']))
+        for pipe, count in sorted(result['unassigned_negative_pixels'].items()):
+            if count:
+                lines.append('  unassigned %s pipe negative in %d pixels (min %.6f)' % (pipe, count, result['unassigned_min'][pipe]))
+        if result['negative_pixels']:
+            lines.append('  negative aov pixels: %s' % ', '.join('%s %d' % (aov, count) for aov, count in sorted(result['negative_pixels'].items())))
+    for frame in report['unreadable']:
+        lines.append('frame %s unreadable: %s' % (frame['frame'], frame['error']))
+    if not report['mismatched'] and not report['unreadable']:
+        lines.append('rebuild QC OK')
+    return '\n'.join(lines)
+
+## command line
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Check a Karma EXR sequence rebuilds back to its beauty.')
+    parser.add_argument('pattern', help = "sequence path using '####', '%%04d' or the path of any frame")
+    parser.add_argument('--frames', type = frame_range_argument,
+                        help = "frame range, eg. '1001-1100' (default: every frame on disk)")
+    parser.add_argument('--workers', type = int, default = None, help = 'worker processes (default: cpu count)')
+    parser.add_argument('--tolerance', type = float, default = TOLERANCE, help = 'largest residual allowed, relative to the beauty above 1 (default: %g)' % TOLERANCE)
+    parser.add_argument('--no-materials', action = 'store_true', help = 'rebuild without the materials pipe')
+    parser.add_argument('--no-lightgroups', action = 'store_true', help = 'rebuild without the lightgroups pipe')
+    add_classification_arguments(parser)
+    parser.add_argument('--json', action = 'store_true', help = 'print the report as json')
+    args = parser.parse_args(argv)
+    if np is None:
+        parser.error('numpy is required (pip install numpy)')
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(classification_settings(args))
+    settings['breakout_materials'] = not args.no_materials
+    settings['breakout_lightgroups'] = not args.no_lightgroups
+
+    report = qc_sequence(args.pattern, args.frames, settings, args.tolerance, args.workers)
+    if args.json:
+        print(json.dumps(report, indent = 2))
+    else:
+        print(format_report(report))
+
+    if report['frame_count'] == 0:
+        return 2
+    return 1 if report['mismatched'] or report['unreadable'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
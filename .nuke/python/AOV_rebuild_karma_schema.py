@@ -0,0 +1,146 @@
+'''Karma AOV schemas, one per Houdini version: which AOVs are materials and utilities, how lightgroups are named,
+which combined AOVs are the sum of a direct and an indirect one, which AOVs hold the same light under different names
+and which AOVs are broken out but kept out of the B pipe.
+
+A schema definition is compiled once into a Schema of plain dicts and sets, so the rebuild answers every per AOV
+question with a lookup. AOVs a schema does not list (custom render vars) fall back to the naming rules and the answer
+is kept, eg. 'combinedcoat' is the sum of 'directcoat' and 'indirectcoat' and anything named albedo stays out of
+the B pipe.
+
+The schema of a render is picked from the Houdini / Karma version in its EXR metadata (schema_for_metadata), renders
+without one get DEFAULT_SCHEMA.
+'''
+import re
+
+## global Variables
+SCHEMA_DEFINITIONS = {
+    'karma_h21' : {
+        'houdini_version' : 21,
+        'lightgroup_regex' : r'^(?:[a-z0-9]+_)?(li?g?h?t?s?)(?:_[a-z0-9]+)*$',
+        'materials' : [
+            'albedo', 'albedodiffuse', 'combineddiffuse', 'directdiffuse', 'indirectdiffuse', 'sss',
+            'combinedglossyreflection', 'directglossyreflection', 'indirectglossyreflection', 'coat',
+            'glossytransmission', 'caustics', 'refract',
+            'combinedemission', 'directemission', 'indirectemission',
+            'combinedvolume', 'directvolume', 'indirectvolume',
+            #'shadow', 'combineddiffuseshadow', 'directdiffuseshadow', 'indirectdiffuseshadow',
+            #'beautyunshadowed', 'combineddiffuseunshadowed', 'directdiffuseunshadowed', 'indirectdiffuseunshadowed',
+            'ao',],
+        'utilities' : ['alpha', 'depth_extra', 'P', 'P_camera', 'pRef', 'N', 'Ng', 'motionvectors', 'velocity', 'uv_extra',
+                       'Facingratio_N', 'Facingratio_Ng', 'indirectraycount', 'primarysamples', 'cputime', 'oraclevariance',],
+        ## combined = direct + indirect
+        'components' : {'combineddiffuse' : ('directdiffuse', 'indirectdiffuse'),
+                        'combinedglossyreflection' : ('directglossyreflection', 'indirectglossyreflection'),
+                        'combinedemission' : ('directemission', 'indirectemission'),
+                        'combinedvolume' : ('directvolume', 'indirectvolume')},
+        ## names the same light is written under, subtracting more than one breaks the unassigned pipe
+        'overlaps' : [('albedo', 'albedodiffuse', 'albedo_diffuse')],
+        ## broken out, not plussed into the B pipe, by reason (see AOV_rebuild_karma_build.bpipe_skip_label)
+        'bpipe_excluded' : {'ao' : 'ao', 'albedo' : 'albedo', 'albedodiffuse' : 'albedo'}},
+}
+
+DEFAULT_SCHEMA = 'karma_h21'
+
+## Houdini / Karma version in the EXR metadata, eg. 'software' : 'Houdini Karma 21.0.440' or 'exr/HoudiniVersion' : '21.0.440'
+VERSION_REGEX = re.compile(r'(?:houdini|karma|husk)\D{0,24}?(\d+)\.\d+', re.IGNORECASE)
+
+_schemas = {}
+
+class Schema(object):
+    '''A schema definition compiled into the lookups the rebuild uses, aov names lowercase'''
+    def __init__(self, name, definition):
+        self.name = name
+        self.houdini_version = definition['houdini_version']
+        self.lightgroup_regex = re.compile(definition['lightgroup_regex'], re.IGNORECASE)
+        self.materials = tuple(definition['materials'])
+        self.utilities = tuple(definition['utilities'])
+        ## aov > 'material' or 'utility'
+        self.roles = {aov.lower() : 'utility' for aov in self.utilities}
+        self.roles.update((aov.lower(), 'material') for aov in self.materials)
+        ## combined aov > (direct aov, indirect aov), None for aovs that are not a sum, filled in as aovs are asked about
+        self.components = {combined : tuple(parts) for combined, parts in definition['components'].items()}
+        ## aov > every name of the same light
+        self.overlaps = {}
+        for group in definition['overlaps']:
+            names = frozenset(aov.lower() for aov in group)
+            for aov in names:
+                self.overlaps[aov] = names
+        ## aov > why it is not plussed into the B pipe, None when it is, filled in as aovs are asked about
+        self.bpipe_excluded = dict(definition['bpipe_excluded'])
+
+    def __repr__(self):
+        return '<Schema %s>' % self.name
+
+    def components_of(self, aov_lower):
+        '''Returns the (direct, indirect) aovs `aov_lower` is the sum of, or None'''
+        try:
+            return self.components[aov_lower]
+        except KeyError:
+            parts = None
+            if aov_lower.startswith('combined'):
+                suffix = aov_lower[len('combined'):]  ## eg. 'diffuse', 'volume', etc
+                parts = ('direct' + suffix, 'indirect' + suffix)
+            self.components[aov_lower] = parts
+            return parts
+
+    def excluded_reason(self, aov_lower):
+        '''Returns why `aov_lower` is never plussed into the B pipe ('ao' or 'albedo'), or None'''
+        try:
+            return self.bpipe_excluded[aov_lower]
+        except KeyError:
+            reason = 'albedo' if 'albedo' in aov_lower else None
+            self.bpipe_excluded[aov_lower] = reason
+            return reason
+
+    def bpipe_skip_reason(self, aov, materials_lower):
+        '''Returns why a material aov of a stream holding `materials_lower` is broken out but not plussed into the
+        B pipe ('combined', 'ao' or 'albedo'), or None'''
+        aov_lower = aov.lower()
+        parts = self.components_of(aov_lower)
+        if parts is not None and parts[0] in materials_lower and parts[1] in materials_lower:
+            return 'combined'
+        return self.excluded_reason(aov_lower)
+
+    def overlapping(self, materials_lower):
+        '''Returns the groups of more than one aov of `materials_lower` holding the same light, as sorted lists'''
+        groups = {}
+        for aov in materials_lower:
+            names = self.overlaps.get(aov)
+            if names is not None:
+                groups.setdefault(names, []).append(aov)
+        return sorted(sorted(found) for found in groups.values() if len(found) > 1)
+
+## registry
+def register_schema(name, definition):
+    '''Adds (or replaces) the schema `name`, eg. a studio's own render vars or a new Houdini version'''
+    SCHEMA_DEFINITIONS[name] = definition
+    _schemas.pop(name, None)
+
+def get_schema(name = None):
+    '''Returns the Schema `name` (DEFAULT_SCHEMA), compiled the first time it is asked for'''
+    name = name or DEFAULT_SCHEMA
+    schema = _schemas.get(name)
+    if schema is None:
+        if name not in SCHEMA_DEFINITIONS:
+            raise KeyError('no AOV schema named %r, known schemas: %s' % (name, ', '.join(sorted(SCHEMA_DEFINITIONS))))
+        schema = _schemas[name] = Schema(name, SCHEMA_DEFINITIONS[name])
+    return schema
+
+def houdini_version(metadata):
+    '''Returns the Houdini major version the render with string `metadata` (EXR header or nuke metadata) came from, or None'''
+    for key, value in metadata.items():
+        if not isinstance(value, str):
+            continue
+        match = VERSION_REGEX.search(value) or VERSION_REGEX.search('%s %s' % (key, value))
+        if match:
+            return int(match.group(1))
+    return None
+
+def schema_for_metadata(metadata):
+    '''Returns the name of the schema of the Houdini version in `metadata`, DEFAULT_SCHEMA when it has none or
+    no schema is registered for it'''
+    version = houdini_version(metadata or {})
+    for name, definition in SCHEMA_DEFINITIONS.items():
+        if definition['houdini_version'] == version:
+            return name
+    return DEFAULT_SCHEMA
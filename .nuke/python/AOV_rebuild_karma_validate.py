@@ -0,0 +1,218 @@
+'''Checks the AOV contract of a Karma EXR sequence without Nuke.
+
+Every frame's header is scanned on a process pool and its layers are classified with the same
+MATERIAL_AOVS, UTILITY_AOVS and LIGHTGROUP_REGEX rules as AOV_rebuild_karma. Frames whose AOV set
+differs from the majority of the sequence are reported, with any AOVs the schema of the render
+(see AOV_rebuild_karma_schema) knows to hold the same light under different names.
+
+    python AOV_rebuild_karma_validate.py /render/h21_karma_all_aovs.####.exr
+    python AOV_rebuild_karma_validate.py /render/h21_karma_all_aovs.%04d.exr --frames 1001-1100 --json
+'''
+import argparse
+import collections
+import concurrent.futures
+import functools
+import glob
+import json
+import math
+import os
+import re
+import sys
+
+from AOV_rebuild_karma_exr import ExrHeaderError, scan_exr_layers
+from AOV_rebuild_karma_layers import LIGHTGROUP_REGEX, ADDITIONAL_LIGHTING_AOVS, MATERIAL_AOVS, UTILITY_AOVS
+from AOV_rebuild_karma_schema import SCHEMA_DEFINITIONS
+
+## global Variables
+AOV_BUCKETS = ('materials', 'lightgroups', 'utilities', 'unknown')
+
+## most frames handed to a worker at a time, headers are tiny so batching saves round trips to the pool
+FRAMES_PER_TASK = 64
+
+## tasks each worker gets at least, so a short sequence is still spread over every worker
+TASKS_PER_WORKER = 4
+
+## sequence helper functions
+def _split_sequence_pattern(pattern):
+    '''Returns (head, padding, tail) for a '####', '%04d' or numbered single frame path'''
+    match = re.search(r'(#+|%0?(\d*)d)', pattern)
+    if match:
+        padding = len(match.group(1)) if match.group(1).startswith('#') else int(match.group(2) or 1)
+        return pattern[:match.start()], padding, pattern[match.end():]
+    ## a path to a single frame of the sequence (eg. '/render/h21_karma_all_aovs.0001.exr')
+    match = re.search(r'(\d+)(\.[^./\\]+)$', pattern)
+    if match:
+        return pattern[:match.start(1)], len(match.group(1)), pattern[match.start(2):]
+    return None
+
+def parse_frame_range(frame_range):
+    '''Converts '1001-1100' or '1001' to a list of frame numbers, raises ValueError for anything else'''
+    match = re.match(r'^(-?\d+)(?:-(-?\d+))?$', frame_range.strip())
+    if match is None:
+        raise ValueError("frame range '%s' is not 'first-last' or a single frame" % frame_range)
+    first, last = match.groups()
+    if last is not None and int(last) < int(first):
+        raise ValueError("frame range '%s' ends before it starts" % frame_range)
+    return list(range(int(first), int(last if last is not None else first) + 1))
+
+def frame_range_argument(frame_range):
+    '''parse_frame_range as an argparse type'''
+    try:
+        return parse_frame_range(frame_range)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def frames_per_task(frame_count, workers = None):
+    '''Returns the pool chunksize spreading `frame_count` frames over `workers` processes, at most FRAMES_PER_TASK'''
+    workers = workers or os.cpu_count() or 1
+    return max(1, min(FRAMES_PER_TASK, math.ceil(frame_count / (workers * TASKS_PER_WORKER))))
+
+def expand_sequence(pattern, frames = None):
+    '''Returns a sorted list of (frame, path) tuples for every frame of `pattern` on disk,
+    or for every frame in `frames` when a frame list is given'''
+    split = _split_sequence_pattern(pattern)
+    if split is None:
+        return [(None, pattern)]
+    head, padding, tail = split
+
+    if frames is not None:
+        return [(f, '%s%0*d%s' % (head, padding, f, tail)) for f in frames]
+
+    sequence = []
+    frame_regex = re.compile(r'^' + re.escape(head) + r'(-?\d+)' + re.escape(tail) + r'$')
+    for path in glob.glob(glob.escape(head) + '*' + glob.escape(tail)):
+        match = frame_regex.match(path)
+        if match:
+            sequence.append((int(match.group(1)), path))
+    sequence.sort()
+    return sequence
+
+## validation
+def scan_frame(path, settings = None):
+    '''Returns the classified AOV buckets for one frame, or an error string if the frame cannot be read'''
+    try:
+        index = scan_exr_layers(path, settings)['layer_index']
+    except (OSError, ExrHeaderError) as e:
+        return {'path' : path, 'error' : str(e)}
+    frame = {'path' : path, 'error' : None, 'schema' : index['schema'], 'overlaps' : index['overlaps']}
+    for bucket in AOV_BUCKETS:
+        frame[bucket] = list(index[bucket])
+    return frame
+
+def _aov_signature(frame):
+    '''Returns a hashable signature of the AOV set of a scanned frame'''
+    return tuple(tuple(sorted(frame[bucket])) for bucket in AOV_BUCKETS)
+
+def validate_sequence(pattern, frames = None, settings = None, workers = None):
+    '''Scans every frame of `pattern` on a process pool and compares each frame's AOV set against the majority.
+
+    Returns a report dictionary holding the majority AOV set, the frames that differ from it with their
+    missing and extra AOVs per bucket, and the frames that could not be read.'''
+    sequence = expand_sequence(pattern, frames)
+    paths = [path for _, path in sequence]
+
+    scan = functools.partial(scan_frame, settings = settings)
+    if workers == 1 or len(paths) < 2:
+        scanned = list(map(scan, paths))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+            scanned = list(pool.map(scan, paths, chunksize = frames_per_task(len(paths), workers)))
+
+    readable = [(frame, result) for (frame, _), result in zip(sequence, scanned) if not result['error']]
+    unreadable = [{'frame' : frame, 'path' : result['path'], 'error' : result['error']}
+                  for (frame, _), result in zip(sequence, scanned) if result['error']]
+
+    signatures = collections.Counter(_aov_signature(result) for _, result in readable)
+    majority = signatures.most_common(1)[0][0] if signatures else tuple(() for _ in AOV_BUCKETS)
+    majority_sets = dict(zip(AOV_BUCKETS, (set(aovs) for aovs in majority)))
+
+    inconsistent = []
+    for frame, result in readable:
+        if _aov_signature(result) == majority:
+            continue
+        difference = {'frame' : frame, 'path' : result['path'], 'missing' : {}, 'extra' : {}}
+        for bucket in AOV_BUCKETS:
+            aovs = set(result[bucket])
+            missing = sorted(majority_sets[bucket] - aovs)
+            extra = sorted(aovs - majority_sets[bucket])
+            if missing:
+                difference['missing'][bucket] = missing
+            if extra:
+                difference['extra'][bucket] = extra
+        inconsistent.append(difference)
+
+    overlaps = sorted({tuple(group) for _, result in readable for group in result['overlaps']})
+
+    return {'pattern' : pattern,
+            'frame_count' : len(sequence),
+            'schemas' : sorted({result['schema'] for _, result in readable}),
+            'overlaps' : [list(group) for group in overlaps],
+            'majority' : {bucket : list(aovs) for bucket, aovs in zip(AOV_BUCKETS, majority)},
+            'majority_frame_count' : signatures[majority] if signatures else 0,
+            'inconsistent' : inconsistent,
+            'unreadable' : unreadable}
+
+def format_report(report):
+    '''Returns a human readable summary of a validate_sequence report'''
+    lines = ['%s: %d frames, %d match the majority AOV set'
+             % (report['pattern'], report['frame_count'], report['majority_frame_count'])]
+    for bucket in AOV_BUCKETS:
+        lines.append('  %-12s %s' % (bucket, ', '.join(report['majority'][bucket]) or '-'))
+    lines.append('  %-12s %s' % ('schema', ', '.join(report['schemas']) or '-'))
+    for group in report['overlaps']:
+        lines.append('overlapping AOVs, the unassigned pipe subtracts the same light more than once: %s' % ', '.join(group))
+    for difference in report['inconsistent']:
+        lines.append('frame %s differs: %s' % (difference['frame'], difference['path']))
+        for key in ('missing', 'extra'):
+            for bucket, aovs in sorted(difference[key].items()):
+                lines.append('  %s %s: %s' % (key, bucket, ', '.join(aovs)))
+    for frame in report['unreadable']:
+        lines.append('frame %s unreadable: %s' % (frame['frame'], frame['error']))
+    if not report['inconsistent'] and not report['unreadable']:
+        lines.append('AOV contract OK')
+    return '\n'.join(lines)
+
+## command line
+def add_classification_arguments(parser):
+    '''Adds the flags matching the classification settings of the breakout panel to `parser`'''
+    parser.add_argument('--lg-regex', default = LIGHTGROUP_REGEX.pattern, help = 'lightgroup regex')
+    parser.add_argument('--case-sensitive', action = 'store_true', help = 'do not ignore case for the lightgroup regex')
+    parser.add_argument('--materials', default = ','.join(MATERIAL_AOVS), help = 'comma separated material AOVs')
+    parser.add_argument('--utilities', default = ','.join(UTILITY_AOVS), help = 'comma separated utility AOVs')
+    parser.add_argument('--additional-lighting', default = ','.join(ADDITIONAL_LIGHTING_AOVS),
+                        help = 'comma separated additional lighting AOVs')
+    parser.add_argument('--schema', choices = sorted(SCHEMA_DEFINITIONS),
+                        help = 'AOV schema (default: picked from the Houdini version in the EXR metadata)')
+
+def classification_settings(args):
+    '''Returns the classification settings given by the flags of add_classification_arguments'''
+    return {'lg_regex' : re.compile(args.lg_regex, 0 if args.case_sensitive else re.IGNORECASE),
+            'expected_materials' : [m.strip() for m in args.materials.split(',') if m.strip()],
+            'expected_utilities' : [u.strip() for u in args.utilities.split(',') if u.strip()],
+            'additional_lighting' : [a.strip() for a in args.additional_lighting.split(',') if a.strip()],
+            'schema' : args.schema}
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Validate the AOV contract across a Karma EXR sequence.')
+    parser.add_argument('pattern', help = "sequence path using '####', '%%04d' or the path of any frame")
+    parser.add_argument('--frames', type = frame_range_argument,
+                        help = "frame range, eg. '1001-1100' (default: every frame on disk)")
+    parser.add_argument('--workers', type = int, default = None, help = 'worker processes (default: cpu count)')
+    add_classification_arguments(parser)
+    parser.add_argument('--json', action = 'store_true', help = 'print the report as json')
+    args = parser.parse_args(argv)
+
+    settings = classification_settings(args)
+
+    report = validate_sequence(args.pattern, args.frames, settings, args.workers)
+    if args.json:
+        print(json.dumps(report, indent = 2))
+    else:
+        print(format_report(report))
+
+    if report['frame_count'] == 0:
+        return 2
+    return 1 if report['inconsistent'] or report['unreadable'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
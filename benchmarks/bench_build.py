@@ -0,0 +1,186 @@
+'''Times building rebuilds in a script, with the stand-in nuke module of fake_nuke.py.
+
+The rebuild (breakout_lightgroups_and_materials), the utilities breakout (breakout_utilities) and the layout pass
+(post_layout_adjustments) are run on synthetic streams of 10 to 1000 aovs, in an empty script and in scripts
+already holding up to 10k nodes. Each case reports its wall time, the nodes created, the nuke api calls made and
+the nodes walked by allNodes / selectedNodes scans.
+
+Counts come from the stand-in and do not depend on the machine, any increase over the stored baseline is
+reported as a regression. Times are compared too, with a tolerance, which only makes sense on the machine the
+baselines were stored on (--no-times skips them).
+
+    python benchmarks/bench_build.py                ## run and compare against benchmarks/baselines/bench_build.json
+    python benchmarks/bench_build.py --update       ## store the results as the new baselines
+    python benchmarks/bench_build.py --aovs 10 50 --script-nodes 0
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, os.pardir, '.nuke', 'python'))
+
+import fake_nuke
+fake_nuke.install()
+
+import AOV_rebuild_karma
+import AOV_rebuild_karma_build
+from bench_compact import synthetic_channels
+
+## global Variables
+AOV_COUNTS = (10, 50, 200, 1000)
+
+SCRIPT_NODE_COUNTS = (0, 1000, 10000)
+
+## 'layout' is given the nodes of the rebuild, 'layout_selected' finds them from a selected sticky note of the rebuild
+OPERATIONS = ('rebuild', 'utilities', 'layout', 'layout_selected')
+
+BASELINES = os.path.join(BENCHMARKS, 'baselines', 'bench_build.json')
+
+## how much slower than its baseline a case can run before it is reported
+TIME_TOLERANCE = 0.5
+
+## counts stored per case, compared exactly
+COUNTS = ('nodes_created', 'api_calls', 'nodes_scanned')
+
+## scripts
+def populate_script(node_count):
+    '''Fills the script with `node_count` nodes of other work: chains of a Read, grades and merges with a sticky note'''
+    chain = None
+    for i in range(node_count):
+        position = i % 10
+        if position == 0:
+            chain = fake_nuke.nodes.Read(file = '/render/plate%d.####.exr' % i)
+        elif position == 9:
+            fake_nuke.nodes.StickyNote(label = 'notes %d' % i)
+            continue
+        elif position % 3 == 0:
+            chain = fake_nuke.nodes.Merge2(inputs = [chain, chain], operation = 'over')
+        else:
+            chain = fake_nuke.nodes.Grade(inputs = [chain], white = 1.1)
+        chain.setXYpos(-2000 - (i // 10) * 120, (position % 9) * 60)
+
+def settings_for(operation):
+    settings = dict(AOV_rebuild_karma_build.DEFAULT_SETTINGS)
+    settings['breakout_utilities'] = operation == 'utilities'
+    return settings
+
+## cases
+def run_case(operation, aov_count, script_nodes):
+    '''Runs one operation and returns its wall time in ms and counts'''
+    fake_nuke.reset()
+    populate_script(script_nodes)
+    read = fake_nuke.read_node(synthetic_channels(aov_count), file = '/render/karma.####.exr')
+    settings = settings_for(operation)
+    pasted = None
+    if operation in ('layout', 'layout_selected'):
+        pasted = AOV_rebuild_karma.breakout_lightgroups_and_materials(read, settings)
+        if operation == 'layout_selected':
+            for n in fake_nuke.selectedNodes():
+                n.setSelected(False)
+            next(n for n in pasted if n.Class() == 'StickyNote').setSelected(True)
+    fake_nuke.calls.clear()
+
+    start = time.perf_counter()
+    if operation == 'rebuild':
+        AOV_rebuild_karma.breakout_lightgroups_and_materials(read, settings)
+    elif operation == 'utilities':
+        AOV_rebuild_karma.breakout_utilities(read, settings)
+    elif operation == 'layout':
+        AOV_rebuild_karma.post_layout_adjustments(pasted)
+    else:
+        AOV_rebuild_karma.post_layout_adjustments()
+    elapsed = time.perf_counter() - start
+
+    calls = fake_nuke.calls
+    api_calls = sum(count for name, count in calls.items() if name not in ('nodes_created', 'nodes_scanned'))
+    return {'ms' : round(elapsed * 1000, 2),
+            'nodes_created' : calls['nodes_created'],
+            'api_calls' : api_calls,
+            'nodes_scanned' : calls['nodes_scanned']}
+
+def case_name(operation, aov_count, script_nodes):
+    return '%s %d aovs %d nodes' % (operation, aov_count, script_nodes)
+
+def run_cases(aov_counts = AOV_COUNTS, script_node_counts = SCRIPT_NODE_COUNTS, operations = OPERATIONS, repeat = 3):
+    '''Returns {case name : result} for every combination, the fastest of `repeat` runs'''
+    results = {}
+    for operation in operations:
+        for aov_count in aov_counts:
+            for script_nodes in script_node_counts:
+                runs = [run_case(operation, aov_count, script_nodes) for _ in range(repeat)]
+                results[case_name(operation, aov_count, script_nodes)] = min(runs, key = lambda run: run['ms'])
+    return results
+
+## baselines
+def load_baselines(path = BASELINES):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)['cases']
+
+def save_baselines(results, path = BASELINES):
+    baselines = load_baselines(path)
+    baselines.update(results)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        json.dump({'cases' : baselines}, f, indent = 1, sort_keys = True)
+        f.write('\n')
+
+def regressions(results, baselines, time_tolerance = TIME_TOLERANCE):
+    '''Returns a list of (case, what, baseline, result) for every count above its baseline and every time
+    more than `time_tolerance` above it (times are skipped when `time_tolerance` is None)'''
+    found = []
+    for case, result in results.items():
+        baseline = baselines.get(case)
+        if baseline is None:
+            continue
+        for key in COUNTS:
+            if result[key] > baseline[key]:
+                found.append((case, key, baseline[key], result[key]))
+        if time_tolerance is not None and result['ms'] > baseline['ms'] * (1 + time_tolerance):
+            found.append((case, 'ms', baseline['ms'], result['ms']))
+    return found
+
+def format_results(results, baselines):
+    lines = ['%-34s %10s %8s %10s %10s %10s' % ('case', 'ms', 'base ms', 'created', 'api calls', 'scanned')]
+    for case, result in results.items():
+        baseline = baselines.get(case, {})
+        lines.append('%-34s %10.2f %8s %10d %10d %10d' % (case, result['ms'],
+                                                          '%.2f' % baseline['ms'] if baseline else '-',
+                                                          result['nodes_created'], result['api_calls'],
+                                                          result['nodes_scanned']))
+    return '\n'.join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Time building rebuilds in a script with a stand-in nuke module.')
+    parser.add_argument('--aovs', type = int, nargs = '+', default = AOV_COUNTS, help = 'aov counts of the synthetic streams')
+    parser.add_argument('--script-nodes', type = int, nargs = '+', default = SCRIPT_NODE_COUNTS,
+                        help = 'nodes already in the script')
+    parser.add_argument('--operations', nargs = '+', default = OPERATIONS, choices = OPERATIONS)
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per case, the fastest is reported')
+    parser.add_argument('--update', action = 'store_true', help = 'store the results as the baselines')
+    parser.add_argument('--no-times', action = 'store_true', help = 'only compare counts against the baselines')
+    parser.add_argument('--time-tolerance', type = float, default = TIME_TOLERANCE,
+                        help = 'fraction a case can run slower than its baseline')
+    args = parser.parse_args(argv)
+
+    results = run_cases(args.aovs, args.script_nodes, args.operations, args.repeat)
+    baselines = load_baselines()
+    print(format_results(results, baselines))
+
+    if args.update:
+        save_baselines(results)
+        print('\nbaselines stored in %s' % BASELINES)
+        return 0
+
+    found = regressions(results, baselines, None if args.no_times else args.time_tolerance)
+    for case, key, baseline, result in found:
+        print('REGRESSION %s: %s %s > baseline %s' % (case, key, result, baseline))
+    return 1 if found else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
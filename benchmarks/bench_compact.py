@@ -0,0 +1,102 @@
+'''Compares the default rebuild layout against compact mode (one upstream unpremult).
+
+Node counts come from the in-memory rebuild graphs, so they run with a plain Python 3 interpreter.
+Render times need Nuke: run the script with `nuke -t` and point it at a Karma EXR, each layout is
+pasted under a Read and rendered through a Write for the given frames.
+
+    python benchmarks/bench_compact.py
+    nuke -t benchmarks/bench_compact.py --exr /render/h21_karma_all_aovs.####.exr --frames 1001-1010
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, '.nuke', 'python'))
+
+import AOV_rebuild_karma_build
+from AOV_rebuild_karma_layers import classify_channels_from_settings
+
+## global Variables
+AOV_COUNTS = (10, 50, 200)
+
+## synthetic streams
+def synthetic_channels(aov_count):
+    '''Returns the channels of a Karma stream with every default material aov and enough lightgroups to reach `aov_count` aovs'''
+    channels = ['rgba.red', 'rgba.green', 'rgba.blue', 'rgba.alpha']
+    materials = AOV_rebuild_karma_build.MATERIAL_AOVS[:aov_count]
+    lightgroups = ['LG_%03d' % i for i in range(max(0, aov_count - len(materials)))]
+    for layer in materials + lightgroups:
+        channels += [layer + '.red', layer + '.green', layer + '.blue']
+    for utility in ('N', 'P'):
+        channels += [utility + '.x', utility + '.y', utility + '.z']
+    return channels
+
+def layout_settings(compact):
+    settings = dict(AOV_rebuild_karma_build.DEFAULT_SETTINGS)
+    settings['compact'] = compact
+    return settings
+
+## node counts
+def count_nodes(channels, compact):
+    '''Returns (node count, unpremult count, build seconds) for one rebuild of `channels`'''
+    settings = layout_settings(compact)
+    start = time.perf_counter()
+    layer_index = classify_channels_from_settings(channels, settings)
+    graph = AOV_rebuild_karma_build.build_rebuild_graph(layer_index, settings)
+    elapsed = time.perf_counter() - start
+    unpremults = sum(1 for n in graph.node_list if n.Class() == 'Unpremult')
+    return len(graph.node_list), unpremults, elapsed
+
+def node_count_table(aov_counts = AOV_COUNTS):
+    lines = ['%6s  %-8s %7s %11s %10s' % ('aovs', 'layout', 'nodes', 'unpremults', 'build ms')]
+    for aov_count in aov_counts:
+        channels = synthetic_channels(aov_count)
+        for compact in (False, True):
+            nodes, unpremults, elapsed = count_nodes(channels, compact)
+            lines.append('%6d  %-8s %7d %11d %10.2f' % (aov_count, 'compact' if compact else 'default',
+                                                         nodes, unpremults, elapsed * 1000))
+    return '\n'.join(lines)
+
+## render times
+def render_time(exr, first, last, compact):
+    '''Pastes a rebuild of `exr` in the given layout and returns the seconds taken to render it through a Write'''
+    import nuke
+    import AOV_rebuild_karma
+
+    for n in nuke.allNodes():
+        nuke.delete(n)
+    read = nuke.nodes.Read(file = exr, first = first, last = last)
+    pasted = AOV_rebuild_karma.breakout_lightgroups_and_materials(read, layout_settings(compact))
+    ends = [n for n in pasted if n.Class() == 'Premult']
+
+    fd, path = tempfile.mkstemp(suffix = '.exr')
+    os.close(fd)
+    try:
+        write = nuke.nodes.Write(inputs = [ends[-1]], file = path, file_type = 'exr', channels = 'rgba')
+        start = time.perf_counter()
+        nuke.execute(write, first, last)
+        return time.perf_counter() - start
+    finally:
+        os.remove(path)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Compare the default and compact rebuild layouts.')
+    parser.add_argument('--exr', help = 'Karma EXR (sequence) to render, requires nuke -t')
+    parser.add_argument('--frames', default = '1-1', help = "frame range to render, eg. '1001-1010'")
+    parser.add_argument('--repeat', type = int, default = 3, help = 'renders per layout, the fastest is reported')
+    args = parser.parse_args(argv)
+
+    print(node_count_table())
+
+    if args.exr:
+        frames = args.frames.split('-')
+        first, last = int(frames[0]), int(frames[-1])
+        print('\n%-8s %10s' % ('layout', 'render s'))
+        for compact in (False, True):
+            best = min(render_time(args.exr, first, last, compact) for _ in range(args.repeat))
+            print('%-8s %10.3f' % ('compact' if compact else 'default', best))
+
+if __name__ == '__main__':
+    main()
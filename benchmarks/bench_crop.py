@@ -0,0 +1,153 @@
+'''Compares full format aov branches against branches cropped to the data of their aov ('crop_to_data').
+
+The branch work is timed with numpy on a synthetic 4K render where a few lightgroups cover the frame and the rest
+are practicals lighting a small part of it: each branch unpremultiplies its aov and plusses it onto the bpipe,
+over the whole format or only over the box of its data, the way Nuke only pulls the box of a Crop from upstream.
+Render times need Nuke: run the script with `nuke -t` and point it at a Karma EXR, the rebuild is pasted under a
+Read with and without cropping and rendered through a Write for the given frames, the scan of the Read included.
+--scope also times every branch cropped to the one box of a Cryptomatte selection covering that fraction of the frame,
+the way a rebuild scoped to a hero asset ('scope_mattes') works.
+
+    python benchmarks/bench_crop.py
+    python benchmarks/bench_crop.py --aovs 80 --coverage 0.02
+    python benchmarks/bench_crop.py --scope 0.05
+    nuke -t benchmarks/bench_crop.py --exr /render/h21_karma_all_aovs.####.exr --frames 1001-1010
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, '.nuke', 'python'))
+
+import numpy as np
+
+import AOV_rebuild_karma_build
+import AOV_rebuild_karma_qc
+
+## global Variables
+RESOLUTION = (3840, 2160)
+
+AOV_COUNT = 40
+
+## lightgroups lighting the whole frame, every other one is a practical
+FULL_FRAME_LIGHTGROUPS = 4
+
+## average fraction of the frame a practical lightgroup covers
+PRACTICAL_COVERAGE = 0.01
+
+## synthetic frames
+def practical_boxes(aov_count, resolution = RESOLUTION, coverage = PRACTICAL_COVERAGE, seed = 0):
+    '''Returns one (x, y, r, t) array box per lightgroup of a synthetic render, None for the full frame ones.
+    Practicals get a box of about `coverage` of the frame, anywhere in it.'''
+    rng = np.random.default_rng(seed)
+    width, height = resolution
+    boxes = [None] * min(aov_count, FULL_FRAME_LIGHTGROUPS)
+    for _ in range(aov_count - len(boxes)):
+        scale = np.sqrt(coverage * rng.uniform(0.5, 1.5))
+        box_width, box_height = max(1, int(width * scale)), max(1, int(height * scale))
+        x = int(rng.integers(0, width - box_width + 1))
+        y = int(rng.integers(0, height - box_height + 1))
+        boxes.append((x, y, x + box_width, y + box_height))
+    return boxes
+
+def time_branches(boxes, resolution = RESOLUTION, crop = False):
+    '''Returns the seconds taken to unpremult and plus one aov per box onto a bpipe, over the whole format or
+    (with `crop`) over each box only. Every aov reads the same random pixels, only the work is timed.'''
+    width, height = resolution
+    rng = np.random.default_rng(1)
+    aov = rng.uniform(0.0, 1.0, (3, height, width)).astype(np.float32)
+    alpha = rng.uniform(0.5, 1.0, (height, width)).astype(np.float32)
+    inverse = AOV_rebuild_karma_qc.inverse_alpha(alpha)
+    bpipe = np.zeros((3, height, width), np.float32)
+    unpremultiplied = np.empty_like(bpipe)
+
+    start = time.perf_counter()
+    for box in boxes:
+        if crop and box is not None:
+            x, y, r, t = box
+            window = (slice(None), slice(y, t), slice(x, r))
+        else:
+            window = (slice(None),)
+        np.multiply(aov[window], inverse[window[1:]], out = unpremultiplied[window])
+        np.add(bpipe[window], unpremultiplied[window], out = bpipe[window])
+    return time.perf_counter() - start
+
+def branch_table(aov_count, coverage, repeat):
+    boxes = practical_boxes(aov_count, coverage = coverage)
+    full_pixels = RESOLUTION[0] * RESOLUTION[1]
+    cropped_pixels = sum(full_pixels if box is None else (box[2] - box[0]) * (box[3] - box[1]) for box in boxes)
+    lines = ['%dx%d, %d lightgroups (%d full frame, practicals covering %.1f%% of the frame each)'
+             % (RESOLUTION[0], RESOLUTION[1], aov_count, min(aov_count, FULL_FRAME_LIGHTGROUPS), coverage * 100),
+             '%-8s %14s %10s' % ('branches', 'branch pixels', 'seconds')]
+    for crop in (False, True):
+        seconds = min(time_branches(boxes, crop = crop) for _ in range(repeat))
+        pixels = cropped_pixels if crop else full_pixels * len(boxes)
+        lines.append('%-8s %14d %10.3f' % ('cropped' if crop else 'full', pixels, seconds))
+    return '\n'.join(lines)
+
+def scope_table(aov_count, scope, repeat):
+    '''Times every branch over the whole format against every branch cropped to one centred box of `scope` of the frame'''
+    width, height = RESOLUTION
+    box_width, box_height = max(1, int(width * np.sqrt(scope))), max(1, int(height * np.sqrt(scope)))
+    x, y = (width - box_width) // 2, (height - box_height) // 2
+    boxes = [(x, y, x + box_width, y + box_height)] * aov_count
+    lines = ['%d branches scoped to a matte covering %.1f%% of the frame' % (aov_count, scope * 100),
+             '%-8s %14s %10s' % ('branches', 'branch pixels', 'seconds')]
+    for crop in (False, True):
+        seconds = min(time_branches(boxes, crop = crop) for _ in range(repeat))
+        pixels = (box_width * box_height if crop else width * height) * aov_count
+        lines.append('%-8s %14d %10.3f' % ('scoped' if crop else 'full', pixels, seconds))
+    return '\n'.join(lines)
+
+## render times
+def render_time(exr, first, last, crop):
+    '''Pastes a rebuild of `exr` with or without cropped branches and returns (scan and build seconds, render seconds)'''
+    import nuke
+    import AOV_rebuild_karma
+
+    for n in nuke.allNodes():
+        nuke.delete(n)
+    read = nuke.nodes.Read(file = exr, first = first, last = last)
+    settings = dict(AOV_rebuild_karma_build.DEFAULT_SETTINGS, crop_to_data = crop)
+    start = time.perf_counter()
+    pasted = AOV_rebuild_karma.breakout_lightgroups_and_materials(read, settings)
+    build = time.perf_counter() - start
+    ends = [n for n in pasted if n.Class() == 'Premult']
+
+    fd, path = tempfile.mkstemp(suffix = '.exr')
+    os.close(fd)
+    try:
+        write = nuke.nodes.Write(inputs = [ends[-1]], file = path, file_type = 'exr', channels = 'rgba')
+        start = time.perf_counter()
+        nuke.execute(write, first, last)
+        return build, time.perf_counter() - start
+    finally:
+        os.remove(path)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Compare full format and cropped aov branches.')
+    parser.add_argument('--aovs', type = int, default = AOV_COUNT, help = 'lightgroups in the synthetic render')
+    parser.add_argument('--coverage', type = float, default = PRACTICAL_COVERAGE,
+                        help = 'fraction of the frame each practical lightgroup covers')
+    parser.add_argument('--scope', type = float, help = 'fraction of the frame a Cryptomatte scope covers, eg. 0.05')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per measurement, the fastest is reported')
+    parser.add_argument('--exr', help = 'Karma EXR (sequence) to render, requires nuke -t')
+    parser.add_argument('--frames', default = '1-1', help = "frame range to render, eg. '1001-1010'")
+    args = parser.parse_args(argv)
+
+    print(branch_table(args.aovs, args.coverage, args.repeat))
+    if args.scope:
+        print('\n' + scope_table(args.aovs, args.scope, args.repeat))
+
+    if args.exr:
+        frames = args.frames.split('-')
+        first, last = int(frames[0]), int(frames[-1])
+        print('\n%-8s %10s %10s' % ('branches', 'build s', 'render s'))
+        for crop in (False, True):
+            build, render = min((render_time(args.exr, first, last, crop) for _ in range(args.repeat)), key = lambda t: t[1])
+            print('%-8s %10.3f %10.3f' % ('cropped' if crop else 'full', build, render))
+
+if __name__ == '__main__':
+    main()
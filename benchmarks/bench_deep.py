@@ -0,0 +1,143 @@
+'''Compares the deep rebuild (deep_breakout) against the flat rebuild of the same render flattened per aov.
+
+A synthetic deep render is made with numpy: every pixel holds a few samples, each with its own alpha and beauty,
+and the beauty of each sample is split into materials and, separately, into lightgroups. Every aov is graded by
+its own gain, then
+
+    deep   the graded aovs of each sample are summed (the DeepExpression) and the stream is flattened once
+    flat   every aov is flattened on its own and rebuilt the way the flat rebuild does, unpremult, plus, premult
+
+and the largest difference between the two is reported for the materials pipe, the lightgroups pipe and both.
+One pipe is a sum of samples, so the two only differ by float rounding. Both pipes combine the pipes per sample
+instead of per flattened pixel, which differs where samples of the same pixel split their light differently.
+The time of one flatten is reported next to flattening every aov.
+
+    python benchmarks/bench_deep.py
+    python benchmarks/bench_deep.py --resolution 960x540 --samples 8 --materials 16 --lightgroups 24
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, '.nuke', 'python'))
+
+import numpy as np
+
+import AOV_rebuild_karma_qc
+
+## global Variables
+RESOLUTION = (480, 270)
+
+SAMPLES = 4
+
+MATERIAL_COUNT = 8
+
+LIGHTGROUP_COUNT = 12
+
+## rounding of float32 sums, a single pipe should match within it
+TOLERANCE = 1e-4
+
+## synthetic deep frames
+def deep_render(resolution = RESOLUTION, samples = SAMPLES, materials = MATERIAL_COUNT, lightgroups = LIGHTGROUP_COUNT,
+                seed = 0):
+    '''Returns (alpha, beauty, material weights, lightgroup weights) of a synthetic deep render: the alpha of every
+    sample as (samples, rows, columns), its premultiplied beauty as (3, samples, rows, columns) and the share of the
+    beauty each aov holds per sample as (aovs, samples, rows, columns), summing to 1 over the aovs of a pipe'''
+    rng = np.random.default_rng(seed)
+    width, height = resolution
+    alpha = rng.uniform(0.1, 0.9, (samples, height, width)).astype(np.float32)
+    beauty = (rng.uniform(0.0, 2.0, (3, samples, height, width)) * alpha).astype(np.float32)
+
+    def weights(count):
+        shares = rng.uniform(0.0, 1.0, (count, samples, height, width)).astype(np.float32)
+        return shares / shares.sum(axis = 0)
+
+    return alpha, beauty, weights(materials), weights(lightgroups)
+
+def flatten(alpha, colour):
+    '''DeepToImage: the samples of `colour` (..., samples, rows, columns) merged over each other front to back'''
+    visible = np.cumprod(np.concatenate([np.ones_like(alpha[:1]), 1 - alpha[:-1]]), axis = 0)
+    return (colour * visible).sum(axis = -3)
+
+def graded_sum(beauty, weights, gains):
+    '''Returns the per sample sum of the aovs holding `weights` of the beauty, each multiplied by its gain'''
+    return beauty * np.tensordot(gains, weights, axes = 1)
+
+## rebuilds
+def deep_rebuild(alpha, beauty, pipes):
+    '''Sums the graded aovs of every sample the way deep_sum_knobs does and flattens once'''
+    sums = [graded_sum(beauty, weights, gains) for weights, gains in pipes]
+    if len(sums) == 1:
+        rgb = sums[0]
+    else:
+        rgb = np.zeros_like(beauty)
+        np.divide(sums[0] * sums[1], beauty, out = rgb, where = beauty != 0)
+    return flatten(alpha, rgb)
+
+def flat_rebuild(alpha, beauty, pipes):
+    '''Flattens every graded aov and rebuilds the flat result: each pipe unpremultiplied and plussed, both pipes
+    combined by beauty * (materials / beauty) * (lightgroups / beauty), premultiplied at the end'''
+    flat_alpha = 1 - np.prod(1 - alpha, axis = 0)
+    inverse = AOV_rebuild_karma_qc.inverse_alpha(flat_alpha)
+    original = AOV_rebuild_karma_qc.unpremult(flatten(alpha, beauty), inverse)
+    result = original
+    for weights, gains in pipes:
+        bpipe = np.zeros_like(original)
+        for aov_weights, gain in zip(weights, gains):
+            bpipe += AOV_rebuild_karma_qc.unpremult(flatten(alpha, beauty * aov_weights * gain), inverse)
+        result = AOV_rebuild_karma_qc.merge_multiply(AOV_rebuild_karma_qc.merge_divide(bpipe, original), result)
+    return result * flat_alpha
+
+def residual_table(alpha, beauty, material_weights, lightgroup_weights, seed = 1):
+    rng = np.random.default_rng(seed)
+    materials = (material_weights, rng.uniform(0.5, 2.0, len(material_weights)).astype(np.float32))
+    lightgroups = (lightgroup_weights, rng.uniform(0.5, 2.0, len(lightgroup_weights)).astype(np.float32))
+    lines = ['%-12s %14s %14s %10s' % ('pipes', 'max residual', 'mean residual', 'matches')]
+    for name, pipes in (('materials', [materials]), ('lightgroups', [lightgroups]), ('both', [materials, lightgroups])):
+        residual = np.abs(deep_rebuild(alpha, beauty, pipes) - flat_rebuild(alpha, beauty, pipes))
+        lines.append('%-12s %14.2e %14.2e %10s' % (name, residual.max(), residual.mean(),
+                                                    'yes' if residual.max() <= TOLERANCE else 'no'))
+    return '\n'.join(lines)
+
+def flatten_table(alpha, beauty, material_weights, lightgroup_weights, repeat):
+    '''Times flattening the summed stream once against flattening the beauty and every aov'''
+    aov_weights = np.concatenate([material_weights, lightgroup_weights])
+
+    def once():
+        start = time.perf_counter()
+        flatten(alpha, beauty)
+        return time.perf_counter() - start
+
+    def per_aov():
+        start = time.perf_counter()
+        flatten(alpha, beauty)
+        for weights in aov_weights:
+            flatten(alpha, beauty * weights)
+        return time.perf_counter() - start
+
+    lines = ['%-18s %10s %10s' % ('flatten', 'flattens', 'seconds'),
+             '%-18s %10d %10.3f' % ('once (deep)', 1, min(once() for _ in range(repeat))),
+             '%-18s %10d %10.3f' % ('per aov (flat)', len(aov_weights) + 1, min(per_aov() for _ in range(repeat)))]
+    return '\n'.join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Compare the deep rebuild against the flat rebuild of flattened aovs.')
+    parser.add_argument('--resolution', default = '%dx%d' % RESOLUTION, help = "synthetic render size, eg. '960x540'")
+    parser.add_argument('--samples', type = int, default = SAMPLES, help = 'deep samples per pixel')
+    parser.add_argument('--materials', type = int, default = MATERIAL_COUNT, help = 'material aovs')
+    parser.add_argument('--lightgroups', type = int, default = LIGHTGROUP_COUNT, help = 'lightgroup aovs')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per measurement, the fastest is reported')
+    args = parser.parse_args(argv)
+
+    resolution = tuple(int(size) for size in args.resolution.lower().split('x'))
+    alpha, beauty, material_weights, lightgroup_weights = deep_render(resolution, args.samples, args.materials,
+                                                                      args.lightgroups)
+    print('%dx%d, %d samples per pixel, %d materials, %d lightgroups, every aov graded'
+          % (resolution[0], resolution[1], args.samples, args.materials, args.lightgroups))
+    print(residual_table(alpha, beauty, material_weights, lightgroup_weights))
+    print()
+    print(flatten_table(alpha, beauty, material_weights, lightgroup_weights, args.repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+'''Times the numpy reference rebuild of AOV_rebuild_karma_qc on a 4K frame.
+
+The synthetic frame is rebuilt a strip of scanlines at a time like a frame read from disk, the same strip
+of random aovs standing in for every strip so only the rebuild maths is timed. Pass --exr to also time
+the QC of a real frame, decoding included.
+
+    python benchmarks/bench_qc.py
+    python benchmarks/bench_qc.py --strip-rows 64
+    python benchmarks/bench_qc.py --aovs 80 --exr /render/h21_karma_all_aovs.1001.exr
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, '.nuke', 'python'))
+
+import numpy as np
+
+import AOV_rebuild_karma_qc
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, MATERIAL_AOVS, bpipe_skip_reason
+from AOV_rebuild_karma_layers import classify_channels_from_settings
+
+## global Variables
+RESOLUTION = (3840, 2160)
+
+AOV_COUNT = 40
+
+## seconds the rebuild maths of a 4K frame of AOV_COUNT aovs should take
+TARGET_SECONDS = 0.5
+
+## synthetic frames
+def synthetic_strip(aov_count, width, rows, seed = 0):
+    '''Returns (layer index, planes) of one strip of a Karma stream with every default material aov and enough
+    lightgroups to reach `aov_count` aovs. The plussed materials and the lightgroups each add up to the beauty.'''
+    rng = np.random.default_rng(seed)
+    materials = MATERIAL_AOVS[:aov_count]
+    lightgroups = ['LG_%03d' % i for i in range(max(1, aov_count - len(materials)))]
+    materials_lower = {m.lower() for m in materials}
+    plussed = [m for m in materials if bpipe_skip_reason(m, materials_lower) is None]
+
+    planes = {'rgba.alpha' : np.ones((rows, width), np.float32)}
+    for component in ('red', 'green', 'blue'):
+        beauty = rng.uniform(0.0, 2.0, (rows, width)).astype(np.float32)
+        planes['rgba.' + component] = beauty
+        for layers in (plussed, lightgroups):
+            weights = rng.uniform(0.1, 1.0, (len(layers), rows, width)).astype(np.float32)
+            weights /= weights.sum(axis = 0)
+            for layer, weight in zip(layers, weights):
+                planes['%s.%s' % (layer, component)] = beauty * weight
+        for layer in materials:
+            if layer not in plussed:
+                planes['%s.%s' % (layer, component)] = rng.uniform(0.0, 0.2, (rows, width)).astype(np.float32)
+
+    return classify_channels_from_settings(list(planes), DEFAULT_SETTINGS), planes
+
+def time_synthetic(aov_count, resolution = RESOLUTION, strip_rows = AOV_rebuild_karma_qc.STRIP_ROWS):
+    '''Returns (seconds, report) for the QC of a synthetic frame of `resolution`'''
+    width, height = resolution
+    layer_index, planes = synthetic_strip(aov_count, width, strip_rows)
+    pipes = AOV_rebuild_karma_qc.rebuild_pipes(layer_index, DEFAULT_SETTINGS)
+
+    qc = AOV_rebuild_karma_qc.FrameQC(pipes)
+    start = time.perf_counter()
+    for first_row in range(0, height, strip_rows):
+        rows = min(strip_rows, height - first_row)
+        qc.add({name : plane[:rows] for name, plane in planes.items()}, first_row)
+    return time.perf_counter() - start, qc.report()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Time the numpy reference rebuild.')
+    parser.add_argument('--aovs', type = int, default = AOV_COUNT, help = 'aovs in the synthetic frame')
+    parser.add_argument('--strip-rows', type = int, default = AOV_rebuild_karma_qc.STRIP_ROWS,
+                        help = 'scanlines rebuilt at a time')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per measurement, the fastest is reported')
+    parser.add_argument('--exr', help = 'also time the QC of this frame, decoding included')
+    args = parser.parse_args(argv)
+
+    runs = [time_synthetic(args.aovs, strip_rows = args.strip_rows) for _ in range(args.repeat)]
+    seconds, report = min(runs, key = lambda run: run[0])
+    print('%dx%d, %d aovs, %d rows a strip: %.3fs per frame (max residual %.6f)'
+          % (RESOLUTION[0], RESOLUTION[1], args.aovs, args.strip_rows, seconds, report['residual_max']))
+    if args.aovs == AOV_COUNT:
+        print('target %.2fs: %s' % (TARGET_SECONDS, 'met' if seconds <= TARGET_SECONDS else 'NOT MET'))
+
+    if args.exr:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = AOV_rebuild_karma_qc.qc_frame(args.exr)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if result['error']:
+            print('%s: %s' % (args.exr, result['error']))
+        else:
+            print('%s: %.3fs per frame (max residual %.6f)' % (args.exr, best, result['residual_max']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''Checks what Nuke startup pays for the rebuild, with the stand-in nuke module of fake_nuke.py.
+
+init.py and menu.py are run from the .nuke directory in a fresh interpreter, the way nuke runs them, and the time
+they take and the modules they import are reported. Startup should only import AOV_rebuild_karma_menu and the
+presets file reader, the rebuild (and numpy, the EXR reader...) is imported by the first command run, which is
+timed too, next to what importing the rebuild at startup would cost. Exits with 1 when startup imports anything else.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 10
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+NUKE_DIR = os.path.join(BENCHMARKS, os.pardir, '.nuke')
+
+## global Variables
+## modules of the package menu.py may import
+STARTUP_MODULES = ('AOV_rebuild_karma_menu', 'AOV_rebuild_karma_presets')
+
+## modules nobody should pay for at startup besides the package's own
+HEAVY_MODULES = ('numpy', 'OpenEXR')
+
+## menu command run as the first use, it imports the rebuild and returns with a message when no rebuild is selected
+FIRST_USE_COMMAND = 'Python/AOV_rebuild_karma update'
+
+## runs in a fresh interpreter from the .nuke directory, prints the results as json
+CHILD = r'''
+import json, sys, time
+sys.path.insert(0, %(benchmarks)r)
+import fake_nuke
+fake_nuke.install()
+import nuke
+
+def package_modules():
+    return sorted(name for name in sys.modules
+                  if name.startswith('AOV_rebuild_karma') or name.split('.')[0] in %(heavy)r)
+
+result = {}
+if %(eager)r:
+    sys.path.insert(0, 'python')
+    start = time.perf_counter()
+    import AOV_rebuild_karma
+    result['eager_ms'] = (time.perf_counter() - start) * 1000
+else:
+    start = time.perf_counter()
+    for script in ('init.py', 'menu.py'):
+        with open(script) as f:
+            exec(compile(f.read(), script, 'exec'), {'__name__' : '__main__'})
+    result['startup_ms'] = (time.perf_counter() - start) * 1000
+    result['startup_modules'] = package_modules()
+
+    command = nuke.menu('Nodes').menu(%(command)r)
+    nuke.nodes.Read(file = '/render/karma.####.exr').setSelected(True)
+    start = time.perf_counter()
+    command.invoke()
+    result['first_use_ms'] = (time.perf_counter() - start) * 1000
+    result['first_use_modules'] = package_modules()
+print(json.dumps(result))
+'''
+
+def run_child(eager = False):
+    code = CHILD % {'benchmarks' : BENCHMARKS, 'heavy' : HEAVY_MODULES, 'eager' : eager, 'command' : FIRST_USE_COMMAND}
+    output = subprocess.check_output([sys.executable, '-c', code], cwd = NUKE_DIR, universal_newlines = True)
+    return json.loads(output.splitlines()[-1])
+
+def unexpected_modules(modules):
+    return [name for name in modules if name not in STARTUP_MODULES]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Check what Nuke startup imports and pays for the rebuild.')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'fresh interpreters per measurement, the fastest is reported')
+    args = parser.parse_args(argv)
+
+    lazy = [run_child() for _ in range(args.repeat)]
+    eager = [run_child(eager = True) for _ in range(args.repeat)]
+    startup = min(lazy, key = lambda result: result['startup_ms'])
+
+    print('%-34s %10.2f ms' % ('init.py + menu.py', startup['startup_ms']))
+    print('%-34s %10.2f ms' % ('first command (imports the rebuild)', min(result['first_use_ms'] for result in lazy)))
+    print('%-34s %10.2f ms' % ('import AOV_rebuild_karma at startup', min(result['eager_ms'] for result in eager)))
+    print('\nimported at startup: %s' % ', '.join(startup['startup_modules']))
+    print('imported by the first command: %s' % ', '.join(m for m in startup['first_use_modules']
+                                                         if m not in startup['startup_modules']))
+
+    found = unexpected_modules(startup['startup_modules'])
+    for name in found:
+        print('REGRESSION startup imports %s' % name)
+    if 'AOV_rebuild_karma' not in startup['first_use_modules']:
+        print('REGRESSION the first command did not import AOV_rebuild_karma')
+        return 1
+    return 1 if found else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,672 @@
+'''Stand-in for the nuke module so the live side of a rebuild can be timed with a plain Python 3 interpreter.
+
+Only the part of the api AOV_rebuild_karma uses is there: nodes with knobs, inputs and positions, selection,
+allNodes / selectedNodes / toNode / delete, a nodePaste that reads the script text AOV_rebuild_karma_graph writes,
+groups with user knobs and a knobChanged script, Reads of EXRs on disk listing the channels of their header,
+a nodeCopy for the precomp renders, and the menus, plugin path and script load callbacks init.py / menu.py set up.
+Every api call is counted in `calls`, with the nodes created and the nodes walked by allNodes / selectedNodes
+scans, so a change in how much a rebuild asks of nuke shows up even where the stand-in is faster than nuke.
+
+    import fake_nuke
+    fake_nuke.install()                ## import nuke now returns this module
+    read = fake_nuke.read_node(['rgba.red', 'rgba.green', 'rgba.blue', 'rgba.alpha', 'LG_key.red'])
+'''
+import collections
+import functools
+import os
+import re
+import sys
+
+## global Variables
+INPUTS = 1
+EXPRESSIONS = 2
+HIDDEN_INPUTS = 4
+
+## screen sizes by class, (80, 18) for everything else
+SCREEN_SIZES = {'Dot' : (12, 12)}
+
+## terminal mode, rebuilds show no ProgressTask unless this is set
+GUI = False
+
+## knob flags
+INVISIBLE = 0x400
+STARTLINE = 0x1000
+
+## writeKnobs flags
+WRITE_NON_DEFAULT_ONLY = 0x10
+TO_SCRIPT = 0x1
+
+## terminal renders (see AOV_rebuild_karma_precomp) run this interpreter unless given another executable
+EXE_PATH = sys.executable
+
+## toolbar menus nuke starts with, menu.py adds to 'Channel'
+TOOLBAR_MENUS = ('Image', 'Draw', 'Time', 'Channel', 'Color', 'Filter', 'Keyer', 'Merge', 'Transform', '3D', 'Other')
+
+## api call name > count, plus 'nodes_created' and 'nodes_scanned'
+calls = collections.Counter()
+
+_nodes = []
+## groups entered with `with group:` / group.begin(), nodes are created in the last one
+_contexts = []
+_names = {}
+## base name > last number given out, so numbering stays cheap in big scripts
+_numbers = {}
+
+def counted(name):
+    '''Counts every call of the decorated function under `name`'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+## knobs and nodes
+class Knob(object):
+    def __init__(self, name, value = ''):
+        self._name = name
+        self._value = value
+
+    def name(self):
+        return self._name
+
+    @counted('Knob.value')
+    def value(self):
+        return self._value
+
+    getValue = value
+
+    @counted('Knob.setValue')
+    def setValue(self, value):
+        self._value = value
+        return True
+
+    def toScript(self):
+        return str(self._value)
+
+    def fromScript(self, text):
+        self._value = text
+        return True
+
+class UserKnob(Knob):
+    '''A knob made with one of the knob classes below and added to a node with addKnob'''
+    default = ''
+
+    def __init__(self, name, label = None, value = None):
+        Knob.__init__(self, name, self.default if value is None else value)
+        self._label = label or name
+        self._flags = set()
+
+    def label(self):
+        return self._label
+
+    def setFlag(self, flag):
+        self._flags.add(flag)
+
+    def clearFlag(self, flag):
+        self._flags.discard(flag)
+
+class Tab_Knob(UserKnob):
+    pass
+
+class Text_Knob(UserKnob):
+    pass
+
+class String_Knob(UserKnob):
+    pass
+
+class PyScript_Knob(UserKnob):
+    pass
+
+class Color_Knob(UserKnob):
+    default = 0.0
+
+class Boolean_Knob(UserKnob):
+    default = False
+
+class Node(object):
+    def __init__(self, node_class, knobs = None, name = None):
+        calls['nodes_created'] += 1
+        self._class = node_class
+        self._knobs = {}
+        self._inputs = []
+        self._outputs = collections.Counter()
+        self._x = 0
+        self._y = 0
+        self._selected = False
+        self._channels = []
+        self._metadata = {}
+        self._parent = _contexts[-1] if _contexts else None
+        self._name = _unique_name(name or node_class + '1')
+        _names[self._name] = self
+        for key, value in (knobs or {}).items():
+            self._knob_or_create(key)._value = value
+        _nodes.append(self)
+
+    def _knob_or_create(self, name):
+        knob = self._knobs.get(name)
+        if knob is None:
+            knob = self._knobs[name] = Knob(name)
+        return knob
+
+    def __repr__(self):
+        return '<%s %s>' % (self._class, self._name)
+
+    @counted('Node.knob')
+    def knob(self, name):
+        ## every node has these, user knobs only exist once added
+        if name in ('label', 'disable', 'tile_color', 'note_font', 'note_font_color', 'note_font_size', 'channels'):
+            return self._knob_or_create(name)
+        return self._knobs.get(name)
+
+    @counted('Node.__getitem__')
+    def __getitem__(self, name):
+        return self._knob_or_create(name)
+
+    def knobs(self):
+        return dict(self._knobs)
+
+    @counted('Node.addKnob')
+    def addKnob(self, knob):
+        self._knobs[knob.name()] = knob
+        return True
+
+    @counted('Node.removeKnob')
+    def removeKnob(self, knob):
+        self._knobs.pop(knob.name(), None)
+
+    ## groups
+    def begin(self):
+        _contexts.append(self)
+        return self
+
+    def end(self):
+        _contexts.remove(self)
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, *exc_info):
+        self.end()
+
+    def Class(self):
+        return self._class
+
+    def name(self):
+        return self._name
+
+    def fullName(self):
+        return self._name
+
+    @counted('Node.setName')
+    def setName(self, name, uncollide = False):
+        del _names[self._name]
+        self._name = _unique_name(name)
+        _names[self._name] = self
+
+    def input(self, i):
+        return self._inputs[i] if i < len(self._inputs) else None
+
+    def inputs(self):
+        return len(self._inputs)
+
+    @counted('Node.setInput')
+    def setInput(self, i, node):
+        _connect(self, i, node)
+        return True
+
+    @counted('Node.dependencies')
+    def dependencies(self, what = INPUTS):
+        return [n for n in self._inputs if n is not None]
+
+    @counted('Node.dependent')
+    def dependent(self, what = INPUTS, forceEvaluate = True):
+        return [n for n, count in self._outputs.items() if count > 0]
+
+    def xpos(self):
+        return self._x
+
+    def ypos(self):
+        return self._y
+
+    @counted('Node.setXYpos')
+    def setXYpos(self, x, y):
+        self._x = int(x)
+        self._y = int(y)
+
+    def setXpos(self, x):
+        self.setXYpos(x, self._y)
+
+    def setYpos(self, y):
+        self.setXYpos(self._x, y)
+
+    def screenWidth(self):
+        return SCREEN_SIZES.get(self._class, (80, 18))[0]
+
+    def screenHeight(self):
+        return SCREEN_SIZES.get(self._class, (80, 18))[1]
+
+    @counted('Node.setSelected')
+    def setSelected(self, selected):
+        self._selected = bool(selected)
+
+    def isSelected(self):
+        return self._selected
+
+    @counted('Node.channels')
+    def channels(self):
+        if not self._channels and self._class == 'Read' and 'file' in self._knobs:
+            self._channels = _exr_channels(self._knobs['file'].value())
+        return list(self._channels)
+
+    @counted('Node.metadata')
+    def metadata(self, key = None):
+        return dict(self._metadata) if key is None else self._metadata.get(key)
+
+    def writeKnobs(self, flags = 0):
+        return '\n'.join(' %s %s' % (name, knob.toScript()) for name, knob in sorted(self._knobs.items()))
+
+def _exr_channels(pattern):
+    '''Returns the channels nuke lists for the first frame of the EXR sequence `pattern` on disk, none when it is not there'''
+    from AOV_rebuild_karma_exr import ExrHeaderError, nuke_channels, read_exr_header
+    from AOV_rebuild_karma_validate import expand_sequence
+    frames = expand_sequence(pattern)
+    if not frames:
+        return []
+    try:
+        return nuke_channels(read_exr_header(frames[0][1]))
+    except (OSError, ExrHeaderError):
+        return []
+
+def _connect(node, i, input_node):
+    '''Sets input `i` of `node`, keeping the output lists dependent() reads in step'''
+    while len(node._inputs) <= i:
+        node._inputs.append(None)
+    if node._inputs[i] is not None:
+        node._inputs[i]._outputs[node] -= 1
+    node._inputs[i] = input_node
+    if input_node is not None:
+        input_node._outputs[node] += 1
+    while node._inputs and node._inputs[-1] is None:
+        node._inputs.pop()
+
+def _unique_name(name):
+    '''Returns `name`, numbered up the way nuke uncollides node names if it is taken'''
+    if name not in _names:
+        return name
+    base = re.sub(r'\d+$', '', name)
+    number = _numbers.get(base, 0) + 1
+    while '%s%d' % (base, number) in _names:
+        number += 1
+    _numbers[base] = number
+    return '%s%d' % (base, number)
+
+class _NodeFactory(object):
+    '''nuke.nodes, `nodes.Grade(inputs = [...], white = 2)` creates a Grade'''
+    def __getattr__(self, node_class):
+        def create(**knobs):
+            calls['nodes.' + node_class] += 1
+            inputs = knobs.pop('inputs', [])
+            node = Node(node_class, knobs)
+            for i, input_node in enumerate(inputs):
+                _connect(node, i, input_node)
+            return node
+        return create
+
+nodes = _NodeFactory()
+
+## script functions
+def _in_context(group = None):
+    '''Returns the nodes of `group`, or of the group entered last (the root when none is)'''
+    if group is None:
+        group = _contexts[-1] if _contexts else None
+    return [n for n in _nodes if n._parent is group]
+
+@counted('allNodes')
+def allNodes(filter = None, group = None):
+    calls['nodes_scanned'] += len(_nodes)
+    return [n for n in _in_context(group) if filter is None or n._class == filter]
+
+@counted('selectedNodes')
+def selectedNodes(filter = None):
+    calls['nodes_scanned'] += len(_nodes)
+    return [n for n in _in_context() if n._selected and (filter is None or n._class == filter)]
+
+@counted('selectedNode')
+def selectedNode():
+    calls['nodes_scanned'] += len(_nodes)
+    selected = [n for n in _in_context() if n._selected]
+    if not selected:
+        raise ValueError('no node selected')
+    return selected[-1]
+
+@counted('toNode')
+def toNode(name):
+    '''Returns the node called `name` (full names such as 'root.Group1.Dot1' included), or None'''
+    return _names.get(name.rpartition('.')[2])
+
+@counted('delete')
+def delete(node):
+    for child in [n for n in _nodes if n._parent is node]:
+        delete(child)
+    for n in list(node._outputs):
+        n._inputs = [None if i is node else i for i in n._inputs]
+        while n._inputs and n._inputs[-1] is None:
+            n._inputs.pop()
+    for i in node._inputs:
+        if i is not None:
+            i._outputs.pop(node, None)
+    _nodes.remove(node)
+    del _names[node._name]
+
+@counted('message')
+def message(text):
+    pass
+
+@counted('ask')
+def ask(text):
+    return ask_answer
+
+## what ask() answers
+ask_answer = True
+
+## channels every script has
+BUILTIN_CHANNELS = ('rgba.red', 'rgba.green', 'rgba.blue', 'rgba.alpha', 'depth.Z')
+
+@counted('channels')
+def channels(node = None):
+    '''Returns the channels of `node`, or every channel the nodes of the script have'''
+    if node is not None:
+        return node.channels()
+    found = dict.fromkeys(BUILTIN_CHANNELS)
+    for n in _nodes:
+        found.update(dict.fromkeys(n._channels))
+    return list(found)
+
+@counted('Layer')
+def Layer(name, channels):
+    pass
+
+@counted('filename')
+def filename(node):
+    return node['file'].value()
+
+_root = Node('Root', name = 'Root')
+_nodes.remove(_root)
+
+def root():
+    return _root
+
+@counted('nodeCopy')
+def nodeCopy(path):
+    '''Writes the class, knobs and inputs of the selected nodes to `path`, one node per line'''
+    with open(path, 'w') as f:
+        for n in _in_context():
+            if n._selected:
+                inputs = [i._name if i is not None else '0' for i in n._inputs]
+                f.write('%s %s %s %s\n' % (n._class, n._name, ','.join(inputs),
+                                            ' '.join('%s=%s' % (name, knob.toScript()) for name, knob in sorted(n._knobs.items()))))
+
+def scriptClear():
+    del _nodes[:]
+    del _contexts[:]
+    _names.clear()
+    _numbers.clear()
+
+def scriptSaveAs(path, overwrite = 0):
+    with open(path, 'w') as f:
+        for n in _nodes:
+            f.write('%s %s\n' % (n._class, n._name))
+
+## callbacks
+_this = []
+on_script_load = []
+
+def addOnScriptLoad(call):
+    on_script_load.append(call)
+
+def thisNode():
+    return _this[-1][0]
+
+def thisKnob():
+    return _this[-1][1]
+
+def knob_changed(node, knob_name):
+    '''Runs the knobChanged script of `node` the way nuke does when `knob_name` changes, eg. 'inputChange' '''
+    script = node.knob('knobChanged')
+    if script is None or not script.value():
+        return
+    _this.append((node, node._knob_or_create(knob_name)))
+    try:
+        exec(script.value(), sys.modules['__main__'].__dict__)
+    finally:
+        _this.pop()
+
+## progress and undo
+class ProgressTask(object):
+    '''nuke.ProgressTask, reports the artist cancelled once `cancel_after` (set on the class) checks have been made'''
+    cancel_after = None
+
+    def __init__(self, title):
+        self.title = title
+        self.message = ''
+        self.progress = 0
+        self.checks = 0
+
+    @counted('ProgressTask.setMessage')
+    def setMessage(self, message):
+        self.message = message
+
+    @counted('ProgressTask.setProgress')
+    def setProgress(self, progress):
+        self.progress = progress
+
+    @counted('ProgressTask.isCancelled')
+    def isCancelled(self):
+        self.checks += 1
+        return self.cancel_after is not None and self.checks > self.cancel_after
+
+class Undo(object):
+    '''nuke.Undo, cancel() deletes the nodes created since the group began (moves and knob changes are kept)'''
+    _groups = []
+
+    @staticmethod
+    @counted('Undo.begin')
+    def begin(name = None):
+        Undo._groups.append({id(n) for n in _nodes})
+
+    @staticmethod
+    @counted('Undo.end')
+    def end():
+        Undo._groups.pop()
+
+    @staticmethod
+    @counted('Undo.cancel')
+    def cancel():
+        existing = Undo._groups.pop()
+        for n in [n for n in _nodes if id(n) not in existing]:
+            delete(n)
+
+## menus
+class Menu(object):
+    '''nuke.Menu, commands are kept as given (the python to run as a string, or a callable)'''
+    def __init__(self, name):
+        self._name = name
+        self._items = []
+
+    def name(self):
+        return self._name
+
+    def items(self):
+        return list(self._items)
+
+    def findItem(self, name):
+        for item in self._items:
+            if item.name() == name:
+                return item
+        return None
+
+    def menu(self, name):
+        '''Returns the sub menu at the path `name` ('a/b'), None when there is none'''
+        item = self
+        for part in name.split('/'):
+            item = item.findItem(part) if isinstance(item, Menu) else None
+        return item
+
+    @counted('Menu.addMenu')
+    def addMenu(self, name, icon = None):
+        item = self
+        for part in name.split('/'):
+            found = item.findItem(part)
+            if found is None:
+                found = Menu(part)
+                item._items.append(found)
+            item = found
+        return item
+
+    @counted('Menu.addCommand')
+    def addCommand(self, name, command = None, shortcut = '', icon = None):
+        menu_path, _, label = name.rpartition('/')
+        menu = self.addMenu(menu_path) if menu_path else self
+        command_item = MenuItem(label, command)
+        menu._items = [item for item in menu._items if item.name() != label] + [command_item]
+        return command_item
+
+    @counted('Menu.clearMenu')
+    def clearMenu(self):
+        del self._items[:]
+
+class MenuItem(object):
+    def __init__(self, name, command):
+        self._name = name
+        self.command = command
+
+    def name(self):
+        return self._name
+
+    def invoke(self):
+        '''Runs the command the way nuke does, strings in the namespace of __main__'''
+        if callable(self.command):
+            return self.command()
+        exec(self.command, sys.modules['__main__'].__dict__)
+
+_menus = {}
+
+@counted('menu')
+def menu(name):
+    if name not in _menus:
+        _menus[name] = Menu(name)
+        if name == 'Nodes':
+            for toolbar_menu in TOOLBAR_MENUS:
+                _menus[name].addMenu(toolbar_menu)
+    return _menus[name]
+
+@counted('pluginAddPath')
+def pluginAddPath(path):
+    '''Puts `path` (relative to the working directory, like the .nuke directory nuke starts init.py in) on sys.path'''
+    sys.path.insert(0, os.path.abspath(path))
+
+## script text
+def _script_value(text):
+    '''Returns the value of a knob line of .nk script text'''
+    text = text.strip()
+    if text.startswith('"'):
+        value = []
+        i = 1
+        while text[i] != '"':
+            if text[i] == '\\':
+                i += 1
+                value.append({'n' : '\n'}.get(text[i], text[i]))
+            else:
+                value.append(text[i])
+            i += 1
+        return ''.join(value)
+    if text.startswith('{'):
+        return text[1:-1]
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+@counted('nodePaste')
+def nodePaste(path):
+    '''Pastes the script text at `path` under the selected node, leaving the pasted nodes selected'''
+    with open(path) as f:
+        lines = f.read().splitlines()
+    selected = [n for n in _in_context() if n._selected]
+    for n in selected:
+        n._selected = False
+    stack = [selected[-1] if selected else None]
+    variables = {}
+    pasted = []
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith('push '):
+            value = line[5:]
+            stack.append(None if value == '0' else variables[value[1:]])
+        elif line.startswith('set '):
+            variables[line.split()[1]] = stack[-1]
+        elif line.endswith(' {') and not line.startswith(' '):
+            node_class = line[:-2]
+            ## nodes without an 'inputs' line take one, nuke writes 'inputs 0' for a Read
+            input_count = 1
+            knobs = {}
+            string_knobs = set()
+            name = None
+            x = y = 0
+            i += 1
+            while lines[i] != '}':
+                key, _, value = lines[i].strip().partition(' ')
+                if key == 'addUserKnob':
+                    knob_type, knob_name = value.strip('{}').split()[:2]
+                    knobs.setdefault(knob_name, '')
+                    ## type 1 is a String_Knob
+                    if knob_type == '1':
+                        string_knobs.add(knob_name)
+                elif key == 'inputs':
+                    input_count = int(value)
+                elif key == 'name':
+                    name = _script_value(value)
+                elif key == 'xpos':
+                    x = int(value)
+                elif key == 'ypos':
+                    y = int(value)
+                else:
+                    knobs[key] = _script_value(value)
+                i += 1
+            for knob_name in string_knobs:
+                knobs[knob_name] = str(knobs[knob_name])
+            inputs = [stack.pop() for _ in range(input_count)]
+            node = Node(node_class, knobs, name)
+            for k, input_node in enumerate(inputs):
+                if input_node is not None:
+                    _connect(node, k, input_node)
+            node._x, node._y = x, y
+            node._selected = True
+            pasted.append(node)
+            stack.append(node)
+        i += 1
+    return pasted[-1] if pasted else None
+
+## set up
+def install():
+    '''Makes `import nuke` return this module'''
+    sys.modules['nuke'] = sys.modules[__name__]
+
+def reset():
+    '''Empties the script and the call counts'''
+    scriptClear()
+    calls.clear()
+    del Undo._groups[:]
+    _menus.clear()
+
+def read_node(channels, **knobs):
+    '''Returns a new Read node with `channels`'''
+    read = nodes.Read(**knobs)
+    read._channels = list(channels)
+    return read
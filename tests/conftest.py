@@ -0,0 +1,24 @@
+'''Puts the package and the stand-in nuke module of benchmarks/fake_nuke.py on the path, so every module imports
+with a plain Python 3 interpreter. `import nuke` returns the stand-in, emptied before each test using the
+fake_nuke fixture.'''
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+PACKAGE = os.path.join(ROOT, '.nuke', 'python')
+BENCHMARKS = os.path.join(ROOT, 'benchmarks')
+
+sys.path.insert(0, PACKAGE)
+sys.path.insert(0, BENCHMARKS)
+
+import fake_nuke
+fake_nuke.install()
+
+@pytest.fixture
+def nuke():
+    '''The stand-in nuke module, with an empty script'''
+    fake_nuke.reset()
+    yield fake_nuke
+    fake_nuke.reset()
@@ -0,0 +1,74 @@
+'''Progress of a rebuild and cancelling it, everything it made rolled back in one undo step'''
+import pytest
+
+import AOV_rebuild_karma
+from AOV_rebuild_karma import RebuildCancelled, undo_group
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS
+from bench_compact import synthetic_channels
+
+@pytest.fixture
+def gui(nuke, monkeypatch):
+    '''nuke with its interface up, so rebuilds show a ProgressTask'''
+    monkeypatch.setattr(nuke, 'GUI', True)
+    return nuke
+
+def cancel_after(nuke, monkeypatch, checks):
+    monkeypatch.setattr(nuke.ProgressTask, 'cancel_after', checks)
+
+def test_undo_group(nuke):
+    kept = nuke.nodes.Dot()
+    with undo_group('kept'):
+        nuke.nodes.Dot()
+    with pytest.raises(RebuildCancelled):
+        with undo_group('cancelled'):
+            nuke.nodes.Dot()
+            nuke.nodes.Dot()
+            raise RebuildCancelled('cancelled')
+    assert len(nuke.allNodes()) == 2 and kept in nuke.allNodes()
+    assert nuke.calls['Undo.cancel'] == 1 and nuke.calls['Undo.end'] == 1
+    assert not nuke.Undo._groups
+
+def test_one_undo_step(gui):
+    read = gui.read_node(synthetic_channels(30), file = '/render/karma.####.exr')
+    pasted = AOV_rebuild_karma.breakout_lightgroups_and_materials(read, dict(DEFAULT_SETTINGS))
+    assert len(pasted) > 100
+    assert gui.calls['Undo.begin'] == gui.calls['Undo.end'] == 1
+    ## a step per aov branch
+    assert gui.calls['ProgressTask.setMessage'] >= 30
+
+def test_cancel_while_building(gui, monkeypatch):
+    read = gui.read_node(synthetic_channels(30), file = '/render/karma.####.exr')
+    cancel_after(gui, monkeypatch, 5)
+    with pytest.raises(RebuildCancelled):
+        AOV_rebuild_karma.breakout_lightgroups_and_materials(read, dict(DEFAULT_SETTINGS))
+    ## nothing is pasted before the graph is complete
+    assert gui.allNodes() == [read]
+    assert gui.calls['Undo.begin'] == 0
+
+def test_cancel_after_the_paste_rolls_back(gui, monkeypatch):
+    read = gui.read_node(synthetic_channels(30), file = '/render/karma.####.exr')
+    AOV_rebuild_karma.breakout_lightgroups_and_materials(read, dict(DEFAULT_SETTINGS))
+    checks = gui.calls['ProgressTask.isCancelled']
+    gui.reset()
+
+    read = gui.read_node(synthetic_channels(30), file = '/render/karma.####.exr')
+    ## cancelled at the very last check, once every node is pasted
+    cancel_after(gui, monkeypatch, checks - 1)
+    with pytest.raises(RebuildCancelled):
+        AOV_rebuild_karma.breakout_lightgroups_and_materials(read, dict(DEFAULT_SETTINGS))
+    assert gui.calls['nodePaste'] == 1
+    assert gui.allNodes() == [read]
+    assert gui.calls['Undo.cancel'] == 1 and not gui.Undo._groups
+
+def test_cancel_batch_rolls_back(gui, monkeypatch):
+    reads = [gui.read_node(synthetic_channels(20), file = '/render/%s.####.exr' % name) for name in 'abc']
+    for x, read in enumerate(reads):
+        read.setXYpos(x * 100, 0)
+    ## cancelled while the second Read is built, the rebuild of the first is undone too
+    checks = AOV_rebuild_karma.branch_total(AOV_rebuild_karma.get_layer_index(reads[0], DEFAULT_SETTINGS)) + 10
+    cancel_after(gui, monkeypatch, checks)
+    with pytest.raises(RebuildCancelled):
+        AOV_rebuild_karma.batch_breakout_lightgroups_and_materials(reads, dict(DEFAULT_SETTINGS))
+    assert gui.calls['nodePaste'] == 1
+    assert gui.allNodes() == reads
+    assert not gui.Undo._groups
@@ -0,0 +1,69 @@
+'''The channel budget of a rebuild and the layer it keeps the original beauty in'''
+import AOV_rebuild_karma
+import AOV_rebuild_karma_channels
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, ORIGINAL_LAYER, build_rebuild_graph
+from AOV_rebuild_karma_channels import BUILTIN_CHANNELS, channel_budget, graph_channels, render_budgets, scratch_layer
+from AOV_rebuild_karma_exr import write_exr
+from AOV_rebuild_karma_graph import ExternalNode
+from AOV_rebuild_karma_layers import classify_channels
+
+def rgba(*layers):
+    return ['%s.%s' % (layer, c) for layer in layers for c in ('red', 'green', 'blue', 'alpha')]
+
+CHANNELS = rgba('rgba', 'albedo', 'sss', 'LG_key', 'LG_fill')
+
+def test_scratch_layer_keeps_the_original_layer():
+    assert scratch_layer(CHANNELS, BUILTIN_CHANNELS) == ORIGINAL_LAYER
+    ## once the script has it, it is shared even with a layer to reuse around
+    assert scratch_layer(CHANNELS, rgba('rgba', 'diffuse', ORIGINAL_LAYER)) == ORIGINAL_LAYER
+
+def test_scratch_layer_reuses_a_layer_of_the_script():
+    registered = list(BUILTIN_CHANNELS) + rgba('LG_key', 'zdiffuse', 'diffuse') + ['motion.red', 'motion.green']
+    ## LG_key is carried by the stream, motion has no blue or alpha, rgba is never reused
+    assert scratch_layer(CHANNELS, registered) == 'diffuse'
+    assert scratch_layer(CHANNELS + rgba('diffuse'), registered) == 'zdiffuse'
+    assert scratch_layer(CHANNELS + rgba('diffuse', 'zdiffuse'), registered) == ORIGINAL_LAYER
+    assert scratch_layer(CHANNELS, registered, layer = 'keep') == 'diffuse'
+
+def test_channel_budget():
+    stream = CHANNELS + ['depth.Z']
+    budget = channel_budget(stream, rgba('rgba', ORIGINAL_LAYER), BUILTIN_CHANNELS, limit = 30)
+    assert budget['registered'] == 5 and budget['stream_channels'] == 21
+    ## what the script or the stream already has is not counted twice
+    assert budget['stream_new'] == sorted(rgba('albedo', 'sss', 'LG_key', 'LG_fill'))
+    assert budget['rebuild_new'] == sorted(rgba(ORIGINAL_LAYER))
+    assert budget['total'] == 5 + 16 + 4 and budget['headroom'] == 5
+
+    over = channel_budget(stream, rgba(ORIGINAL_LAYER), BUILTIN_CHANNELS, limit = 20)
+    assert over['headroom'] == -5
+    assert 'OVER THE LIMIT by 5 channels' in AOV_rebuild_karma_channels.format_budget(over)
+    assert channel_budget(stream, rgba(ORIGINAL_LAYER), stream + rgba(ORIGINAL_LAYER))['total'] == 25
+
+def test_rebuild_adds_only_the_original_layer():
+    layer_index = classify_channels(CHANNELS)
+    for compact in (False, True):
+        graph = build_rebuild_graph(layer_index, dict(DEFAULT_SETTINGS, compact = compact), ExternalNode(None))
+        budget = channel_budget(CHANNELS, graph_channels(graph))
+        assert budget['rebuild_new'] == sorted(rgba(ORIGINAL_LAYER)), compact
+    graph = build_rebuild_graph(layer_index, dict(DEFAULT_SETTINGS, original_layer = 'diffuse'), ExternalNode(None))
+    assert channel_budget(CHANNELS, graph_channels(graph), BUILTIN_CHANNELS + tuple(rgba('diffuse')))['rebuild_new'] == []
+
+def test_render_budgets(tmp_path):
+    karma = ['R', 'G', 'B', 'A'] + ['%s.%s' % (aov, c) for aov in ('albedo', 'sss', 'LG_key') for c in 'RGB']
+    write_exr(str(tmp_path / 'karma.1001.exr'), karma)
+    write_exr(str(tmp_path / 'karma_fx.1001.exr'), karma + ['LG_fx.%s' % c for c in 'RGB'])
+    first, second = render_budgets([str(tmp_path / 'karma.####.exr'), str(tmp_path / 'karma_fx.####.exr')])
+    assert len(first['stream_new']) == 9 and first['rebuild_new']
+    ## the second render only adds its own lightgroup, the original layer is shared
+    assert second['stream_new'] == ['LG_fx.blue', 'LG_fx.green', 'LG_fx.red'] and second['rebuild_new'] == []
+    assert second['total'] == first['total'] + 3
+    assert AOV_rebuild_karma_channels.main([str(tmp_path / 'karma.####.exr'), '--limit', '10']) == 1
+
+def test_reuse_channels_in_the_script(nuke):
+    nuke.read_node(rgba('rgba', 'diffuse'), file = '/render/plate.####.exr')
+    read = nuke.read_node(CHANNELS, file = '/render/karma.####.exr')
+    settings = dict(DEFAULT_SETTINGS, reuse_channels = True)
+    assert AOV_rebuild_karma.channel_settings(read, settings)['original_layer'] == 'diffuse'
+    assert AOV_rebuild_karma.channel_budget([read], settings)[read.name()]['rebuild_new'] == []
+    assert AOV_rebuild_karma.channel_budget([read], dict(DEFAULT_SETTINGS))[read.name()]['rebuild_new'] == \
+        sorted(rgba(ORIGINAL_LAYER))
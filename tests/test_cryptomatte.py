@@ -0,0 +1,64 @@
+'''Cryptomatte ids of the names a Cryptomatte node picks, from the manifest or hashed'''
+import json
+import struct
+
+import pytest
+
+from AOV_rebuild_karma_cryptomatte import (_murmur3_32, crypto_layers, matte_ids, name_to_id, parse_matte_list,
+                                           rank_layers)
+
+def float_bits(value):
+    return struct.unpack('<I', struct.pack('<f', value))[0]
+
+## the manifest gives bunny an id its hash would not
+METADATA = {'cryptomatte/0a1b2c3/name' : 'CryptoMaterial',
+            'cryptomatte/0a1b2c3/hash' : 'MurmurHash3_32',
+            'cryptomatte/0a1b2c3/manifest' : json.dumps({'bunny' : '3f800000', 'car,red' : '40000000'}),
+            'cryptomatte/9f8e7d6/name' : 'CryptoObject',
+            'cryptomatte/9f8e7d6/hash' : 'MurmurHash3_32',
+            'exr/HoudiniVersion' : '21.0.440'}
+
+@pytest.mark.parametrize('data, seed, expected', [
+    (b'', 0, 0),
+    (b'', 1, 0x514e28b7),
+    (b'hello', 0, 0x248bfa47),
+    (b'The quick brown fox jumps over the lazy dog', 0, 0x2e4ff723),
+])
+def test_murmur3(data, seed, expected):
+    assert _murmur3_32(data, seed) == expected
+
+def test_name_to_id():
+    assert float_bits(name_to_id('hello')) == 0x248bfa47
+    ## hashes with a denormal or inf / nan exponent get bit 23 flipped
+    assert _murmur3_32(b'asset3') == 0x8003d262 and float_bits(name_to_id('asset3')) == 0x8083d262
+    assert _murmur3_32(b'asset295') == 0x7fbcd8a9 and float_bits(name_to_id('asset295')) == 0x7f3cd8a9
+
+def test_parse_matte_list():
+    assert parse_matte_list('bunny, car\\,red, <1.4378e-21>, ,') == ['bunny', 'car,red', '<1.4378e-21>']
+    assert parse_matte_list('back\\\\slash,') == ['back\\slash']
+    assert parse_matte_list('') == [] and parse_matte_list(None) == []
+
+def test_crypto_layers():
+    layers = crypto_layers(METADATA)
+    assert sorted(layers) == ['CryptoMaterial', 'CryptoObject']
+    assert 'manifest' not in layers['CryptoObject']
+
+def test_manifest_ids():
+    ids = matte_ids(METADATA, 'CryptoMaterial', ['bunny', 'car,red', 'teapot'])
+    assert ids == [1.0, 2.0, name_to_id('teapot')]
+
+def test_hashed_without_a_manifest():
+    assert matte_ids(METADATA, 'CryptoObject', ['bunny']) == [name_to_id('bunny')]
+    assert matte_ids(METADATA, 'CryptoAsset', ['bunny']) == [name_to_id('bunny')]
+    broken = dict(METADATA, **{'cryptomatte/0a1b2c3/manifest' : '{"bunny" : '})
+    assert matte_ids(broken, 'CryptoMaterial', ['bunny']) == [name_to_id('bunny')]
+
+def test_raw_ids():
+    ## ids the node could not name are used as they are, unreadable ones are left out
+    assert matte_ids(METADATA, 'CryptoMaterial', ['<1.5>', '<2e-21>', '<bunny>']) == [1.5, 2e-21]
+    teapot = name_to_id('teapot')
+    assert matte_ids(METADATA, 'CryptoMaterial', parse_matte_list('<%r>, bunny' % teapot)) == [teapot, 1.0]
+
+def test_rank_layers():
+    layers = ['CryptoMaterial02', 'CryptoMaterial00', 'CryptoMaterial', 'CryptoMaterial01', 'CryptoObject00', 'CryptoMaterial001']
+    assert rank_layers(layers, 'CryptoMaterial') == ['CryptoMaterial00', 'CryptoMaterial01', 'CryptoMaterial02']
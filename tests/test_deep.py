@@ -0,0 +1,52 @@
+'''The deep rebuild: a DeepColorCorrect per aov, one DeepExpression summing them and one DeepToImage'''
+import AOV_rebuild_karma
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, build_deep_rebuild_graph, deep_sum_knobs, summed_aovs
+from AOV_rebuild_karma_graph import ExternalNode
+from AOV_rebuild_karma_layers import classify_channels
+
+def rgba(*layers):
+    return ['%s.%s' % (layer, c) for layer in layers for c in ('red', 'green', 'blue', 'alpha')]
+
+CHANNELS = rgba('rgba', 'albedo', 'directdiffuse', 'sss', 'LG_key', 'LG_fill')
+
+def test_one_pipe():
+    layer_index = classify_channels(CHANNELS)
+    knobs = deep_sum_knobs(layer_index, [('lightgroups', ['LG_key', 'LG_fill'])])
+    assert knobs == {'chans0' : 'rgb',
+                     'rgba.red' : '(LG_key.red + LG_fill.red)',
+                     'rgba.green' : '(LG_key.green + LG_fill.green)',
+                     'rgba.blue' : '(LG_key.blue + LG_fill.blue)'}
+
+def test_both_pipes():
+    ## rgb * (materials / rgb) * (lightgroups / rgb), per sample
+    layer_index = classify_channels(CHANNELS)
+    knobs = deep_sum_knobs(layer_index, [('materials', ['directdiffuse', 'sss']), ('lightgroups', ['LG_key', 'LG_fill'])])
+    assert knobs['rgba.green'] == ('rgba.green != 0 ? (directdiffuse.green + sss.green) * (LG_key.green + LG_fill.green)'
+                                   ' / rgba.green : 0')
+
+def test_missing_channels_are_left_out():
+    ## LG_rim only has red, a pipe with nothing to sum adds up to 0
+    layer_index = classify_channels(CHANNELS + ['LG_rim.red'])
+    knobs = deep_sum_knobs(layer_index, [('lightgroups', ['LG_key', 'LG_rim'])])
+    assert knobs['rgba.red'] == '(LG_key.red + LG_rim.red)'
+    assert knobs['rgba.green'] == '(LG_key.green)'
+    assert deep_sum_knobs(layer_index, [('lightgroups', ['LG_gone'])])['rgba.blue'] == '(0)'
+
+def test_deep_rebuild_graph():
+    layer_index = classify_channels(CHANNELS)
+    graph = build_deep_rebuild_graph(layer_index, dict(DEFAULT_SETTINGS), ExternalNode(None, node_class = 'DeepRead'))
+    classes = [n.node_class for n in graph.node_list]
+    summed = [aov for _, aovs in summed_aovs(layer_index, DEFAULT_SETTINGS) for aov in aovs]
+    assert [n['channels'].value() for n in graph.node_list if n.node_class == 'DeepColorCorrect'] == summed
+    assert classes.count('DeepExpression') == classes.count('DeepToImage') == 1
+    ## albedo is broken out by the flat rebuild but not summed, a note says so
+    note = next(n for n in graph.node_list if n.node_class == 'StickyNote')
+    assert '<i>albedo</i> not summed' in note['label'].value()
+
+def test_deep_read_gets_a_deep_rebuild(nuke):
+    read = nuke.nodes.DeepRead(file = '/render/karma_deep.####.exr')
+    read._channels = CHANNELS
+    pasted = AOV_rebuild_karma.breakout_lightgroups_and_materials(read, dict(DEFAULT_SETTINGS))
+    assert AOV_rebuild_karma.rebuild_end(pasted).Class() == 'DeepToImage'
+    deep_sum = next(n for n in pasted if n.Class() == 'DeepExpression')
+    assert deep_sum['rgba.red'].value().startswith('rgba.red != 0 ? (')
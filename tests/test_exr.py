@@ -0,0 +1,103 @@
+'''The header-only EXR scanner on synthetic renders written by write_exr'''
+import struct
+
+import pytest
+
+from AOV_rebuild_karma_exr import (EXR_COMPRESSION, EXR_MAGIC, EXR_MULTIPART_FLAG, HEADER_READ_SIZE, ExrHeaderError,
+                                   _attribute, layer_data_windows, nuke_channels, read_exr_header, scan_exr_layers,
+                                   write_exr)
+
+KARMA_CHANNELS = ['R', 'G', 'B', 'A', 'combineddiffuse.R', 'combineddiffuse.G', 'combineddiffuse.B', 'LG_key.R', 'LG_key.G', 'LG_key.B',
+                  'N.x', 'N.y', 'N.z', 'Z']
+
+def part_header(name, channels, data_window, compression = 'zip'):
+    '''Packs the header of one part of a multipart scanline EXR with half float `channels`'''
+    chlist = b''.join(c.encode() + b'\0' + struct.pack('<iB3xii', 1, 0, 1, 1) for c in sorted(channels)) + b'\0'
+    return (_attribute('channels', 'chlist', chlist)
+            + _attribute('compression', 'compression', bytes([EXR_COMPRESSION.index(compression)]))
+            + _attribute('dataWindow', 'box2i', struct.pack('<4i', *data_window))
+            + _attribute('displayWindow', 'box2i', struct.pack('<4i', 0, 0, 63, 31))
+            + _attribute('lineOrder', 'lineOrder', b'\0')
+            + _attribute('name', 'string', name.encode())
+            + _attribute('type', 'string', b'scanlineimage')
+            + _attribute('chunkCount', 'int', struct.pack('<i', 1))
+            + b'\0')
+
+def write_multipart_exr(path, parts):
+    '''Writes the headers of a multipart EXR of `parts` (name, channels, data window), with no pixels'''
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<iI', EXR_MAGIC, 2 | EXR_MULTIPART_FLAG))
+        for part in parts:
+            f.write(part_header(*part))
+        f.write(b'\0')
+        f.write(struct.pack('<Q', 0) * len(parts))
+
+def test_channel_list(tmp_path):
+    path = str(tmp_path / 'karma.1001.exr')
+    write_exr(path, KARMA_CHANNELS)
+    header = read_exr_header(path)
+    assert header['channels'] == sorted(KARMA_CHANNELS)
+    assert not header['multipart']
+    assert not header['deep']
+    assert sorted(nuke_channels(header)) == sorted(
+        ['rgba.red', 'rgba.green', 'rgba.blue', 'rgba.alpha', 'combineddiffuse.red', 'combineddiffuse.green', 'combineddiffuse.blue',
+         'LG_key.red', 'LG_key.green', 'LG_key.blue', 'N.x', 'N.y', 'N.z', 'depth.Z'])
+
+def test_data_and_display_window(tmp_path):
+    path = str(tmp_path / 'crop.exr')
+    write_exr(path, ['R', 'G', 'B'], data_window = (4, 2, 19, 9), display_window = (0, 0, 31, 15))
+    header = read_exr_header(path)
+    assert header['data_window'] == (4, 2, 19, 9)
+    assert header['display_window'] == (0, 0, 31, 15)
+
+@pytest.mark.parametrize('compression', ['none', 'zips', 'zip', 'piz', 'dwaa'])
+def test_compression(tmp_path, compression):
+    path = str(tmp_path / 'compressed.exr')
+    write_exr(path, ['R', 'G', 'B'], compression = compression)
+    assert read_exr_header(path)['compression'] == compression
+
+def test_metadata_and_classification(tmp_path):
+    path = str(tmp_path / 'karma.1001.exr')
+    write_exr(path, KARMA_CHANNELS, metadata = {'comment' : 'sh010'})
+    header = scan_exr_layers(path)
+    assert header['metadata'] == {'comment' : 'sh010'}
+    index = header['layer_index']
+    assert index['materials'] == ['combineddiffuse']
+    assert index['lightgroups'] == ['LG_key']
+
+def test_header_larger_than_first_read(tmp_path):
+    path = str(tmp_path / 'long.exr')
+    write_exr(path, ['R', 'G', 'B'], metadata = {'long' : 'x' * (HEADER_READ_SIZE * 2)})
+    header = read_exr_header(path)
+    assert len(header['metadata']['long']) == HEADER_READ_SIZE * 2
+    assert header['channels'] == ['B', 'G', 'R']
+
+def test_multipart(tmp_path):
+    path = str(tmp_path / 'multipart.exr')
+    write_multipart_exr(path, [('rgba', ['R', 'G', 'B', 'A'], (0, 0, 63, 31)),
+                               ('LG_key', ['LG_key.R', 'LG_key.G', 'LG_key.B'], (10, 4, 20, 12))])
+    header = read_exr_header(path)
+    assert header['multipart']
+    assert [part['name'] for part in header['parts']] == ['rgba', 'LG_key']
+    assert header['channels'] == ['A', 'B', 'G', 'R', 'LG_key.B', 'LG_key.G', 'LG_key.R']
+    assert header['data_window'] == (0, 0, 63, 31)
+    assert layer_data_windows(header) == {'rgba' : (0, 0, 63, 31), 'LG_key' : (10, 4, 20, 12)}
+
+def test_not_an_exr(tmp_path):
+    path = tmp_path / 'karma.1001.exr'
+    path.write_bytes(b'this is not an exr, only a text file long enough to read a magic number from')
+    with pytest.raises(ExrHeaderError):
+        read_exr_header(str(path))
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'karma.1001.exr'
+    path.write_bytes(b'')
+    with pytest.raises(ExrHeaderError):
+        read_exr_header(str(path))
+
+def test_truncated_header(tmp_path):
+    path = tmp_path / 'karma.1001.exr'
+    write_exr(str(path), KARMA_CHANNELS)
+    path.write_bytes(path.read_bytes()[:60])
+    with pytest.raises(ExrHeaderError, match = 'truncated'):
+        read_exr_header(str(path))
@@ -0,0 +1,140 @@
+'''The farm dispatcher driving Python workers, `import nuke` in the workers giving the stand-in of fake_nuke.py'''
+import json
+import os
+import sys
+
+import pytest
+
+import AOV_rebuild_karma_farm
+from AOV_rebuild_karma_exr import write_exr
+from conftest import BENCHMARKS
+
+KARMA_CHANNELS = ['R', 'G', 'B', 'A', 'albedo.R', 'albedo.G', 'albedo.B', 'sss.R', 'sss.G', 'sss.B',
+                  'LG_key.R', 'LG_key.G', 'LG_key.B', 'LG_fill.R', 'LG_fill.G', 'LG_fill.B']
+
+## made importable as nuke on the workers' PYTHONPATH
+NUKE_SHIM = '''import fake_nuke
+fake_nuke.install()
+'''
+
+@pytest.fixture
+def shot_dir(tmp_path, monkeypatch):
+    shim = tmp_path / 'shim'
+    shim.mkdir()
+    (shim / 'nuke.py').write_text(NUKE_SHIM)
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join([str(shim), BENCHMARKS]))
+    for shot in ('sh010', 'sh020'):
+        (tmp_path / shot).mkdir()
+        for frame in (1001, 1002):
+            write_exr(str(tmp_path / shot / ('karma.%d.exr' % frame)), KARMA_CHANNELS)
+    return tmp_path
+
+def write_manifest(shot_dir, shots, settings = None):
+    path = shot_dir / 'shots.json'
+    path.write_text(json.dumps({'settings' : settings or {}, 'shots' : shots}))
+    return str(path)
+
+def test_load_manifest(shot_dir):
+    manifest = write_manifest(shot_dir, [{'read' : 'sh010/karma.####.exr', 'output' : '/comp/sh010.nk'},
+                                         {'name' : 'sh020', 'read' : '/render/sh020/karma.####.exr', 'output' : 'comp/sh020.nk'}])
+    shots = AOV_rebuild_karma_farm.load_manifest(manifest)['shots']
+    assert [shot['name'] for shot in shots] == ['shot001', 'sh020']
+    assert [shot['read'] for shot in shots] == [str(shot_dir / 'sh010' / 'karma.####.exr'), '/render/sh020/karma.####.exr']
+    assert [shot['output'] for shot in shots] == ['/comp/sh010.nk', str(shot_dir / 'comp' / 'sh020.nk')]
+
+def test_worker_command():
+    command = AOV_rebuild_karma_farm.worker_command('/shots.json', [0, 1], '/opt/nuke/Nuke15.1')
+    assert command[:2] == ['/opt/nuke/Nuke15.1', '-t']
+    assert command[-3:] == ['--shots', '0,1', '/shots.json']
+    assert AOV_rebuild_karma_farm.worker_command('/shots.json', [0])[0] == sys.executable
+
+def test_shot_chunks():
+    assert AOV_rebuild_karma_farm.shot_chunks(8, 8) == [[i] for i in range(8)]
+    assert AOV_rebuild_karma_farm.shot_chunks(5, 2) == [[0, 1, 2], [3, 4]]
+    assert AOV_rebuild_karma_farm.shot_chunks(3, 8) == [[0], [1], [2]]
+    assert AOV_rebuild_karma_farm.shot_chunks(0, 4) == []
+    ## capped, bigger manifests queue more sessions than there are workers
+    chunks = AOV_rebuild_karma_farm.shot_chunks(100, 4, 8)
+    assert len(chunks) == 13 and max(len(chunk) for chunk in chunks) == 8
+    assert sum(chunks, []) == list(range(100))
+
+def test_every_worker_gets_shots(shot_dir, monkeypatch):
+    manifest = write_manifest(shot_dir, [{'name' : 'sh%03d' % i, 'read' : 'sh010/karma.####.exr', 'output' : 'comp/%d.nk' % i}
+                                         for i in range(8)])
+    commands = []
+    def run_chunk(command):
+        commands.append(command)
+        return [], 0, ''
+    monkeypatch.setattr(AOV_rebuild_karma_farm, 'run_chunk', run_chunk)
+    AOV_rebuild_karma_farm.build_manifest(manifest, workers = 8)
+    assert sorted(command[command.index('--shots') + 1] for command in commands) == [str(i) for i in range(8)]
+
+def test_duplicate_shot_names(shot_dir, capsys):
+    manifest = write_manifest(shot_dir, [{'name' : 'sh010', 'read' : 'sh010/karma.####.exr', 'output' : 'comp/a.nk'},
+                                         {'name' : 'sh010', 'read' : 'sh020/karma.####.exr', 'output' : 'comp/b.nk'}])
+    with pytest.raises(ValueError, match = 'sh010 is used twice'):
+        AOV_rebuild_karma_farm.load_manifest(manifest)
+    assert AOV_rebuild_karma_farm.main([manifest, '--python']) == 2
+    assert 'used twice' in capsys.readouterr().err
+
+def test_run_chunk():
+    result = {'name' : 'sh010', 'output' : '/comp/sh010.nk', 'error' : None, 'nodes' : 12, 'seconds' : 0.5}
+    code = 'print("loading plugins")\nprint(%r)' % (AOV_rebuild_karma_farm.RESULT_PREFIX + json.dumps(result))
+    results, returncode, output = AOV_rebuild_karma_farm.run_chunk([sys.executable, '-c', code])
+    assert results == [result]
+    assert returncode == 0
+    assert output.startswith('loading plugins')
+
+def test_builds_every_shot(shot_dir):
+    manifest = write_manifest(shot_dir, [
+        {'name' : 'sh010', 'read' : 'sh010/karma.####.exr', 'first' : 1001, 'last' : 1002, 'output' : 'comp/sh010.nk'},
+        {'name' : 'sh020', 'read' : 'sh020/karma.####.exr', 'output' : 'comp/sh020.nk',
+         'settings' : {'breakout_lightgroups' : False}}])
+    results = AOV_rebuild_karma_farm.build_manifest(manifest, workers = 2, shots_per_process = 1)
+
+    assert [result['name'] for result in results] == ['sh010', 'sh020']
+    for result in results:
+        assert result['error'] is None
+        assert result['output'] == str(shot_dir / 'comp' / ('%s.nk' % result['name']))
+        assert os.path.isfile(result['output'])
+    ## the shot override leaves the lightgroups out
+    assert results[0]['nodes'] > results[1]['nodes'] > 0
+
+    with open(results[0]['output']) as f:
+        saved = [line.split() for line in f]
+    assert ['Read', 'Read1'] in saved
+    assert sum(1 for node_class, _name in saved if node_class == 'Premult') == 1
+    assert len(saved) == results[0]['nodes'] + 1
+
+def test_result_lines(shot_dir, capfd):
+    manifest = write_manifest(shot_dir, [
+        {'name' : 'sh010', 'read' : 'sh010/karma.####.exr', 'output' : 'comp/sh010.nk'},
+        {'name' : 'missing', 'read' : 'missing/karma.####.exr', 'output' : 'comp/missing.nk'}])
+    AOV_rebuild_karma_farm.run_worker(manifest, [0, 1])
+    lines = [line for line in capfd.readouterr().out.splitlines()
+             if line.startswith(AOV_rebuild_karma_farm.RESULT_PREFIX)]
+    results = [json.loads(line[len(AOV_rebuild_karma_farm.RESULT_PREFIX):]) for line in lines]
+    assert [result['name'] for result in results] == ['sh010', 'missing']
+    assert results[0]['error'] is None and results[0]['nodes'] > 0
+    assert results[1]['error'] == 'ValueError: no channels in %s' % (shot_dir / 'missing' / 'karma.####.exr')
+
+def test_dead_worker(shot_dir):
+    manifest = write_manifest(shot_dir, [{'name' : 'sh010', 'read' : 'sh010/karma.####.exr', 'output' : 'comp/sh010.nk'},
+                                         {'name' : 'sh020', 'read' : 'sh020/karma.####.exr', 'output' : 'comp/sh020.nk'}])
+    ## a nuke that quits as it starts, taking the worker down before it builds anything
+    (shot_dir / 'shim' / 'nuke.py').write_text('import sys\nprint("nuke: no license available")\nsys.exit(3)\n')
+    results = AOV_rebuild_karma_farm.build_manifest(manifest, workers = 1)
+    assert [result['error'] for result in results] == ['worker exited with 3: nuke: no license available'] * 2
+
+def test_silent_dead_worker(shot_dir):
+    manifest = write_manifest(shot_dir, [{'name' : 'sh010', 'read' : 'sh010/karma.####.exr', 'output' : 'comp/sh010.nk'}])
+    (shot_dir / 'shim' / 'nuke.py').write_text('import sys\nsys.exit(3)\n')
+    results = AOV_rebuild_karma_farm.build_manifest(manifest, workers = 1)
+    assert [result['error'] for result in results] == ['worker exited with 3: ']
+
+def test_main_exit_code(shot_dir, capsys):
+    manifest = write_manifest(shot_dir, [{'name' : 'sh010, take 2', 'read' : 'sh010/karma.####.exr', 'output' : 'comp/sh010.nk'}])
+    assert AOV_rebuild_karma_farm.main([manifest, '--python', '--json']) == 0
+    ## the name goes back to the worker as an index, a comma in it does not split it
+    result = json.loads(capsys.readouterr().out)[0]
+    assert (result['name'], result['error']) == ('sh010, take 2', None)
@@ -0,0 +1,41 @@
+'''Finding the nodes of one rebuild from any of them, without looking through the rest of the script'''
+import AOV_rebuild_karma
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS
+from bench_compact import synthetic_channels
+
+def rebuild(nuke, aov_count = 10):
+    read = nuke.read_node(synthetic_channels(aov_count), file = '/render/karma.####.exr')
+    return read, AOV_rebuild_karma.breakout_lightgroups_and_materials(read, dict(DEFAULT_SETTINGS))
+
+def names(nodes):
+    return sorted(n.fullName() for n in nodes)
+
+def test_from_a_connected_node(nuke):
+    _read, pasted = rebuild(nuke)
+    assert names(AOV_rebuild_karma.find_rebuild_nodes(pasted[-1])) == names(pasted)
+
+def test_from_a_sticky_note(nuke):
+    _read, pasted = rebuild(nuke)
+    notes = [n for n in pasted if n.Class() == 'StickyNote']
+    assert notes
+    for note in notes:
+        assert names(AOV_rebuild_karma.find_rebuild_nodes(note)) == names(pasted)
+
+def test_rebuilds_are_kept_apart(nuke):
+    _read, first = rebuild(nuke)
+    _read, second = rebuild(nuke, 20)
+    note = next(n for n in second if n.Class() == 'StickyNote')
+    assert names(AOV_rebuild_karma.find_rebuild_nodes(note)) == names(second)
+    assert names(AOV_rebuild_karma.find_rebuild_nodes(first[0])) == names(first)
+
+def test_no_script_scan(nuke):
+    _read, pasted = rebuild(nuke)
+    for i in range(500):
+        nuke.nodes.StickyNote(label = 'notes %d' % i)
+    nuke.calls.clear()
+    AOV_rebuild_karma.find_rebuild_nodes(next(n for n in pasted if n.Class() == 'StickyNote'))
+    assert nuke.calls['allNodes'] == 0
+    assert nuke.calls['nodes_scanned'] == 0
+
+def test_untagged_node(nuke):
+    assert AOV_rebuild_karma.find_rebuild_nodes(nuke.nodes.Grade()) == []
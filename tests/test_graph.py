@@ -0,0 +1,148 @@
+'''The script text of a rebuild graph and the tags it gives every node'''
+import pytest
+
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, build_rebuild_graph
+from AOV_rebuild_karma_graph import (GRAPH_KEY_KNOB, REBUILD_ID_KNOB, REBUILD_ROLE_KNOB, TAG_KNOB_PREFIX, Expression,
+                                     ExternalNode, Graph, nk_value)
+from AOV_rebuild_karma_layers import classify_channels
+
+def rgba(*layers):
+    return ['%s.%s' % (layer, c) for layer in layers for c in ('red', 'green', 'blue', 'alpha')]
+
+def rebuild(**settings):
+    channels = rgba('rgba', 'albedo', 'sss', 'LG_key', 'LG_fill')
+    return build_rebuild_graph(classify_channels(channels), dict(DEFAULT_SETTINGS, **settings), ExternalNode(None))
+
+def nk_nodes(text):
+    '''Returns the (class, knobs) of every node block of `text`, knobs as written'''
+    nodes = []
+    for line in text.splitlines():
+        if line.endswith(' {') and not line.startswith(' '):
+            nodes.append((line[:-2], {}))
+        elif line.startswith(' ') and nodes and not line.startswith(' addUserKnob'):
+            name, _, value = line[1:].partition(' ')
+            nodes[-1][1][name] = value
+    return nodes
+
+def test_every_node_is_tagged():
+    graph = rebuild()
+    nodes = nk_nodes(graph.to_nk())
+    assert len(nodes) == len(graph.node_list)
+    assert {knobs[REBUILD_ID_KNOB] for _, knobs in nodes} == {graph.rebuild_id}
+    assert sorted(int(knobs[GRAPH_KEY_KNOB]) for _, knobs in nodes) == list(range(len(nodes)))
+
+def test_roles_are_the_names_given():
+    graph = rebuild()
+    roles = [knobs.get(REBUILD_ROLE_KNOB) for _, knobs in nk_nodes(graph.to_nk())]
+    assert roles.count('start_dot') == 2
+    assert roles.count('aov_dot') == 4
+    ## the name is uncollided, the role is not
+    names = [knobs['name'] for _, knobs in nk_nodes(graph.to_nk()) if knobs.get(REBUILD_ROLE_KNOB) == 'aov_dot']
+    assert len(set(names)) == 4
+
+def test_rebuild_ids():
+    assert rebuild().rebuild_id != rebuild().rebuild_id
+    assert Graph(rebuild_id = 'abc123').rebuild_id == 'abc123'
+
+## strings nuke would read as a tcl command, a variable or the end of the value unless escaped
+AWKWARD_STRINGS = ['say "hi"', '[value root.name]', '$gui', 'Pruned AOVs:\nLG_rim', 'C:\\render', 'two words', '']
+
+def small_graph():
+    graph = Graph(rebuild_id = 'abc123')
+    read = graph.nodes.Read(file = '/render/karma.####.exr', first = 1001, last = 1010)
+    dot = graph.nodes.Dot(inputs = [graph.source])
+    dot.setName('start_dot', uncollide = True)
+    dot.setXYpos(34, 103)
+    merge = graph.nodes.Merge2(inputs = [dot, read], operation = 'plus', mix = 0.5, disable = False, label = 'LG_key')
+    graph.nodes.Grade(inputs = [merge], white = [Expression('parent.white.r'), 1.0, 2.5])
+    graph.nodes.StickyNote(label = 'Pruned AOVs:\nLG_rim')
+    graph.add_layer('LG_key', ['LG_key.red', 'LG_key.green', 'LG_key.blue'])
+    return graph
+
+## small_graph() as script text, without the tag knobs
+SMALL_GRAPH_NK = '''set cut_paste_input [stack 0]
+add_layer {LG_key LG_key.red LG_key.green LG_key.blue}
+Read {
+ inputs 0
+ file "/render/karma.####.exr"
+ first 1001
+ last 1010
+ xpos 0
+ ypos 0
+}
+set N0 [stack 0]
+push $cut_paste_input
+Dot {
+ name start_dot
+ xpos 34
+ ypos 103
+}
+set N1 [stack 0]
+push $N0
+push $N1
+Merge2 {
+ inputs 2
+ operation plus
+ mix 0.5
+ disable false
+ label LG_key
+ xpos 0
+ ypos 0
+}
+set N2 [stack 0]
+Grade {
+ white {{parent.white.r} 1 2.5}
+ xpos 0
+ ypos 0
+}
+StickyNote {
+ inputs 0
+ label "Pruned AOVs:\\nLG_rim"
+ xpos 0
+ ypos 0
+}
+'''
+
+def test_to_nk():
+    text = small_graph().to_nk()
+    assert '\n'.join(l for l in text.splitlines() if TAG_KNOB_PREFIX not in l) + '\n' == SMALL_GRAPH_NK
+
+@pytest.mark.parametrize('value, written', [
+    ('LG_key', 'LG_key'),
+    ('/render/LG_key.exr', '/render/LG_key.exr'),
+    ('say "hi"', r'"say \"hi\""'),
+    ('[value root.name]', r'"\[value root.name]"'),
+    ('$gui', r'"\$gui"'),
+    ('Pruned AOVs:\nLG_rim', r'"Pruned AOVs:\nLG_rim"'),
+    ('C:\\render', r'"C:\\render"'),
+    ('', '""'),
+    (True, 'true'),
+    (3, '3'),
+    (2.0, '2'),
+    (0.25, '0.25'),
+    (Expression('parent.mix'), '{parent.mix}'),
+    ([Expression('$gui'), 0], r'{{"\$gui"} 0}'),
+])
+def test_nk_value(value, written):
+    assert nk_value(value) == written
+
+def test_round_trip(nuke, tmp_path):
+    source = nuke.nodes.Read(file = '/render/karma.####.exr')
+    source.setSelected(True)
+    graph = small_graph()
+    for label in AWKWARD_STRINGS:
+        graph.nodes.NoOp(inputs = [graph.source], label = label)
+    path = tmp_path / 'graph.nk'
+    path.write_text(graph.to_nk())
+    nuke.nodePaste(str(path))
+
+    pasted = [n for n in nuke.allNodes() if n is not source]
+    assert [n.Class() for n in pasted] == [n.node_class for n in graph.node_list]
+    read, dot, merge, grade, note = pasted[:5]
+    assert read.inputs() == 0 and note.inputs() == 0
+    assert dot.input(0) is source
+    assert (merge.input(0), merge.input(1)) == (dot, read)
+    assert grade.input(0) is merge
+    assert note['label'].value() == 'Pruned AOVs:\nLG_rim'
+    assert [n['label'].value() for n in pasted[5:]] == AWKWARD_STRINGS
+    assert all(n.input(0) is source for n in pasted[5:])
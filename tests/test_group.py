@@ -0,0 +1,66 @@
+'''Rebuilds packaged in a Group, rebuilt only when their input changes'''
+import AOV_rebuild_karma_group
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, GRADE_KNOB, MUTE_KNOB
+from AOV_rebuild_karma_group import SIGNATURE_KNOB, create_group, rebuild_group
+
+def rgba(*layers):
+    return ['%s.%s' % (layer, c) for layer in layers for c in ('red', 'green', 'blue', 'alpha')]
+
+CHANNELS = rgba('rgba', 'albedo', 'sss', 'LG_key', 'LG_fill')
+
+def grouped(nuke, channels = CHANNELS):
+    read = nuke.read_node(channels, file = '/render/karma.####.exr')
+    return read, create_group(read, dict(DEFAULT_SETTINGS))
+
+def aov_knobs(group):
+    return sorted(name for name in AOV_rebuild_karma_group.aov_knob_names(group) if name.endswith(GRADE_KNOB % ''))
+
+def test_create_group(nuke):
+    _, group = grouped(nuke)
+    inside = nuke.allNodes(group = group)
+    assert [n.Class() for n in inside if n.Class() in ('Input', 'Output')] == ['Input', 'Output']
+    ## a grade for every plussed aov, albedo is only divided out
+    assert aov_knobs(group) == [GRADE_KNOB % aov for aov in ('LG_fill', 'LG_key', 'sss')]
+    assert group[SIGNATURE_KNOB].value()
+
+def test_signature_match_skips_the_rebuild(nuke):
+    _, group = grouped(nuke)
+    inside = nuke.allNodes(group = group)
+    nuke.calls.clear()
+    assert rebuild_group(group) is False
+    assert nuke.allNodes(group = group) == inside
+    assert nuke.calls['nodes_created'] == 0 and nuke.calls['delete'] == 0
+
+def test_changed_input_rebuilds(nuke):
+    read, group = grouped(nuke)
+    signature = group[SIGNATURE_KNOB].value()
+    read._channels += rgba('LG_rim')
+    assert rebuild_group(group) is True
+    assert group[SIGNATURE_KNOB].value() != signature
+    assert GRADE_KNOB % 'LG_rim' in aov_knobs(group)
+    ## up to date again
+    assert rebuild_group(group) is False
+
+def test_grades_survive_a_rebuild(nuke):
+    read, group = grouped(nuke)
+    group[GRADE_KNOB % 'LG_key'].setValue(0.5)
+    group[MUTE_KNOB % 'sss'].setValue(True)
+    group[GRADE_KNOB % 'LG_fill'].setValue(2)
+    read._channels = rgba('rgba', 'albedo', 'sss', 'LG_key', 'LG_rim')
+    assert rebuild_group(group) is True
+
+    assert group[GRADE_KNOB % 'LG_key'].toScript() == '0.5'
+    assert group[MUTE_KNOB % 'sss'].toScript() == 'True'
+    ## gone with its aov, new aovs start ungraded
+    assert group.knob(GRADE_KNOB % 'LG_fill') is None
+    assert group[GRADE_KNOB % 'LG_rim'].value() == 1
+
+def test_deep_input_is_refused(nuke):
+    _, group = grouped(nuke)
+    signature = group[SIGNATURE_KNOB].value()
+    inside = nuke.allNodes(group = group)
+    group.setInput(0, nuke.nodes.DeepRead(file = '/render/karma_deep.####.exr'))
+    assert rebuild_group(group, force = True) is False
+    assert nuke.calls['message'] == 1
+    assert nuke.allNodes(group = group) == inside
+    assert group[SIGNATURE_KNOB].value() == signature
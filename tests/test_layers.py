@@ -0,0 +1,99 @@
+'''The layer index against the get_* functions it replaced, which scanned the channels once per lookup'''
+import re
+
+import pytest
+
+import AOV_rebuild_karma
+from AOV_rebuild_karma_layers import (LIGHTGROUP_REGEX, MATERIAL_AOVS, UTILITY_AOVS, classify_channels,
+                                      clear_layer_index_cache)
+
+## the get_* functions before the layer index, on a list of channels instead of a node
+def old_get_all_layers(channels):
+    layers = list(set([c.split('.')[0] for c in channels]))
+    layers.sort()
+    return layers
+
+def old_get_lightgroup_layers(channels, lightgroup_regex = LIGHTGROUP_REGEX, additional_lighting = ()):
+    lightgroups = []
+    for layer in old_get_all_layers(channels):
+        if lightgroup_regex.search(layer):
+            lightgroups.append(layer)
+        elif layer in additional_lighting:
+            lightgroups.append(layer)
+    return lightgroups
+
+def old_get_materials(channels, expected_materials = MATERIAL_AOVS):
+    materials = []
+    for material in expected_materials:
+        for layer in old_get_all_layers(channels):
+            if layer.lower() == material.lower():
+                materials.append(layer)
+    return materials
+
+def old_get_utilities(channels, expected_utilities = UTILITY_AOVS):
+    utilities = []
+    for utility in expected_utilities:
+        for layer in old_get_all_layers(channels):
+            if layer == utility:
+                utilities.append(layer)
+    return utilities
+
+def rgba(*layers):
+    return ['%s.%s' % (layer, c) for layer in layers for c in ('red', 'green', 'blue', 'alpha')]
+
+CHANNEL_LISTS = {
+    'empty' : [],
+    'beauty' : rgba('rgba'),
+    'karma' : rgba('rgba', 'albedo', 'combineddiffuse', 'directemission', 'sss', 'LG_key', 'LG_fill', 'N', 'P',
+                   'depth', 'C_custom'),
+    'case' : rgba('rgba', 'combineddiffuse', 'CombinedDiffuse', 'DIRECTEMISSION', 'lg_rim', 'LG_Rim', 'n'),
+    'unordered' : rgba('LG_z', 'rgba', 'sss', 'LG_a', 'albedo', 'ao') + ['depth.Z'],
+    'duplicates' : rgba('rgba', 'LG_key') + rgba('LG_key'),
+    'malformed' : ['', '.', '.red', 'red', 'LG_key', 'LG_key.', 'LG_key.red.extra', 'albedo..green',
+                   ' albedo.red', 'sss', 'rgba.red'],
+}
+
+@pytest.fixture(autouse = True)
+def empty_cache():
+    clear_layer_index_cache()
+
+@pytest.mark.parametrize('name', sorted(CHANNEL_LISTS))
+def test_index_matches_old_lookups(name):
+    channels = CHANNEL_LISTS[name]
+    index = classify_channels(channels)
+    assert index['layers'] == old_get_all_layers(channels)
+    assert index['lightgroups'] == old_get_lightgroup_layers(channels)
+    assert index['materials'] == old_get_materials(channels)
+    assert index['utilities'] == old_get_utilities(channels)
+
+@pytest.mark.parametrize('name', sorted(CHANNEL_LISTS))
+def test_index_matches_old_lookups_with_custom_rules(name):
+    channels = CHANNEL_LISTS[name]
+    regex = re.compile(r'^lg_', re.IGNORECASE)
+    additional = ['C_emission', 'albedo']
+    materials = ['CombinedDiffuse', 'ALBEDO', 'missing']
+    utilities = ['N', 'depth', 'missing']
+    index = classify_channels(channels, regex, additional, materials, utilities)
+    assert index['lightgroups'] == old_get_lightgroup_layers(channels, regex, additional)
+    assert index['materials'] == old_get_materials(channels, materials)
+    assert index['utilities'] == old_get_utilities(channels, utilities)
+
+@pytest.mark.parametrize('name', sorted(CHANNEL_LISTS))
+def test_node_lookups_match_old_lookups(nuke, name):
+    channels = CHANNEL_LISTS[name]
+    read = nuke.read_node(channels)
+    assert AOV_rebuild_karma.get_all_layers(read) == old_get_all_layers(channels)
+    assert AOV_rebuild_karma.get_lightgroup_layers(read) == old_get_lightgroup_layers(channels)
+    assert AOV_rebuild_karma.get_materials(read) == old_get_materials(channels)
+    assert AOV_rebuild_karma.get_utilities(read) == old_get_utilities(channels)
+
+def test_buckets_cover_every_layer():
+    index = classify_channels(CHANNEL_LISTS['karma'])
+    classified = set(index['lightgroups']) | set(index['materials']) | set(index['utilities'])
+    assert sorted(classified | set(index['unknown'])) == index['layers']
+    assert not classified & set(index['unknown'])
+
+def test_index_is_cached_per_channel_list():
+    channels = CHANNEL_LISTS['karma']
+    assert classify_channels(channels) is classify_channels(list(channels))
+    assert classify_channels(channels) is not classify_channels(CHANNEL_LISTS['case'])
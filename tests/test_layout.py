@@ -0,0 +1,133 @@
+'''Positions the layout of a rebuild graph gives its nodes, worked out from the size table without any live node'''
+
+import AOV_rebuild_karma
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, X_SPACE, build_rebuild_graph, build_utilities_graph, get_centre_xypos
+from AOV_rebuild_karma_graph import ExternalNode
+from AOV_rebuild_karma_layers import classify_channels
+from AOV_rebuild_karma_layout import (NODE_SIZES, SHUFFLE_Y_OFFSET, UNPREMULT_Y_OFFSET, graph_bbox, graph_positions,
+                                      node_size, translate_graph)
+
+def rgba(*layers):
+    return ['%s.%s' % (layer, c) for layer in layers for c in ('red', 'green', 'blue', 'alpha')]
+
+def read_at(xpos = 0, ypos = 0):
+    return ExternalNode(None, xpos, ypos, 80, 18, 'Read')
+
+def rebuild(channels, source = None, **settings):
+    return build_rebuild_graph(classify_channels(channels), dict(DEFAULT_SETTINGS, **settings), source or read_at())
+
+def by_role(graph, role):
+    return [n for n in graph.node_list if getattr(n, 'role', None) == role]
+
+## (class, role, xpos, ypos) of a lightgroups only rebuild of one lightgroup hanging off a Read at 0, 0
+SINGLE_PIPE = [('Shuffle2', 'original_shuffle', 0, 100),
+               ('Unpremult', 'unpremult_original', 0, 200),
+               ('Dot', None, 34, 303),
+               ('Dot', None, 334, 303),
+               ('Dot', 'start_dot', 334, 553),
+               ('Dot', 'aov_dot', 634, 553),
+               ('Shuffle2', 'aov_shuffle', 600, 578),
+               ('Unpremult', 'aov_unpremult', 600, 610),
+               ('Dot', 'bottom_aov_dot', 634, 853),
+               ('Remove', 'remove_rgb', 300, 578),
+               ('Merge2', 'aov_merge_plus', 300, 850),
+               ('Dot', 'unassigned_aov_dot', 934, 553),
+               ('Shuffle2', 'unassigned_shuffle', 900, 650),
+               ('Unpremult', 'unassigned_unpremult', 900, 750),
+               ('Merge2', 'unassigned_merge_from', 900, 850),
+               ('Dot', 'unassigned_bottom_dot', 934, 903),
+               ('Merge2', 'merge_plus', 300, 900),
+               ('Dot', 'end_result', 334, 1003),
+               ('Dot', None, 34, 1003),
+               ('Shuffle2', None, 150, 1000),
+               ('Merge2', None, 300, 1100),
+               ('Merge2', None, 0, 1200),
+               ('Premult', None, 0, 1300)]
+
+def layout(graph):
+    return [(node_class, getattr(node, 'role', None), x, y)
+            for (node_class, _name, x, y), node in zip(graph_positions(graph), graph.node_list)]
+
+def test_node_size_table():
+    assert node_size('Dot') == NODE_SIZES['Dot']
+    assert node_size('Merge2') == (80, 18)
+    assert node_size('Dot', {'Dot' : (20, 20)}) == (20, 20)
+
+def test_empty_graph():
+    ## no utility to break out, nothing is laid out and the graph only covers the node it hangs off
+    graph = build_utilities_graph(classify_channels(rgba('rgba', 'LG_key')), DEFAULT_SETTINGS, read_at(50, -20))
+    assert graph_positions(graph) == []
+    assert graph_bbox(graph) == (50, -20, 130, -2)
+
+def test_single_pipe():
+    graph = rebuild(rgba('rgba', 'LG_key'), breakout_materials = False)
+    assert layout(graph) == SINGLE_PIPE
+
+def test_layout_follows_the_source():
+    graph = rebuild(rgba('rgba', 'LG_key'), read_at(-210, 480), breakout_materials = False)
+    assert layout(graph) == [(c, role, x - 210, y + 480) for c, role, x, y in SINGLE_PIPE]
+
+def test_small_graph():
+    graph = rebuild(rgba('rgba', 'albedo', 'sss', 'LG_key', 'LG_fill'))
+    ## the aov dots of each pipe sit in one row, X_SPACE apart
+    for start in by_role(graph, 'start_dot'):
+        row = [start]
+        while True:
+            following = [n for n in by_role(graph, 'aov_dot') if n.inputs[0] is row[-1]]
+            if not following:
+                break
+            row.append(following[0])
+        assert len(row) == 3
+        centres = [get_centre_xypos(n) for n in row]
+        assert len({y for _, y in centres}) == 1
+        assert [x for x, _ in centres] == [centres[0][0] + i * X_SPACE for i in range(3)]
+
+    ## every branch hangs straight under its aov dot: the Shuffle2, then the Unpremult
+    for shuffle in by_role(graph, 'aov_shuffle'):
+        dot = shuffle.inputs[0]
+        unpremult = next(n for n in by_role(graph, 'aov_unpremult') if n.inputs[0] is shuffle)
+        dot_x, dot_y = get_centre_xypos(dot)
+        assert get_centre_xypos(shuffle) == (dot_x, dot_y + SHUFFLE_Y_OFFSET)
+        assert get_centre_xypos(unpremult) == (dot_x, dot_y + SHUFFLE_Y_OFFSET + UNPREMULT_Y_OFFSET)
+
+    ## the graph flows down: no node sits above what it is connected from
+    for node in graph.node_list:
+        for input_node in node.inputs:
+            if input_node is not None:
+                assert get_centre_xypos(node)[1] >= get_centre_xypos(input_node)[1]
+
+def test_bbox_and_translate():
+    graph = rebuild(rgba('rgba', 'LG_key'), breakout_materials = False)
+    left, top, right, bottom = graph_bbox(graph)
+    assert (left, top) == (0, 0)
+    assert right == max(x + node_size(c)[0] for c, _role, x, _y in SINGLE_PIPE)
+    assert bottom == max(y + node_size(c)[1] for c, _role, _x, y in SINGLE_PIPE)
+
+    translate_graph(graph, 15, -40)
+    assert graph_bbox(graph) == (left + 15, top - 40, right + 15, bottom - 40)
+    assert (graph.source.xpos(), graph.source.ypos()) == (15, -40)
+
+def live_bbox(nodes):
+    return (min(n.xpos() for n in nodes), min(n.ypos() for n in nodes),
+            max(n.xpos() + n.screenWidth() for n in nodes), max(n.ypos() + n.screenHeight() for n in nodes))
+
+def test_batch_rebuilds_do_not_overlap(nuke, monkeypatch):
+    classified = []
+    classify = AOV_rebuild_karma.classify_channels_from_settings
+    monkeypatch.setattr(AOV_rebuild_karma, 'classify_channels_from_settings',
+                        lambda channels, *args: classified.append(channels) or classify(channels, *args))
+    ## left to right: two Reads on top of each other with the same channels, then a wider rebuild just right of them
+    reads = [nuke.read_node(rgba('rgba', 'LG_key'), file = '/render/a.####.exr'),
+             nuke.read_node(rgba('rgba', 'LG_key'), file = '/render/b.####.exr'),
+             nuke.read_node(rgba('rgba', 'albedo', 'sss', 'LG_key', 'LG_fill', 'LG_rim'), file = '/render/c.####.exr')]
+    for x, read in zip((0, 10, 200), reads):
+        read.setXYpos(x, 0)
+
+    pasted = AOV_rebuild_karma.batch_breakout_lightgroups_and_materials(reads, dict(DEFAULT_SETTINGS))
+    assert len(classified) == 2
+    boxes = [live_bbox([read] + pasted[read.name()]) for read in reads]
+    for (_, _, right, _), (left, _, _, _) in zip(boxes, boxes[1:]):
+        assert right + DEFAULT_SETTINGS['x_space'] <= left
+    ## the first rebuild stays where it is, each Read moves with its rebuild
+    assert reads[0].xpos() == 0
+    assert [box[0] for box in boxes] == [read.xpos() for read in reads]
@@ -0,0 +1,156 @@
+'''Precomps of a rebuild's breakout, rendered by a stand-in for terminal nuke that writes empty frames'''
+import os
+import stat
+import sys
+import time
+
+import pytest
+
+import AOV_rebuild_karma
+import AOV_rebuild_karma_precomp
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS
+from AOV_rebuild_karma_exr import write_exr
+from AOV_rebuild_karma_precomp import PrecompError, frame_chunks, precomp_staleness, render_precomp
+
+KARMA_CHANNELS = ['R', 'G', 'B', 'A', 'albedo.R', 'albedo.G', 'albedo.B', 'LG_key.R', 'LG_key.G', 'LG_key.B']
+
+FRAMES = (1001, 1004)
+
+## `nuke -x -m threads -X write -F first-last script`: writes an empty frame for every frame of the range to the file
+## of the Write named in the script nodeCopy of fake_nuke.py saved, STUB_EXIT fails and STUB_SLEEP hangs first
+STUB_NUKE = '''#!%s
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+print(' '.join(args))
+if os.environ.get('STUB_SLEEP'):
+    time.sleep(float(os.environ['STUB_SLEEP']))
+if os.environ.get('STUB_EXIT'):
+    sys.exit(int(os.environ['STUB_EXIT']))
+write = args[args.index('-X') + 1]
+first, last = (int(f) for f in args[args.index('-F') + 1].split('-'))
+for line in open(args[-1]):
+    if line.startswith('Write %%s ' %% write):
+        pattern = next(word[len('file='):] for word in line.split() if word.startswith('file='))
+os.makedirs(os.path.dirname(pattern), exist_ok = True)
+for frame in range(first, last + 1):
+    open(pattern.replace('####', '%%04d' %% frame), 'w').close()
+''' % sys.executable
+
+@pytest.fixture
+def stub_nuke(tmp_path):
+    path = tmp_path / 'Nuke15.1'
+    path.write_text(STUB_NUKE)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+def write_sequence(pattern, channels, mtime):
+    for frame in range(FRAMES[0], FRAMES[1] + 1):
+        path = pattern.replace('####', '%04d' % frame)
+        write_exr(path, channels)
+        os.utime(path, (mtime, mtime))
+
+@pytest.fixture
+def precomp(nuke, tmp_path):
+    '''A Switch between the Unpremult under a render and a fresh precomp of it'''
+    render = str(tmp_path / 'karma.####.exr')
+    precomp = str(tmp_path / 'karma_precomp.####.exr')
+    write_sequence(render, KARMA_CHANNELS, time.time() - 100)
+    write_sequence(precomp, KARMA_CHANNELS, time.time() - 50)
+    source = nuke.nodes.Read(file = render, first = FRAMES[0], last = FRAMES[1])
+    unpremult = nuke.nodes.Unpremult(inputs = [source])
+    read = nuke.nodes.Read(file = precomp, first = FRAMES[0], last = FRAMES[1])
+    return nuke.nodes.Switch(inputs = [unpremult, read], which = 0)
+
+def test_frame_chunks():
+    assert frame_chunks(1001, 1010, 3) == [(1001, 1004), (1005, 1007), (1008, 1010)]
+    assert frame_chunks(1001, 1004, 4) == [(f, f) for f in range(1001, 1005)]
+    ## never more chunks than frames, never none
+    assert frame_chunks(1001, 1002, 8) == [(1001, 1001), (1002, 1002)]
+    assert frame_chunks(1001, 1001, 0) == [(1001, 1001)]
+    chunks = frame_chunks(-5, 94, 7)
+    assert chunks[0][0] == -5 and chunks[-1][1] == 94
+    assert all(end + 1 == start for (_, end), (start, _) in zip(chunks, chunks[1:]))
+    assert {last - first for first, last in chunks} == {13, 14}
+
+def test_fresh_precomp(precomp):
+    assert precomp_staleness(precomp) is None
+
+def test_not_connected(precomp):
+    precomp.setInput(1, None)
+    assert precomp_staleness(precomp) == 'not connected'
+
+def test_frames_not_rendered(precomp):
+    os.remove(precomp.input(1)['file'].value().replace('####', '1002'))
+    assert precomp_staleness(precomp) == '1 frames not rendered'
+
+def test_render_is_newer(precomp):
+    source = precomp.input(0).input(0)
+    newer = source['file'].value().replace('####', '1003')
+    os.utime(newer, (time.time(), time.time()))
+    assert precomp_staleness(precomp) == '%s is newer' % source.name()
+
+def test_frame_range_changed(precomp):
+    source = precomp.input(0).input(0)
+    source['last'].setValue(FRAMES[1] + 10)
+    assert precomp_staleness(precomp) == 'frame range of %s changed' % source.name()
+
+def test_channels_missing(nuke, tmp_path, precomp):
+    ## the live stream is the render itself, one aov more than the precomp has
+    render = str(tmp_path / 'karma_new.####.exr')
+    write_sequence(render, KARMA_CHANNELS + ['LG_rim.R', 'LG_rim.G', 'LG_rim.B'], time.time() - 100)
+    precomp.setInput(0, nuke.nodes.Read(file = render, first = FRAMES[0], last = FRAMES[1]))
+    assert precomp_staleness(precomp) == '3 channels not in the precomp'
+
+def test_render_precomp(nuke, tmp_path, stub_nuke):
+    pattern = str(tmp_path / 'precomp' / 'karma_precomp.####.exr')
+    write = nuke.nodes.Write(inputs = [nuke.nodes.Read(file = str(tmp_path / 'karma.####.exr'))], file = pattern)
+    progress = []
+    render_precomp(write, FRAMES[0], FRAMES[1], 2, stub_nuke, lambda done, total: progress.append((done, total)))
+    assert all(os.path.exists(pattern.replace('####', str(f))) for f in range(FRAMES[0], FRAMES[1] + 1))
+    assert all(0 <= done <= total == 4 for done, total in progress)
+
+def test_render_failed(nuke, tmp_path, stub_nuke, monkeypatch):
+    monkeypatch.setenv('STUB_EXIT', '3')
+    write = nuke.nodes.Write(file = str(tmp_path / 'karma_precomp.####.exr'))
+    with pytest.raises(PrecompError, match = '2 of 2 renders failed') as e:
+        render_precomp(write, FRAMES[0], FRAMES[1], 2, stub_nuke)
+    log = str(e.value).rpartition(' ')[2]
+    with open(log) as f:
+        assert '-X %s' % write.name() in f.read()
+
+def test_render_cancelled(nuke, tmp_path, stub_nuke, monkeypatch):
+    monkeypatch.setenv('STUB_SLEEP', '30')
+    write = nuke.nodes.Write(file = str(tmp_path / 'karma_precomp.####.exr'))
+    def cancel(done, total):
+        raise AOV_rebuild_karma.RebuildCancelled()
+    start = time.time()
+    with pytest.raises(AOV_rebuild_karma.RebuildCancelled):
+        render_precomp(write, FRAMES[0], FRAMES[1], 2, stub_nuke, cancel)
+    ## the renders were killed, not waited for
+    assert time.time() - start < 10
+
+def test_precomp_rebuild(nuke, tmp_path, stub_nuke, monkeypatch):
+    monkeypatch.setattr(AOV_rebuild_karma_precomp, 'POLL_SECONDS', 0.05)
+    render = str(tmp_path / 'karma.####.exr')
+    write_sequence(render, KARMA_CHANNELS, time.time() - 100)
+    read = nuke.nodes.Read(file = render, first = FRAMES[0], last = FRAMES[1])
+    AOV_rebuild_karma.breakout_lightgroups_and_materials(read, dict(DEFAULT_SETTINGS, compact = True))
+    top = next(n for n in nuke.allNodes('Unpremult') if n['label'].value() == 'compact')
+
+    switch, reason = AOV_rebuild_karma.precomp_rebuild(top, 'zip', 2, str(tmp_path / 'precomp'), stub_nuke)
+    assert reason is None and switch['which'].value() == 1
+    assert switch.input(0) is top
+    write = next(n for n in nuke.allNodes('Write'))
+    assert write['datatype'].value() == '32 bit float'
+    assert write['compression'].value() == 'Zip (1 scanline)'
+
+def test_precomp_needs_a_compact_rebuild(nuke, tmp_path, stub_nuke):
+    channels = ['%s.%s' % (layer, c) for layer in ('rgba', 'LG_key') for c in ('red', 'green', 'blue', 'alpha')]
+    read = nuke.read_node(channels, file = str(tmp_path / 'karma.####.exr'), first = FRAMES[0], last = FRAMES[1])
+    pasted = AOV_rebuild_karma.breakout_lightgroups_and_materials(read, dict(DEFAULT_SETTINGS))
+    with pytest.raises(PrecompError, match = 'not a compact rebuild'):
+        AOV_rebuild_karma.precomp_rebuild(pasted[-1], 'zip', 2, str(tmp_path / 'precomp'), stub_nuke)
+    assert not nuke.allNodes('Write')
@@ -0,0 +1,108 @@
+'''Presets files: validation, the settings they give and reading them again once they change'''
+import json
+import os
+import re
+
+import pytest
+
+import AOV_rebuild_karma_presets
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS
+from AOV_rebuild_karma_presets import (PresetError, load_presets, preset_from_settings, preset_names, preset_settings,
+                                       save_preset, settings_from_dict, validate_preset)
+
+def write_file(path, presets, mtime = None):
+    path.write_text(json.dumps({'presets' : presets}))
+    if mtime is not None:
+        os.utime(str(path), (mtime, mtime))
+    return str(path)
+
+@pytest.mark.parametrize('preset, error', [
+    ({'lg_regex' : '^LG_(['}, 'lg_regex .* does not compile'),
+    ({'lg_regex' : 12}, 'lg_regex is not a string'),
+    ({'x_space' : True}, 'x_space is not a whole number'),
+    ({'y_space' : -10}, 'y_space is not a whole number'),
+    ({'prune_sample_frames' : 2.5}, 'prune_sample_frames is not a whole number'),
+    ({'prune_sample_frames' : 0}, 'prune_sample_frames must be 1 or more'),
+    ({'compact' : 1}, 'compact is not true or false'),
+    ({'expected_materials' : 'albedo'}, 'expected_materials is not a list of names'),
+    ({'schema' : ['karma']}, 'schema is not a schema name or null'),
+    ({'x_sapce' : 200}, "unknown setting 'x_sapce'"),
+    ({'pruned_aovs' : []}, "unknown setting 'pruned_aovs'"),
+    (['compact'], 'is not a json object'),
+])
+def test_bad_presets(preset, error):
+    with pytest.raises(PresetError, match = error):
+        validate_preset('show', preset)
+
+def test_bad_names():
+    for name in ('', 'show/karma', 3):
+        with pytest.raises(PresetError, match = 'is not a preset name'):
+            validate_preset(name, {})
+    assert validate_preset('show karma-v2.1', {'prune_sample_frames' : 1}) == {'prune_sample_frames' : 1}
+
+def test_a_bad_file_names_itself(tmp_path):
+    path = tmp_path / 'presets.json'
+    path.write_text('{"presets" : ')
+    with pytest.raises(PresetError, match = 'is not valid json'):
+        load_presets(str(path))
+    path.write_text('{"show" : {}}')
+    with pytest.raises(PresetError, match = 'has no "presets" object'):
+        load_presets(str(path))
+    assert load_presets(str(tmp_path / 'missing.json')) == {}
+
+def test_round_trip(tmp_path):
+    settings = dict(DEFAULT_SETTINGS, lg_regex = re.compile('^light_', 0), breakout_materials = False,
+                    expected_materials = ('diffuse', 'specular'), prune_sample_frames = 4, x_space = 200, schema = 'karma_h21')
+    preset = preset_from_settings(settings)
+    assert preset['lg_regex'] == '^light_' and preset['lg_regex_ignore_case'] is False
+    assert preset['expected_materials'] == ['diffuse', 'specular']
+    assert set(preset) == set(AOV_rebuild_karma_presets.PRESET_TYPES)
+    ## what a preset holds is json friendly and valid
+    assert json.loads(json.dumps(validate_preset('show', preset))) == preset
+
+    restored = settings_from_dict(preset)
+    assert restored['lg_regex'].pattern == '^light_' and not restored['lg_regex'].flags & re.IGNORECASE
+    for key in AOV_rebuild_karma_presets.PRESET_TYPES:
+        if key not in ('lg_regex', 'lg_regex_ignore_case'):
+            expected = list(settings[key]) if isinstance(settings[key], tuple) else settings[key]
+            assert restored[key] == expected, key
+
+    path = str(tmp_path / 'presets.json')
+    save_preset('show', settings, path)
+    assert preset_settings('show', path) == restored
+    ## the defaults are copied, never changed
+    assert preset_settings('show', path) is not DEFAULT_SETTINGS and DEFAULT_SETTINGS['x_space'] != 200
+
+def test_settings_from_dict():
+    settings = settings_from_dict({'x_space' : 300})
+    assert settings['x_space'] == 300 and settings['lg_regex'] is DEFAULT_SETTINGS['lg_regex']
+    ## regexes are compiled once per pattern and flag
+    assert settings_from_dict({'lg_regex' : '^LG_'})['lg_regex'] is settings_from_dict({'lg_regex' : '^LG_'})['lg_regex']
+    assert settings_from_dict({'lg_regex' : '^LG_'})['lg_regex'].flags & re.IGNORECASE
+    with pytest.raises(KeyError, match = 'unknown setting'):
+        settings_from_dict({'x_sapce' : 300})
+
+def test_missing_preset(tmp_path):
+    path = write_file(tmp_path / 'presets.json', {'show' : {}})
+    with pytest.raises(PresetError, match = 'there is no preset named film'):
+        preset_settings('film', path)
+
+def test_reloaded_once_changed(tmp_path):
+    path = write_file(tmp_path / 'presets.json', {'show' : {'x_space' : 200}}, mtime = 1000000)
+    presets = load_presets(path)
+    assert load_presets(path) is presets
+
+    ## same size, only the modification time tells it changed
+    write_file(tmp_path / 'presets.json', {'show' : {'x_space' : 300}}, mtime = 1000000)
+    assert load_presets(path) is presets
+    os.utime(path, (1000010, 1000010))
+    assert load_presets(path)['show'] == {'x_space' : 300}
+
+    write_file(tmp_path / 'presets.json', {'show' : {}, 'Film' : {'compact' : True}}, mtime = 1000020)
+    assert preset_names(path) == ['Film', 'show']
+
+    ## a file broken after it was read is reported, not served from the cache
+    (tmp_path / 'presets.json').write_text('{"presets" : {"show" : {"compact" : "yes"}}}')
+    os.utime(path, (1000030, 1000030))
+    with pytest.raises(PresetError, match = 'compact is not true or false'):
+        load_presets(path)
@@ -0,0 +1,174 @@
+'''The numpy reference engine against the Merge2 maths of the rebuild graph'''
+import re
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import AOV_rebuild_karma
+import AOV_rebuild_karma_qc
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, ORIGINAL_LAYER, unassigned_expression_knobs
+from AOV_rebuild_karma_exr import write_exr
+from AOV_rebuild_karma_layers import classify_channels
+
+SHAPE = (2, 3)
+
+def planes_of(beauty, alpha = 1.0, **aovs):
+    '''Returns constant planes of a frame with rgb `beauty`, `alpha` and one grey value per aov'''
+    planes = {'rgba.alpha' : np.full(SHAPE, alpha, np.float32)}
+    for component in AOV_rebuild_karma_qc.AOV_COMPONENTS:
+        planes['rgba.' + component] = np.full(SHAPE, beauty, np.float32)
+        for aov, value in aovs.items():
+            planes['%s.%s' % (aov, component)] = np.full(SHAPE, value, np.float32)
+    return planes
+
+def rebuild(planes, **settings):
+    layer_index = classify_channels(sorted(planes))
+    pipes = AOV_rebuild_karma_qc.rebuild_pipes(layer_index, dict(DEFAULT_SETTINGS, **settings))
+    return AOV_rebuild_karma_qc.rebuild_planes(planes, pipes)
+
+def test_merge_divide_follows_merge2():
+    a = np.array([1.0, -1.0, -1.0, 1.0, 2.0], np.float32)
+    b = np.array([2.0, 2.0, -2.0, -2.0, 0.0], np.float32)
+    ## A/B, 0 where both are negative or B is 0
+    assert AOV_rebuild_karma_qc.merge_divide(a, b).tolist() == [0.5, -0.5, 0.0, -0.5, 0.0]
+
+def test_merge_multiply_follows_merge2():
+    a = np.array([2.0, -2.0, -2.0], np.float32)
+    b = np.array([3.0, 3.0, -3.0], np.float32)
+    ## A*B, A where both are negative
+    assert AOV_rebuild_karma_qc.merge_multiply(a, b).tolist() == [6.0, -6.0, -2.0]
+
+def test_aovs_summing_to_the_beauty():
+    result = rebuild(planes_of(1.0, LG_key = 0.6, LG_fill = 0.4))
+    assert np.allclose(result['rebuilt'], 1.0)
+    assert np.allclose(result['residual'], 0.0)
+
+def test_aovs_not_summing_to_the_beauty():
+    ## the lightgroups only hold 0.8 of the beauty: the divide of the graph (pipe as A, original as B) scales
+    ## the beauty down to what the lightgroups add up to
+    result = rebuild(planes_of(1.0, LG_key = 0.5, LG_fill = 0.3))
+    assert np.allclose(result['rebuilt'], 0.8)
+    assert np.allclose(result['residual'], -0.2)
+    assert np.allclose(result['unassigned']['lightgroups'], 0.2)
+
+def test_both_pipes_match_the_deep_rebuild():
+    ## rgb * (materials / rgb) * (lightgroups / rgb), the combination deep_sum_knobs writes per sample
+    result = rebuild(planes_of(2.0, directdiffuse = 0.5, sss = 1.0, LG_key = 1.2, LG_fill = 0.4))
+    assert np.allclose(result['rebuilt'], 1.5 * 1.6 / 2.0)
+
+def test_negative_pipe():
+    ## a pipe and an original both below 0 divide to 0, Merge2's rule, so the pixel goes black
+    result = rebuild(planes_of(-1.0, LG_key = -0.5))
+    assert np.allclose(result['rebuilt'], 0.0)
+    assert result['negative_pixels']['LG_key'] == SHAPE[0] * SHAPE[1]
+
+def test_frame_qc_reports_the_mismatch():
+    planes = planes_of(1.0, LG_key = 0.5, LG_fill = 0.3)
+    pipes = AOV_rebuild_karma_qc.rebuild_pipes(classify_channels(sorted(planes)), DEFAULT_SETTINGS)
+    qc = AOV_rebuild_karma_qc.FrameQC(pipes)
+    qc.add(planes, 0)
+    report = qc.report()
+    assert report['residual_max'] == pytest.approx(0.2, abs = 1e-6)
+    assert report['pixels_over_tolerance'] == SHAPE[0] * SHAPE[1]
+
+## unassigned Expression
+def random_planes(aovs, seed = 0):
+    '''Returns premultiplied planes of a frame whose aovs add up to more than the beauty on some pixels,
+    with an alpha of 0 on some pixels and partial elsewhere'''
+    rng = np.random.default_rng(seed)
+    shape = (4, 5)
+    alpha = rng.choice(np.array([0.0, 0.25, 0.5, 1.0], np.float32), shape)
+    planes = {'rgba.alpha' : alpha}
+    for component in AOV_rebuild_karma_qc.AOV_COMPONENTS:
+        planes['rgba.' + component] = rng.uniform(0.0, 2.0, shape).astype(np.float32) * alpha
+        for aov in aovs:
+            planes['%s.%s' % (aov, component)] = rng.uniform(0.0, 0.8, shape).astype(np.float32) * alpha
+    return planes
+
+def evaluate_expression(knobs, planes):
+    '''Evaluates the knobs of the unassigned Expression node on `planes`, returns its rgb stack and alpha'''
+    def python(expression):
+        expression = re.sub(r'\(([\w.]+) != 0 \? ([\w.]+) : 1\)', r'where(\1 != 0, \2, 1)', expression)
+        expression = re.sub(r'\b(\w+) < 0', r'(\1 < 0)', expression).replace('||', '|').replace('max(', 'maximum(')
+        return re.sub(r'\b(\w+)\.(red|green|blue|alpha)\b', r"planes['\1.\2']", expression)
+    scope = {'planes' : planes, 'where' : np.where, 'maximum' : np.maximum}
+    for i in range(3):
+        scope[knobs['temp_name%d' % i]] = eval(python(knobs['temp_expr%d' % i]), scope)
+    rgb = np.stack([eval(python(knobs['expr%d' % i]), scope) for i in range(3)])
+    return rgb, eval(python(knobs['expr3']), scope) if 'expr3' in knobs else None
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_unassigned_expression_matches_the_merge_chain(compact):
+    aovs = ['LG_key', 'LG_fill', 'LG_rim']
+    planes = random_planes(aovs)
+    layer_index = classify_channels(sorted(planes))
+    pipes = AOV_rebuild_karma_qc.rebuild_pipes(layer_index, dict(DEFAULT_SETTINGS, breakout_materials = False))
+    ## the Unpremult / Merge2 (from) chain, as the reference engine runs it
+    result = AOV_rebuild_karma_qc.rebuild_planes(planes, pipes)
+    chain = result['unassigned']['lightgroups']
+
+    ## what the Expression node reads: the original unpremultiplied and the aovs as rendered, or unpremultiplied
+    ## by the Unpremult at the top of a compact rebuild
+    inverse = AOV_rebuild_karma_qc.inverse_alpha(planes['rgba.alpha'])
+    read = dict(planes)
+    for i, component in enumerate(AOV_rebuild_karma_qc.AOV_COMPONENTS):
+        read['%s.%s' % (ORIGINAL_LAYER, component)] = result['original'][i]
+        if compact:
+            for aov in aovs:
+                read['%s.%s' % (aov, component)] = planes['%s.%s' % (aov, component)] * inverse
+    read['%s.alpha' % ORIGINAL_LAYER] = planes['rgba.alpha']
+
+    rgb, _ = evaluate_expression(unassigned_expression_knobs(layer_index, aovs, compact), read)
+    assert np.allclose(rgb, chain, atol = 1e-5)
+
+    ## guarded: clamped at 0, the alpha marks the pixels the chain takes below 0
+    assert (chain < 0).any()
+    rgb, mask = evaluate_expression(unassigned_expression_knobs(layer_index, aovs, compact, guard = True), read)
+    assert np.allclose(rgb, np.maximum(chain, 0), atol = 1e-5)
+    assert (mask == (chain < 0).any(axis = 0)).all()
+
+## pruning
+FRAMES = range(1001, 1021)
+
+def write_flash_sequence(directory):
+    '''Writes 20 frames where LG_key is lit throughout, LG_flash only on frame 1004 (between the sampled frames)
+    and LG_off never'''
+    channels = ['R', 'G', 'B', 'A'] + ['%s.%s' % (aov, c) for aov in ('LG_key', 'LG_flash', 'LG_off') for c in 'RGB']
+    for frame in FRAMES:
+        values = {'R' : 1.0, 'G' : 1.0, 'B' : 1.0, 'A' : 1.0, 'LG_key.R' : 0.5}
+        if frame == 1004:
+            values['LG_flash.G'] = 2.0
+        write_exr(str(directory / ('karma.%d.exr' % frame)), channels, values = values)
+    return str(directory / 'karma.####.exr')
+
+def test_layer_stats(tmp_path):
+    pattern = write_flash_sequence(tmp_path)
+    stats = AOV_rebuild_karma_qc.layer_stats(pattern.replace('####', '1004'), ['LG_key', 'LG_flash', 'LG_off'])
+    assert stats['LG_flash']['max'] == 2.0
+    assert stats['LG_key']['nonzero'] == 16 * 16
+    assert stats['LG_off']['nonzero'] == 0
+
+def test_empty_layers_are_confirmed_on_every_frame(tmp_path):
+    pattern = write_flash_sequence(tmp_path)
+    scanned = []
+    empty = AOV_rebuild_karma_qc.sequence_empty_layers(pattern, FRAMES, ['LG_key', 'LG_flash', 'LG_off'], samples = 10,
+                                                       progress = lambda path, done, total: scanned.append(path))
+    assert empty == ['LG_off']
+    assert len(scanned) == len(FRAMES)
+    ## the sampled frames come first
+    assert scanned[:2] == [pattern.replace('####', '1001'), pattern.replace('####', '1003')]
+
+def test_empty_layers_stop_once_nothing_is_empty(tmp_path):
+    pattern = write_flash_sequence(tmp_path)
+    scanned = []
+    empty = AOV_rebuild_karma_qc.sequence_empty_layers(pattern, FRAMES, ['LG_key'], samples = 10,
+                                                       progress = lambda path, done, total: scanned.append(path))
+    assert empty == []
+    assert len(scanned) == 1
+
+def test_prune_settings(nuke, tmp_path):
+    pattern = write_flash_sequence(tmp_path)
+    read = nuke.nodes.Read(file = pattern, first = 1001, last = 1020)
+    settings = AOV_rebuild_karma.scan_settings(read, dict(DEFAULT_SETTINGS, prune_empty = True))
+    assert list(settings['pruned_aovs']) == ['LG_off']
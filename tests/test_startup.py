@@ -0,0 +1,13 @@
+'''Nuke startup under fake_nuke: init.py and menu.py run in a fresh interpreter, the way nuke runs them'''
+import bench_startup
+from bench_startup import HEAVY_MODULES, STARTUP_MODULES
+
+def test_startup_imports_only_the_menu():
+    result = bench_startup.run_child()
+    assert result['startup_modules'] == sorted(STARTUP_MODULES)
+    assert not [name for name in result['startup_modules'] if name.split('.')[0] in HEAVY_MODULES]
+
+def test_first_command_imports_the_rebuild():
+    result = bench_startup.run_child()
+    assert 'AOV_rebuild_karma' in result['first_use_modules']
+    assert set(result['startup_modules']) <= set(result['first_use_modules'])
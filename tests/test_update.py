@@ -0,0 +1,101 @@
+'''Patching an existing rebuild once the aovs upstream change'''
+import pytest
+
+import AOV_rebuild_karma
+from AOV_rebuild_karma_build import DEFAULT_SETTINGS, build_patch_graph, build_rebuild_graph
+from AOV_rebuild_karma_exr import nuke_box, write_exr
+from AOV_rebuild_karma_graph import ExternalNode
+from AOV_rebuild_karma_layers import classify_channels
+from bench_compact import synthetic_channels
+
+def rgba(*layers):
+    return ['%s.%s' % (layer, c) for layer in layers for c in ('red', 'green', 'blue', 'alpha')]
+
+CHANNELS = rgba('rgba', 'albedo', 'sss', 'LG_key', 'LG_fill')
+
+def rebuild():
+    return build_rebuild_graph(classify_channels(CHANNELS), dict(DEFAULT_SETTINGS), ExternalNode(None))
+
+def pipe_nodes(graph, pipe, role):
+    return [n for n in graph.node_list if n.tags.get('pipe') == pipe and n.role == role]
+
+def test_branches_are_tagged():
+    graph = rebuild()
+    for pipe, aovs in (('materials', ['albedo', 'sss']), ('lightgroups', ['LG_fill', 'LG_key'])):
+        shuffles = pipe_nodes(graph, pipe, 'aov_shuffle')
+        assert sorted(n.tags['aov'] for n in shuffles) == aovs
+        assert [n['in1'].value() for n in shuffles] == [n.tags['aov'] for n in shuffles]
+    ## the Remove belongs to the pipe, not to the aov it was created for
+    for remove in pipe_nodes(graph, 'lightgroups', 'remove_rgb'):
+        assert 'aov' not in remove.tags
+
+def test_patch_graph():
+    graph = rebuild()
+    top = pipe_nodes(graph, 'lightgroups', 'aov_dot')[-1]
+    bpipe = pipe_nodes(graph, 'lightgroups', 'aov_merge_plus')[-1]
+    unassigned = pipe_nodes(graph, 'lightgroups', 'unassigned_merge_from')[-1]
+    layer_index = classify_channels(CHANNELS + rgba('LG_new'))
+    settings = dict(DEFAULT_SETTINGS)
+
+    patch, bpipe_tail, unassigned_tail = build_patch_graph(layer_index, 'lightgroups', ['LG_new'], settings,
+                                                           top, bpipe, unassigned, graph.rebuild_id)
+    assert patch.rebuild_id == graph.rebuild_id
+    assert {n.tags['aov'] for n in patch.node_list} == {'LG_new'}
+    ## the new branch sits right of the pipe's last aov and merges after the bpipe's last merge
+    dot = next(n for n in patch.node_list if n.role == 'aov_dot')
+    assert dot.inputs[0] is patch.source and patch.source.live is top
+    assert dot.xpos() == top.xpos() + settings['x_space']
+    assert bpipe_tail['label'].value() == 'LG_new'
+    assert bpipe_tail.inputs[0].live is bpipe
+    assert unassigned_tail['Achannels'].value() == 'LG_new'
+    assert {live for _, _, live in patch.external_inputs()} == {bpipe, unassigned}
+
+def test_adds_new_aovs(nuke):
+    read = nuke.read_node(synthetic_channels(30), file = '/render/karma.####.exr')
+    pasted = AOV_rebuild_karma.breakout_lightgroups_and_materials(read, dict(DEFAULT_SETTINGS))
+    read._channels += ['LG_new.%s' % c for c in ('red', 'green', 'blue', 'alpha')]
+    report = AOV_rebuild_karma.update_rebuild(pasted[-1], dict(DEFAULT_SETTINGS))
+    assert report['lightgroups'] == {'added' : ['LG_new'], 'removed' : []}
+
+def test_utilities_only(nuke):
+    read = nuke.read_node(synthetic_channels(30), file = '/render/karma.####.exr')
+    pasted = AOV_rebuild_karma.breakout_utilities(read, dict(DEFAULT_SETTINGS))
+    assert pasted
+    with pytest.raises(ValueError, match = 'nothing to update'):
+        AOV_rebuild_karma.update_rebuild(pasted[-1], dict(DEFAULT_SETTINGS))
+
+## crops
+DISPLAY_WINDOW = (0, 0, 63, 31)
+
+def write_cropped_sequence(directory, data_window, lit):
+    '''Writes two frames whose channels only cover `data_window` of the format, the `lit` lightgroups at 0.5'''
+    channels = ['R', 'G', 'B', 'A'] + ['%s.%s' % (aov, c) for aov in ('LG_key', 'LG_fill') for c in 'RGB']
+    values = dict({'R' : 1.0, 'G' : 1.0, 'B' : 1.0, 'A' : 1.0}, **{'%s.R' % aov : 0.5 for aov in lit})
+    for frame in (1001, 1002):
+        write_exr(str(directory / ('karma.%d.exr' % frame)), channels, data_window, DISPLAY_WINDOW, values = values)
+    return str(directory / 'karma.####.exr')
+
+def crops(nuke):
+    return {AOV_rebuild_karma.get_rebuild_tag(n, 'aov') : n for n in nuke.allNodes('Crop')}
+
+def box(crop):
+    ## pasted as script text, set as a list by an update
+    value = crop['box'].value()
+    return [int(v) for v in (value.split() if isinstance(value, str) else value)]
+
+def test_crops_follow_the_data(nuke, tmp_path):
+    pytest.importorskip('numpy')
+    settings = dict(DEFAULT_SETTINGS, crop_to_data = True, breakout_materials = False)
+    pattern = write_cropped_sequence(tmp_path, (10, 4, 20, 12), ['LG_key', 'LG_fill'])
+    read = nuke.nodes.Read(file = pattern, first = 1001, last = 1002)
+    pasted = AOV_rebuild_karma.breakout_lightgroups_and_materials(read, settings)
+    assert {aov : box(crop) for aov, crop in crops(nuke).items()} == \
+        {aov : list(nuke_box((10, 4, 20, 12), DISPLAY_WINDOW)) for aov in ('LG_key', 'LG_fill')}
+
+    ## rerendered: LG_key covers more of the frame, LG_fill went black
+    write_cropped_sequence(tmp_path, (0, 2, 40, 30), ['LG_key'])
+    report = AOV_rebuild_karma.update_rebuild(pasted[-1], settings)
+    assert report['lightgroups'] == {'added' : [], 'removed' : []}
+    key, fill = crops(nuke)['LG_key'], crops(nuke)['LG_fill']
+    assert box(key) == list(nuke_box((0, 2, 40, 30), DISPLAY_WINDOW)) and not key['disable'].value()
+    assert fill['disable'].value() is True
@@ -0,0 +1,71 @@
+'''The AOV contract check on synthetic sequences written by write_exr'''
+import json
+
+import pytest
+
+import AOV_rebuild_karma_validate
+from AOV_rebuild_karma_exr import write_exr
+from AOV_rebuild_karma_validate import frames_per_task, parse_frame_range, validate_sequence
+
+def karma_channels(*aovs):
+    return ['R', 'G', 'B', 'A'] + ['%s.%s' % (aov, c) for aov in aovs for c in 'RGB']
+
+AOVS = ('albedo', 'sss', 'LG_key', 'LG_fill')
+
+@pytest.fixture
+def sequence(tmp_path):
+    '''Frames 1001-1006: 1004 lost LG_fill, 1005 gained LG_rim and 1006 is not an EXR'''
+    for frame in range(1001, 1006):
+        aovs = list(AOVS)
+        if frame == 1004:
+            aovs.remove('LG_fill')
+        if frame == 1005:
+            aovs.append('LG_rim')
+        write_exr(str(tmp_path / ('karma.%d.exr' % frame)), karma_channels(*aovs))
+    (tmp_path / 'karma.1006.exr').write_bytes(b'not an exr')
+    return str(tmp_path / 'karma.####.exr')
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_report(sequence, workers):
+    report = validate_sequence(sequence, workers = workers)
+    assert report['frame_count'] == 6
+    assert report['majority_frame_count'] == 3
+    assert report['majority']['lightgroups'] == ['LG_fill', 'LG_key']
+    assert report['majority']['materials'] == ['albedo', 'sss']
+
+    assert [(d['frame'], d['missing'], d['extra']) for d in report['inconsistent']] == [
+        (1004, {'lightgroups' : ['LG_fill']}, {}),
+        (1005, {}, {'lightgroups' : ['LG_rim']})]
+    assert [frame['frame'] for frame in report['unreadable']] == [1006]
+
+def test_frame_list(sequence):
+    report = validate_sequence(sequence, [1001, 1002, 1007], workers = 1)
+    assert report['frame_count'] == 3
+    assert [frame['frame'] for frame in report['unreadable']] == [1007]
+    assert not report['inconsistent']
+
+def test_main(sequence, capsys):
+    assert AOV_rebuild_karma_validate.main([sequence, '--frames', '1001-1003']) == 0
+    assert 'AOV contract OK' in capsys.readouterr().out
+    assert AOV_rebuild_karma_validate.main([sequence, '--workers', '1', '--json']) == 1
+    assert json.loads(capsys.readouterr().out)['majority_frame_count'] == 3
+
+@pytest.mark.parametrize('frame_range', ['1001-1100x2', '1001:1100', '', 'a-b', '1100-1001'])
+def test_bad_frame_range(sequence, capsys, frame_range):
+    with pytest.raises(ValueError):
+        parse_frame_range(frame_range)
+    with pytest.raises(SystemExit) as exit:
+        AOV_rebuild_karma_validate.main([sequence, '--frames', frame_range])
+    assert exit.value.code == 2
+    assert 'frame range' in capsys.readouterr().err
+
+def test_parse_frame_range():
+    assert parse_frame_range('1001-1004') == [1001, 1002, 1003, 1004]
+    assert parse_frame_range(' 1001 ') == [1001]
+    assert parse_frame_range('-5--3') == [-5, -4, -3]
+
+def test_frames_per_task():
+    ## a short sequence is spread over every worker
+    assert frames_per_task(100, 8) == 4
+    assert frames_per_task(3, 8) == 1
+    assert frames_per_task(100000, 8) == AOV_rebuild_karma_validate.FRAMES_PER_TASK